@@ -0,0 +1,92 @@
+"""
+Compares memory and thread count per agent between standalone AgentClients
+(Paho network thread per agent) and agents hosted by AgentHost.
+
+Requires an MQTT broker accepting any credentials, e.g. a local Mosquitto:
+
+    python3 agent_host_footprint.py -H 127.0.0.1 -p 1883 -n 500
+"""
+from veides.sdk.agent import AgentClient, AgentHost, AgentProperties, ConnectionProperties
+import argparse
+import gc
+import threading
+import tracemalloc
+
+
+def measure(connect, disconnect, agents):
+    gc.collect()
+    threads_before = threading.active_count()
+    tracemalloc.start()
+
+    clients = connect()
+
+    gc.collect()
+    memory, _ = tracemalloc.get_traced_memory()
+    threads = threading.active_count() - threads_before
+
+    tracemalloc.stop()
+    disconnect(clients)
+
+    return memory / agents, threads / agents
+
+
+def standalone(connection_properties, agents):
+    def connect():
+        clients = []
+
+        for i in range(agents):
+            client = AgentClient(
+                AgentProperties(client_id='standalone_%d' % i, key='key', secret_key='secret'),
+                connection_properties,
+            )
+            client.connect()
+            clients.append(client)
+
+        return clients
+
+    def disconnect(clients):
+        for client in clients:
+            client.disconnect()
+
+    return measure(connect, disconnect, agents)
+
+
+def hosted(connection_properties, agents, io_threads):
+    def connect():
+        host = AgentHost(connection_properties, io_threads=io_threads)
+
+        for i in range(agents):
+            host.add_agent(AgentProperties(client_id='hosted_%d' % i, key='key', secret_key='secret'))
+
+        host.connect()
+
+        return host
+
+    def disconnect(host):
+        host.disconnect()
+
+    return measure(connect, disconnect, agents)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Memory and thread count per agent: AgentClient vs AgentHost")
+
+    parser.add_argument("-H", "--host", default="127.0.0.1", help="Broker host")
+    parser.add_argument("-p", "--port", type=int, default=1883, help="Broker port")
+    parser.add_argument("-n", "--agents", type=int, default=200, help="Number of agents")
+    parser.add_argument("-t", "--io-threads", type=int, default=1, help="Number of AgentHost I/O threads")
+    parser.add_argument("--tls", action="store_true", help="Use TLS")
+
+    args = parser.parse_args()
+
+    properties = ConnectionProperties(args.host, port=args.port, use_tls=args.tls)
+
+    results = [
+        ('AgentClient', standalone(properties, args.agents)),
+        ('AgentHost', hosted(properties, args.agents, args.io_threads)),
+    ]
+
+    print("%-12s %16s %16s" % ("mode", "bytes/agent", "threads/agent"))
+
+    for name, (memory, threads) in results:
+        print("%-12s %16d %16.3f" % (name, memory, threads))
@@ -0,0 +1,60 @@
+"""
+Measures encode/decode throughput of available payload codecs for typical
+trail, facts and method payloads. Doesn't require a broker.
+
+    python3 codec_throughput.py -n 200000
+"""
+from veides.sdk.agent.codecs import JsonCodec, OrjsonCodec, UjsonCodec
+import argparse
+import timeit
+
+
+PAYLOADS = {
+    'trail': {'value': 1234.5678},
+    'facts': {'fact_%d' % i: 'value_%d' % i for i in range(20)},
+    'method': {
+        'payload': {
+            'status': 'ok',
+            'readings': [{'sensor': 'sensor_%d' % i, 'value': i * 0.5, 'valid': True} for i in range(50)],
+        },
+        'code': 200,
+    },
+}
+
+
+def available_codecs():
+    codecs = []
+
+    for codec in (JsonCodec, OrjsonCodec, UjsonCodec):
+        try:
+            codecs.append(codec())
+        except ImportError:
+            pass
+
+    return codecs
+
+
+def throughput(func, number):
+    return number / min(timeit.repeat(func, number=number, repeat=3))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Codec encode/decode throughput")
+
+    parser.add_argument("-n", "--number", type=int, default=100000, help="Operations per measurement")
+
+    args = parser.parse_args()
+
+    print("%-8s %-8s %16s %16s" % ("codec", "payload", "encode ops/s", "decode ops/s"))
+
+    for codec in available_codecs():
+        for name, data in PAYLOADS.items():
+            encoded = codec.encode(data)
+
+            if isinstance(encoded, str):
+                encoded = encoded.encode('utf-8')
+
+            encode = throughput(lambda: codec.encode(data), args.number)
+            decode = throughput(lambda: codec.decode(encoded), args.number)
+
+            print("%-8s %-8s %16d %16d" % (codec.name, name, encode, decode))
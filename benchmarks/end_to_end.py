@@ -0,0 +1,213 @@
+"""
+Drives AgentClient end to end over loopback against the in-process broker from
+tests/unit/broker.py, with or without TLS: trail and facts throughput until
+every message is acknowledged, method call round-trip latency, reconnect time
+after the broker drops connections and trail throughput of N agents. Results
+may be saved as JSON to compare releases. Run from the repository root, as
+the broker lives in the tests package:
+
+    PYTHONPATH=. python3 benchmarks/end_to_end.py -n 20000 --tls
+"""
+from veides.sdk.agent import AgentClient, AgentProperties, ConnectionProperties, QosPolicy, ReconnectPolicy
+from tests.unit.broker import Broker, client_ssl_context, generate_certificate, server_ssl_context
+import argparse
+import json
+import tempfile
+import threading
+import time
+
+
+class Counter(object):
+    def __init__(self, broker, pattern):
+        self.count = 0
+        self.last = None
+        self._condition = threading.Condition()
+        broker.subscribe(pattern, self._on_message)
+
+    def _on_message(self, client_id, topic, payload):
+        with self._condition:
+            self.count += 1
+            self.last = time.perf_counter()
+            self._condition.notify_all()
+
+    def wait(self, count, timeout=30):
+        with self._condition:
+            return self._condition.wait_for(lambda: self.count >= count, timeout)
+
+
+def create_client(broker, ssl_context, client_id='benchmark_agent', **kwargs):
+    client = AgentClient(
+        AgentProperties(client_id=client_id, key='key', secret_key='secret'),
+        ConnectionProperties(host='127.0.0.1', port=broker.port, use_tls=ssl_context is not None),
+        ssl_context=ssl_context,
+        **kwargs
+    )
+    client.connect()
+
+    return client
+
+
+def percentile(values, q):
+    values = sorted(values)
+
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def throughput(broker, ssl_context, kind, qos, number):
+    client = create_client(
+        broker,
+        ssl_context,
+        qos_policy=QosPolicy(trail=qos, facts=qos),
+        max_inflight_messages=1000,
+    )
+    counter = Counter(broker, 'agent/+/%s/#' % kind if kind == 'trail' else 'agent/+/%s' % kind)
+
+    if kind == 'trail':
+        send = lambda i: client.send_trail('speed', i)
+    else:
+        send = lambda i: client.send_facts({'battery_level': 'level_%d' % (i % 100)})
+
+    try:
+        start = time.perf_counter()
+
+        for i in range(number):
+            send(i)
+
+        client.flush(timeout=60)
+        counter.wait(number)
+
+        return number / (counter.last - start)
+    finally:
+        client.disconnect()
+
+
+def method_round_trip(broker, ssl_context, number):
+    client = create_client(broker, ssl_context)
+    client.on_method('get_status', lambda name, payload: client.send_method_response(name, {'status': 'idle'}))
+    counter = Counter(broker, 'agent/+/method_response/+')
+    latencies = []
+
+    try:
+        for i in range(number):
+            start = time.perf_counter()
+            broker.publish('agent/benchmark_agent/method/get_status', b'{}', qos=1)
+
+            if not counter.wait(i + 1, timeout=5):
+                raise RuntimeError('method response not received')
+
+            latencies.append(counter.last - start)
+
+        return latencies
+    finally:
+        client.disconnect()
+
+
+def reconnect_time(broker, ssl_context, number):
+    # Backoff is kept at 1 ms, so the measured time is mostly connection setup and resubscription
+    policy = ReconnectPolicy(min_delay=0.001, max_delay=0.001, jitter=False)
+    client = create_client(broker, ssl_context, reconnect_policy=policy)
+    times = []
+
+    try:
+        for _ in range(number):
+            connects = len(broker.connects)
+            start = time.perf_counter()
+            broker.drop_connections()
+
+            while len(broker.connects) == connects or not client._ready.is_set():
+                time.sleep(0.0005)
+
+            times.append(time.perf_counter() - start)
+
+        return times
+    finally:
+        client.disconnect()
+
+
+def send_trails(client, number):
+    for i in range(number):
+        client.send_trail('speed', i)
+
+    client.flush(timeout=60)
+
+
+def agents_scaling(broker, ssl_context, agents, number):
+    start = time.perf_counter()
+    clients = [create_client(broker, ssl_context, client_id='agent_%d' % i) for i in range(agents)]
+    connect_time = time.perf_counter() - start
+    counter = Counter(broker, 'agent/+/trail/+')
+
+    try:
+        start = time.perf_counter()
+        threads = [threading.Thread(target=send_trails, args=(client, number)) for client in clients]
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        counter.wait(agents * number)
+
+        return connect_time, agents * number / (counter.last - start)
+    finally:
+        for client in clients:
+            client.disconnect()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="End-to-end AgentClient benchmarks against in-process broker")
+
+    parser.add_argument("-n", "--number", type=int, default=20000, help="Messages per throughput measurement")
+    parser.add_argument("-m", "--methods", type=int, default=1000, help="Method calls for round-trip latency")
+    parser.add_argument("-r", "--reconnects", type=int, default=50, help="Reconnects for reconnect time")
+    parser.add_argument("-a", "--agents", type=int, nargs='+', default=[1, 10, 50], help="Agent counts for scaling")
+    parser.add_argument("--tls", action='store_true', help="Connect over TLS with a self-signed certificate")
+    parser.add_argument("-o", "--output", help="Save results as JSON to given file")
+
+    args = parser.parse_args()
+
+    server_context = client_context = None
+
+    if args.tls:
+        certificate, key = generate_certificate(tempfile.mkdtemp())
+        server_context = server_ssl_context(certificate, key)
+        client_context = client_ssl_context(certificate)
+
+    results = {'tls': args.tls}
+
+    print("transport: %s" % ("TLS" if args.tls else "TCP"))
+
+    for kind in ('trail', 'facts'):
+        for qos in (0, 1):
+            with Broker(ssl_context=server_context) as broker:
+                rate = throughput(broker, client_context, kind, qos, args.number)
+
+            results['%s_qos%d_msgs_per_s' % (kind, qos)] = rate
+            print("%-32s %12.0f msg/s" % ("send_%s QoS %d" % (kind, qos), rate))
+
+    with Broker(ssl_context=server_context) as broker:
+        latencies = method_round_trip(broker, client_context, args.methods)
+
+    for name, q in (('p50', 0.5), ('p99', 0.99)):
+        results['method_round_trip_%s_ms' % name] = percentile(latencies, q) * 1000
+        print("%-32s %12.3f ms" % ("method round trip %s" % name, percentile(latencies, q) * 1000))
+
+    with Broker(ssl_context=server_context) as broker:
+        times = reconnect_time(broker, client_context, args.reconnects)
+
+    for name, q in (('p50', 0.5), ('p99', 0.99)):
+        results['reconnect_%s_ms' % name] = percentile(times, q) * 1000
+        print("%-32s %12.3f ms" % ("reconnect %s" % name, percentile(times, q) * 1000))
+
+    for agents in args.agents:
+        with Broker(ssl_context=server_context) as broker:
+            connect_time, rate = agents_scaling(broker, client_context, agents, args.number // agents)
+
+        results['agents_%d_connect_ms' % agents] = connect_time * 1000
+        results['agents_%d_trail_msgs_per_s' % agents] = rate
+        print("%-32s %12.0f msg/s, connected in %.1f ms" % ("%d agents send_trail" % agents, rate, connect_time * 1000))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
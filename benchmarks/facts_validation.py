@@ -0,0 +1,51 @@
+"""
+Compares facts validation cost: previous multi-pass validation, single-pass
+validation (strict mode), once-per-name mode and disabled validation.
+Doesn't require a broker.
+
+    python3 facts_validation.py -n 10000
+"""
+from veides.sdk.agent.validation import ValidationMode, Validator, validate_facts
+import argparse
+import timeit
+
+
+def multi_pass_validation(facts):
+    if not isinstance(facts, dict):
+        raise TypeError('facts should be a dictionary')
+
+    if not all(map(lambda v: isinstance(v, str), facts.values())):
+        raise TypeError('facts should be key-value string pairs')
+
+    if not all(map(lambda v: len(v) > 0, facts.keys())):
+        raise ValueError('fact names should be at least 1 length')
+
+    if not all(map(lambda v: len(v) > 0, facts.values())):
+        raise ValueError('fact values should be at least 1 length')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Facts validation cost")
+
+    parser.add_argument("-n", "--number", type=int, default=10000, help="Validations per measurement")
+
+    args = parser.parse_args()
+
+    print("%-6s %-12s %12s" % ("keys", "validation", "us/call"))
+
+    for size in (1, 500):
+        facts = {'fact_%d' % i: 'value_%d' % i for i in range(size)}
+        once = Validator(ValidationMode.ONCE_PER_NAME)
+        off = Validator(ValidationMode.OFF)
+
+        cases = [
+            ('multi-pass', lambda: multi_pass_validation(facts)),
+            ('strict', lambda: validate_facts(facts)),
+            ('once', lambda: once.facts(facts)),
+            ('off', lambda: off.facts(facts)),
+        ]
+
+        for name, func in cases:
+            elapsed = min(timeit.repeat(func, number=args.number, repeat=3)) / args.number
+
+            print("%-6d %-12s %12.3f" % (size, name, elapsed * 1e6))
@@ -0,0 +1,93 @@
+"""
+Measures per-publish cost of logging with SDK and MQTT loggers at their
+default levels (WARN and ERROR): eager formatting with Paho's on_log callback
+(previous behaviour) versus lazy formatting with the MQTT logger handed over
+to Paho. QoS 0 trails are written by real Paho client to a socket pair, so
+no broker is required.
+
+    python3 lazy_logging.py -n 100000
+"""
+from veides.sdk.agent import AgentClient, AgentProperties, ConnectionProperties
+import paho.mqtt.client as paho
+import argparse
+import logging
+import socket
+import threading
+import time
+
+
+class EagerLoggingClient(AgentClient):
+    """
+    Logging as it was done before: data formatted on every message and
+    every Paho log line formatted and forwarded through on_log
+    """
+    def __init__(self, *args, **kwargs):
+        AgentClient.__init__(self, *args, **kwargs)
+
+        self.client.disable_logger()
+        self.client.on_log = self._on_log
+
+    def _send(self, topic, data, qos, kind=None, correlation_data=None):
+        self.logger.debug("Sending message to %s with data %s" % (topic, str(data)))
+
+        return self.client.publish(topic, self.codec.encode(data), qos=qos, retain=False)
+
+    def _on_log(self, client, userdata, level, string):
+        self.mqtt_logger.log(paho.LOGGING_LEVEL[level], string)
+
+
+def build_client(cls):
+    client = cls(
+        AgentProperties(client_id='benchmark_agent', key='key', secret_key='secret'),
+        ConnectionProperties(host='127.0.0.1', use_tls=False),
+        log_level=logging.WARN,
+        mqtt_log_level=logging.ERROR,
+    )
+
+    sock, peer = socket.socketpair()
+    client.client._sock = sock
+    client.connected.set()
+
+    def drain():
+        while peer.recv(65536):
+            pass
+
+    threading.Thread(target=drain, daemon=True).start()
+
+    return client
+
+
+def measure(client, number):
+    data = {'value': 1.5}
+    publish = client.trail_publisher('speed')
+
+    for _ in range(1000):
+        publish(1.5)
+
+    started_at = time.process_time()
+
+    for _ in range(number):
+        client._publish(publish._topic, data, 0)
+
+    return (time.process_time() - started_at) / number
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Logging cost per published message")
+
+    parser.add_argument("-n", "--number", type=int, default=100000, help="Number of published messages")
+    parser.add_argument("-r", "--rate", type=int, default=10000, help="Message rate used to express CPU usage")
+
+    args = parser.parse_args()
+
+    results = [
+        ('eager (on_log)', measure(build_client(EagerLoggingClient), args.number)),
+        ('lazy', measure(build_client(AgentClient), args.number)),
+    ]
+
+    print("%-16s %14s %22s" % ("logging", "us/publish", "CPU %% at %d msg/s" % args.rate))
+
+    for name, seconds in results:
+        print("%-16s %14.2f %22.1f" % (name, seconds * 1e6, seconds * args.rate * 100))
+
+    print("saving: %.2f us/publish" % ((results[0][1] - results[1][1]) * 1e6))
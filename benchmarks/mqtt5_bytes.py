@@ -0,0 +1,276 @@
+"""
+Compares bytes on the wire per sent message type for MQTT 3.1.1 and MQTT v5
+with topic aliases. Messages are sent to a minimal broker started by the
+script, which resolves topic aliases, counts bytes of PUBLISH packets per
+message type and reports aliases it doesn't know, so no external broker is
+required.
+
+    python3 mqtt5_bytes.py -n 1000
+"""
+from veides.sdk.agent import AgentClient, AgentProperties, ConnectionProperties
+import argparse
+import socket
+import struct
+import threading
+
+
+class CountingBroker(object):
+    """
+    Accepts any client, acknowledges CONNECT, SUBSCRIBE, PUBLISH (QoS 1) and PINGREQ
+    packets and counts bytes of PUBLISH packets per message type
+    """
+
+    def __init__(self, topic_alias_maximum):
+        self.topic_alias_maximum = topic_alias_maximum
+        self.bytes = {}
+        self.messages = {}
+        self.unknown_aliases = 0
+        self._lock = threading.Lock()
+
+        self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._server.bind(('127.0.0.1', 0))
+        self._server.listen(16)
+        self.port = self._server.getsockname()[1]
+
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def reset(self):
+        with self._lock:
+            self.bytes = {}
+            self.messages = {}
+
+    def close(self):
+        self._server.close()
+
+    def _accept(self):
+        while True:
+            try:
+                connection, _ = self._server.accept()
+            except OSError:
+                return
+
+            threading.Thread(target=self._serve, args=(connection,), daemon=True).start()
+
+    def _serve(self, connection):
+        v5 = False
+        aliases = {}
+
+        try:
+            while True:
+                header = _read(connection, 1)[0]
+                length, length_size = _read_varint(connection)
+                body = _read(connection, length)
+                packet_type = header & 0xf0
+
+                if packet_type == 0x10:
+                    v5 = body[6] == 5
+
+                    if v5:
+                        properties = b'\x22' + struct.pack('!H', self.topic_alias_maximum)
+                        connection.sendall(_packet(0x20, b'\x00\x00' + _varint(len(properties)) + properties))
+                    else:
+                        connection.sendall(b'\x20\x02\x00\x00')
+                elif packet_type == 0x30:
+                    self._on_publish(connection, header, body, 1 + length_size + length, v5, aliases)
+                elif packet_type == 0x80:
+                    offset = 2
+
+                    if v5:
+                        properties_length, size = _decode_varint(body, offset)
+                        offset += size + properties_length
+
+                    topics = 0
+
+                    while offset < len(body):
+                        offset += 2 + struct.unpack('!H', body[offset:offset + 2])[0] + 1
+                        topics += 1
+
+                    connection.sendall(_packet(0x90, body[:2] + (b'\x00' if v5 else b'') + b'\x01' * topics))
+                elif packet_type == 0xc0:
+                    connection.sendall(b'\xd0\x00')
+                elif packet_type == 0xe0:
+                    return
+        except (OSError, IndexError):
+            pass
+        finally:
+            connection.close()
+
+    def _on_publish(self, connection, header, body, size, v5, aliases):
+        qos = (header >> 1) & 0x03
+        topic_length = struct.unpack('!H', body[:2])[0]
+        topic = body[2:2 + topic_length].decode('utf-8')
+        offset = 2 + topic_length
+        packet_id = None
+
+        if qos > 0:
+            packet_id = body[offset:offset + 2]
+            offset += 2
+
+        if v5:
+            alias = _topic_alias(body, offset)
+
+            if alias is not None:
+                if topic:
+                    aliases[alias] = topic
+                else:
+                    topic = aliases.get(alias)
+
+        if topic is None:
+            with self._lock:
+                self.unknown_aliases += 1
+        else:
+            kind = topic.split('/')[2]
+
+            with self._lock:
+                self.bytes[kind] = self.bytes.get(kind, 0) + size
+                self.messages[kind] = self.messages.get(kind, 0) + 1
+
+        if packet_id is not None:
+            connection.sendall(b'\x40\x02' + packet_id)
+
+
+def _topic_alias(body, offset):
+    properties_length, size = _decode_varint(body, offset)
+    offset += size
+    end = offset + properties_length
+    alias = None
+
+    while offset < end:
+        identifier = body[offset]
+        offset += 1
+
+        if identifier == 0x23:
+            alias = struct.unpack('!H', body[offset:offset + 2])[0]
+            offset += 2
+        elif identifier == 0x01:
+            offset += 1
+        elif identifier == 0x02:
+            offset += 4
+        elif identifier in (0x03, 0x08, 0x09):
+            offset += 2 + struct.unpack('!H', body[offset:offset + 2])[0]
+        elif identifier == 0x26:
+            for _ in range(2):
+                offset += 2 + struct.unpack('!H', body[offset:offset + 2])[0]
+        else:
+            raise ValueError('unexpected property %d' % identifier)
+
+    return alias
+
+
+def _read(connection, size):
+    data = b''
+
+    while len(data) < size:
+        chunk = connection.recv(size - len(data))
+
+        if not chunk:
+            raise OSError('connection closed')
+
+        data += chunk
+
+    return data
+
+
+def _read_varint(connection):
+    value, multiplier, size = 0, 1, 0
+
+    while True:
+        byte = _read(connection, 1)[0]
+        value += (byte & 0x7f) * multiplier
+        multiplier *= 128
+        size += 1
+
+        if byte & 0x80 == 0:
+            return value, size
+
+
+def _decode_varint(data, offset):
+    value, multiplier, size = 0, 1, 0
+
+    while True:
+        byte = data[offset + size]
+        value += (byte & 0x7f) * multiplier
+        multiplier *= 128
+        size += 1
+
+        if byte & 0x80 == 0:
+            return value, size
+
+
+def _varint(value):
+    encoded = b''
+
+    while True:
+        byte = value % 128
+        value //= 128
+
+        if value > 0:
+            encoded += bytes([byte | 0x80])
+        else:
+            return encoded + bytes([byte])
+
+
+def _packet(header, body):
+    return bytes([header]) + _varint(len(body)) + body
+
+
+def send_messages(client, number, trails):
+    senders = {
+        'trail': lambda i: client.send_trail('trail_%d' % (i % trails), i * 0.5),
+        'facts': lambda i: client.send_facts({'battery_level': 'level_%d' % (i % 100)}),
+        'event': lambda i: client.send_event('ready_to_work'),
+        'action_completed': lambda i: client.send_action_completed('move_forward'),
+        'method_response': lambda i: client.send_method_response('get_status', {'status': 'idle'}),
+    }
+
+    for kind, send in senders.items():
+        for i in range(number):
+            send(i)
+
+    client.flush()
+
+
+def measure(broker, mqtt_v5, number, trails, trail_expiry):
+    broker.reset()
+
+    client = AgentClient(
+        AgentProperties(client_id='benchmark_agent', key='key', secret_key='secret'),
+        ConnectionProperties(host='127.0.0.1', port=broker.port, use_tls=False, mqtt_v5=mqtt_v5),
+        message_expiry={'trail': trail_expiry} if mqtt_v5 and trail_expiry else None,
+    )
+    client.connect()
+
+    try:
+        send_messages(client, number, trails)
+    finally:
+        client.disconnect()
+
+    return {kind: broker.bytes[kind] / float(broker.messages[kind]) for kind in broker.bytes}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bytes on the wire per message type, MQTT 3.1.1 vs MQTT v5")
+
+    parser.add_argument("-n", "--number", type=int, default=1000, help="Number of messages per message type")
+    parser.add_argument("-t", "--trails", type=int, default=10, help="Number of distinct trail names")
+    parser.add_argument("-a", "--aliases", type=int, default=100, help="Topic Alias Maximum of the broker")
+    parser.add_argument("-e", "--trail-expiry", type=int, default=60,
+                        help="Message expiry (in seconds) of trails sent with MQTT v5, 0 disables it")
+
+    args = parser.parse_args()
+
+    broker = CountingBroker(args.aliases)
+
+    try:
+        v3 = measure(broker, False, args.number, args.trails, args.trail_expiry)
+        v5 = measure(broker, True, args.number, args.trails, args.trail_expiry)
+    finally:
+        broker.close()
+
+    print("%d messages per type, %d trail names, topic alias maximum %d" % (args.number, args.trails, args.aliases))
+    print("%-18s %14s %14s %10s" % ("message type", "3.1.1 B/msg", "v5 B/msg", "saved"))
+
+    for kind in sorted(v3):
+        print("%-18s %14.1f %14.1f %9.1f%%" % (kind, v3[kind], v5[kind], 100 * (1 - v5[kind] / v3[kind])))
+
+    print("PUBLISH packets with unknown topic alias: %d" % broker.unknown_aliases)
@@ -0,0 +1,72 @@
+"""
+Measures outbox replay after restart: trails are queued while the agent is
+disconnected, the outbox file is reopened by a new client (as after process
+restart) and queued messages are sent after connecting.
+
+Requires an MQTT broker accepting any credentials, e.g. a local Mosquitto:
+
+    python3 outbox_replay.py -H 127.0.0.1 -p 1883 -n 50000
+"""
+from veides.sdk.agent import AgentClient, AgentProperties, ConnectionProperties
+import argparse
+import os
+import tempfile
+import time
+
+
+def create_client(connection_properties, path, drain_rate):
+    client = AgentClient(
+        AgentProperties(client_id='outbox_replay', key='key', secret_key='secret'),
+        connection_properties,
+    )
+    client.enable_outbox(path=path, max_messages=10 ** 7, drain_rate=drain_rate)
+
+    return client
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Outbox enqueue and replay throughput")
+
+    parser.add_argument("-H", "--host", default="127.0.0.1", help="Broker host")
+    parser.add_argument("-p", "--port", type=int, default=1883, help="Broker port")
+    parser.add_argument("-n", "--messages", type=int, default=50000, help="Number of queued messages")
+    parser.add_argument("-r", "--drain-rate", type=float, default=None, help="Replay rate limit (messages/s)")
+    parser.add_argument("--tls", action="store_true", help="Use TLS")
+
+    args = parser.parse_args()
+
+    properties = ConnectionProperties(args.host, port=args.port, use_tls=args.tls)
+    path = os.path.join(tempfile.mkdtemp(), 'outbox')
+
+    client = create_client(properties, path, args.drain_rate)
+
+    started_at = time.perf_counter()
+
+    for i in range(args.messages):
+        client.send_trail('counter', i)
+
+    enqueue_time = time.perf_counter() - started_at
+    client.disable_outbox()
+
+    print("enqueued %d messages in %.3fs (%.0f msg/s), file size %d bytes" % (
+        args.messages, enqueue_time, args.messages / enqueue_time, os.path.getsize(path)
+    ))
+
+    started_at = time.perf_counter()
+    client = create_client(properties, path, args.drain_rate)
+    restore_time = time.perf_counter() - started_at
+
+    print("restored %d messages in %.3fs" % (client.get_outbox_stats()['pending'], restore_time))
+
+    started_at = time.perf_counter()
+    client.connect()
+
+    while client.get_outbox_stats()['pending'] > 0:
+        time.sleep(0.01)
+
+    replay_time = time.perf_counter() - started_at
+    client.disconnect()
+
+    print("replayed %d messages in %.3fs (%.0f msg/s)" % (
+        args.messages, replay_time, args.messages / replay_time
+    ))
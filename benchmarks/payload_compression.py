@@ -0,0 +1,123 @@
+"""
+Compares compressed size and compression/decompression time of a 200 KB
+diagnostic dump and typical facts and method responses for zlib and zstd
+(when zstandard is installed) levels, with and without a dictionary trained
+on typical payloads. Payloads are compressed the way enable_compression()
+does it, header included. Doesn't require a broker.
+
+    python3 payload_compression.py -n 100
+"""
+from veides.sdk.agent.codecs import JsonCodec
+from veides.sdk.agent.compression import PayloadCompression, ZlibCompressor, ZstdCompressor, decompress, train_dictionary
+import argparse
+import random
+import timeit
+
+
+def diagnostic_dump(size):
+    lines = []
+    length = 0
+    rng = random.Random(1)
+
+    while length < size:
+        line = '2021-03-%02d %02d:%02d:%02d.%03d %s motor_%d temperature=%.1f current=%.2f status=%s' % (
+            rng.randint(1, 28), rng.randint(0, 23), rng.randint(0, 59), rng.randint(0, 59), rng.randint(0, 999),
+            rng.choice(('INFO', 'INFO', 'INFO', 'WARN', 'ERROR')), rng.randint(0, 3),
+            rng.uniform(30, 90), rng.uniform(0, 5), rng.choice(('ok', 'ok', 'overheat', 'stalled')),
+        )
+        lines.append(line)
+        length += len(line) + 4
+
+    return {'payload': {'log': lines, 'uptime': 123456}, 'code': 200}
+
+
+def facts(rng):
+    return {
+        'battery_level': rng.choice(('full', 'high', 'medium', 'low')),
+        'charging': rng.choice(('yes', 'no')),
+        'firmware': '1.%d.%d' % (rng.randint(0, 3), rng.randint(0, 20)),
+        'position': '%.5f,%.5f' % (rng.uniform(50, 51), rng.uniform(19, 20)),
+        'error_codes': ','.join('E%03d' % rng.randint(0, 999) for _ in range(rng.randint(0, 5))),
+        'mode': rng.choice(('manual', 'auto', 'maintenance')),
+    }
+
+
+def method_response(rng):
+    return {
+        'payload': {
+            'status': rng.choice(('idle', 'moving', 'charging')),
+            'readings': [
+                {'sensor': 'sensor_%d' % i, 'value': round(rng.uniform(0, 100), 2), 'valid': True} for i in range(20)
+            ],
+        },
+        'code': 200,
+    }
+
+
+def available_compressors(dictionary, levels):
+    compressors = []
+
+    for level in levels['zlib']:
+        compressors.append(('zlib-%d' % level, ZlibCompressor(level=level)))
+
+    compressors.append(('zlib-6+dict', ZlibCompressor(dictionary=dictionary, level=6)))
+
+    try:
+        for level in levels['zstd']:
+            compressors.append(('zstd-%d' % level, ZstdCompressor(level=level)))
+
+        compressors.append(('zstd-3+dict', ZstdCompressor(dictionary=dictionary, level=3)))
+    except ImportError:
+        pass
+
+    return compressors
+
+
+def best(func, number):
+    return min(timeit.repeat(func, number=number, repeat=3)) / number
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Payload compression: bytes saved vs. CPU time")
+
+    parser.add_argument("-n", "--number", type=int, default=100, help="Compressions of the dump per measurement")
+    parser.add_argument("-s", "--size", type=int, default=200 * 1024, help="Size of the diagnostic dump (in bytes)")
+    parser.add_argument("-d", "--dictionary-size", type=int, default=16384, help="Size of the trained dictionary")
+
+    args = parser.parse_args()
+
+    codec = JsonCodec()
+    rng = random.Random(2)
+    samples = [codec.encode(facts(rng)) for _ in range(500)] + [codec.encode(method_response(rng)) for _ in range(500)]
+    dictionary = train_dictionary(samples, size=args.dictionary_size)
+
+    payloads = [
+        ('dump', codec.encode(diagnostic_dump(args.size)), args.number),
+        ('facts', codec.encode(facts(rng)), args.number * 100),
+        ('method', codec.encode(method_response(rng)), args.number * 100),
+    ]
+    levels = {'zlib': (1, 6, 9), 'zstd': (1, 3, 19)}
+
+    print("dictionary %d B trained on %d samples" % (len(dictionary), len(samples)))
+    print("%-8s %-12s %10s %10s %8s %14s %14s" % (
+        "payload", "compressor", "raw B", "sent B", "saved", "compress us", "decompress us"
+    ))
+
+    for name, payload, number in payloads:
+        for compressor_name, compressor in available_compressors(dictionary, levels):
+            compression = PayloadCompression(compressor, threshold=0, kinds=(name,))
+            compressed = compression.compress(payload, name)
+            sent = len(compressed)
+
+            # Payloads which don't get smaller are sent as they are
+            if compressed is payload:
+                decompress_time = 0
+            else:
+                decompress_time = best(lambda: decompress(compressed, compressor), number)
+
+            compress_time = best(lambda: compression.compress(payload, name), number)
+
+            print("%-8s %-12s %10d %10d %7.1f%% %14.1f %14.1f" % (
+                name, compressor_name, len(payload), sent, 100 * (1 - sent / float(len(payload))),
+                compress_time * 1e6, decompress_time * 1e6
+            ))
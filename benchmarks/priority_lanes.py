@@ -0,0 +1,121 @@
+"""
+Measures method response latency while the agent sends trails at a fixed rate,
+with and without priority lanes. Trails are sent in bursts every --interval
+seconds, as a sampling loop would do, and method calls arrive in between. The
+latency is measured by the in-process broker from tests/unit/broker.py, from
+publishing the call to receiving the response. Run from the repository root:
+
+    PYTHONPATH=. python3 benchmarks/priority_lanes.py -r 5000 -m 500
+"""
+from veides.sdk.agent import AgentClient, AgentProperties, ConnectionProperties
+from tests.unit.broker import Broker
+import argparse
+import threading
+import time
+
+
+def percentile(values, q):
+    values = sorted(values)
+
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def send_trails(client, rate, interval, stop):
+    burst = max(1, int(rate * interval))
+    next_burst = time.perf_counter()
+    sent = 0
+
+    while not stop.is_set():
+        for i in range(burst):
+            client.send_trail('sample_%d' % (i % 100), i)
+
+        sent += burst
+        next_burst += interval
+        delay = next_burst - time.perf_counter()
+
+        if delay > 0:
+            time.sleep(delay)
+
+    return sent
+
+
+def measure(rate, interval, methods, lanes, max_inflight):
+    with Broker() as broker:
+        responses = {}
+        received = threading.Condition()
+
+        def on_response(client_id, topic, payload):
+            with received:
+                responses[len(responses)] = time.perf_counter()
+                received.notify_all()
+
+        broker.subscribe('agent/+/method_response/+', on_response)
+
+        client = AgentClient(
+            AgentProperties(client_id='benchmark_agent', key='key', secret_key='secret'),
+            ConnectionProperties(host='127.0.0.1', port=broker.port, use_tls=False),
+            max_inflight_messages=max_inflight
+        )
+
+        if lanes:
+            client.enable_priority_lanes()
+
+        client.on_method('get_status', lambda name, payload: client.send_method_response(name, {'status': 'idle'}))
+        client.connect()
+
+        stop = threading.Event()
+        result = {}
+        loader = threading.Thread(target=lambda: result.update(sent=send_trails(client, rate, interval, stop)))
+        loader.start()
+
+        latencies = []
+        started = time.perf_counter()
+
+        try:
+            # Let the trail backlog build up first
+            time.sleep(0.5)
+
+            for i in range(methods):
+                time.sleep(interval / 3)
+                published_at = time.perf_counter()
+                broker.publish('agent/benchmark_agent/method/get_status', b'{}', qos=1)
+
+                with received:
+                    if not received.wait_for(lambda: i in responses, timeout=30):
+                        raise RuntimeError('method response not received')
+
+                latencies.append(responses[i] - published_at)
+        finally:
+            stop.set()
+            loader.join()
+            elapsed = time.perf_counter() - started
+            client.flush(timeout=60)
+            client.disconnect()
+
+        return latencies, result['sent'] / elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Method response latency under trail load, with and without priority lanes")
+
+    parser.add_argument("-r", "--rate", type=int, default=5000, help="Trails sent per second")
+    parser.add_argument("-i", "--interval", type=float, default=0.1, help="Time (in seconds) between bursts of trails")
+    parser.add_argument("-m", "--methods", type=int, default=500, help="Number of method calls")
+    parser.add_argument("--max-inflight", type=int, default=20, help="Paho's in-flight window")
+
+    args = parser.parse_args()
+
+    print("%d trails/s in bursts of %d, %d method calls" % (args.rate, int(args.rate * args.interval), args.methods))
+
+    for lanes in (False, True):
+        latencies, trail_rate = measure(args.rate, args.interval, args.methods, lanes, args.max_inflight)
+
+        print(
+            "%-16s p50 %8.3f ms   p99 %8.3f ms   max %8.3f ms   trails %8.0f/s" % (
+                "priority lanes" if lanes else "single queue",
+                percentile(latencies, 0.5) * 1000,
+                percentile(latencies, 0.99) * 1000,
+                max(latencies) * 1000,
+                trail_rate,
+            )
+        )
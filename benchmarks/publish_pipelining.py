@@ -0,0 +1,51 @@
+"""
+Compares QoS 1 trail throughput when waiting for every acknowledgement
+(send_trail_nowait().wait()) with pipelined sending (send_trail_nowait() and flush()).
+
+Requires an MQTT broker accepting any credentials, e.g. a local Mosquitto:
+
+    python3 publish_pipelining.py -H 127.0.0.1 -p 1883 -n 20000
+"""
+from veides.sdk.agent import AgentClient, AgentProperties, ConnectionProperties
+import argparse
+import time
+
+
+def one_by_one(client, messages):
+    for i in range(messages):
+        client.send_trail_nowait('counter', i).wait(10)
+
+
+def pipelined(client, messages):
+    for i in range(messages):
+        client.send_trail_nowait('counter', i)
+
+    client.flush(60)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Acknowledged QoS 1 messages per second")
+
+    parser.add_argument("-H", "--host", default="127.0.0.1", help="Broker host")
+    parser.add_argument("-p", "--port", type=int, default=1883, help="Broker port")
+    parser.add_argument("-n", "--messages", type=int, default=20000, help="Number of messages")
+    parser.add_argument("--tls", action="store_true", help="Use TLS")
+
+    args = parser.parse_args()
+
+    client = AgentClient(
+        AgentProperties(client_id='publish_pipelining', key='key', secret_key='secret'),
+        ConnectionProperties(args.host, port=args.port, use_tls=args.tls),
+        # Paho's default window of 20 in-flight messages would hide the difference
+        max_inflight_messages=1000,
+    )
+    client.connect()
+
+    print("%-12s %12s" % ("mode", "msg/s"))
+
+    for name, run in (('one by one', one_by_one), ('pipelined', pipelined)):
+        started_at = time.perf_counter()
+        run(client, args.messages)
+        print("%-12s %12.0f" % (name, args.messages / (time.perf_counter() - started_at)))
+
+    client.disconnect()
@@ -0,0 +1,57 @@
+"""
+Measures trails per second (sent and, for QoS 1, acknowledged) for different
+QoS policies and Paho in-flight windows.
+
+Requires an MQTT broker accepting any credentials, e.g. a local Mosquitto:
+
+    python3 qos_policy_throughput.py -H 127.0.0.1 -p 1883 -n 20000
+"""
+from veides.sdk.agent import AgentClient, AgentProperties, ConnectionProperties, QosPolicy
+import argparse
+import time
+
+POLICIES = [
+    ('QoS 1, in-flight 20', QosPolicy(), 20),
+    ('QoS 1, in-flight 1000', QosPolicy(), 1000),
+    ('QoS 0 trails', QosPolicy(trail=0), 20),
+]
+
+
+def measure(connection_properties, messages, policy, max_inflight_messages):
+    client = AgentClient(
+        AgentProperties(client_id='qos_policy_throughput', key='key', secret_key='secret'),
+        connection_properties,
+        qos_policy=policy,
+        max_inflight_messages=max_inflight_messages,
+    )
+    client.connect()
+
+    started_at = time.perf_counter()
+
+    for i in range(messages):
+        client.send_trail('counter', i)
+
+    client.flush(60)
+    elapsed = time.perf_counter() - started_at
+
+    client.disconnect()
+
+    return messages / elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Trails per second per QoS policy")
+
+    parser.add_argument("-H", "--host", default="127.0.0.1", help="Broker host")
+    parser.add_argument("-p", "--port", type=int, default=1883, help="Broker port")
+    parser.add_argument("-n", "--messages", type=int, default=20000, help="Number of messages")
+    parser.add_argument("--tls", action="store_true", help="Use TLS")
+
+    args = parser.parse_args()
+
+    properties = ConnectionProperties(args.host, port=args.port, use_tls=args.tls)
+
+    print("%-24s %12s" % ("policy", "msg/s"))
+
+    for name, policy, max_inflight_messages in POLICIES:
+        print("%-24s %12.0f" % (name, measure(properties, args.messages, policy, max_inflight_messages)))
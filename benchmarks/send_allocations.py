@@ -0,0 +1,70 @@
+"""
+Measures memory allocated (and released) by the SDK per sent trail using
+tracemalloc peak tracking (requires Python 3.9+).
+Paho's publish() is replaced with a no-op, so only SDK overhead is measured
+and no broker is required.
+
+    python3 send_allocations.py -n 10000
+"""
+from veides.sdk.agent import AgentClient, AgentProperties, ConnectionProperties
+from paho.mqtt.client import MQTT_ERR_SUCCESS
+import argparse
+import timeit
+import tracemalloc
+
+
+def build_client():
+    client = AgentClient(
+        AgentProperties(client_id='benchmark_agent', key='key', secret_key='secret'),
+        ConnectionProperties(host='127.0.0.1', use_tls=False)
+    )
+    client.client.publish = lambda *_, **__: (MQTT_ERR_SUCCESS, 1)
+    client.connected.set()
+
+    return client
+
+
+def allocated_bytes(func, number):
+    func()
+
+    tracemalloc.start()
+    total = 0
+
+    for _ in range(number):
+        tracemalloc.reset_peak()
+        current, _ = tracemalloc.get_traced_memory()
+
+        func()
+
+        _, peak = tracemalloc.get_traced_memory()
+        total += peak - current
+
+    tracemalloc.stop()
+
+    return total / number
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Allocations and time per sent trail")
+
+    parser.add_argument("-n", "--number", type=int, default=10000, help="Number of sent trails")
+
+    args = parser.parse_args()
+
+    client = build_client()
+    publish_speed = client.trail_publisher('speed')
+    topic_prefix = 'agent/{}/trail/{}'
+
+    cases = [
+        ('formatted topic', lambda: client._publish(topic_prefix.format(client.client_id, 'speed'), {'value': 1.5})),
+        ('send_trail', lambda: client.send_trail('speed', 1.5)),
+        ('trail_publisher', lambda: publish_speed(1.5)),
+    ]
+
+    print("%-16s %20s %16s" % ("path", "peak bytes/call", "us/call"))
+
+    for name, func in cases:
+        allocated = allocated_bytes(func, args.number)
+        elapsed = min(timeit.repeat(func, number=args.number, repeat=3)) / args.number
+
+        print("%-16s %20.1f %16.3f" % (name, allocated, elapsed * 1e6))
@@ -0,0 +1,146 @@
+"""
+Measures cost of routing a received message to callbacks registered with
+AgentClient.subscribe() when there are many routes (10k by default):
+linear scan with Paho's topic_matches_sub(), Paho's own matcher, the topic
+trie without and with its match cache, and full dispatch by the client
+(routing, payload decoding and callback call). It doesn't require a broker.
+
+    python3 topic_dispatch.py -r 10000 -n 100000
+"""
+from veides.sdk.agent import AgentClient, AgentProperties, ConnectionProperties
+from veides.sdk.agent.topics import TopicTrie
+from paho.mqtt.matcher import MQTTMatcher
+import paho.mqtt.client as paho
+import argparse
+import random
+import time
+
+
+def build_patterns(routes):
+    patterns = []
+
+    for i in range(routes):
+        if i % 4 == 0:
+            patterns.append('fleet/agent%d/+/position' % i)
+        elif i % 4 == 1:
+            patterns.append('fleet/agent%d/sensors/#' % i)
+        elif i % 4 == 2:
+            patterns.append('site/%d/+/+/status' % i)
+        else:
+            patterns.append('site/%d/zone/%d/alarm' % (i, i))
+
+    return patterns
+
+
+def build_topics(routes, distinct):
+    topics = []
+
+    for _ in range(distinct):
+        i = random.randrange(routes)
+
+        if i % 4 == 0:
+            topics.append('fleet/agent%d/gps/position' % i)
+        elif i % 4 == 1:
+            topics.append('fleet/agent%d/sensors/temperature/1' % i)
+        elif i % 4 == 2:
+            topics.append('site/%d/zone/door/status' % i)
+        else:
+            topics.append('site/%d/zone/%d/alarm' % (i, i))
+
+    return topics
+
+
+def measure(match, topics, number):
+    count = len(topics)
+    started_at = time.perf_counter()
+
+    for i in range(number):
+        match(topics[i % count])
+
+    return (time.perf_counter() - started_at) / number
+
+
+def linear_matcher(patterns):
+    def match(topic):
+        return [pattern for pattern in patterns if paho.topic_matches_sub(pattern, topic)]
+
+    return match
+
+
+def paho_matcher(patterns):
+    matcher = MQTTMatcher()
+
+    for pattern in patterns:
+        matcher[pattern] = pattern
+
+    def match(topic):
+        return list(matcher.iter_match(topic))
+
+    return match
+
+
+def trie_matcher(patterns, cached):
+    trie = TopicTrie()
+
+    for pattern in patterns:
+        trie.add(pattern, pattern)
+
+    if cached:
+        return trie.match
+
+    return trie._match
+
+
+def client_dispatcher(patterns):
+    client = AgentClient(
+        AgentProperties(client_id='benchmark_agent', key='key', secret_key='secret'),
+        ConnectionProperties(host='127.0.0.1', use_tls=False),
+    )
+
+    def callback(topic, payload):
+        pass
+
+    for pattern in patterns:
+        client.subscribe(pattern, callback)
+
+    messages = {}
+
+    def dispatch(topic):
+        msg = messages.get(topic)
+
+        if msg is None:
+            msg = messages[topic] = paho.MQTTMessage(topic=topic.encode('utf-8'))
+            msg.payload = b'{"value":21.5}'
+
+        client._on_message(client.client, None, msg)
+
+    return dispatch
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Topic routing cost with many subscriptions")
+
+    parser.add_argument("-r", "--routes", type=int, default=10000, help="Number of subscribed topic filters")
+    parser.add_argument("-n", "--number", type=int, default=100000, help="Number of routed messages")
+    parser.add_argument("-t", "--topics", type=int, default=1000, help="Number of distinct message topics")
+    parser.add_argument("-l", "--linear", type=int, default=200, help="Number of messages routed with linear scan")
+
+    args = parser.parse_args()
+
+    random.seed(1)
+    patterns = build_patterns(args.routes)
+    topics = build_topics(args.routes, args.topics)
+
+    results = [
+        ('linear scan', measure(linear_matcher(patterns), topics, args.linear)),
+        ('paho matcher', measure(paho_matcher(patterns), topics, args.number)),
+        ('trie', measure(trie_matcher(patterns, False), topics, args.number)),
+        ('trie, cached', measure(trie_matcher(patterns, True), topics, args.number)),
+        ('client dispatch', measure(client_dispatcher(patterns), topics, args.number)),
+    ]
+
+    print("%d routes, %d distinct topics" % (args.routes, args.topics))
+    print("%-18s %14s %14s" % ("matcher", "us/message", "messages/s"))
+
+    for name, seconds in results:
+        print("%-18s %14.2f %14.0f" % (name, seconds * 1e6, 1 / seconds))
@@ -0,0 +1,95 @@
+"""
+Measures ingest throughput of trail aggregation for samples added one by one
+(add_sample()) and in batches (add_samples()) given as lists, array('d') and
+NumPy arrays, with array('d') and NumPy ring buffers, and the time of sending
+aggregates at the end of a window. Aggregates are sent to a no-op, so it
+doesn't require a broker.
+
+    python3 trail_aggregation.py -n 2000000 -b 1000 -t 10
+"""
+from veides.sdk.agent import aggregation
+from veides.sdk.agent.aggregation import TrailAggregator
+import argparse
+import array
+import random
+import time
+
+
+AGGREGATES = ('mean', 'min', 'max', 'count', 'p50', 'p99')
+
+
+def build_aggregator(use_numpy, capacity):
+    aggregator = TrailAggregator(lambda name, value: True, interval=3600, aggregates=AGGREGATES, capacity=capacity, use_numpy=use_numpy)
+
+    # Warm up, so first emit doesn't include lazy imports of NumPy
+    aggregator.add('warm_up', 0.0)
+    aggregator.emit()
+
+    return aggregator
+
+
+def ingest_single(aggregator, names, values):
+    add = aggregator.add
+    trails = len(names)
+    started = time.perf_counter()
+
+    for i, value in enumerate(values):
+        add(names[i % trails], value)
+
+    return len(values) / (time.perf_counter() - started)
+
+
+def ingest_batches(aggregator, names, batches):
+    add_many = aggregator.add_many
+    trails = len(names)
+    started = time.perf_counter()
+    samples = 0
+
+    for i, batch in enumerate(batches):
+        add_many(names[i % trails], batch)
+        samples += len(batch)
+
+    return samples / (time.perf_counter() - started)
+
+
+def emit_time(aggregator):
+    started = time.perf_counter()
+    aggregator.emit()
+
+    return time.perf_counter() - started
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Trail aggregation ingest throughput and window emit time")
+
+    parser.add_argument("-n", "--number", type=int, default=2000000, help="Samples per measurement")
+    parser.add_argument("-b", "--batch", type=int, default=1000, help="Samples per add_samples() call")
+    parser.add_argument("-t", "--trails", type=int, default=10, help="Number of aggregated trails")
+    parser.add_argument("-c", "--capacity", type=int, default=4096, help="Samples kept per trail for percentiles")
+
+    args = parser.parse_args()
+
+    names = ['sensor_%d' % i for i in range(args.trails)]
+    values = [random.gauss(20, 5) for _ in range(args.number)]
+    lists = [values[i:i + args.batch] for i in range(0, args.number, args.batch)]
+    inputs = [('list', lists), ('array', [array.array('d', batch) for batch in lists])]
+
+    if aggregation.numpy is not None:
+        inputs.append(('numpy', [aggregation.numpy.array(batch) for batch in lists]))
+
+    buffers = [False, True] if aggregation.numpy is not None else [False]
+
+    print("%d samples, %d trails, batches of %d, aggregates: %s" % (args.number, args.trails, args.batch, ', '.join(AGGREGATES)))
+    print("%-8s %-16s %16s %14s" % ("buffer", "input", "samples/s", "emit ms"))
+
+    for use_numpy in buffers:
+        buffer = 'numpy' if use_numpy else 'array'
+
+        aggregator = build_aggregator(use_numpy, args.capacity)
+        rate = ingest_single(aggregator, names, values)
+        print("%-8s %-16s %16.0f %14.3f" % (buffer, 'add_sample()', rate, emit_time(aggregator) * 1000))
+
+        for name, batches in inputs:
+            aggregator = build_aggregator(use_numpy, args.capacity)
+            rate = ingest_batches(aggregator, names, batches)
+            print("%-8s %-16s %16.0f %14.3f" % (buffer, 'batches of ' + name, rate, emit_time(aggregator) * 1000))
@@ -0,0 +1,57 @@
+from veides.sdk.agent import AsyncAgentClient, ConnectionProperties, AgentProperties
+import asyncio
+import logging
+import argparse
+
+
+async def main(args):
+    client = AsyncAgentClient(
+        connection_properties=ConnectionProperties(host=args.host),
+        agent_properties=AgentProperties(
+            client_id=args.client_id,
+            key=args.key,
+            secret_key=args.secret_key
+        ),
+        log_level=logging.DEBUG
+    )
+
+    await client.connect()
+
+    # Handlers may be coroutine functions. They are scheduled on the event loop
+    async def on_shutdown_method_invoked(name, payload):
+        await client.send_method_response(name, {"received_payload": payload})
+
+    client.on_method('shutdown', on_shutdown_method_invoked)
+
+    # Every send_* method resolves when the message is acknowledged
+    await client.send_facts({
+        'battery_level': 'full',
+        'charging': 'no',
+    })
+
+    await client.send_event('ready_to_rock')
+
+    uptime = 0
+
+    try:
+        while True:
+            await asyncio.sleep(1)
+            uptime += 1
+
+            await client.send_trail('uptime', uptime)
+    finally:
+        await client.disconnect()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Example of connecting agent to Veides using asyncio")
+
+    parser.add_argument("-i", "--client-id", required=True, help="Client id of agent")
+    parser.add_argument("-k", "--key", required=True, help="Key of agent")
+    parser.add_argument("-s", "--secret-key", required=True, help="Secret key of agent")
+    parser.add_argument("-H", "--host", required=True, help="Host to connect to")
+
+    try:
+        asyncio.get_event_loop().run_until_complete(main(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
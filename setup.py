@@ -37,4 +37,10 @@ setup(
     install_requires=[
         'paho-mqtt==1.5.1',
     ],
+    extras_require={
+        'numpy': ['numpy>=1.19.0'],
+        'orjson': ['orjson>=3.0.0'],
+        'ujson': ['ujson>=4.0.0'],
+        'zstd': ['zstandard>=0.15.0'],
+    },
 )
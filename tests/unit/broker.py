@@ -0,0 +1,424 @@
+import asyncio
+import os
+import shutil
+import ssl
+import subprocess
+import threading
+import time
+from veides.sdk.agent.topics import TopicTrie
+
+CONNECT = 0x10
+CONNACK = 0x20
+PUBLISH = 0x30
+PUBACK = 0x40
+PUBREC = 0x50
+PUBREL = 0x60
+PUBCOMP = 0x70
+SUBSCRIBE = 0x80
+SUBACK = 0x90
+UNSUBSCRIBE = 0xa0
+UNSUBACK = 0xb0
+PINGREQ = 0xc0
+PINGRESP = 0xd0
+DISCONNECT = 0xe0
+
+
+class Broker(object):
+    """
+    Minimal MQTT 3.1.1 broker for tests and benchmarks, running an asyncio event loop in
+    its own thread. Accepts any credentials, routes QoS 0, 1 and 2 messages between
+    connected clients and to listeners added with subscribe(). Sessions are always clean
+    and retained messages, wills and keep alive timeouts are not supported
+
+        with Broker() as broker:
+            client = AgentClient(..., ConnectionProperties(host='127.0.0.1', port=broker.port, use_tls=False))
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, ssl_context=None):
+        """
+        :param host: Listening address
+        :type host: str
+        :param port: Listening port, a free port is picked by default
+        :type port: int
+        :param ssl_context: Server SSL context, e.g. from server_ssl_context(). Plain TCP by default
+        :type ssl_context: ssl.SSLContext
+        """
+        self.host = host
+        self.port = port
+        self.ssl_context = ssl_context
+        # Times (time.monotonic()) of accepted CONNECT packets
+        self.connects = []
+        self.messages_received = 0
+
+        self._loop = None
+        self._server = None
+        self._thread = None
+        self._connections = {}
+        self._routes = TopicTrie()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def start(self):
+        """
+        :return Broker
+        """
+        started = threading.Event()
+        errors = []
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self._loop)
+
+            try:
+                self._loop.run_until_complete(self._start())
+            except Exception as e:
+                errors.append(e)
+                started.set()
+                return
+
+            started.set()
+            self._loop.run_forever()
+            self._loop.close()
+
+        self._thread = threading.Thread(target=run, name='mqtt-broker', daemon=True)
+        self._thread.start()
+        started.wait()
+
+        if errors:
+            raise errors[0]
+
+        return self
+
+    def stop(self):
+        if self._loop is None or self._loop.is_closed():
+            return
+
+        self._call(self._stop())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+    def clients(self):
+        """
+        :return list Client ids of connected clients
+        """
+        return self._call(self._clients())
+
+    def subscriptions(self, client_id):
+        """
+        :param client_id: Client id
+        :type client_id: str
+        :return dict Topic filters subscribed by connected client and their granted QoS
+        """
+        return self._call(self._subscriptions(client_id))
+
+    def publish(self, topic, payload, qos=0):
+        """
+        Sends message to subscribed clients and listeners, as if it was published by a client
+
+        :param topic: Message topic
+        :type topic: str
+        :param payload
+        :type payload: bytes
+        :param qos
+        :type qos: int
+        :return void
+        """
+        self._loop.call_soon_threadsafe(self._route, None, topic, payload, qos)
+
+    def subscribe(self, pattern, callback):
+        """
+        Calls callback(client_id, topic, payload) for every message matching the topic filter.
+        Callbacks run in the broker thread, so they shouldn't block
+
+        :param pattern: Topic filter
+        :type pattern: str
+        :param callback
+        :type callback: callable
+        :return void
+        """
+        self._routes.add(pattern, (callback, 2))
+
+    def unsubscribe(self, pattern, callback):
+        self._routes.remove(pattern, (callback, 2))
+
+    def drop_connections(self):
+        """
+        Closes all client connections abruptly, without DISCONNECT
+
+        :return void
+        """
+        self._call(self._drop_connections())
+
+    def _call(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    async def _start(self):
+        self._server = await asyncio.start_server(self._serve, self.host, self.port, ssl=self.ssl_context)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def _stop(self):
+        self._server.close()
+        await self._drop_connections()
+        await self._server.wait_closed()
+
+    async def _clients(self):
+        return list(self._connections)
+
+    async def _subscriptions(self, client_id):
+        connection = self._connections.get(client_id)
+
+        return dict(connection.subscriptions) if connection is not None else {}
+
+    async def _drop_connections(self):
+        for connection in list(self._connections.values()):
+            connection.close()
+
+    async def _serve(self, reader, writer):
+        connection = None
+
+        try:
+            packet_type, flags, body = await _read_packet(reader)
+
+            if packet_type != CONNECT:
+                return
+
+            connection = self._connect(body, writer)
+
+            if connection is None:
+                return
+
+            while True:
+                packet_type, flags, body = await _read_packet(reader)
+
+                if packet_type == PUBLISH:
+                    self._on_publish(connection, flags, body)
+                elif packet_type == PUBREL:
+                    connection.incoming.discard(body[:2])
+                    connection.send(PUBCOMP, body[:2])
+                elif packet_type == PUBREC:
+                    connection.send(PUBREL | 0x02, body[:2])
+                elif packet_type == SUBSCRIBE:
+                    self._on_subscribe(connection, body)
+                elif packet_type == UNSUBSCRIBE:
+                    self._on_unsubscribe(connection, body)
+                elif packet_type == PINGREQ:
+                    connection.send(PINGRESP, b'')
+                elif packet_type == DISCONNECT:
+                    return
+
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, ssl.SSLError):
+            pass
+        finally:
+            if connection is not None:
+                self._disconnect(connection)
+
+            writer.close()
+
+    def _connect(self, body, writer):
+        name_length = int.from_bytes(body[:2], 'big')
+        offset = 2 + name_length
+        level = body[offset]
+        client_id_length = int.from_bytes(body[offset + 4:offset + 6], 'big')
+        client_id = body[offset + 6:offset + 6 + client_id_length].decode('utf-8')
+
+        if level != 4:
+            writer.write(bytes([CONNACK, 2, 0, 1]))
+            return None
+
+        previous = self._connections.get(client_id)
+
+        if previous is not None:
+            previous.close()
+            self._disconnect(previous)
+
+        connection = _Connection(client_id, writer)
+        self._connections[client_id] = connection
+        self.connects.append(time.monotonic())
+        connection.send(CONNACK, b'\x00\x00')
+
+        return connection
+
+    def _disconnect(self, connection):
+        if self._connections.get(connection.client_id) is connection:
+            del self._connections[connection.client_id]
+
+        for pattern in connection.subscriptions:
+            self._routes.remove(pattern, (connection, connection.subscriptions[pattern]))
+
+        connection.subscriptions = {}
+
+    def _on_publish(self, connection, flags, body):
+        qos = (flags >> 1) & 0x03
+        topic_length = int.from_bytes(body[:2], 'big')
+        topic = body[2:2 + topic_length].decode('utf-8')
+        offset = 2 + topic_length
+        packet_id = None
+
+        if qos > 0:
+            packet_id = body[offset:offset + 2]
+            offset += 2
+
+        self.messages_received += 1
+
+        if qos == 1:
+            connection.send(PUBACK, packet_id)
+        elif qos == 2:
+            connection.send(PUBREC, packet_id)
+
+            # Redelivered message not released yet was routed already
+            if packet_id in connection.incoming:
+                return
+
+            connection.incoming.add(packet_id)
+
+        self._route(connection.client_id, topic, body[offset:], qos)
+
+    def _route(self, client_id, topic, payload, qos):
+        for target, granted in self._routes.match(topic):
+            if isinstance(target, _Connection):
+                target.deliver(topic, payload, min(qos, granted))
+            else:
+                target(client_id, topic, payload)
+
+    def _on_subscribe(self, connection, body):
+        packet_id = body[:2]
+        offset = 2
+        granted = b''
+
+        while offset < len(body):
+            length = int.from_bytes(body[offset:offset + 2], 'big')
+            pattern = body[offset + 2:offset + 2 + length].decode('utf-8')
+            qos = min(body[offset + 2 + length] & 0x03, 2)
+            offset += 3 + length
+
+            previous = connection.subscriptions.pop(pattern, None)
+
+            if previous is not None:
+                self._routes.remove(pattern, (connection, previous))
+
+            connection.subscriptions[pattern] = qos
+            self._routes.add(pattern, (connection, qos))
+            granted += bytes([qos])
+
+        connection.send(SUBACK, packet_id + granted)
+
+    def _on_unsubscribe(self, connection, body):
+        offset = 2
+
+        while offset < len(body):
+            length = int.from_bytes(body[offset:offset + 2], 'big')
+            pattern = body[offset + 2:offset + 2 + length].decode('utf-8')
+            offset += 2 + length
+
+            qos = connection.subscriptions.pop(pattern, None)
+
+            if qos is not None:
+                self._routes.remove(pattern, (connection, qos))
+
+        connection.send(UNSUBACK, body[:2])
+
+
+class _Connection(object):
+    def __init__(self, client_id, writer):
+        self.client_id = client_id
+        self.writer = writer
+        # Topic filter -> granted QoS
+        self.subscriptions = {}
+        # Ids of received QoS 2 messages not released yet
+        self.incoming = set()
+        self._packet_id = 0
+
+    def send(self, packet_type, body):
+        self.writer.write(bytes([packet_type]) + _varint(len(body)) + body)
+
+    def deliver(self, topic, payload, qos):
+        topic = topic.encode('utf-8')
+        body = len(topic).to_bytes(2, 'big') + topic
+
+        if qos > 0:
+            self._packet_id = self._packet_id % 65535 + 1
+            body += self._packet_id.to_bytes(2, 'big')
+
+        self.send(PUBLISH | (qos << 1), body + payload)
+
+    def close(self):
+        self.writer.transport.abort()
+
+
+async def _read_packet(reader):
+    header = (await reader.readexactly(1))[0]
+    length, multiplier = 0, 1
+
+    while True:
+        byte = (await reader.readexactly(1))[0]
+        length += (byte & 0x7f) * multiplier
+        multiplier *= 128
+
+        if byte & 0x80 == 0:
+            break
+
+    body = await reader.readexactly(length) if length else b''
+
+    return header & 0xf0, header & 0x0f, body
+
+
+def _varint(value):
+    encoded = b''
+
+    while True:
+        byte = value % 128
+        value //= 128
+
+        if value > 0:
+            encoded += bytes([byte | 0x80])
+        else:
+            return encoded + bytes([byte])
+
+
+def generate_certificate(directory, openssl=None):
+    """
+    Generates self-signed certificate for localhost and 127.0.0.1 with openssl command
+
+    :param directory: Directory to write cert.pem and key.pem to
+    :type directory: str
+    :param openssl: Path to openssl, found in PATH by default
+    :type openssl: str
+    :raises RuntimeError: If openssl is not found
+    :return tuple Certificate and private key paths
+    """
+    openssl = openssl or shutil.which('openssl')
+
+    if openssl is None:
+        raise RuntimeError('openssl not found')
+
+    certificate = os.path.join(directory, 'cert.pem')
+    key = os.path.join(directory, 'key.pem')
+
+    subprocess.run(
+        [
+            openssl, 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1',
+            '-keyout', key, '-out', certificate, '-subj', '/CN=localhost',
+            '-addext', 'subjectAltName=DNS:localhost,IP:127.0.0.1',
+        ],
+        check=True,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+    return certificate, key
+
+
+def server_ssl_context(certificate, key):
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(certificate, key)
+
+    return context
+
+
+def client_ssl_context(certificate):
+    return ssl.create_default_context(cafile=certificate)
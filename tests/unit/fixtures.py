@@ -1,5 +1,7 @@
+import asyncio
 import pytest
-from veides.sdk.agent import AgentClient, AgentProperties, ConnectionProperties
+import threading
+from veides.sdk.agent import AgentClient, AsyncAgentClient, AgentProperties, ConnectionProperties
 
 
 @pytest.fixture()
@@ -24,13 +26,25 @@ def mocked_paho_client(mocker):
         disconnect = mocker.stub("disconnect")
         loop_start = mocker.stub("loop_start")
         loop_stop = mocker.stub("loop_stop")
+        loop = mocker.stub("loop")
+        socket = mocker.stub("socket")
+        reconnect = mocker.stub("reconnect")
         username_pw_set = mocker.stub("username_pw_set")
         tls_set_context = mocker.stub("tls_set_context")
+        enable_logger = mocker.stub("enable_logger")
+        disable_logger = mocker.stub("disable_logger")
         message_callback_add = mocker.stub("message_callback_add")
         publish = mocker.stub("publish")
         subscribe = mocker.stub("subscribe")
+        unsubscribe = mocker.stub("unsubscribe")
+        max_inflight_messages_set = mocker.stub("max_inflight_messages_set")
+        max_queued_messages_set = mocker.stub("max_queued_messages_set")
+        _out_message_mutex = threading.RLock()
 
-    return MockedPahoClient()
+    client = MockedPahoClient()
+    client.socket.return_value = None
+
+    return client
 
 
 @pytest.fixture()
@@ -56,3 +70,27 @@ def not_connected_client(mocker, mocked_paho_client, agent_key, agent_secret_key
     )
 
     return client
+
+
+@pytest.fixture()
+def loop():
+    # asyncio.run() requires Python 3.7
+    event_loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(event_loop)
+
+    yield event_loop
+
+    asyncio.set_event_loop(None)
+    event_loop.close()
+
+
+@pytest.fixture()
+def async_client(mocker, mocked_paho_client, agent_key, agent_secret_key, hostname):
+    mocker.patch("paho.mqtt.client.Client", return_value=mocked_paho_client)
+
+    client = AsyncAgentClient(
+        AgentProperties(client_id='some_id', key=agent_key, secret_key=agent_secret_key),
+        ConnectionProperties(host=hostname)
+    )
+
+    return client
@@ -0,0 +1,241 @@
+import asyncio
+import json
+import pytest
+import threading
+from paho.mqtt.client import MQTTMessage, MQTT_ERR_SUCCESS, MQTT_ERR_NO_CONN
+from veides.sdk.agent import RateLimiter
+from tests.unit.fixtures import (
+    async_client,
+    loop,
+    mocked_paho_client,
+    agent_key,
+    agent_secret_key,
+    hostname
+)
+
+
+def test_should_connect_and_subscribe_to_base_topics(async_client, hostname, loop):
+    def side_effect(*_, **__):
+        async_client._loop.call_soon_threadsafe(async_client.client.on_connect, None, None, None, 0)
+        async_client._loop.call_soon_threadsafe(async_client.client.on_subscribe, None, None, 1, (1, 1))
+
+    async_client.client.connect.side_effect = side_effect
+    async_client.client.subscribe.return_value = (MQTT_ERR_SUCCESS, 1)
+
+    async def run():
+        await async_client.connect(timeout=1)
+        async_client._misc_task.cancel()
+
+    loop.run_until_complete(run())
+
+    async_client.client.connect.assert_called_once_with(hostname, keepalive=60, port=8883)
+    async_client.client.loop_start.assert_not_called()
+    assert async_client.client.subscribe.call_count == 1
+    assert async_client.is_connected() is True
+
+
+def test_should_resolve_send_when_message_is_acknowledged(async_client, loop):
+    async_client.client.publish.return_value = (MQTT_ERR_SUCCESS, 7)
+
+    async def run():
+        await prepare(async_client)
+
+        send = asyncio.ensure_future(async_client.send_event('ready'))
+        await asyncio.sleep(0)
+
+        assert send.done() is False
+
+        async_client._on_publish(None, None, 7)
+
+        return await send
+
+    assert loop.run_until_complete(run()) is True
+
+
+def test_should_resolve_send_when_message_was_written_before_publish_returned(async_client, loop):
+    def side_effect(*_, **__):
+        async_client._on_publish(None, None, 3)
+        return MQTT_ERR_SUCCESS, 3
+
+    async_client.client.publish.side_effect = side_effect
+
+    async def run():
+        await prepare(async_client)
+
+        return await async_client.send_trail('speed', 10)
+
+    assert loop.run_until_complete(run()) is True
+
+
+def test_should_resolve_send_as_failed_when_publish_fails(async_client, loop):
+    async_client.client.publish.return_value = (MQTT_ERR_NO_CONN, 1)
+
+    async def run():
+        await prepare(async_client)
+
+        return await async_client.send_facts({'battery': 'low'})
+
+    assert loop.run_until_complete(run()) is False
+
+
+def test_should_not_send_in_disconnected_state(async_client, loop):
+    async def run():
+        return await async_client.send_event('ready')
+
+    assert loop.run_until_complete(run()) is False
+    async_client.client.publish.assert_not_called()
+
+
+def test_should_run_coroutine_method_handler(async_client, loop):
+    method_name = 'some_method'
+    payload = {'foo': 'bar'}
+    received = []
+
+    msg = MQTTMessage()
+    msg.topic = f'agent/{async_client.client_id}/method/{method_name}'.encode('utf-8')
+    msg.payload = json.dumps(payload).encode('utf-8')
+
+    async def handler(name, body):
+        await asyncio.sleep(0)
+        received.append((name, body))
+
+    async_client.on_method(method_name, handler)
+
+    async def run():
+        await prepare(async_client)
+
+        async_client._on_method(None, None, msg)
+
+        await asyncio.gather(*async_client._handler_tasks)
+
+    loop.run_until_complete(run())
+
+    assert received == [(method_name, payload)]
+
+
+def test_should_measure_coroutine_handlers(async_client, loop):
+    async_client.enable_metrics()
+
+    async def handler(name, entities):
+        await asyncio.sleep(0)
+
+        if name == 'fail':
+            raise RuntimeError('failed')
+
+    async_client.on_any_action(handler)
+
+    async def run():
+        await prepare(async_client)
+
+        for name in ('ok', 'fail'):
+            msg = MQTTMessage()
+            msg.topic = f'agent/{async_client.client_id}/action_received'.encode('utf-8')
+            msg.payload = json.dumps({'name': name}).encode('utf-8')
+
+            async_client._on_action(None, None, msg)
+
+        await asyncio.gather(*async_client._handler_tasks, return_exceptions=True)
+
+    loop.run_until_complete(run())
+
+    metrics = async_client.get_metrics()
+
+    assert metrics['veides_handler_duration_seconds']['action:ok']['count'] == 1
+    assert metrics['veides_handler_duration_seconds']['action:fail']['count'] == 1
+    assert metrics['veides_handler_errors_total'] == {'action:fail': 1}
+
+
+async def prepare(client):
+    client._loop = asyncio.get_event_loop()
+    client._loop_thread_id = threading.get_ident()
+    client.connected.set()
+
+
+def test_should_flush_until_messages_are_acknowledged(async_client, loop):
+    async_client.client.publish.return_value = (MQTT_ERR_SUCCESS, 9)
+
+    async def run():
+        await prepare(async_client)
+
+        send = asyncio.ensure_future(async_client.send_trail('temperature', 20))
+        await asyncio.sleep(0)
+
+        assert await async_client.flush(timeout=0.01) is False
+
+        async_client._on_publish(None, None, 9)
+
+        return await async_client.flush(timeout=1) and await send
+
+    assert loop.run_until_complete(run()) is True
+
+
+def test_should_complete_nowait_handle_when_message_is_acknowledged(async_client, loop):
+    async_client.client.publish.return_value = (MQTT_ERR_SUCCESS, 4)
+
+    async def run():
+        await prepare(async_client)
+
+        handle = async_client.send_trail_nowait('speed', 10)
+
+        assert handle.accepted() is True
+        assert handle.done() is False
+
+        async_client._on_publish(None, None, 4)
+
+        return handle
+
+    assert loop.run_until_complete(run()).delivered() is True
+
+
+def test_should_measure_delivery_latency(async_client, loop):
+    async_client.client.publish.return_value = (MQTT_ERR_SUCCESS, 5)
+    async_client.enable_metrics()
+
+    async def run():
+        await prepare(async_client)
+
+        send = asyncio.ensure_future(async_client.send_event('ready'))
+        await asyncio.sleep(0)
+
+        async_client._on_publish(None, None, 5)
+
+        return await send
+
+    assert loop.run_until_complete(run()) is True
+
+    metrics = async_client.get_metrics()
+
+    assert metrics['veides_publish_latency_seconds']['1']['count'] == 1
+    assert metrics['veides_inflight_messages'] == 0
+
+
+def test_should_send_control_messages_ahead_of_telemetry_in_lanes(async_client, loop):
+    async_client.client.publish.side_effect = [(MQTT_ERR_SUCCESS, mid) for mid in range(1, 4)]
+    async_client.enable_priority_lanes(window=1)
+
+    async def run():
+        await prepare(async_client)
+
+        trails = [asyncio.ensure_future(async_client.send_trail('speed', value)) for value in (1, 2)]
+        event = asyncio.ensure_future(async_client.send_event('ready'))
+        await asyncio.sleep(0)
+
+        for mid in range(1, 4):
+            async_client._on_publish(None, None, mid)
+
+        return await asyncio.gather(*trails, event)
+
+    assert loop.run_until_complete(run()) == [True, True, True]
+
+    topics = [c[0][0] for c in async_client.client.publish.call_args_list]
+
+    assert topics == [
+        f'agent/{async_client.client_id}/trail/speed',
+        f'agent/{async_client.client_id}/event',
+        f'agent/{async_client.client_id}/trail/speed',
+    ]
+
+
+def test_should_not_allow_blocking_rate_limiting(async_client):
+    with pytest.raises(ValueError):
+        async_client.enable_rate_limiting({'trail': 10}, overflow=RateLimiter.BLOCK)
@@ -2,6 +2,7 @@ import pytest
 import json
 from paho.mqtt.client import MQTTMessage, MQTT_ERR_SUCCESS
 from unittest.mock import call
+from veides.sdk.agent.exceptions import ConnectionException
 from tests.unit.fixtures import (
     connected_client,
     not_connected_client,
@@ -15,20 +16,70 @@ from tests.unit.fixtures import (
 def test_should_subscribe_to_base_topics_and_set_event_when_connected(not_connected_client, hostname):
     def side_effect(*_, **__):
         not_connected_client.client.on_connect(None, None, None, 0)
+        not_connected_client.client.on_subscribe(None, None, 1, (1, 1))
 
     not_connected_client.client.connect.side_effect = side_effect
-    not_connected_client.client.subscribe.return_value = (MQTT_ERR_SUCCESS, None)
+    not_connected_client.client.subscribe.return_value = (MQTT_ERR_SUCCESS, 1)
     not_connected_client.connect()
 
     not_connected_client.client.connect.assert_called_once_with(hostname, keepalive=60, port=8883)
-    not_connected_client.client.loop_start.assert_called_once()
-    not_connected_client.client.subscribe.assert_has_calls([
-        call(f'agent/{not_connected_client.client_id}/action_received', qos=1),
-        call(f'agent/{not_connected_client.client_id}/method/+', qos=1),
+    not_connected_client.client.loop_start.assert_not_called()
+    assert not_connected_client._loop_thread is not None
+    not_connected_client.client.subscribe.assert_called_once_with([
+        (f'agent/{not_connected_client.client_id}/action_received', 1),
+        (f'agent/{not_connected_client.client_id}/method/+', 1),
     ])
     assert not_connected_client.is_connected() is True
 
 
+def test_should_subscribe_in_batches_and_wait_for_all_acknowledgements(not_connected_client, mocker):
+    not_connected_client.SUBSCRIBE_BATCH_SIZE = 2
+    not_connected_client.client.subscribe.side_effect = [(MQTT_ERR_SUCCESS, 1), (MQTT_ERR_SUCCESS, 2)]
+    not_connected_client.subscribe('fleet/#', mocker.stub())
+
+    not_connected_client._on_connect(None, None, None, 0)
+
+    assert not_connected_client.client.subscribe.call_count == 2
+    assert not_connected_client.client.subscribe.call_args[0][0] == [('fleet/#', 1)]
+    assert not_connected_client.is_connected() is True
+    assert not not_connected_client._ready.is_set()
+
+    not_connected_client._on_subscribe(None, None, 2, (1,))
+    assert not not_connected_client._ready.is_set()
+
+    not_connected_client._on_subscribe(None, None, 1, (1, 1))
+    assert not_connected_client._ready.is_set()
+    assert not_connected_client._connect_error is None
+
+
+def test_should_fail_connect_when_subscription_is_rejected(not_connected_client):
+    def side_effect(*_, **__):
+        not_connected_client.client.on_connect(None, None, None, 0)
+        not_connected_client.client.on_subscribe(None, None, 1, (1, 0x80))
+
+    not_connected_client.client.connect.side_effect = side_effect
+    not_connected_client.client.subscribe.return_value = (MQTT_ERR_SUCCESS, 1)
+
+    with pytest.raises(ConnectionException, match='method'):
+        not_connected_client.connect()
+
+    not_connected_client.client.disconnect.assert_called_once()
+    assert not_connected_client._loop_stopping.is_set()
+
+
+def test_should_fail_connect_when_connection_is_refused_without_raising_in_callback(not_connected_client):
+    def side_effect(*_, **__):
+        not_connected_client.client.on_connect(None, None, None, 4)
+
+    not_connected_client.client.connect.side_effect = side_effect
+
+    with pytest.raises(ConnectionException, match='Bad key or secret key'):
+        not_connected_client.connect()
+
+    assert not_connected_client.is_connected() is False
+    not_connected_client.client.subscribe.assert_not_called()
+
+
 def test_should_stop_loop_and_clear_event_after_disconnect(connected_client):
     def side_effect(*_, **__):
         connected_client.client.on_disconnect(None, None, 0)
@@ -38,7 +89,7 @@ def test_should_stop_loop_and_clear_event_after_disconnect(connected_client):
     connected_client.disconnect()
 
     connected_client.client.disconnect.assert_called_once()
-    connected_client.client.loop_stop.assert_called_once()
+    assert connected_client._loop_stopping.is_set()
     assert connected_client.is_connected() is False
 
 
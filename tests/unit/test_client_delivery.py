@@ -0,0 +1,112 @@
+import threading
+from paho.mqtt.client import MQTT_ERR_SUCCESS, MQTT_ERR_NO_CONN, MQTT_ERR_QUEUE_SIZE
+from tests.unit.fixtures import (
+    connected_client,
+    not_connected_client,
+    mocked_paho_client,
+    agent_key,
+    agent_secret_key,
+    hostname
+)
+
+
+def test_should_complete_handle_when_message_is_acknowledged(connected_client):
+    connected_client.client.publish.return_value = (MQTT_ERR_SUCCESS, 7)
+
+    handle = connected_client.send_event_nowait('some_event')
+
+    assert handle.accepted() is True
+    assert handle.mid == 7
+    assert handle.done() is False
+
+    connected_client._on_publish(None, None, 7)
+
+    assert handle.done() is True
+    assert handle.delivered() is True
+    assert handle.wait(0) is True
+
+
+def test_should_complete_handle_acknowledged_before_publish_returned(connected_client):
+    connected_client.client.publish.return_value = (MQTT_ERR_SUCCESS, 3)
+    connected_client._on_publish(None, None, 3)
+
+    handle = connected_client.send_trail_nowait('some_trail', 1)
+
+    assert handle.delivered() is True
+
+
+def test_should_fail_handle_when_paho_rejects_message(connected_client):
+    connected_client.client.publish.return_value = (MQTT_ERR_QUEUE_SIZE, 0)
+
+    handle = connected_client.send_action_completed_nowait('some_action')
+
+    assert handle.accepted() is False
+    assert handle.done() is True
+    assert handle.delivered() is False
+
+
+def test_should_not_wait_for_connection(not_connected_client):
+    handle = not_connected_client.send_method_response_nowait('some_method', {})
+
+    assert handle.rc == MQTT_ERR_NO_CONN
+    assert handle.done() is True
+    not_connected_client.client.publish.assert_not_called()
+
+
+def test_should_call_done_callbacks(connected_client):
+    connected_client.client.publish.return_value = (MQTT_ERR_SUCCESS, 1)
+    calls = []
+
+    handle = connected_client.send_facts_nowait({'battery': 'full'})
+    handle.add_done_callback(calls.append)
+
+    connected_client._on_publish(None, None, 1)
+    handle.add_done_callback(calls.append)
+
+    assert calls == [handle, handle]
+
+
+def test_should_fail_qos0_messages_on_disconnect(connected_client):
+    connected_client.client.publish.return_value = (MQTT_ERR_SUCCESS, 1)
+
+    handle = connected_client._publish_nowait('some/topic', {}, qos=0)
+    connected_client._on_disconnect(None, None, 1)
+
+    assert handle.done() is True
+    assert handle.delivered() is False
+
+
+def test_should_flush_until_all_messages_are_acknowledged(connected_client):
+    mids = iter(range(1, 4))
+    connected_client.client.publish.side_effect = lambda *args, **kwargs: (MQTT_ERR_SUCCESS, next(mids))
+
+    for i in range(3):
+        assert connected_client.send_trail('some_trail', i) is True
+
+    assert connected_client.flush(timeout=0.01) is False
+
+    timer = threading.Timer(0.05, lambda: [connected_client._on_publish(None, None, mid) for mid in (1, 2, 3)])
+    timer.start()
+
+    assert connected_client.flush(timeout=2) is True
+    timer.join()
+
+
+def test_should_complete_handle_of_queued_message_after_delivery(not_connected_client):
+    not_connected_client.client.publish.return_value = (MQTT_ERR_SUCCESS, 5)
+    not_connected_client.client.subscribe.return_value = (MQTT_ERR_SUCCESS, 1)
+    not_connected_client.enable_outbox()
+
+    handle = not_connected_client.send_event_nowait('some_event')
+
+    assert handle.accepted() is True
+    assert handle.done() is False
+
+    not_connected_client._on_connect(None, None, None, 0)
+
+    assert not_connected_client.flush(timeout=0.5) is False
+
+    not_connected_client._on_publish(None, None, 5)
+
+    assert handle.wait(2) is True
+    assert not_connected_client.flush(timeout=2) is True
@@ -0,0 +1,142 @@
+import itertools
+from paho.mqtt.client import MQTT_ERR_SUCCESS, MQTT_ERR_NO_CONN
+from unittest.mock import call
+from veides.sdk.agent import RateLimiter
+from tests.unit.fixtures import (
+    connected_client,
+    mocked_paho_client,
+    agent_key,
+    agent_secret_key,
+    hostname
+)
+
+
+def facts_call(client, facts):
+    return call(
+        'agent/{}/facts'.format(client.client_id),
+        client.codec.encode(facts),
+        qos=1,
+        retain=False
+    )
+
+
+def acknowledge_publishes(client):
+    mids = itertools.count(1)
+
+    def publish(*args, **kwargs):
+        mid = next(mids)
+        client._on_publish(None, None, mid)
+        return MQTT_ERR_SUCCESS, mid
+
+    client.client.publish.side_effect = publish
+
+
+def test_should_send_only_changed_facts(connected_client):
+    acknowledge_publishes(connected_client)
+    connected_client.enable_fact_cache()
+
+    assert connected_client.send_facts({'battery': 'full', 'charging': 'no'}) is True
+    assert connected_client.send_facts({'battery': 'full', 'charging': 'no'}) is True
+    assert connected_client.send_facts({'battery': 'low', 'charging': 'no'}) is True
+
+    assert connected_client.client.publish.call_args_list == [
+        facts_call(connected_client, {'battery': 'full', 'charging': 'no'}),
+        facts_call(connected_client, {'battery': 'low'}),
+    ]
+
+
+def test_should_send_facts_again_when_previous_send_failed(connected_client):
+    connected_client.client.publish.return_value = (MQTT_ERR_NO_CONN, 1)
+    connected_client.enable_fact_cache()
+
+    assert connected_client.send_facts({'battery': 'full'}) is False
+
+    connected_client.client.publish.return_value = (MQTT_ERR_SUCCESS, 1)
+
+    assert connected_client.send_facts({'battery': 'full'}) is True
+    assert connected_client.client.publish.call_count == 2
+
+
+def test_should_send_invalidated_facts_again(connected_client):
+    acknowledge_publishes(connected_client)
+    connected_client.enable_fact_cache()
+
+    connected_client.send_facts({'battery': 'full', 'charging': 'no'})
+    connected_client.invalidate_fact_cache(['battery'])
+    connected_client.send_facts({'battery': 'full', 'charging': 'no'})
+    connected_client.invalidate_fact_cache()
+    connected_client.send_facts({'battery': 'full', 'charging': 'no'})
+
+    assert connected_client.client.publish.call_args_list == [
+        facts_call(connected_client, {'battery': 'full', 'charging': 'no'}),
+        facts_call(connected_client, {'battery': 'full'}),
+        facts_call(connected_client, {'battery': 'full', 'charging': 'no'}),
+    ]
+
+
+def test_should_send_facts_again_until_they_are_delivered(connected_client):
+    connected_client.client.publish.return_value = (MQTT_ERR_SUCCESS, 1)
+    connected_client.enable_fact_cache()
+
+    connected_client.send_facts({'battery': 'full'})
+    connected_client.send_facts({'battery': 'full'})
+    connected_client._on_publish(None, None, 1)
+    connected_client.send_facts({'battery': 'full'})
+
+    assert connected_client.client.publish.call_count == 2
+
+
+def test_should_not_remember_facts_held_back_by_rate_limiter(connected_client):
+    acknowledge_publishes(connected_client)
+    connected_client.enable_fact_cache()
+    connected_client.enable_rate_limiting({'facts': 0.1}, burst=1, overflow=RateLimiter.DROP)
+
+    connected_client.send_facts({'battery': 'full'})
+    connected_client.send_facts({'charging': 'no'})
+    connected_client.disable_rate_limiting()
+    connected_client.send_facts({'charging': 'no'})
+
+    assert connected_client.client.publish.call_args_list == [
+        facts_call(connected_client, {'battery': 'full'}),
+        facts_call(connected_client, {'charging': 'no'}),
+    ]
+
+
+def test_should_resend_cached_facts_after_reconnect(connected_client):
+    acknowledge_publishes(connected_client)
+    connected_client.client.subscribe.return_value = (MQTT_ERR_SUCCESS, 1)
+    connected_client.enable_fact_cache(resync_on_reconnect=True)
+
+    connected_client.send_facts({'battery': 'full'})
+    connected_client.send_facts({'charging': 'no'})
+
+    connected_client._on_disconnect(None, None, 1)
+    connected_client._on_connect(None, None, {}, 0)
+
+    assert connected_client.client.publish.call_args_list[-1] == facts_call(
+        connected_client,
+        {'battery': 'full', 'charging': 'no'}
+    )
+
+
+def test_should_not_resend_cached_facts_after_reconnect_when_disabled(connected_client):
+    connected_client.client.publish.return_value = (MQTT_ERR_SUCCESS, 1)
+    connected_client.client.subscribe.return_value = (MQTT_ERR_SUCCESS, 1)
+    connected_client.enable_fact_cache(resync_on_reconnect=False)
+
+    connected_client.send_facts({'battery': 'full'})
+
+    connected_client._on_disconnect(None, None, 1)
+    connected_client._on_connect(None, None, {}, 0)
+
+    assert connected_client.client.publish.call_count == 1
+
+
+def test_should_send_all_facts_when_cache_is_disabled(connected_client):
+    connected_client.enable_fact_cache()
+    connected_client.disable_fact_cache()
+
+    connected_client.send_facts({'battery': 'full'})
+    connected_client.send_facts({'battery': 'full'})
+
+    assert connected_client.client.publish.call_count == 2
@@ -0,0 +1,96 @@
+import pytest
+from paho.mqtt.client import MQTT_ERR_SUCCESS
+from veides.sdk.agent import AgentClient, AgentProperties, ConnectionProperties, QosPolicy
+from tests.unit.fixtures import (
+    mocked_paho_client,
+    agent_key,
+    agent_secret_key,
+    hostname
+)
+
+
+@pytest.fixture()
+def create_client(mocker, mocked_paho_client, agent_key, agent_secret_key, hostname):
+    mocker.patch("paho.mqtt.client.Client", return_value=mocked_paho_client)
+    mocked_paho_client.publish.return_value = (MQTT_ERR_SUCCESS, 1)
+
+    def create(**kwargs):
+        client = AgentClient(
+            AgentProperties(client_id='some_id', key=agent_key, secret_key=agent_secret_key),
+            ConnectionProperties(host=hostname),
+            **kwargs
+        )
+        client.connected.set()
+
+        return client
+
+    return create
+
+
+def sent_qos(client):
+    return [c[1]['qos'] for c in client.client.publish.call_args_list]
+
+
+def test_should_send_messages_with_qos_of_their_type(create_client):
+    client = create_client(qos_policy=QosPolicy(trail=0, event=0, facts=1, method_response=1, action_completed=2))
+
+    client.send_trail('temperature', 20)
+    client.send_event('ready')
+    client.send_facts({'battery': 'full'})
+    client.send_method_response('some_method', {})
+    client.send_action_completed('some_action')
+
+    assert sent_qos(client) == [0, 0, 1, 1, 2]
+
+
+def test_should_send_trails_with_qos_of_their_name(create_client):
+    client = create_client(qos_policy=QosPolicy(trail=0, trails={'alarm': 1}))
+
+    client.send_trail('temperature', 20)
+    client.send_trail('alarm', 'fire')
+    client.trail_publisher('temperature')(21)
+    client.trail_publisher('alarm')('smoke')
+    client.send_trail_nowait('alarm', 'fire')
+
+    assert sent_qos(client) == [0, 1, 0, 1, 1]
+
+
+def test_should_use_qos_1_by_default(create_client):
+    client = create_client()
+
+    client.send_trail('temperature', 20)
+    client.send_event('ready')
+
+    assert sent_qos(client) == [1, 1]
+
+
+def test_should_configure_paho_queues(create_client):
+    client = create_client(max_inflight_messages=100, max_queued_messages=1000)
+
+    client.client.max_inflight_messages_set.assert_called_once_with(100)
+    client.client.max_queued_messages_set.assert_called_once_with(1000)
+
+
+@pytest.mark.parametrize("kwargs", [
+    {'trail': 3},
+    {'facts': -1},
+    {'event': True},
+    {'trails': {'alarm': '1'}},
+])
+def test_should_raise_error_when_given_invalid_qos(kwargs):
+    with pytest.raises(ValueError):
+        QosPolicy(**kwargs)
+
+
+@pytest.mark.parametrize("kwargs", [
+    {'max_inflight_messages': 0},
+    {'max_queued_messages': -1},
+])
+def test_should_raise_error_when_given_invalid_paho_limits(create_client, kwargs):
+    with pytest.raises(ValueError):
+        create_client(**kwargs)
+
+
+def test_should_raise_error_when_given_invalid_qos_policy(create_client):
+    with pytest.raises(TypeError):
+        create_client(qos_policy={'trail': 0})
@@ -1,5 +1,4 @@
 import pytest
-import json
 from tests.unit.fixtures import (
     connected_client,
     mocked_paho_client,
@@ -16,7 +15,7 @@ def test_should_send_action_completed_without_facts(connected_client):
 
     connected_client.client.publish.assert_called_once_with(
         'agent/{}/action_completed'.format(connected_client.client_id),
-        json.dumps({
+        connected_client.codec.encode({
             'name': action_name,
         }),
         qos=1,
@@ -42,7 +41,7 @@ def test_should_send_event(connected_client):
 
     connected_client.client.publish.assert_called_once_with(
         'agent/{}/event'.format(connected_client.client_id),
-        json.dumps(dict(name=event_name)),
+        connected_client.codec.encode(dict(name=event_name)),
         qos=1,
         retain=False
     )
@@ -67,7 +66,7 @@ def test_should_send_facts(connected_client):
 
     connected_client.client.publish.assert_called_once_with(
         'agent/{}/facts'.format(connected_client.client_id),
-        json.dumps(facts),
+        connected_client.codec.encode(facts),
         qos=1,
         retain=False
     )
@@ -97,7 +96,7 @@ def test_should_send_method_response(connected_client):
 
     connected_client.client.publish.assert_called_once_with(
         'agent/{}/method_response/{}'.format(connected_client.client_id, method_name),
-        json.dumps({
+        connected_client.codec.encode({
             "payload": payload,
             "code": 201
         }),
@@ -0,0 +1,109 @@
+import pytest
+from paho.mqtt.client import MQTTMessage, MQTT_ERR_NO_CONN, MQTT_ERR_SUCCESS
+from tests.unit.fixtures import (
+    connected_client,
+    not_connected_client,
+    mocked_paho_client,
+    agent_key,
+    agent_secret_key,
+    hostname
+)
+
+
+def message(topic, payload):
+    msg = MQTTMessage(topic=topic.encode('utf-8'))
+    msg.payload = payload
+
+    return msg
+
+
+def test_should_subscribe_when_connected(connected_client, mocker):
+    connected_client.client.subscribe.return_value = (MQTT_ERR_SUCCESS, 1)
+
+    assert connected_client.subscribe('fleet/+/position', mocker.stub(), qos=0)
+
+    connected_client.client.subscribe.assert_called_once_with('fleet/+/position', qos=0)
+    assert connected_client._subscribed_topics['fleet/+/position'] == 0
+
+
+def test_should_subscribe_on_connect(not_connected_client, mocker):
+    not_connected_client.client.subscribe.return_value = (MQTT_ERR_SUCCESS, 1)
+
+    assert not_connected_client.subscribe('fleet/#', mocker.stub())
+    not_connected_client.client.subscribe.assert_not_called()
+
+    not_connected_client._on_connect(None, None, {}, 0)
+
+    assert ('fleet/#', 1) in not_connected_client.client.subscribe.call_args[0][0]
+
+
+def test_should_return_false_when_subscribing_failed(connected_client, mocker):
+    connected_client.client.subscribe.return_value = (MQTT_ERR_NO_CONN, None)
+
+    assert not connected_client.subscribe('fleet/#', mocker.stub())
+    assert 'fleet/#' in connected_client._subscribed_topics
+
+
+def test_should_not_subscribe_again_with_lower_qos(connected_client, mocker):
+    connected_client.client.subscribe.return_value = (MQTT_ERR_SUCCESS, 1)
+
+    connected_client.subscribe('fleet/#', mocker.stub(), qos=1)
+    connected_client.subscribe('fleet/#', mocker.stub(), qos=0)
+
+    assert connected_client.client.subscribe.call_count == 1
+
+
+def test_should_dispatch_message_to_matching_callbacks(connected_client, mocker):
+    connected_client.client.subscribe.return_value = (MQTT_ERR_SUCCESS, 1)
+    position = mocker.stub()
+    everything = mocker.stub()
+    raw = mocker.stub()
+    other = mocker.stub()
+
+    connected_client.subscribe('fleet/+/position', position)
+    connected_client.subscribe('fleet/#', everything)
+    connected_client.subscribe('fleet/+/position', raw, raw=True)
+    connected_client.subscribe('other/#', other)
+
+    connected_client._on_message(None, None, message('fleet/agent1/position', b'{"x":1}'))
+
+    position.assert_called_once_with('fleet/agent1/position', {'x': 1})
+    everything.assert_called_once_with('fleet/agent1/position', {'x': 1})
+    raw.assert_called_once_with('fleet/agent1/position', b'{"x":1}')
+    other.assert_not_called()
+
+
+def test_should_unsubscribe_when_no_callback_left(connected_client, mocker):
+    connected_client.client.subscribe.return_value = (MQTT_ERR_SUCCESS, 1)
+    first = mocker.stub()
+    second = mocker.stub()
+
+    connected_client.subscribe('fleet/#', first)
+    connected_client.subscribe('fleet/#', second)
+
+    connected_client.unsubscribe('fleet/#', first)
+    connected_client.client.unsubscribe.assert_not_called()
+
+    connected_client.unsubscribe('fleet/#', second)
+    connected_client.client.unsubscribe.assert_called_once_with('fleet/#')
+    assert 'fleet/#' not in connected_client._subscribed_topics
+
+    connected_client._on_message(None, None, message('fleet/a', b'{}'))
+
+    first.assert_not_called()
+    second.assert_not_called()
+
+
+def test_should_not_subscribe_to_reserved_topics(connected_client, mocker):
+    with pytest.raises(ValueError):
+        connected_client.subscribe('agent/some_id/method/+', mocker.stub())
+
+
+@pytest.mark.parametrize('args,exception', [
+    (('a/#/b', lambda t, p: None), ValueError),
+    (('a/b', None), TypeError),
+    (('a/b', lambda t, p: None, 3), ValueError),
+])
+def test_should_validate_subscription(connected_client, args, exception):
+    with pytest.raises(exception):
+        connected_client.subscribe(*args)
@@ -0,0 +1,94 @@
+import time
+from paho.mqtt.client import MQTT_ERR_SUCCESS, MQTT_ERR_NO_CONN
+from unittest.mock import call
+from tests.unit.fixtures import (
+    connected_client,
+    mocked_paho_client,
+    agent_key,
+    agent_secret_key,
+    hostname
+)
+
+
+def trail_call(client, name, value):
+    return call(
+        'agent/{}/trail/{}'.format(client.client_id, name),
+        client.codec.encode({'value': value}),
+        qos=1,
+        retain=False
+    )
+
+
+def test_should_keep_last_trail_value_and_flush_on_disconnect(connected_client):
+    connected_client.client.publish.return_value = (MQTT_ERR_SUCCESS, 1)
+    connected_client.enable_trail_batching(max_size=10, max_latency=60)
+
+    connected_client.send_trail('speed', 1)
+    connected_client.send_trail('speed', 2)
+    connected_client.send_trail('level', 'low')
+
+    connected_client.client.publish.assert_not_called()
+
+    connected_client.disconnect()
+
+    connected_client.client.publish.assert_has_calls([
+        trail_call(connected_client, 'speed', 2),
+        trail_call(connected_client, 'level', 'low'),
+    ])
+    assert connected_client.client.publish.call_count == 2
+    assert connected_client.get_trail_batching_stats() == {
+        'flushed': 2,
+        'merged': 1,
+        'dropped': 0,
+        'buffered': 0,
+    }
+
+
+def test_should_flush_when_size_budget_is_hit(connected_client):
+    connected_client.enable_trail_batching(max_size=2, max_latency=60)
+
+    connected_client.send_trail('speed', 1)
+    connected_client.send_trail('level', 2)
+
+    assert connected_client.client.publish.call_count == 2
+
+
+def test_should_flush_when_latency_budget_is_hit(connected_client):
+    connected_client.enable_trail_batching(max_size=10, max_latency=0.01)
+
+    connected_client.send_trail('speed', 1)
+
+    deadline = time.monotonic() + 2
+    while connected_client.client.publish.call_count == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    connected_client.client.publish.assert_called_once_with(
+        'agent/{}/trail/speed'.format(connected_client.client_id),
+        connected_client.codec.encode({'value': 1}),
+        qos=1,
+        retain=False
+    )
+
+
+def test_should_count_dropped_trails_when_publish_fails(connected_client):
+    connected_client.client.publish.return_value = (MQTT_ERR_NO_CONN, None)
+    connected_client.enable_trail_batching(max_size=10, max_latency=60)
+
+    connected_client.send_trail('speed', 1)
+    connected_client.disconnect()
+
+    assert connected_client.get_trail_batching_stats()['dropped'] == 1
+
+
+def test_should_flush_and_send_immediately_when_batching_disabled(connected_client):
+    connected_client.enable_trail_batching(max_size=10, max_latency=60)
+
+    connected_client.send_trail('speed', 1)
+    connected_client.disable_trail_batching()
+    connected_client.send_trail('speed', 2)
+
+    assert connected_client.client.publish.call_count == 2
+
+
+def test_should_return_no_stats_when_batching_disabled(connected_client):
+    assert connected_client.get_trail_batching_stats() is None
@@ -0,0 +1,58 @@
+import pytest
+from paho.mqtt.client import MQTT_ERR_SUCCESS
+from tests.unit.fixtures import (
+    connected_client,
+    mocked_paho_client,
+    agent_key,
+    agent_secret_key,
+    hostname
+)
+
+
+def test_trail_publisher_should_send_trail(connected_client):
+    connected_client.client.publish.return_value = (MQTT_ERR_SUCCESS, 1)
+
+    publish_speed = connected_client.trail_publisher('speed')
+
+    assert publish_speed(10) is True
+    assert publish_speed.name == 'speed'
+
+    connected_client.client.publish.assert_called_once_with(
+        'agent/{}/trail/speed'.format(connected_client.client_id),
+        connected_client.codec.encode({'value': 10}),
+        qos=1,
+        retain=False
+    )
+
+
+def test_trail_publisher_should_use_trail_batching(connected_client):
+    publish_speed = connected_client.trail_publisher('speed')
+
+    connected_client.enable_trail_batching(max_size=10, max_latency=60)
+
+    publish_speed(1)
+    publish_speed(2)
+
+    connected_client.client.publish.assert_not_called()
+    assert connected_client.get_trail_batching_stats()['merged'] == 1
+
+
+def test_should_reuse_topics_of_sent_trails(connected_client):
+    connected_client.send_trail('speed', 1)
+    connected_client.send_trail('speed', 2)
+
+    first_topic = connected_client.client.publish.call_args_list[0][0][0]
+    second_topic = connected_client.client.publish.call_args_list[1][0][0]
+
+    assert first_topic is second_topic
+
+
+@pytest.mark.parametrize("name", [
+    None,
+    {},
+    123,
+    '',
+])
+def test_trail_publisher_should_raise_error_if_given_invalid_name(name, connected_client):
+    with pytest.raises(Exception):
+        connected_client.trail_publisher(name)
@@ -0,0 +1,115 @@
+import pytest
+import json
+from paho.mqtt.client import MQTTMessage
+from veides.sdk.agent import AgentClient, AgentProperties, ConnectionProperties
+from veides.sdk.agent.codecs import Codec, JsonCodec, OrjsonCodec, UjsonCodec, default_codec
+from tests.unit.fixtures import (
+    mocked_paho_client,
+    agent_key,
+    agent_secret_key,
+    hostname
+)
+
+
+class ReversedJsonCodec(Codec):
+    name = 'reversed'
+
+    def encode(self, data):
+        return json.dumps(data)[::-1].encode('utf-8')
+
+    def decode(self, payload):
+        return json.loads(bytes(payload)[::-1])
+
+
+def available_codecs():
+    codecs = [JsonCodec]
+
+    for codec in (OrjsonCodec, UjsonCodec):
+        try:
+            codec()
+            codecs.append(codec)
+        except ImportError:
+            pass
+
+    return codecs
+
+
+@pytest.mark.parametrize("codec", available_codecs())
+@pytest.mark.parametrize("data", [
+    {'value': 12.5},
+    {'battery_level': 'full', 'charging': 'no'},
+    {'payload': {'items': [1, 2, 3], 'nested': {'ok': True}}, 'code': 200},
+])
+def test_codec_should_decode_encoded_data(codec, data):
+    codec = codec()
+    encoded = codec.encode(data)
+
+    if isinstance(encoded, str):
+        encoded = encoded.encode('utf-8')
+
+    assert codec.decode(encoded) == data
+
+
+@pytest.mark.parametrize("codec", available_codecs())
+def test_codec_should_encode_non_str_keys_like_json(codec):
+    codec = codec()
+    encoded = codec.encode({'payload': {1: 'one', 2.5: 'half'}})
+
+    if isinstance(encoded, str):
+        encoded = encoded.encode('utf-8')
+
+    assert codec.decode(encoded) == {'payload': {'1': 'one', '2.5': 'half'}}
+
+
+def test_default_codec_should_prefer_fastest_available_codec(mocker):
+    mocker.patch("veides.sdk.agent.codecs.orjson", None)
+    mocker.patch("veides.sdk.agent.codecs.ujson", None)
+
+    assert isinstance(default_codec(), JsonCodec)
+
+    if OrjsonCodec in available_codecs():
+        mocker.stopall()
+
+        assert isinstance(default_codec(), OrjsonCodec)
+
+
+def test_client_should_use_given_codec(mocker, mocked_paho_client, agent_key, agent_secret_key, hostname):
+    mocker.patch("paho.mqtt.client.Client", return_value=mocked_paho_client)
+
+    client = AgentClient(
+        AgentProperties(client_id='some_id', key=agent_key, secret_key=agent_secret_key),
+        ConnectionProperties(host=hostname),
+        codec=ReversedJsonCodec()
+    )
+    client.connected.set()
+
+    client.send_event('ready')
+
+    client.client.publish.assert_called_once_with(
+        'agent/some_id/event',
+        json.dumps({'name': 'ready'})[::-1].encode('utf-8'),
+        qos=1,
+        retain=False
+    )
+
+    func = mocker.stub('some_method_handler')
+    client.on_method('some_method', func)
+
+    msg = MQTTMessage()
+    msg.topic = b'agent/some_id/method/some_method'
+    msg.payload = json.dumps({'foo': 'bar'})[::-1].encode('utf-8')
+
+    client._on_method(None, None, msg)
+
+    func.assert_called_once_with('some_method', {'foo': 'bar'})
+
+
+def test_client_should_raise_error_when_given_invalid_codec(mocker, mocked_paho_client, hostname):
+    mocker.patch("paho.mqtt.client.Client", return_value=mocked_paho_client)
+
+    with pytest.raises(TypeError):
+        AgentClient(
+            AgentProperties(client_id='some_id', key='key', secret_key='secret'),
+            ConnectionProperties(host=hostname),
+            codec=json
+        )
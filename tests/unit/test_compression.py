@@ -0,0 +1,215 @@
+import pytest
+import json
+import zlib
+from paho.mqtt.client import MQTTMessage, MQTT_ERR_SUCCESS
+from veides.sdk.agent import AgentClient, AgentProperties, ConnectionProperties
+from veides.sdk.agent.compression import (
+    HEADER,
+    MARKER,
+    PayloadCompression,
+    ZlibCompressor,
+    ZstdCompressor,
+    decompress,
+    default_compressor,
+    is_compressed,
+    train_dictionary,
+)
+from tests.unit.fixtures import (
+    mocked_paho_client,
+    agent_key,
+    agent_secret_key,
+    hostname
+)
+
+SAMPLES = [
+    json.dumps({'payload': {'status': 'idle', 'battery': i % 100, 'errors': []}, 'code': 200}).encode('utf-8')
+    for i in range(500)
+]
+DIAGNOSTICS = json.dumps({
+    'payload': {'log': ['%d motor_%d temperature=%d status=ok' % (i, i % 4, 40 + i % 20) for i in range(2000)]},
+    'code': 200,
+}).encode('utf-8')
+
+
+def available_compressors():
+    compressors = [ZlibCompressor]
+
+    try:
+        ZstdCompressor()
+        compressors.append(ZstdCompressor)
+    except ImportError:
+        pass
+
+    return compressors
+
+
+@pytest.fixture()
+def client(mocker, mocked_paho_client, agent_key, agent_secret_key, hostname):
+    mocker.patch("paho.mqtt.client.Client", return_value=mocked_paho_client)
+    mocked_paho_client.publish.return_value = (MQTT_ERR_SUCCESS, 1)
+
+    client = AgentClient(
+        AgentProperties(client_id='some_id', key=agent_key, secret_key=agent_secret_key),
+        ConnectionProperties(host=hostname)
+    )
+    client.connected.set()
+
+    return client
+
+
+def method_message(dictionary):
+    msg = MQTTMessage()
+    msg.topic = b'agent/some_id/method/get_diagnostics'
+    msg.payload = PayloadCompression(ZlibCompressor(dictionary=dictionary), threshold=0, kinds=('method',)).compress(
+        json.dumps({'lines': ['motor_%d' % i for i in range(100)]}).encode('utf-8'),
+        'method'
+    )
+
+    assert is_compressed(msg.payload)
+
+    return msg
+
+
+@pytest.mark.parametrize("compressor", available_compressors())
+@pytest.mark.parametrize("dictionary", [None, train_dictionary(SAMPLES, size=4096)])
+def test_should_decompress_compressed_payload(compressor, dictionary):
+    compression = PayloadCompression(compressor(dictionary=dictionary), threshold=0)
+
+    compressed = compression.compress(DIAGNOSTICS, 'method_response')
+
+    assert is_compressed(compressed)
+    assert len(compressed) < len(DIAGNOSTICS) / 10
+    assert decompress(compressed, compression.compressor) == DIAGNOSTICS
+
+
+def test_should_compress_only_given_kinds_above_threshold():
+    compression = PayloadCompression(ZlibCompressor(), threshold=100, kinds=('facts',))
+
+    assert compression.compress(DIAGNOSTICS, 'method_response') is DIAGNOSTICS
+    assert compression.compress(b'{"battery": "full"}', 'facts') == b'{"battery": "full"}'
+    assert is_compressed(compression.compress(DIAGNOSTICS, 'facts'))
+    assert compression.stats() == {
+        'compressed': 1,
+        'bytes_in': len(DIAGNOSTICS),
+        'bytes_out': len(compression.compress(DIAGNOSTICS, 'facts')),
+    }
+
+
+def test_should_not_compress_payload_which_does_not_get_smaller():
+    compression = PayloadCompression(ZlibCompressor(), threshold=0)
+    payload = bytes(range(256))
+
+    assert compression.compress(payload, 'facts') is payload
+    assert compression.stats()['compressed'] == 0
+
+
+def test_should_reject_payload_compressed_with_unknown_dictionary():
+    compressed = PayloadCompression(ZlibCompressor(dictionary=b'{"payload": '), threshold=0).compress(DIAGNOSTICS, 'facts')
+
+    with pytest.raises(ValueError):
+        decompress(compressed)
+
+    with pytest.raises(ValueError):
+        decompress(compressed, ZlibCompressor(dictionary=b'{"code": '))
+
+
+@pytest.mark.parametrize("compressor", available_compressors())
+def test_should_reject_payload_above_max_size(compressor):
+    compressed = PayloadCompression(compressor(), threshold=0).compress(b'{"a": "' + b'a' * 100000 + b'"}', 'facts')
+
+    with pytest.raises(ValueError):
+        decompress(compressed, max_size=1000)
+
+
+def test_should_reject_corrupted_payload():
+    with pytest.raises(ValueError):
+        decompress(HEADER.pack(MARKER, ZlibCompressor.id, 0) + b'not zlib')
+
+    with pytest.raises(ValueError):
+        decompress(MARKER)
+
+    with pytest.raises(ValueError):
+        decompress(HEADER.pack(MARKER, 99, 0) + zlib.compress(DIAGNOSTICS))
+
+
+def test_default_compressor_should_fall_back_to_zlib(mocker):
+    mocker.patch("veides.sdk.agent.compression.zstandard", None)
+
+    assert isinstance(default_compressor(), ZlibCompressor)
+    assert isinstance(train_dictionary(SAMPLES, size=1024), bytes)
+    assert len(train_dictionary(SAMPLES, size=1024)) <= 1024
+
+
+def test_client_should_compress_large_method_response(client):
+    client.enable_compression(ZlibCompressor(), threshold=1024)
+
+    client.send_method_response('get_status', {'status': 'idle'})
+    client.send_method_response('get_diagnostics', json.loads(DIAGNOSTICS)['payload'])
+
+    small, large = [c[0][1] for c in client.client.publish.call_args_list]
+
+    assert json.loads(small) == {'payload': {'status': 'idle'}, 'code': 200}
+    assert is_compressed(large)
+    assert json.loads(decompress(large)) == json.loads(DIAGNOSTICS)
+    assert client.get_compression_stats()['compressed'] == 1
+
+    client.disable_compression()
+
+    assert client.get_compression_stats() is None
+
+
+def test_client_should_queue_compressed_payload(client):
+    client.enable_compression(ZlibCompressor(), threshold=0)
+    client.enable_outbox()
+    client.connected.clear()
+
+    client.send_facts({'battery_level': 'full' * 100})
+
+    topic, payload, _ = client._outbox.peek()
+
+    assert topic == 'agent/some_id/facts'
+    assert json.loads(decompress(payload)) == {'battery_level': 'full' * 100}
+
+    client.disable_outbox()
+
+
+def test_client_should_decompress_received_method_payload(client, mocker):
+    dictionary = train_dictionary(SAMPLES, size=4096)
+    client.enable_compression(ZlibCompressor(dictionary=dictionary))
+    func = mocker.stub('method_handler')
+    client.on_method('get_diagnostics', func)
+
+    client._on_method(None, None, method_message(dictionary))
+
+    func.assert_called_once_with('get_diagnostics', {'lines': ['motor_%d' % i for i in range(100)]})
+
+
+def test_client_should_drop_method_payload_which_cannot_be_decompressed(client, mocker):
+    func = mocker.stub('method_handler')
+    client.on_method('get_diagnostics', func)
+
+    client._on_method(None, None, method_message(b'{"lines": '))
+
+    func.assert_not_called()
+
+
+def test_client_should_pass_payload_looking_compressed_to_raw_subscription_as_received(client, mocker):
+    client.client.subscribe.return_value = (MQTT_ERR_SUCCESS, 1)
+    raw = mocker.stub('raw_handler')
+    decoded = mocker.stub('decoded_handler')
+    client.subscribe('sensors/+/image', raw, raw=True)
+    client.subscribe('sensors/#', decoded)
+
+    msg = MQTTMessage()
+    msg.topic = b'sensors/camera/image'
+    msg.payload = MARKER + b'\xff\xd8 not compressed'
+
+    client._on_message(None, None, msg)
+
+    raw.assert_called_once_with('sensors/camera/image', MARKER + b'\xff\xd8 not compressed')
+    decoded.assert_not_called()
+
+
+def test_client_should_raise_error_when_given_invalid_compressor(client):
+    with pytest.raises(TypeError):
+        client.enable_compression(zlib)
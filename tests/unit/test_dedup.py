@@ -0,0 +1,195 @@
+import pytest
+import json
+from paho.mqtt.client import MQTTMessage
+from veides.sdk.agent.dedup import DedupCache, message_key
+from tests.unit.fixtures import (
+    connected_client,
+    mocked_paho_client,
+    agent_key,
+    agent_secret_key,
+    hostname
+)
+
+
+def message(topic, payload, mid=1, qos=1, dup=False):
+    msg = MQTTMessage(mid=mid, topic=topic.encode('utf-8'))
+    msg.payload = json.dumps(payload).encode('utf-8')
+    msg.qos = qos
+    msg.dup = dup
+
+    return msg
+
+
+def redelivered(msg):
+    return message(msg.topic, json.loads(msg.payload), mid=msg.mid, qos=msg.qos, dup=True)
+
+
+def test_cache_should_report_seen_keys():
+    cache = DedupCache(ttl=10)
+
+    assert cache.seen('a', now=100) is False
+    assert cache.seen('b', now=100) is False
+    assert cache.seen('a', now=101) is True
+    assert cache.stats() == {'size': 2, 'hits': 1, 'misses': 2, 'expired': 0, 'evicted': 0}
+
+
+def test_cache_should_remember_added_keys_as_new():
+    cache = DedupCache(ttl=10)
+
+    cache.add('a', now=100)
+    cache.add('a', now=105)
+
+    assert cache.seen('a', now=111) is True
+    assert cache.stats() == {'size': 1, 'hits': 1, 'misses': 2, 'expired': 0, 'evicted': 0}
+
+
+def test_cache_should_forget_keys_after_ttl():
+    cache = DedupCache(ttl=10)
+
+    cache.seen('a', now=100)
+    cache.seen('b', now=105)
+
+    assert cache.seen('a', now=109) is True
+    assert cache.seen('a', now=111) is False
+    assert cache.seen('b', now=112) is True
+    assert cache.stats()['expired'] == 1
+
+
+def test_cache_should_forget_all_keys_after_long_pause():
+    cache = DedupCache(ttl=10)
+
+    for i in range(100):
+        cache.seen(i, now=100 + i / 10)
+
+    assert cache.seen('a', now=10000) is False
+    assert len(cache) == 1
+    assert cache.stats()['expired'] == 100
+
+
+def test_cache_should_forget_least_recently_seen_key_when_full():
+    cache = DedupCache(ttl=10, max_size=2)
+
+    cache.seen('a', now=100)
+    cache.seen('b', now=100)
+    cache.seen('a', now=100)
+    cache.seen('c', now=100)
+
+    assert cache.seen('a', now=100) is True
+    assert cache.seen('b', now=100) is False
+    assert cache.stats()['evicted'] == 2
+
+
+def test_cache_should_expire_key_seen_again_after_eviction_at_its_new_deadline():
+    cache = DedupCache(ttl=10, max_size=1)
+
+    cache.seen('a', now=100)
+    cache.seen('b', now=101)
+    cache.seen('a', now=105)
+
+    assert cache.seen('a', now=112) is True
+    assert cache.seen('a', now=116) is False
+
+
+@pytest.mark.parametrize('kwargs', [{'ttl': 0}, {'ttl': True}, {'max_size': 0}, {'max_size': 1.5}, {'resolution': -1}])
+def test_cache_should_validate_arguments(kwargs):
+    with pytest.raises(ValueError):
+        DedupCache(**kwargs)
+
+
+def test_message_key_should_differ_by_packet_id_and_payload():
+    assert message_key('a', 1, b'{}') == message_key('a', 1, b'{}')
+    assert message_key('a', 1, b'{}') != message_key('a', 2, b'{}')
+    assert message_key('a', 1, b'{}') != message_key('a', 1, b'[]')
+
+
+def test_should_drop_redelivered_action(connected_client):
+    calls = []
+    connected_client.enable_deduplication()
+    connected_client.on_action('open_door', lambda name, entities: calls.append(name))
+
+    msg = message('agent/some_id/action_received', {'name': 'open_door', 'entities': []}, mid=7)
+
+    connected_client._on_action(None, None, msg)
+    connected_client._on_action(None, None, redelivered(msg))
+    connected_client._on_action(None, None, message('agent/some_id/action_received', {'name': 'open_door'}, mid=8))
+
+    assert calls == ['open_door', 'open_door']
+    assert connected_client.get_deduplication_stats()['hits'] == 1
+
+
+def test_should_drop_redelivered_method_before_tracking_call(connected_client):
+    calls = []
+    connected_client.enable_deduplication()
+    connected_client.on_method('reboot', lambda name, payload: calls.append(payload))
+
+    msg = message('agent/some_id/method/reboot', {'delay': 1}, mid=3)
+
+    connected_client._on_method(None, None, msg)
+    connected_client._on_method(None, None, redelivered(msg))
+
+    assert calls == [{'delay': 1}]
+    assert len(connected_client._method_calls) == 1
+
+
+def test_should_not_deduplicate_qos_0_messages(connected_client):
+    calls = []
+    connected_client.enable_deduplication()
+    connected_client.on_action('open_door', lambda name, entities: calls.append(name))
+
+    msg = message('agent/some_id/action_received', {'name': 'open_door'}, mid=0, qos=0)
+
+    connected_client._on_action(None, None, msg)
+    connected_client._on_action(None, None, msg)
+
+    assert len(calls) == 2
+    assert connected_client.get_deduplication_stats()['misses'] == 0
+
+
+def test_should_handle_repeated_action_with_reused_packet_id(connected_client):
+    calls = []
+    connected_client.enable_deduplication()
+    connected_client.on_action('open_door', lambda name, entities: calls.append(name))
+
+    msg = message('agent/some_id/action_received', {'name': 'open_door'}, mid=1)
+
+    connected_client._on_action(None, None, msg)
+    connected_client._on_action(None, None, msg)
+    connected_client._on_action(None, None, redelivered(msg))
+
+    assert len(calls) == 2
+    assert connected_client.get_deduplication_stats()['hits'] == 1
+
+
+def test_should_handle_redelivered_action_when_deduplication_is_disabled(connected_client):
+    calls = []
+    connected_client.on_action('open_door', lambda name, entities: calls.append(name))
+
+    msg = message('agent/some_id/action_received', {'name': 'open_door'})
+
+    connected_client._on_action(None, None, msg)
+    connected_client._on_action(None, None, redelivered(msg))
+
+    assert len(calls) == 2
+    assert connected_client.get_deduplication_stats() is None
+
+    connected_client.enable_deduplication()
+    connected_client.disable_deduplication()
+
+    assert connected_client.get_deduplication_stats() is None
+
+
+def test_should_count_hits_and_misses(connected_client):
+    registry = connected_client.enable_metrics()
+    connected_client.enable_deduplication()
+
+    msg = message('agent/some_id/action_received', {'name': 'open_door'})
+
+    connected_client._on_action(None, None, msg)
+    connected_client._on_action(None, None, redelivered(msg))
+    connected_client._on_method(None, None, message('agent/some_id/method/reboot', {}))
+
+    snapshot = registry.snapshot()
+
+    assert snapshot['veides_dedup_hits_total'] == {'action': 1}
+    assert snapshot['veides_dedup_misses_total'] == {'action': 1, 'method': 1}
+    assert snapshot['veides_dedup_cache_size'] == 2
@@ -0,0 +1,180 @@
+import pytest
+import json
+import threading
+import time
+from paho.mqtt.client import MQTTMessage
+from veides.sdk.agent import HandlerDispatcher
+from tests.unit.fixtures import (
+    connected_client,
+    mocked_paho_client,
+    agent_key,
+    agent_secret_key,
+    hostname
+)
+
+
+def multiply(name, payload):
+    return payload * 2
+
+
+def wait_until(condition, timeout=2):
+    deadline = time.monotonic() + timeout
+
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    return condition()
+
+
+def test_should_execute_method_handler_outside_of_network_thread(connected_client):
+    threads = []
+    dispatcher = HandlerDispatcher(HandlerDispatcher.THREAD_POOL, max_workers=2)
+
+    msg = MQTTMessage()
+    msg.topic = f'agent/{connected_client.client_id}/method/some_method'.encode('utf-8')
+    msg.payload = json.dumps({'foo': 'bar'}).encode('utf-8')
+
+    connected_client.set_dispatcher(dispatcher)
+    connected_client.on_method('some_method', lambda name, payload: threads.append(threading.current_thread()))
+
+    connected_client._on_method(None, None, msg)
+    dispatcher.shutdown()
+
+    assert len(threads) == 1
+    assert threads[0] is not threading.current_thread()
+    assert dispatcher.stats()['handlers']['method:some_method']['calls'] == 1
+
+
+def test_should_execute_handler_inline_by_default(connected_client):
+    threads = []
+
+    msg = MQTTMessage()
+    msg.topic = f'agent/{connected_client.client_id}/action_received'.encode('utf-8')
+    msg.payload = json.dumps({'name': 'some_action'}).encode('utf-8')
+
+    connected_client.set_dispatcher(HandlerDispatcher())
+    connected_client.on_action('some_action', lambda name, entities: threads.append(threading.current_thread()))
+
+    connected_client._on_action(None, None, msg)
+
+    assert threads == [threading.current_thread()]
+
+
+def test_should_execute_calls_of_the_same_handler_in_order_when_ordered():
+    calls = []
+    dispatcher = HandlerDispatcher(HandlerDispatcher.THREAD_POOL, max_workers=4, ordered=True)
+
+    def handler(name, payload):
+        time.sleep(0.005)
+        calls.append(payload)
+
+    for i in range(20):
+        dispatcher.dispatch('method:ordered', handler, 'ordered', i)
+
+    dispatcher.shutdown()
+
+    assert calls == list(range(20))
+
+
+def test_should_execute_different_handlers_in_parallel_when_ordered():
+    barrier = threading.Barrier(2, timeout=2)
+    dispatcher = HandlerDispatcher(HandlerDispatcher.THREAD_POOL, max_workers=2, ordered=True)
+
+    def handler(name, payload):
+        barrier.wait()
+
+    dispatcher.dispatch('method:first', handler, 'first', None)
+    dispatcher.dispatch('method:second', handler, 'second', None)
+    dispatcher.shutdown()
+
+    stats = dispatcher.stats()['handlers']
+
+    assert stats['method:first']['errors'] == 0
+    assert stats['method:second']['errors'] == 0
+
+
+def test_should_respect_per_handler_concurrency_limit():
+    lock = threading.Lock()
+    running = [0, 0]
+    dispatcher = HandlerDispatcher(
+        HandlerDispatcher.THREAD_POOL,
+        max_workers=4,
+        concurrency_limits={'action:limited': 2}
+    )
+
+    def handler(name, payload):
+        with lock:
+            running[0] += 1
+            running[1] = max(running[0], running[1])
+
+        time.sleep(0.01)
+
+        with lock:
+            running[0] -= 1
+
+    for _ in range(10):
+        dispatcher.dispatch('action:limited', handler, 'limited', [])
+
+    dispatcher.shutdown()
+
+    assert running[1] == 2
+
+
+def test_should_drop_calls_when_queue_is_full():
+    release = threading.Event()
+    dispatcher = HandlerDispatcher(HandlerDispatcher.THREAD_POOL, max_workers=1, max_queue_size=2)
+
+    dispatcher.dispatch('action:slow', lambda *_: release.wait(2), 'slow', [])
+    assert wait_until(lambda: dispatcher.queue_depth() == 0)
+
+    assert dispatcher.dispatch('action:slow', lambda *_: None, 'slow', []) is True
+    assert dispatcher.dispatch('action:slow', lambda *_: None, 'slow', []) is True
+    assert dispatcher.dispatch('action:slow', lambda *_: None, 'slow', []) is False
+
+    release.set()
+    dispatcher.shutdown()
+
+    stats = dispatcher.stats()
+
+    assert stats['dropped'] == 1
+    assert stats['max_queue_depth'] == 2
+    assert stats['queue_depth'] == 0
+
+
+def test_should_count_failed_handlers():
+    dispatcher = HandlerDispatcher()
+
+    def handler(name, payload):
+        raise RuntimeError('failed')
+
+    dispatcher.dispatch('method:failing', handler, 'failing', None)
+
+    assert dispatcher.stats()['handlers']['method:failing']['errors'] == 1
+
+
+def test_should_execute_handlers_in_process_pool():
+    dispatcher = HandlerDispatcher(HandlerDispatcher.PROCESS_POOL, max_workers=1)
+
+    dispatcher.dispatch('method:multiply', multiply, 'multiply', 2)
+    dispatcher.shutdown()
+
+    stats = dispatcher.stats()['handlers']['method:multiply']
+
+    assert stats['calls'] == 1
+    assert stats['errors'] == 0
+
+
+@pytest.mark.parametrize("kwargs", [
+    {'mode': 'unknown'},
+    {'max_workers': 0},
+    {'max_queue_size': 0},
+    {'max_concurrency': 0},
+])
+def test_should_raise_error_when_given_invalid_configuration(kwargs):
+    with pytest.raises(ValueError):
+        HandlerDispatcher(**kwargs)
+
+
+def test_should_raise_error_when_given_invalid_dispatcher(connected_client):
+    with pytest.raises(TypeError):
+        connected_client.set_dispatcher(object())
@@ -0,0 +1,200 @@
+import json
+import pytest
+import socket
+import threading
+import time
+from veides.sdk.agent import (
+    AgentClient,
+    AgentProperties,
+    AsyncAgentClient,
+    ConnectionProperties,
+    QosPolicy,
+    ReconnectPolicy
+)
+from tests.unit.broker import Broker, client_ssl_context, generate_certificate, server_ssl_context
+from tests.unit.fixtures import loop
+
+
+class Inbox(object):
+    """
+    Collects messages routed by the broker to a topic filter
+    """
+
+    def __init__(self, broker, pattern):
+        self.messages = []
+        self._condition = threading.Condition()
+        broker.subscribe(pattern, self._on_message)
+
+    def _on_message(self, client_id, topic, payload):
+        with self._condition:
+            self.messages.append((topic, json.loads(payload)))
+            self._condition.notify_all()
+
+    def wait(self, count, timeout=5):
+        with self._condition:
+            self._condition.wait_for(lambda: len(self.messages) >= count, timeout)
+
+            return self.messages
+
+
+def wait_until(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+
+    while not predicate() and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    return predicate()
+
+
+@pytest.fixture()
+def broker():
+    with Broker() as broker:
+        yield broker
+
+
+@pytest.fixture(scope='module')
+def certificate(tmp_path_factory):
+    try:
+        return generate_certificate(str(tmp_path_factory.mktemp('certificate')))
+    except RuntimeError:
+        pytest.skip('openssl is required to generate certificate')
+
+
+@pytest.fixture()
+def create_client(broker):
+    clients = []
+
+    def create(client_id='agent_1', port=None, ssl_context=None, **kwargs):
+        client = AgentClient(
+            AgentProperties(client_id=client_id, key='key', secret_key='secret'),
+            ConnectionProperties(
+                host='127.0.0.1',
+                port=port or broker.port,
+                use_tls=ssl_context is not None
+            ),
+            ssl_context=ssl_context,
+            **kwargs
+        )
+        client.connect()
+        clients.append(client)
+
+        return client
+
+    yield create
+
+    for client in clients:
+        client.disconnect()
+
+
+def test_should_deliver_messages_of_every_type(broker, create_client):
+    inbox = Inbox(broker, 'agent/agent_1/#')
+    client = create_client()
+
+    client.send_trail('speed', 12.5)
+    client.send_facts({'battery_level': 'full'})
+    client.send_event('ready_to_work')
+    client.send_action_completed('move_forward')
+
+    assert client.flush(timeout=5) is True
+    assert inbox.wait(4) == [
+        ('agent/agent_1/trail/speed', {'value': 12.5}),
+        ('agent/agent_1/facts', {'battery_level': 'full'}),
+        ('agent/agent_1/event', {'name': 'ready_to_work'}),
+        ('agent/agent_1/action_completed', {'name': 'move_forward'}),
+    ]
+
+
+@pytest.mark.parametrize('qos', [0, 1, 2])
+def test_should_deliver_trails_with_every_qos(broker, create_client, qos):
+    inbox = Inbox(broker, 'agent/+/trail/+')
+    client = create_client(qos_policy=QosPolicy(trail=qos))
+
+    for i in range(100):
+        client.send_trail('speed', i)
+
+    assert client.flush(timeout=5) is True
+    assert [payload['value'] for _, payload in inbox.wait(100)] == list(range(100))
+
+
+def test_should_respond_to_method_called_through_broker(broker, create_client):
+    inbox = Inbox(broker, 'agent/agent_1/method_response/+')
+    client = create_client()
+    client.on_method('get_status', lambda name, payload: client.send_method_response(name, {'echo': payload}))
+
+    broker.publish('agent/agent_1/method/get_status', b'{"verbose": true}', qos=1)
+
+    assert inbox.wait(1) == [
+        ('agent/agent_1/method_response/get_status', {'payload': {'echo': {'verbose': True}}, 'code': 200}),
+    ]
+
+
+def test_should_disable_nagle_algorithm(create_client):
+    client = create_client()
+
+    assert client.client.socket().getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY) != 0
+
+
+def test_should_receive_actions_after_reconnecting(broker, create_client):
+    received = threading.Event()
+    client = create_client(reconnect_policy=ReconnectPolicy(min_delay=0.05, max_delay=0.05))
+    client.on_action('move_forward', lambda name, entities: received.set())
+
+    broker.drop_connections()
+
+    assert wait_until(lambda: len(broker.connects) == 2 and client._ready.is_set()) is True
+
+    broker.publish('agent/agent_1/action_received', b'{"name": "move_forward", "entities": []}', qos=1)
+
+    assert received.wait(5) is True
+
+
+def test_should_route_messages_between_agents(broker, create_client):
+    received = []
+    done = threading.Event()
+    receiver = create_client('agent_1')
+    sender = create_client('agent_2')
+
+    def callback(topic, payload):
+        received.append((topic, payload))
+        done.set()
+
+    receiver.subscribe('agent/+/event', callback)
+
+    assert wait_until(lambda: 'agent/+/event' in broker.subscriptions('agent_1')) is True
+
+    sender.send_event('ready_to_work')
+
+    assert done.wait(5) is True
+    assert received == [('agent/agent_2/event', {'name': 'ready_to_work'})]
+
+
+def test_should_connect_over_tls(certificate, create_client):
+    with Broker(ssl_context=server_ssl_context(*certificate)) as broker:
+        inbox = Inbox(broker, 'agent/+/trail/+')
+        client = create_client(port=broker.port, ssl_context=client_ssl_context(certificate[0]))
+
+        client.send_trail('speed', 1)
+
+        assert client.flush(timeout=5) is True
+        assert inbox.wait(1) == [('agent/agent_1/trail/speed', {'value': 1})]
+
+        client.disconnect()
+
+
+def test_should_resolve_async_send_on_acknowledgement(broker, loop):
+    inbox = Inbox(broker, 'agent/+/facts')
+    client = AsyncAgentClient(
+        AgentProperties(client_id='agent_1', key='key', secret_key='secret'),
+        ConnectionProperties(host='127.0.0.1', port=broker.port, use_tls=False)
+    )
+
+    async def run():
+        await client.connect(timeout=5)
+
+        try:
+            return await client.send_facts({'battery_level': 'full'})
+        finally:
+            await client.disconnect()
+
+    assert loop.run_until_complete(run()) is True
+    assert inbox.wait(1) == [('agent/agent_1/facts', {'battery_level': 'full'})]
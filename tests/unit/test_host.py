@@ -0,0 +1,138 @@
+import pytest
+import socket
+import threading
+import time
+from paho.mqtt.client import MQTT_ERR_SUCCESS
+from veides.sdk.agent import AgentHost, AgentProperties, ConnectionProperties, ReconnectPolicy
+from veides.sdk.agent.exceptions import ConnectionException
+from veides.sdk.agent.host import _IoLoop
+from tests.unit.fixtures import (
+    hostname
+)
+
+
+@pytest.fixture()
+def host(mocker, hostname):
+    mocker.patch("paho.mqtt.client.Client", side_effect=lambda *_, **__: build_paho_client(mocker))
+
+    agent_host = AgentHost(ConnectionProperties(host=hostname), io_threads=2)
+
+    yield agent_host
+
+    agent_host.stop()
+
+
+def build_paho_client(mocker):
+    client = mocker.MagicMock()
+    client.subscribe.return_value = (MQTT_ERR_SUCCESS, 1)
+
+    return client
+
+
+def test_should_share_loggers_and_ssl_context_between_agents(host):
+    first = host.add_agent(AgentProperties(client_id='first', key='key', secret_key='secret'))
+    second = host.add_agent(AgentProperties(client_id='second', key='key', secret_key='secret'))
+
+    assert first.logger is second.logger
+    assert first.mqtt_logger is second.mqtt_logger
+    assert first.client.tls_set_context.call_args == second.client.tls_set_context.call_args
+    assert host.get_agent('first') is first
+
+
+def test_should_not_host_the_same_agent_twice(host):
+    host.add_agent(AgentProperties(client_id='first', key='key', secret_key='secret'))
+
+    with pytest.raises(ValueError):
+        host.add_agent(AgentProperties(client_id='first', key='key', secret_key='secret'))
+
+
+def test_should_connect_agents_without_paho_network_threads(host, hostname):
+    agents = [
+        host.add_agent(AgentProperties(client_id='agent_%d' % i, key='key', secret_key='secret'))
+        for i in range(10)
+    ]
+
+    for agent in agents:
+        agent.client.connect.side_effect = lambda *_, a=agent, **__: (
+            a._on_connect(None, None, None, 0),
+            a._on_subscribe(None, None, 1, (1, 1)),
+        )
+
+    threads_before = threading.active_count()
+
+    host.connect(timeout=1)
+
+    assert all(agent.is_connected() for agent in agents)
+    assert threading.active_count() - threads_before == 2
+
+    for agent in agents:
+        agent.client.connect.assert_called_once_with(hostname, port=8883, keepalive=60)
+        agent.client.loop_start.assert_not_called()
+
+
+def test_should_retry_connecting_agents_as_configured_by_reconnect_policy(mocker, hostname):
+    mocker.patch("paho.mqtt.client.Client", side_effect=lambda *_, **__: build_paho_client(mocker))
+
+    policy = ReconnectPolicy(min_delay=0.01, max_delay=0.01, connect_attempts=2)
+    host = AgentHost(ConnectionProperties(host=hostname), reconnect_policy=policy)
+    agent = host.add_agent(AgentProperties(client_id='some_id', key='key', secret_key='secret'))
+    acquire = mocker.spy(policy, 'acquire')
+
+    agent.client.connect.side_effect = connect_side_effects(agent, [socket.error('refused'), None])
+
+    try:
+        host.connect(timeout=1)
+    finally:
+        host.stop()
+
+    assert agent.is_connected() is True
+    assert agent.client.connect.call_count == 2
+    assert acquire.call_count == 2
+
+
+def test_should_raise_when_agent_failed_all_connect_attempts(host):
+    agent = host.add_agent(AgentProperties(client_id='some_id', key='key', secret_key='secret'))
+    agent.client.connect.side_effect = socket.error('refused')
+
+    with pytest.raises(ConnectionException):
+        host.connect(timeout=1)
+
+    assert agent.client.connect.call_count == 1
+
+
+def connect_side_effects(agent, errors):
+    errors = iter(errors)
+
+    def side_effect(*_, **__):
+        error = next(errors)
+
+        if error is not None:
+            raise error
+
+        agent._on_connect(None, None, None, 0)
+        agent._on_subscribe(None, None, 1, (1, 1))
+
+    return side_effect
+
+
+def test_io_loop_should_drive_registered_sockets(mocker):
+    io_loop = _IoLoop('test-io-loop', mocker.MagicMock())
+    reader, writer = socket.socketpair()
+
+    agent = mocker.MagicMock()
+    agent.client.loop_read.side_effect = lambda: reader.recv(1024)
+
+    io_loop.start()
+    io_loop.call_soon(io_loop.register, reader, agent)
+
+    writer.send(b'data')
+
+    deadline = time.monotonic() + 2
+    while agent.client.loop_read.call_count == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    io_loop.stop()
+    reader.close()
+    writer.close()
+
+    agent.client.loop_read.assert_called()
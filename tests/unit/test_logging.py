@@ -0,0 +1,68 @@
+import logging
+from paho.mqtt.client import MQTT_ERR_SUCCESS
+from veides.sdk.agent import AgentClient, AgentProperties, ConnectionProperties
+from tests.unit.fixtures import (
+    connected_client,
+    mocked_paho_client,
+    agent_key,
+    agent_secret_key,
+    hostname
+)
+
+
+class CountingDict(dict):
+    formatted = 0
+
+    def __repr__(self):
+        CountingDict.formatted += 1
+        return dict.__repr__(self)
+
+    __str__ = __repr__
+
+
+def create_client(mocker, mocked_paho_client, mqtt_log_level):
+    mocker.patch("paho.mqtt.client.Client", return_value=mocked_paho_client)
+
+    return AgentClient(
+        AgentProperties(client_id='some_id', key='some_key', secret_key='some_secret_key'),
+        ConnectionProperties(host='hostname'),
+        mqtt_log_level=mqtt_log_level
+    )
+
+
+def test_should_not_format_sent_data_when_debug_is_disabled(connected_client):
+    connected_client.client.publish.return_value = (MQTT_ERR_SUCCESS, 1)
+    CountingDict.formatted = 0
+
+    connected_client.send_facts(CountingDict(battery='full'))
+
+    assert CountingDict.formatted == 0
+
+
+def test_should_format_sent_data_when_debug_is_enabled(connected_client):
+    connected_client.client.publish.return_value = (MQTT_ERR_SUCCESS, 1)
+    connected_client.logger.setLevel(logging.DEBUG)
+    connected_client.logger.handlers = [logging.NullHandler()]
+    CountingDict.formatted = 0
+
+    connected_client.send_facts(CountingDict(battery='full'))
+
+    assert CountingDict.formatted > 0
+
+
+def test_should_hand_mqtt_logger_over_to_paho(mocker, mocked_paho_client):
+    client = create_client(mocker, mocked_paho_client, logging.ERROR)
+
+    mocked_paho_client.enable_logger.assert_called_once_with(client.mqtt_logger)
+    assert not hasattr(mocked_paho_client, 'on_log')
+
+
+def test_should_not_attach_mqtt_logger_when_it_is_disabled(mocker, mocked_paho_client):
+    client = create_client(mocker, mocked_paho_client, logging.CRITICAL)
+
+    mocked_paho_client.enable_logger.assert_not_called()
+    mocked_paho_client.disable_logger.assert_called_once()
+
+    client.set_mqtt_log_level(logging.DEBUG)
+
+    mocked_paho_client.enable_logger.assert_called_once_with(client.mqtt_logger)
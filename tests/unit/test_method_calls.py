@@ -0,0 +1,288 @@
+import pytest
+import json
+import logging
+import random
+import threading
+import time
+from paho.mqtt.client import MQTTMessage, MQTT_ERR_SUCCESS
+from veides.sdk.agent import (
+    AgentClient,
+    AgentHost,
+    AgentProperties,
+    ConnectionProperties,
+    HandlerDispatcher,
+    MethodCall
+)
+from veides.sdk.agent.methods import MethodCallTable
+from tests.unit.broker import Broker
+from tests.unit.fixtures import (
+    connected_client,
+    mocked_paho_client,
+    agent_key,
+    agent_secret_key,
+    hostname
+)
+
+
+def wait_until(condition, timeout=2):
+    deadline = time.monotonic() + timeout
+
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    return condition()
+
+
+def call_method(client, name, payload):
+    msg = MQTTMessage()
+    msg.topic = f'agent/{client.client_id}/method/{name}'.encode('utf-8')
+    msg.payload = json.dumps(payload).encode('utf-8')
+
+    client._on_method(None, None, msg)
+
+
+def responses(client):
+    return [(c[0][0], json.loads(c[0][1])) for c in client.client.publish.call_args_list]
+
+
+@pytest.fixture()
+def client(connected_client):
+    connected_client.client.publish.return_value = (MQTT_ERR_SUCCESS, 1)
+
+    return connected_client
+
+
+def test_table_should_pop_oldest_call_or_call_with_given_id():
+    table = MethodCallTable()
+
+    first, _ = table.add('reboot', {'delay': 1})
+    second, _ = table.add('reboot', {'delay': 2})
+    third, _ = table.add('reboot', {'delay': 3})
+
+    assert table.pop('reboot', second.id) is second
+    assert table.pop('reboot', second.id) is None
+    assert table.pop('reboot') is first
+    assert table.pop('reboot') is third
+    assert table.pop('reboot') is None
+    assert len(table) == 0
+
+
+def test_table_should_not_pop_calls_which_deadline_passed():
+    table = MethodCallTable()
+
+    expired, _ = table.add('reboot', {}, timeout=1)
+    waiting, _ = table.add('reboot', {}, timeout=10)
+    now = time.monotonic() + 2
+
+    assert table.pop('reboot', expired.id, now=now) is None
+    assert table.pop('reboot', now=now) is waiting
+    assert table.expired(now) == [expired]
+
+
+def test_table_should_return_calls_which_deadline_passed():
+    table = MethodCallTable()
+
+    expiring, _ = table.add('reboot', {}, timeout=10)
+    answered, _ = table.add('reboot', {}, timeout=5)
+    table.add('reboot', {})
+
+    table.pop('reboot', answered.id)
+
+    assert table.expired(time.monotonic() + 1) == []
+    assert table.expired(time.monotonic() + 11) == [expiring]
+    assert len(table) == 1
+
+
+def test_table_should_forget_oldest_call_above_limit():
+    table = MethodCallTable(max_pending=2)
+
+    first, _ = table.add('reboot', {})
+    table.add('reboot', {})
+    _, dropped = table.add('reboot', {})
+
+    assert dropped is first
+    assert len(table) == 2
+
+
+def test_table_should_report_expired_calls_before_removing_them():
+    table = MethodCallTable()
+    reported = []
+
+    call, _ = table.add('reboot', {}, timeout=10)
+
+    assert table.expired(time.monotonic() + 11, on_expired=reported.append) == [call]
+    assert reported == [call]
+
+
+def test_should_forget_calls_without_timeout_quietly(client, mocker):
+    client._method_calls = MethodCallTable(max_pending=1)
+    log = mocker.spy(client.logger, 'log')
+    client.on_method('reboot', lambda name, payload: None)
+
+    for _ in range(3):
+        call_method(client, 'reboot', {})
+
+    assert [c[0][0] for c in log.call_args_list] == [logging.DEBUG, logging.DEBUG]
+    assert len(client._method_calls) == 1
+
+
+def test_should_pass_method_call_to_handler(client):
+    calls = []
+    client.on_method('reboot', lambda name, call: calls.append(call), with_call=True)
+
+    call_method(client, 'reboot', {'delay': 1})
+    call_method(client, 'reboot', {'delay': 2})
+
+    assert all(isinstance(call, MethodCall) for call in calls)
+    assert [call.payload for call in calls] == [{'delay': 1}, {'delay': 2}]
+    assert calls[0].id != calls[1].id
+    assert calls[0].time_left() is None
+
+
+def test_should_answer_concurrent_calls_by_id(client):
+    calls = []
+    client.on_method('reboot', lambda name, call: calls.append(call), with_call=True)
+
+    call_method(client, 'reboot', {'delay': 1})
+    call_method(client, 'reboot', {'delay': 2})
+
+    assert client.send_method_response('reboot', {'delay': 2}, call_id=calls[1].id) is True
+    assert client.send_method_response('reboot', {'delay': 1}, call_id=calls[0].id) is True
+    assert client.send_method_response('reboot', {'delay': 1}, call_id=calls[0].id) is False
+    assert client.send_method_response_nowait('reboot', {}, call_id=calls[0].id).done() is True
+    assert client.client.publish.call_count == 2
+
+
+def test_should_answer_timed_out_call_with_504(client):
+    client.on_method('reboot', lambda name, call: None, timeout=0.05, with_call=True)
+
+    call_method(client, 'reboot', {})
+
+    assert wait_until(lambda: client.client.publish.call_count == 1) is True
+    assert responses(client) == [
+        ('agent/some_id/method_response/reboot', {'payload': {'error': 'method call timed out'}, 'code': 504}),
+    ]
+    assert client.send_method_response('reboot', {}, call_id=1) is False
+
+
+def test_should_not_expire_answered_call(client):
+    client.on_method('reboot', lambda name, payload: client.send_method_response(name, 'ok'), timeout=0.05)
+
+    call_method(client, 'reboot', {})
+    time.sleep(0.15)
+
+    assert responses(client) == [('agent/some_id/method_response/reboot', {'payload': 'ok', 'code': 200})]
+
+
+def test_should_count_timed_out_calls(mocker, mocked_paho_client, hostname):
+    mocker.patch("paho.mqtt.client.Client", return_value=mocked_paho_client)
+    mocked_paho_client.publish.return_value = (MQTT_ERR_SUCCESS, 1)
+
+    client = AgentClient(
+        AgentProperties(client_id='some_id', key='key', secret_key='secret'),
+        ConnectionProperties(host=hostname),
+        method_timeout=0.05
+    )
+    client.connected.set()
+    registry = client.enable_metrics()
+    client.on_any_method(lambda name, call: None, with_call=True)
+
+    call_method(client, 'reboot', {})
+    call_method(client, 'shutdown', {})
+
+    assert registry.snapshot()['veides_pending_method_calls'] == 2
+    assert wait_until(lambda: registry.snapshot()['veides_pending_method_calls'] == 0) is True
+    # Timeouts are counted before calls leave the table
+    assert registry.snapshot()['veides_method_timeouts_total'] == {'reboot': 1, 'shutdown': 1}
+
+
+@pytest.mark.parametrize('timeout', [0, -1, True, '1'])
+def test_should_validate_method_timeout(client, mocker, mocked_paho_client, hostname, timeout):
+    with pytest.raises(ValueError):
+        client.on_method('reboot', lambda name, payload: None, timeout=timeout)
+
+    mocker.patch("paho.mqtt.client.Client", return_value=mocked_paho_client)
+
+    with pytest.raises(ValueError):
+        AgentClient(
+            AgentProperties(client_id='some_id', key='key', secret_key='secret'),
+            ConnectionProperties(host=hostname),
+            method_timeout=timeout
+        )
+
+
+def test_hosted_agent_should_answer_timed_out_call_on_tick(mocker, mocked_paho_client, hostname):
+    mocker.patch("paho.mqtt.client.Client", return_value=mocked_paho_client)
+    mocked_paho_client.publish.return_value = (MQTT_ERR_SUCCESS, 1)
+
+    host = AgentHost(ConnectionProperties(host=hostname), method_timeout=0.01)
+    agent = host.add_agent(AgentProperties(client_id='some_id', key='key', secret_key='secret'))
+    agent.connected.set()
+
+    call_method(agent, 'reboot', {})
+    time.sleep(0.02)
+
+    assert agent._method_deadlines_thread is None
+    assert agent.client.publish.call_count == 0
+
+    agent._tick(time.monotonic())
+
+    assert json.loads(agent.client.publish.call_args[0][1])['code'] == 504
+
+
+def test_should_answer_concurrent_calls_of_one_method_in_parallel():
+    with Broker() as broker:
+        received = {}
+        done = threading.Event()
+
+        def on_response(client_id, topic, payload):
+            response = json.loads(payload)['payload']
+            received[response['request']] = response
+
+            if len(received) == 20:
+                done.set()
+
+        broker.subscribe('agent/some_id/method_response/+', on_response)
+
+        client = AgentClient(
+            AgentProperties(client_id='some_id', key='key', secret_key='secret'),
+            ConnectionProperties(host='127.0.0.1', port=broker.port, use_tls=False)
+        )
+        dispatcher = HandlerDispatcher(HandlerDispatcher.THREAD_POOL, max_workers=8)
+        client.set_dispatcher(dispatcher)
+
+        def handler(name, call):
+            time.sleep(random.uniform(0, 0.05))
+            client.send_method_response(name, {'request': call.payload['request'], 'call': call.id}, call_id=call.id)
+
+        client.on_method('compute', handler, with_call=True)
+        client.connect()
+
+        try:
+            for i in range(20):
+                broker.publish('agent/some_id/method/compute', json.dumps({'request': i}).encode('utf-8'), qos=1)
+
+            assert done.wait(5) is True
+            assert sorted(received) == list(range(20))
+            assert len(set(response['call'] for response in received.values())) == 20
+        finally:
+            dispatcher.shutdown()
+            client.disconnect()
+
+
+def test_should_drop_late_response_without_call_id(mocker, mocked_paho_client, hostname):
+    mocker.patch("paho.mqtt.client.Client", return_value=mocked_paho_client)
+    mocked_paho_client.publish.return_value = (MQTT_ERR_SUCCESS, 1)
+
+    client = AgentClient(
+        AgentProperties(client_id='some_id', key='key', secret_key='secret'),
+        ConnectionProperties(host=hostname),
+        method_timeout=0.01
+    )
+    client.connected.set()
+
+    call_method(client, 'reboot', {})
+
+    assert wait_until(lambda: client.client.publish.call_count == 1)
+    assert client.send_method_response('reboot', {'ok': True}) is False
+    assert [response['code'] for _, response in responses(client)] == [504]
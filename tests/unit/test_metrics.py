@@ -0,0 +1,181 @@
+import json
+import pytest
+import urllib.request
+from paho.mqtt.client import MQTTMessage, MQTT_ERR_SUCCESS, MQTT_ERR_NO_CONN
+from veides.sdk.agent import HandlerDispatcher, MetricsRegistry
+from tests.unit.fixtures import (
+    connected_client,
+    mocked_paho_client,
+    agent_key,
+    agent_secret_key,
+    hostname
+)
+
+
+def test_should_export_metrics_as_dictionary():
+    registry = MetricsRegistry()
+
+    registry.counter('sent_total', 'Sent messages', 'kind').labels('trail').inc(2)
+    registry.histogram('latency_seconds', 'Latency', bounds=(0.1, 1.0)).labels().observe(0.5)
+    registry.gauge('queue_depth', 'Queue depth', lambda: 3)
+    registry.gauge('queue_depth', 'Queue depth', lambda: 4)
+
+    assert registry.snapshot() == {
+        'latency_seconds': {'count': 1, 'sum': 0.5, 'buckets': {0.1: 0, 1.0: 1, float('inf'): 1}},
+        'queue_depth': 7,
+        'sent_total': {'trail': 2},
+    }
+
+
+def test_should_export_metrics_in_prometheus_format():
+    registry = MetricsRegistry()
+
+    registry.counter('sent_total', 'Sent messages', 'kind').labels('trail').inc()
+    registry.histogram('latency_seconds', 'Latency', 'qos', bounds=(0.1,)).labels('1').observe(0.05)
+
+    assert registry.prometheus_text() == '\n'.join([
+        '# HELP latency_seconds Latency',
+        '# TYPE latency_seconds histogram',
+        'latency_seconds_bucket{qos="1",le="0.1"} 1',
+        'latency_seconds_bucket{qos="1",le="+Inf"} 1',
+        'latency_seconds_sum{qos="1"} 0.05',
+        'latency_seconds_count{qos="1"} 1',
+        '# HELP sent_total Sent messages',
+        '# TYPE sent_total counter',
+        'sent_total{kind="trail"} 1',
+    ]) + '\n'
+
+
+def test_should_serve_metrics_over_http():
+    registry = MetricsRegistry()
+    registry.counter('sent_total', 'Sent messages').labels().inc()
+
+    server = registry.start_http_server(0)
+
+    try:
+        with urllib.request.urlopen('http://127.0.0.1:%d/metrics' % server.server_address[1], timeout=2) as response:
+            body = response.read().decode('utf-8')
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert 'sent_total 1' in body
+
+
+def test_should_raise_error_when_metric_is_registered_with_different_type():
+    registry = MetricsRegistry()
+    registry.counter('sent_total', 'Sent messages')
+
+    with pytest.raises(ValueError):
+        registry.histogram('sent_total', 'Sent messages')
+
+
+def test_should_count_sent_messages_and_publish_latency(connected_client):
+    connected_client.client.publish.return_value = (MQTT_ERR_SUCCESS, 1)
+    connected_client.enable_metrics()
+
+    connected_client.send_trail('temperature', 20)
+    connected_client.send_event('ready')
+
+    assert connected_client.get_metrics()['veides_inflight_messages'] == 1
+
+    connected_client._on_publish(None, None, 1)
+
+    connected_client.client.publish.return_value = (MQTT_ERR_NO_CONN, 0)
+    connected_client.send_event('ready')
+
+    metrics = connected_client.get_metrics()
+
+    assert metrics['veides_messages_sent_total'] == {'trail': 1, 'event': 1}
+    assert metrics['veides_messages_failed_total'] == {'event': 1}
+    assert metrics['veides_publish_latency_seconds']['1']['count'] == 1
+    assert metrics['veides_bytes_sent_total'] > 0
+    assert metrics['veides_inflight_messages'] == 0
+
+
+def test_should_measure_received_messages_and_handlers(connected_client):
+    connected_client.enable_metrics()
+    connected_client.on_method('some_method', lambda name, payload: None)
+
+    msg = MQTTMessage()
+    msg.topic = f'agent/{connected_client.client_id}/method/some_method'.encode('utf-8')
+    msg.payload = json.dumps({'foo': 'bar'}).encode('utf-8')
+
+    connected_client._on_method(None, None, msg)
+
+    metrics = connected_client.get_metrics()
+
+    assert metrics['veides_messages_received_total'] == {'method': 1}
+    assert metrics['veides_bytes_received_total'] == len(msg.topic) + len(msg.payload)
+    assert metrics['veides_handler_duration_seconds']['method:some_method']['count'] == 1
+
+
+def test_should_count_reconnects(connected_client):
+    connected_client.client.subscribe.return_value = (MQTT_ERR_SUCCESS, 1)
+    connected_client.enable_metrics()
+
+    connected_client._on_connect(None, None, None, 0)
+    connected_client._on_disconnect(None, None, 1)
+    connected_client._on_connect(None, None, None, 0)
+
+    metrics = connected_client.get_metrics()
+
+    assert metrics['veides_connects_total'] == 2
+    assert metrics['veides_reconnects_total'] == 1
+    assert metrics['veides_disconnects_total'] == 1
+
+
+def test_should_measure_handlers_executed_by_dispatcher(connected_client):
+    dispatcher = HandlerDispatcher(HandlerDispatcher.THREAD_POOL, max_workers=1)
+
+    connected_client.enable_metrics()
+    connected_client.set_dispatcher(dispatcher)
+    connected_client.on_action('some_action', lambda name, entities: None)
+
+    msg = MQTTMessage()
+    msg.topic = f'agent/{connected_client.client_id}/action_received'.encode('utf-8')
+    msg.payload = json.dumps({'name': 'some_action'}).encode('utf-8')
+
+    connected_client._on_action(None, None, msg)
+    dispatcher.shutdown()
+
+    assert connected_client.get_metrics()['veides_handler_duration_seconds']['action:some_action']['count'] == 1
+
+
+@pytest.mark.parametrize('dispatcher', [None, HandlerDispatcher(HandlerDispatcher.INLINE)])
+def test_should_label_topic_handlers_by_subscribed_filter(connected_client, dispatcher):
+    connected_client.client.subscribe.return_value = (MQTT_ERR_SUCCESS, 1)
+    connected_client.enable_metrics()
+
+    if dispatcher is not None:
+        connected_client.set_dispatcher(dispatcher)
+
+    connected_client.subscribe('sensors/+/temperature', lambda topic, payload: None)
+
+    for sensor in ('kitchen', 'garage'):
+        msg = MQTTMessage()
+        msg.topic = f'sensors/{sensor}/temperature'.encode('utf-8')
+        msg.payload = b'20'
+
+        connected_client._on_message(None, None, msg)
+
+    handlers = connected_client.get_metrics()['veides_handler_duration_seconds']
+
+    assert list(handlers) == ['topic:sensors/+/temperature']
+    assert handlers['topic:sensors/+/temperature']['count'] == 2
+
+
+def test_should_replace_gauges_when_metrics_are_enabled_again(connected_client):
+    registry = MetricsRegistry()
+    registry.gauge('veides_inflight_messages', 'Messages waiting for acknowledgement', lambda: 1)
+
+    connected_client.enable_metrics(registry)
+    connected_client.enable_metrics(registry)
+    connected_client._deliveries.track(1, 1)
+
+    assert registry.snapshot()['veides_inflight_messages'] == 2
+
+    connected_client.disable_metrics()
+
+    assert registry.snapshot()['veides_inflight_messages'] == 1
+    assert 'veides_pending_method_calls' not in registry.snapshot()
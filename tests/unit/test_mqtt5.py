@@ -0,0 +1,224 @@
+import pytest
+import threading
+import paho.mqtt.client as paho
+from paho.mqtt.client import MQTT_ERR_SUCCESS
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
+from paho.mqtt.reasoncodes import ReasonCodes
+from veides.sdk.agent import AgentClient, AgentProperties, ConnectionProperties
+from veides.sdk.agent.exceptions import ConnectionException
+from veides.sdk.agent.topics import TopicAliases
+from tests.unit.fixtures import (
+    mocked_paho_client,
+    agent_key,
+    agent_secret_key,
+    hostname
+)
+
+
+@pytest.fixture()
+def create_client(mocker, mocked_paho_client, agent_key, agent_secret_key, hostname):
+    paho_client = mocker.patch("paho.mqtt.client.Client", return_value=mocked_paho_client)
+    mocked_paho_client.subscribe.return_value = (MQTT_ERR_SUCCESS, 1)
+    mocked_paho_client.publish.return_value = (MQTT_ERR_SUCCESS, 1)
+    mocked_paho_client._out_message_mutex = threading.Lock()
+    mocked_paho_client._out_messages = {}
+
+    def create(**kwargs):
+        return AgentClient(
+            AgentProperties(client_id='some_id', key=agent_key, secret_key=agent_secret_key),
+            ConnectionProperties(host=hostname, mqtt_v5=True),
+            **kwargs
+        )
+
+    create.paho_client = paho_client
+
+    return create
+
+
+def connack_properties(topic_alias_maximum):
+    properties = Properties(PacketTypes.CONNACK)
+    properties.TopicAliasMaximum = topic_alias_maximum
+
+    return properties
+
+
+def connect(client, topic_alias_maximum=10):
+    client._on_connect(None, None, {'session present': 0}, ReasonCodes(PacketTypes.CONNACK), connack_properties(topic_alias_maximum))
+    client._on_subscribe(None, None, 1, [ReasonCodes(PacketTypes.SUBACK, identifier=1)] * 2)
+
+
+def published(client):
+    return [(c[0][0], getattr(c[1]['properties'], 'TopicAlias', None)) for c in client.client.publish.call_args_list]
+
+
+def test_aliases_should_replace_topics_after_first_qos0_message():
+    aliases = TopicAliases(maximum=10)
+
+    assert aliases.resolve('a/b', 0) == ('a/b', 1)
+    aliases.sent(1, 0, 1)
+
+    assert aliases.resolve('a/b', 0) == ('', 1)
+    assert aliases.resolve('a/c', 0) == ('a/c', 2)
+    assert aliases.topic(2) == 'a/c'
+
+
+def test_aliases_should_be_used_by_qos0_messages_once_qos1_message_is_acknowledged():
+    aliases = TopicAliases(maximum=10)
+
+    aliases.resolve('a/b', 1)
+    aliases.sent(7, 1, 1)
+
+    assert aliases.resolve('a/b', 1) == ('', 1)
+    assert aliases.resolve('a/b', 0) == ('a/b', 1)
+
+    aliases.published(7)
+
+    assert aliases.resolve('a/b', 0) == ('', 1)
+
+
+def test_aliases_should_send_full_topics_above_maximum():
+    aliases = TopicAliases(maximum=1)
+
+    assert aliases.resolve('a/b', 0) == ('a/b', 1)
+    assert aliases.resolve('a/c', 0) == ('a/c', None)
+    assert TopicAliases().resolve('a/b', 0) == ('a/b', None)
+
+
+def test_should_use_mqtt5_with_clean_start(create_client):
+    client = create_client()
+
+    assert create_client.paho_client.call_args[1]['protocol'] == paho.MQTTv5
+    assert 'clean_session' not in create_client.paho_client.call_args[1]
+    assert client._connect_args == {'clean_start': True, 'properties': None}
+
+
+def test_should_keep_session_of_persistent_mqtt5_client(create_client):
+    client = create_client(persistent_session=True)
+
+    assert client._connect_args['clean_start'] is False
+    assert client._connect_args['properties'].SessionExpiryInterval == client.SESSION_EXPIRY_INTERVAL
+
+
+def test_should_send_repeated_topics_as_aliases(create_client):
+    client = create_client()
+    connect(client)
+
+    client.send_trail('speed', 1)
+    client.send_trail('speed', 2)
+    client.send_event('ready')
+
+    assert published(client) == [
+        ('agent/some_id/trail/speed', 1),
+        ('', 1),
+        ('agent/some_id/event', 2),
+    ]
+
+
+def test_should_not_use_aliases_when_broker_does_not_accept_them(create_client):
+    client = create_client()
+    connect(client, topic_alias_maximum=0)
+
+    client.send_trail('speed', 1)
+    client.send_trail('speed', 2)
+
+    assert published(client) == [('agent/some_id/trail/speed', None)] * 2
+
+
+def test_should_restore_topics_of_messages_sent_again_after_reconnect(create_client):
+    client = create_client()
+    connect(client)
+
+    client.send_trail('speed', 1)
+    client.send_trail('speed', 2)
+
+    messages = {}
+
+    for mid, (args, kwargs) in enumerate(client.client.publish.call_args_list):
+        message = paho.MQTTMessage(mid=mid, topic=args[0].encode('utf-8'))
+        message.properties = kwargs['properties']
+        messages[mid] = message
+
+    client.client._out_messages = messages
+    client._reset_topic_aliases()
+
+    assert [(m.topic, m.properties) for m in messages.values()] == [
+        ('agent/some_id/trail/speed', None),
+        ('agent/some_id/trail/speed', None),
+    ]
+    assert len(client._topic_aliases) == 0
+    assert client._topic_aliases.maximum == 0
+
+
+def test_should_send_message_expiry(create_client):
+    client = create_client(message_expiry={'trail': 30})
+    connect(client, topic_alias_maximum=0)
+
+    client.send_trail('speed', 1)
+    client.send_event('ready')
+
+    calls = client.client.publish.call_args_list
+
+    assert calls[0][1]['properties'].MessageExpiryInterval == 30
+    assert calls[1][1]['properties'] is None
+
+
+@pytest.mark.parametrize('message_expiry', [{'trail': 0}, {'trail': 1.5}, {'trail': True}])
+def test_should_validate_message_expiry(create_client, message_expiry):
+    with pytest.raises(ValueError):
+        create_client(message_expiry=message_expiry)
+
+
+def test_should_require_mqtt5_for_message_expiry(mocker, mocked_paho_client, hostname):
+    mocker.patch("paho.mqtt.client.Client", return_value=mocked_paho_client)
+
+    with pytest.raises(ValueError):
+        AgentClient(
+            AgentProperties(client_id='some_id', key='key', secret_key='secret'),
+            ConnectionProperties(host=hostname),
+            message_expiry={'trail': 30}
+        )
+
+
+def test_should_send_correlation_data_of_method_call_with_response(create_client, mocker):
+    client = create_client()
+    connect(client, topic_alias_maximum=0)
+    client.on_method('reboot', mocker.stub())
+
+    for correlation_data in (b'first', b'second'):
+        msg = paho.MQTTMessage(topic=b'agent/some_id/method/reboot')
+        msg.payload = b'{}'
+        msg.properties = Properties(PacketTypes.PUBLISH)
+        msg.properties.CorrelationData = correlation_data
+        client._on_method(None, None, msg)
+
+    client.send_method_response('reboot', {}, 200)
+    client.send_method_response('reboot', {}, 200)
+    client.send_method_response('reboot', {}, 200)
+
+    assert [c[1]['properties'] and c[1]['properties'].CorrelationData
+            for c in client.client.publish.call_args_list] == [b'first', b'second', None]
+
+
+def test_should_fail_connecting_when_mqtt5_subscription_is_rejected(create_client):
+    client = create_client()
+    client._connecting = True
+
+    client._on_connect(None, None, {'session present': 0}, ReasonCodes(PacketTypes.CONNACK), connack_properties(10))
+    client._on_subscribe(None, None, 1, [
+        ReasonCodes(PacketTypes.SUBACK, identifier=1),
+        ReasonCodes(PacketTypes.SUBACK, identifier=0x87),
+    ])
+
+    assert isinstance(client._connect_error, ConnectionException)
+    assert 'agent/some_id/method/+' in str(client._connect_error)
+
+
+def test_should_fail_connecting_when_mqtt5_connection_is_refused(create_client):
+    client = create_client()
+    client._connecting = True
+
+    client._on_connect(None, None, {'session present': 0}, ReasonCodes(PacketTypes.CONNACK, identifier=0x87), None)
+
+    assert str(client._connect_error) == 'Connection refused: Not authorized (rc=135)'
+    assert client._ready.is_set()
@@ -0,0 +1,201 @@
+import pytest
+import time
+from paho.mqtt.client import MQTT_ERR_SUCCESS
+from unittest.mock import call
+from veides.sdk.agent.outbox import Outbox
+from tests.unit.fixtures import (
+    connected_client,
+    not_connected_client,
+    mocked_paho_client,
+    agent_key,
+    agent_secret_key,
+    hostname
+)
+
+
+def wait_until(condition, timeout=2):
+    deadline = time.monotonic() + timeout
+
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    return condition()
+
+
+def test_should_drop_oldest_message_when_full():
+    outbox = Outbox(max_messages=2)
+
+    assert outbox.put('topic', b'1', 1) is True
+    assert outbox.put('topic', b'2', 1) is True
+    assert outbox.put('topic', b'3', 1) is True
+
+    assert outbox.peek() == ('topic', b'2', 1)
+    assert outbox.stats() == {'queued': 3, 'sent': 0, 'dropped': 1, 'pending': 2}
+
+
+def test_should_drop_newest_message_when_full():
+    outbox = Outbox(max_messages=2, overflow=Outbox.DROP_NEWEST)
+
+    assert outbox.put('topic', b'1', 1) is True
+    assert outbox.put('topic', b'2', 1) is True
+    assert outbox.put('topic', b'3', 1) is False
+
+    assert outbox.peek() == ('topic', b'1', 1)
+    assert outbox.stats()['dropped'] == 1
+
+
+def test_should_restore_pending_messages_after_restart(tmp_path):
+    path = str(tmp_path / 'outbox')
+
+    outbox = Outbox(path=path)
+    outbox.put('first', b'1', 1)
+    outbox.put('second', b'2', 0)
+    outbox.put('third', b'3', 1)
+    outbox.pop()
+    outbox.close()
+
+    outbox = Outbox(path=path)
+
+    assert len(outbox) == 2
+    assert outbox.peek() == ('second', b'2', 0)
+
+    outbox.pop()
+    outbox.pop()
+    outbox.close()
+
+    assert len(Outbox(path=path)) == 0
+
+
+def test_should_discard_incomplete_message_after_crash(tmp_path):
+    path = str(tmp_path / 'outbox')
+
+    outbox = Outbox(path=path)
+    outbox.put('first', b'1', 1)
+    outbox.close()
+
+    with open(path, 'ab') as f:
+        f.write(b'\x01\x00')
+
+    outbox = Outbox(path=path)
+    outbox.put('second', b'2', 1)
+    outbox.close()
+
+    outbox = Outbox(path=path)
+
+    assert len(outbox) == 2
+    outbox.pop()
+    assert outbox.peek() == ('second', b'2', 1)
+
+
+def test_should_not_drop_message_being_sent(tmp_path):
+    path = str(tmp_path / 'outbox')
+
+    outbox = Outbox(path=path, max_messages=2)
+    outbox.put('first', b'1', 1)
+    outbox.put('second', b'2', 1)
+
+    assert outbox.sending() == ('first', b'1', 1)
+    assert outbox.put('third', b'3', 1) is True
+
+    outbox.pop()
+
+    assert outbox.peek() == ('third', b'3', 1)
+    assert outbox.stats() == {'queued': 3, 'sent': 1, 'dropped': 1, 'pending': 1}
+
+    outbox.close()
+    outbox = Outbox(path=path)
+
+    assert len(outbox) == 1
+    assert outbox.peek() == ('third', b'3', 1)
+
+
+def test_should_drop_new_message_when_only_message_is_being_sent():
+    outbox = Outbox(max_messages=1)
+    outbox.put('first', b'1', 1)
+
+    outbox.sending()
+
+    assert outbox.put('second', b'2', 1) is False
+
+    outbox.release()
+
+    assert outbox.put('second', b'2', 1) is True
+    assert outbox.peek() == ('second', b'2', 1)
+
+
+def test_should_send_queued_messages_filling_outbox_while_publishing(not_connected_client):
+    client = not_connected_client
+    client.client.subscribe.return_value = (MQTT_ERR_SUCCESS, 1)
+    client.enable_outbox(max_messages=2)
+
+    first = client.send_event_nowait('first')
+    second = client.send_event_nowait('second')
+    published = []
+
+    def publish(topic, payload, qos, retain):
+        if not published:
+            # Outbox is full, so the oldest message waiting to be sent is dropped
+            client.send_event_nowait('third')
+
+        published.append(client.codec.decode(payload)['name'])
+
+        return MQTT_ERR_SUCCESS, len(published)
+
+    client.client.publish.side_effect = publish
+    client._on_connect(None, None, None, 0)
+
+    assert wait_until(lambda: client.get_outbox_stats()['pending'] == 0)
+    assert published == ['first', 'third']
+    assert first.mid == 1
+    assert second.done() is True and second.delivered() is False
+
+
+def test_should_queue_messages_when_disconnected(not_connected_client):
+    not_connected_client.enable_outbox()
+
+    assert not_connected_client.send_event('some_event') is True
+
+    not_connected_client.client.publish.assert_not_called()
+    assert not_connected_client.get_outbox_stats()['pending'] == 1
+
+
+def test_should_send_queued_messages_after_connecting(not_connected_client):
+    not_connected_client.client.publish.return_value = (MQTT_ERR_SUCCESS, 1)
+    not_connected_client.client.subscribe.return_value = (MQTT_ERR_SUCCESS, 1)
+    not_connected_client.enable_outbox()
+
+    not_connected_client.send_event('first')
+    not_connected_client.send_event('second')
+
+    not_connected_client._on_connect(None, None, None, 0)
+
+    assert wait_until(lambda: not_connected_client.get_outbox_stats()['pending'] == 0)
+    assert not_connected_client.client.publish.call_args_list == [
+        call(
+            'agent/{}/event'.format(not_connected_client.client_id),
+            not_connected_client.codec.encode({'name': name}),
+            qos=1,
+            retain=False
+        )
+        for name in ('first', 'second')
+    ]
+
+
+def test_should_send_directly_when_connected_and_outbox_is_empty(connected_client):
+    connected_client.client.publish.return_value = (MQTT_ERR_SUCCESS, 1)
+    connected_client.enable_outbox()
+
+    assert connected_client.send_event('some_event') is True
+
+    assert connected_client.get_outbox_stats()['queued'] == 0
+    connected_client.client.publish.assert_called_once()
+
+
+@pytest.mark.parametrize("kwargs", [
+    {'max_messages': 0},
+    {'overflow': 'unknown'},
+    {'drain_rate': 0},
+])
+def test_should_raise_error_when_given_invalid_outbox_configuration(not_connected_client, kwargs):
+    with pytest.raises(ValueError):
+        not_connected_client.enable_outbox(**kwargs)
@@ -0,0 +1,265 @@
+import pytest
+import itertools
+import json
+import threading
+import time
+from paho.mqtt.client import MQTTMessage, MQTT_ERR_SUCCESS, MQTT_ERR_QUEUE_SIZE
+from veides.sdk.agent import AgentClient, AgentProperties, ConnectionProperties
+from veides.sdk.agent.lanes import PriorityLanes
+from tests.unit.broker import Broker
+from tests.unit.fixtures import (
+    connected_client,
+    mocked_paho_client,
+    agent_key,
+    agent_secret_key,
+    hostname
+)
+
+
+class Sink(object):
+    def __init__(self):
+        self.sent = []
+        self.open = True
+
+    def send(self, lane, message, waited):
+        self.sent.append(message)
+
+    def can_send(self):
+        return self.open
+
+
+def lanes_with_sink(**kwargs):
+    sink = Sink()
+
+    return PriorityLanes(sink.send, sink.can_send, **kwargs), sink
+
+
+@pytest.fixture()
+def client(connected_client):
+    mids = itertools.count(1)
+    connected_client.client.publish.side_effect = lambda *args, **kwargs: (MQTT_ERR_SUCCESS, next(mids))
+
+    return connected_client
+
+
+def sent_topics(client):
+    return [c[0][0] for c in client.client.publish.call_args_list]
+
+
+def test_lanes_should_let_message_through_when_idle():
+    lanes, sink = lanes_with_sink()
+
+    assert lanes.put('trail', 'a') == (PriorityLanes.SEND, None)
+    assert len(lanes) == 0
+
+
+def test_lanes_should_drain_control_lane_with_higher_weight():
+    lanes, sink = lanes_with_sink(weights={'control': 2, 'telemetry': 1})
+    sink.open = False
+
+    for i in range(4):
+        lanes.put('trail', 'trail_%d' % i)
+
+    for i in range(3):
+        lanes.put('method_response', 'response_%d' % i)
+
+    sink.open = True
+    lanes.drain()
+
+    assert sink.sent == ['response_0', 'trail_0', 'response_1', 'response_2', 'trail_1', 'trail_2', 'trail_3']
+    assert lanes.stats()['control'] == {'queued': 3, 'sent': 3, 'dropped': 0, 'pending': 0}
+
+
+def test_lanes_should_not_let_message_overtake_queued_ones():
+    lanes, sink = lanes_with_sink()
+    sink.open = False
+
+    lanes.put('trail', 'a')
+    sink.open = True
+
+    assert lanes.put('trail', 'b') == (PriorityLanes.QUEUED, None)
+
+    lanes.drain()
+
+    assert sink.sent == ['a', 'b']
+
+
+@pytest.mark.parametrize('overflow,expected', [
+    (PriorityLanes.DROP_OLDEST, [(PriorityLanes.QUEUED, None), (PriorityLanes.QUEUED, None), (PriorityLanes.QUEUED, 'a')]),
+    (PriorityLanes.DROP_NEWEST, [(PriorityLanes.QUEUED, None), (PriorityLanes.QUEUED, None), (PriorityLanes.DROPPED, None)]),
+])
+def test_lanes_should_drop_messages_above_lane_limit(overflow, expected):
+    lanes, sink = lanes_with_sink(max_queued={'telemetry': 2}, overflow=overflow)
+    sink.open = False
+
+    assert [lanes.put('trail', message) for message in ('a', 'b', 'c')] == expected
+    assert lanes.put('event', 'd') == (PriorityLanes.QUEUED, None)
+    assert lanes.stats()['telemetry']['dropped'] == 1
+
+
+def test_lanes_should_return_queued_messages_on_close():
+    lanes, sink = lanes_with_sink()
+    sink.open = False
+
+    lanes.put('trail', 'a')
+    lanes.put('action_completed', 'b')
+
+    assert lanes.close() == ['b', 'a']
+    assert lanes.wait(0) is True
+
+
+@pytest.mark.parametrize('kwargs', [
+    {'weights': {'control': 0}},
+    {'weights': {'bulk': 1}},
+    {'max_queued': {'telemetry': 0}},
+    {'overflow': 'block'},
+])
+def test_lanes_should_validate_arguments(kwargs):
+    with pytest.raises(ValueError):
+        lanes_with_sink(**kwargs)
+
+
+def test_method_response_should_overtake_trail_backlog(client):
+    client.enable_priority_lanes(window=2)
+
+    for i in range(5):
+        client.send_trail('speed', i)
+
+    assert client.send_method_response('reboot', 'ok') is True
+    assert len(sent_topics(client)) == 2
+
+    client._on_publish(None, None, 1)
+    client._on_publish(None, None, 2)
+
+    assert sent_topics(client)[2:] == ['agent/some_id/method_response/reboot', 'agent/some_id/trail/speed']
+    assert client.get_priority_lanes_stats()['telemetry']['pending'] == 2
+
+
+def test_should_complete_handle_of_message_dropped_from_lane(client):
+    client.enable_priority_lanes(window=1, max_queued={'telemetry': 1}, overflow=PriorityLanes.DROP_NEWEST)
+
+    client.send_trail('speed', 1)
+    queued = client.send_trail_nowait('speed', 2)
+    dropped = client.send_trail_nowait('speed', 3)
+
+    assert queued.done() is False
+    assert dropped.done() is True
+    assert dropped.rc == MQTT_ERR_QUEUE_SIZE
+
+
+def test_flush_should_wait_for_lanes(client):
+    client.enable_priority_lanes(window=1)
+
+    for i in range(3):
+        client.send_trail('speed', i)
+
+    def acknowledge():
+        for mid in range(1, 4):
+            time.sleep(0.02)
+            client._on_publish(None, None, mid)
+
+    thread = threading.Thread(target=acknowledge)
+    thread.start()
+
+    assert client.flush(timeout=2) is True
+    assert len(sent_topics(client)) == 3
+
+    thread.join()
+
+
+def test_disabling_lanes_should_hand_queued_messages_over(client):
+    client.enable_priority_lanes(window=1)
+
+    client.send_trail('speed', 1)
+    client.send_event('ready')
+    client.disable_priority_lanes()
+
+    assert sent_topics(client) == ['agent/some_id/trail/speed', 'agent/some_id/event']
+    assert client.get_priority_lanes_stats() is None
+
+
+def test_should_measure_lane_wait_time(client):
+    registry = client.enable_metrics()
+    client.enable_priority_lanes(window=1)
+
+    client.send_trail('speed', 1)
+    client.send_trail('speed', 2)
+
+    assert registry.snapshot()['veides_telemetry_lane_messages'] == 1
+
+    client._on_publish(None, None, 1)
+    snapshot = registry.snapshot()
+
+    assert snapshot['veides_telemetry_lane_messages'] == 0
+    assert snapshot['veides_lane_wait_seconds']['telemetry']['count'] == 1
+
+
+def test_handler_should_not_wait_for_paho_lock_held_by_other_thread(client):
+    client.on_method('reboot', lambda name, payload: client.send_method_response(name, 'ok'))
+    locked = threading.Event()
+    release = threading.Event()
+
+    def hold_lock():
+        with client.client._out_message_mutex:
+            locked.set()
+            release.wait()
+
+    thread = threading.Thread(target=hold_lock)
+    thread.start()
+    locked.wait()
+
+    msg = MQTTMessage()
+    msg.topic = b'agent/some_id/method/reboot'
+    msg.payload = json.dumps({}).encode('utf-8')
+
+    client._on_method(None, None, msg)
+
+    assert client.client.publish.call_count == 0
+
+    release.set()
+    thread.join()
+    client._send_deferred()
+
+    assert sent_topics(client) == ['agent/some_id/method_response/reboot']
+
+
+def test_method_response_should_not_deadlock_with_trails_sent_by_other_thread():
+    with Broker() as broker:
+        responses = []
+        done = threading.Event()
+
+        def on_response(client_id, topic, payload):
+            responses.append(topic)
+
+            if len(responses) == 20:
+                done.set()
+
+        broker.subscribe('agent/some_id/method_response/+', on_response)
+
+        client = AgentClient(
+            AgentProperties(client_id='some_id', key='key', secret_key='secret'),
+            ConnectionProperties(host='127.0.0.1', port=broker.port, use_tls=False)
+        )
+        client.enable_priority_lanes()
+        client.on_method('get_status', lambda name, payload: client.send_method_response(name, 'idle'))
+        client.connect()
+
+        stop = threading.Event()
+
+        def send_trails():
+            while not stop.is_set():
+                client.send_trail('speed', 1)
+
+        thread = threading.Thread(target=send_trails)
+        thread.start()
+
+        try:
+            for _ in range(20):
+                broker.publish('agent/some_id/method/get_status', b'{}', qos=1)
+                time.sleep(0.01)
+
+            assert done.wait(10) is True
+        finally:
+            stop.set()
+            thread.join()
+            client.disconnect()
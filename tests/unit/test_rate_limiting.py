@@ -0,0 +1,164 @@
+import pytest
+import json
+import threading
+import time
+from paho.mqtt.client import MQTT_ERR_SUCCESS
+from veides.sdk.agent import RateLimiter
+from tests.unit.fixtures import (
+    connected_client,
+    mocked_paho_client,
+    agent_key,
+    agent_secret_key,
+    hostname
+)
+
+
+def wait_until(condition, timeout=2):
+    deadline = time.monotonic() + timeout
+
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    return condition()
+
+
+def test_should_drop_messages_above_the_limit(connected_client):
+    connected_client.client.publish.return_value = (MQTT_ERR_SUCCESS, 1)
+    connected_client.enable_rate_limiting({'trail': 1}, burst=2, overflow=RateLimiter.DROP)
+
+    results = [connected_client.send_trail('temperature', i) for i in range(4)]
+
+    assert results == [True, True, False, False]
+    assert connected_client.client.publish.call_count == 2
+
+    stats = connected_client.get_rate_limiting_stats()
+
+    assert stats['throttled'] == 2
+    assert stats['dropped'] == 2
+    assert stats['kinds']['trail']['dropped'] == 2
+
+
+def test_should_not_limit_other_kinds(connected_client):
+    connected_client.client.publish.return_value = (MQTT_ERR_SUCCESS, 1)
+    connected_client.enable_rate_limiting({'trail': 1}, burst=1, overflow=RateLimiter.DROP)
+
+    assert connected_client.send_trail('temperature', 20) is True
+    assert connected_client.send_event('ready') is True
+    assert connected_client.send_event('ready') is True
+
+
+def test_should_block_until_token_is_available(connected_client):
+    connected_client.client.publish.return_value = (MQTT_ERR_SUCCESS, 1)
+    connected_client.enable_rate_limiting({'event': 20}, burst=1)
+
+    started_at = time.monotonic()
+
+    for _ in range(3):
+        assert connected_client.send_event('ready') is True
+
+    assert time.monotonic() - started_at >= 0.09
+    assert connected_client.get_rate_limiting_stats()['throttled'] == 2
+
+
+def test_should_send_only_latest_coalesced_message_of_topic(connected_client):
+    connected_client.client.publish.return_value = (MQTT_ERR_SUCCESS, 1)
+    connected_client.enable_rate_limiting({'trail': 20}, burst=1, overflow=RateLimiter.COALESCE)
+
+    for i in range(5):
+        assert connected_client.send_trail('temperature', i) is True
+
+    assert wait_until(lambda: connected_client.client.publish.call_count == 2)
+    time.sleep(0.1)
+
+    payloads = [c[0][1] for c in connected_client.client.publish.call_args_list]
+
+    assert payloads == [connected_client.codec.encode({'value': i}) for i in (0, 4)]
+    assert connected_client.get_rate_limiting_stats()['coalesced'] == 4
+
+
+def test_should_merge_coalesced_facts(connected_client):
+    connected_client.client.publish.return_value = (MQTT_ERR_SUCCESS, 1)
+    connected_client.enable_rate_limiting({'facts': 20}, burst=1, overflow=RateLimiter.COALESCE)
+
+    for facts in ({'x': 'a'}, {'y': 'b'}, {'z': 'c', 'y': 'd'}):
+        assert connected_client.send_facts(facts) is True
+
+    assert wait_until(lambda: connected_client.client.publish.call_count == 2)
+
+    payloads = [json.loads(c[0][1]) for c in connected_client.client.publish.call_args_list]
+
+    assert payloads == [{'x': 'a'}, {'y': 'd', 'z': 'c'}]
+
+
+def test_should_not_coalesce_events_sharing_topic(connected_client):
+    connected_client.client.publish.return_value = (MQTT_ERR_SUCCESS, 1)
+    connected_client.enable_rate_limiting({'event': 20}, burst=1, overflow=RateLimiter.COALESCE)
+
+    for name in ('a', 'b', 'c'):
+        assert connected_client.send_event(name) is True
+
+    payloads = [json.loads(c[0][1]) for c in connected_client.client.publish.call_args_list]
+
+    assert payloads == [{'name': name} for name in ('a', 'b', 'c')]
+
+
+def test_should_keep_correlation_data_of_pending_message():
+    published = []
+    limiter = RateLimiter(
+        lambda topic, data, qos, **kwargs: published.append((topic, kwargs['correlation_data'])),
+        {'method_response': 20},
+        burst=1,
+        can_block=lambda: False
+    )
+
+    assert limiter.acquire('method_response', 'response', {}, 1, b'first') == RateLimiter.SEND
+    assert limiter.acquire('method_response', 'response', {}, 1, b'second') == RateLimiter.QUEUED
+    assert wait_until(lambda: len(published) == 1)
+    assert published == [('response', b'second')]
+
+    limiter.close()
+
+
+def test_handler_in_network_thread_should_not_wait_for_acknowledgements(connected_client):
+    mids = iter(range(1, 100))
+    connected_client.client.publish.side_effect = lambda *args, **kwargs: (MQTT_ERR_SUCCESS, next(mids))
+    connected_client.enable_rate_limiting(max_inflight=1)
+    connected_client._message_callback_thread = threading.get_ident()
+
+    started_at = time.monotonic()
+
+    assert connected_client.send_event('first') is True
+    assert connected_client.send_event('second') is True
+    assert time.monotonic() - started_at < 1
+    assert connected_client.client.publish.call_count == 1
+    assert connected_client.get_rate_limiting_stats()['queued'] == 1
+
+    connected_client._message_callback_thread = None
+    connected_client._on_publish(None, None, 1)
+
+    assert wait_until(lambda: connected_client.client.publish.call_count == 2)
+
+
+def test_should_hold_messages_back_when_too_many_are_in_flight(connected_client):
+    mids = iter(range(1, 100))
+    connected_client.client.publish.side_effect = lambda *args, **kwargs: (MQTT_ERR_SUCCESS, next(mids))
+    connected_client.enable_rate_limiting(overflow=RateLimiter.DROP, max_inflight=2)
+
+    assert connected_client.send_event('first') is True
+    assert connected_client.send_event('second') is True
+    assert connected_client.send_event('third') is False
+
+    connected_client._on_publish(None, None, 1)
+
+    assert connected_client.send_event('third') is True
+
+
+@pytest.mark.parametrize("kwargs", [
+    {'rates': {'trail': 0}},
+    {'rates': {'trail': 10}, 'burst': 0},
+    {'overflow': 'unknown'},
+    {'max_inflight': 0},
+])
+def test_should_raise_error_when_given_invalid_rate_limiting_configuration(connected_client, kwargs):
+    with pytest.raises(ValueError):
+        connected_client.enable_rate_limiting(**kwargs)
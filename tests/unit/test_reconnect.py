@@ -0,0 +1,181 @@
+import pytest
+import socket
+import time
+from paho.mqtt.client import MQTT_ERR_SUCCESS
+from veides.sdk.agent import AgentClient, AgentProperties, ConnectionProperties, ReconnectPolicy
+from veides.sdk.agent.exceptions import ConnectionException
+from tests.unit.broker import Broker
+from tests.unit.fixtures import (
+    not_connected_client,
+    mocked_paho_client,
+    agent_key,
+    agent_secret_key,
+    hostname
+)
+
+
+def test_should_double_delay_up_to_max_delay_without_jitter():
+    policy = ReconnectPolicy(min_delay=1, max_delay=10, jitter=False)
+
+    assert [policy.backoff(attempt) for attempt in range(1, 7)] == [1, 2, 4, 8, 10, 10]
+    assert policy.backoff(10000) == 10
+
+
+def test_should_pick_delay_between_zero_and_exponential_delay_with_full_jitter():
+    policy = ReconnectPolicy(min_delay=1, max_delay=10)
+
+    delays = [policy.backoff(4) for _ in range(1000)]
+
+    assert all(0 <= delay <= 8 for delay in delays)
+    assert min(delays) < 1
+    assert max(delays) > 7
+
+
+def test_should_give_up_after_max_attempts():
+    policy = ReconnectPolicy(max_attempts=3, connect_attempts=2)
+
+    assert policy.reconnect_delay(3) is not None
+    assert policy.reconnect_delay(4) is None
+    assert policy.connect_delay(1) is not None
+    assert policy.connect_delay(2) is None
+
+
+def test_should_open_circuit_breaker_after_consecutive_failures():
+    policy = ReconnectPolicy(breaker_threshold=3, breaker_timeout=0.1)
+
+    policy.record_failure()
+    policy.record_failure()
+    assert policy.acquire() == 0
+    assert policy.state == ReconnectPolicy.CLOSED
+
+    policy.record_failure()
+    assert policy.state == ReconnectPolicy.OPEN
+    assert 0 < policy.acquire() <= 0.1
+
+    time.sleep(0.11)
+
+    # Single probe is let through
+    assert policy.acquire() == 0
+    assert policy.state == ReconnectPolicy.HALF_OPEN
+    assert policy.acquire() > 0
+
+    policy.record_failure()
+    assert policy.state == ReconnectPolicy.OPEN
+
+    time.sleep(0.11)
+
+    assert policy.acquire() == 0
+    policy.record_success()
+    assert policy.state == ReconnectPolicy.CLOSED
+    assert policy.acquire() == 0
+
+
+@pytest.mark.parametrize('kwargs', [
+    {'min_delay': 0},
+    {'min_delay': 2, 'max_delay': 1},
+    {'max_attempts': 0},
+    {'connect_attempts': 0},
+    {'breaker_threshold': 0},
+    {'breaker_timeout': 0},
+])
+def test_should_validate_policy(kwargs):
+    with pytest.raises(ValueError):
+        ReconnectPolicy(**kwargs)
+
+
+def test_should_retry_initial_connect(not_connected_client, mocker):
+    not_connected_client._reconnect_policy = ReconnectPolicy(min_delay=0.01, max_delay=0.01, connect_attempts=3)
+    listener = mocker.stub()
+    not_connected_client.on_connection_event(listener)
+    attempts = []
+
+    def side_effect(*_, **__):
+        attempts.append(1)
+
+        if len(attempts) < 3:
+            raise socket.error('refused')
+
+        not_connected_client.client.on_connect(None, None, None, 0)
+        not_connected_client.client.on_subscribe(None, None, 1, (1, 1))
+
+    not_connected_client.client.connect.side_effect = side_effect
+    not_connected_client.client.subscribe.return_value = (MQTT_ERR_SUCCESS, 1)
+
+    not_connected_client.connect()
+
+    assert len(attempts) == 3
+    assert [c[0][0] for c in listener.call_args_list] == [
+        'failed', 'scheduled', 'failed', 'scheduled', 'connected'
+    ]
+    assert not_connected_client._reconnect_attempt == 0
+
+
+def test_should_raise_when_connect_attempts_are_exhausted(not_connected_client, mocker):
+    not_connected_client._reconnect_policy = ReconnectPolicy(min_delay=0.01, max_delay=0.01, connect_attempts=2)
+    not_connected_client.client.connect.side_effect = socket.error('refused')
+    registry = not_connected_client.enable_metrics()
+
+    with pytest.raises(ConnectionException):
+        not_connected_client.connect()
+
+    assert not_connected_client.client.connect.call_count == 2
+    assert registry.snapshot()['veides_connect_attempts_total'] == {'failure': 2}
+    assert registry.snapshot()['veides_reconnect_delay_seconds']['count'] == 1
+
+
+def reconnect_times(policy, agents):
+    broker = Broker().start()
+    clients = []
+
+    try:
+        for i in range(agents):
+            client = AgentClient(
+                AgentProperties(client_id='agent_%d' % i, key='key', secret_key='secret'),
+                ConnectionProperties(host='127.0.0.1', port=broker.port, use_tls=False),
+                reconnect_policy=policy,
+            )
+            client.connect()
+            clients.append(client)
+
+        connected = len(broker.connects)
+        dropped_at = time.monotonic()
+        broker.drop_connections()
+
+        deadline = time.monotonic() + 5
+
+        while len(broker.connects) < connected + agents and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        assert all(client._ready.wait(5) for client in clients)
+
+        return [at - dropped_at for at in broker.connects[connected:]]
+    finally:
+        for client in clients:
+            client.disconnect()
+
+        broker.stop()
+
+
+def test_should_spread_reconnects_of_many_agents():
+    agents = 30
+    jittered = reconnect_times(ReconnectPolicy(min_delay=0.6, max_delay=0.6), agents)
+    synchronized = reconnect_times(ReconnectPolicy(min_delay=0.6, max_delay=0.6, jitter=False), agents)
+
+    def busiest_bucket(times):
+        buckets = {}
+
+        for at in times:
+            buckets[int(at / 0.05)] = buckets.get(int(at / 0.05), 0) + 1
+
+        return max(buckets.values())
+
+    assert len(jittered) == agents
+    assert len(synchronized) == agents
+
+    # Without jitter all agents hit the broker within the same moment
+    assert max(synchronized) - min(synchronized) < 0.2
+    assert busiest_bucket(synchronized) > agents / 2
+
+    # With full jitter reconnects are spread over the whole delay
+    assert max(jittered) - min(jittered) > 0.3
+    assert busiest_bucket(jittered) < agents / 3
@@ -0,0 +1,182 @@
+import pytest
+from paho.mqtt.client import MQTT_ERR_NO_CONN, MQTT_ERR_SUCCESS
+from veides.sdk.agent import AgentClient, AgentProperties, ConnectionProperties
+from veides.sdk.agent.session import InflightStore
+from tests.unit.fixtures import (
+    mocked_paho_client,
+    agent_key,
+    agent_secret_key,
+    hostname
+)
+
+
+@pytest.fixture()
+def create_client(mocker, mocked_paho_client, agent_key, agent_secret_key, hostname):
+    paho_client = mocker.patch("paho.mqtt.client.Client", return_value=mocked_paho_client)
+    mocked_paho_client.subscribe.return_value = (MQTT_ERR_SUCCESS, 1)
+
+    def create(**kwargs):
+        return AgentClient(
+            AgentProperties(client_id='some_id', key=agent_key, secret_key=agent_secret_key),
+            ConnectionProperties(host=hostname),
+            **kwargs
+        )
+
+    create.paho_client = paho_client
+
+    return create
+
+
+def test_store_should_restore_unacknowledged_messages(tmp_path):
+    path = str(tmp_path / 'session')
+
+    store = InflightStore(path)
+    store.add(1, 'topic/a', b'a', 1)
+    store.add(2, 'topic/b', b'b', 1)
+    store.add(3, 'topic/c', b'c', 1)
+    store.remove(2)
+    store.close()
+
+    store = InflightStore(path)
+
+    # Message acknowledged out of order stays behind the oldest pending one and is sent again
+    assert [message[1:] for message in store.restored()] == [
+        ('topic/a', b'a', 1),
+        ('topic/b', b'b', 1),
+        ('topic/c', b'c', 1),
+    ]
+    assert len(store) == 3
+
+
+def test_store_should_advance_past_acknowledged_messages(tmp_path):
+    path = str(tmp_path / 'session')
+
+    store = InflightStore(path)
+    store.add(1, 'topic/a', b'a', 1)
+    store.add(2, 'topic/b', b'b', 1)
+    store.add(3, 'topic/c', b'c', 1)
+    store.remove(2)
+    store.remove(1)
+    store.close()
+
+    assert [message[1:] for message in InflightStore(path).restored()] == [('topic/c', b'c', 1)]
+
+
+def test_store_should_not_keep_message_acknowledged_before_it_was_added(tmp_path):
+    store = InflightStore(str(tmp_path / 'session'))
+
+    store.remove(7)
+    store.add(7, 'topic/a', b'a', 1)
+
+    assert len(store) == 0
+
+
+def test_store_should_forget_old_early_acknowledgements(tmp_path):
+    store = InflightStore(str(tmp_path / 'session'))
+
+    for mid in range(InflightStore.MAX_EARLY + 10):
+        store.remove(mid)
+
+    store.add(1, 'topic/a', b'a', 1)
+
+    assert len(store) == 1
+
+
+def test_should_use_clean_session_by_default(create_client):
+    create_client()
+
+    assert create_client.paho_client.call_args[1]['clean_session'] is True
+
+
+def test_should_keep_session_when_persistent(create_client):
+    create_client(persistent_session=True)
+
+    assert create_client.paho_client.call_args[1]['clean_session'] is False
+
+
+def test_should_not_resubscribe_when_session_is_present(create_client, mocker):
+    client = create_client(persistent_session=True)
+    client.subscribe('fleet/#', mocker.stub())
+
+    client._on_connect(None, None, {'session present': 0}, 0)
+    client._on_subscribe(None, None, 1, (1, 1, 1))
+    client._on_disconnect(None, None, 1)
+
+    client.client.subscribe.reset_mock()
+    client.subscribe('other/#', mocker.stub())
+    client._on_connect(None, None, {'session present': 1}, 0)
+
+    client.client.subscribe.assert_called_once_with([('other/#', 1)])
+
+
+def test_should_resubscribe_when_session_is_lost(create_client):
+    client = create_client(persistent_session=True)
+
+    client._on_connect(None, None, {'session present': 0}, 0)
+    client._on_subscribe(None, None, 1, (1, 1))
+    client._on_connect(None, None, {'session present': 0}, 0)
+
+    assert client.client.subscribe.call_count == 2
+    assert len(client.client.subscribe.call_args[0][0]) == 2
+
+
+def test_should_be_ready_when_session_keeps_all_subscriptions(create_client):
+    client = create_client(persistent_session=True)
+
+    client._on_connect(None, None, {'session present': 0}, 0)
+    client._on_subscribe(None, None, 1, (1, 1))
+    client._ready.clear()
+    client.client.subscribe.reset_mock()
+
+    client._on_connect(None, None, {'session present': 1}, 0)
+
+    client.client.subscribe.assert_not_called()
+    assert client._ready.is_set()
+
+
+def test_should_store_sent_messages_until_acknowledged(create_client, tmp_path):
+    client = create_client(session_path=str(tmp_path / 'session'))
+    client.connected.set()
+    client.client.publish.return_value = (MQTT_ERR_SUCCESS, 5)
+
+    client.send_event('ready')
+
+    assert len(client._inflight_store) == 1
+
+    client._on_publish(None, None, 5)
+
+    assert len(client._inflight_store) == 0
+
+
+def test_should_resend_messages_of_previous_process_on_connect(create_client, tmp_path):
+    path = str(tmp_path / 'session')
+    store = InflightStore(path)
+    store.add(1, 'agent/some_id/event', b'{"name":"ready"}', 1)
+    store.close()
+
+    client = create_client(session_path=path)
+    client.client.publish.return_value = (MQTT_ERR_SUCCESS, 9)
+
+    client._on_connect(None, None, {'session present': 0}, 0)
+
+    client.client.publish.assert_called_once_with('agent/some_id/event', b'{"name":"ready"}', qos=1, retain=False)
+    assert client._inflight_store.restored() == []
+    assert len(client._inflight_store) == 1
+
+    client._on_publish(None, None, 9)
+
+    assert len(client._inflight_store) == 0
+
+
+def test_should_keep_restored_messages_when_resending_failed(create_client, tmp_path):
+    path = str(tmp_path / 'session')
+    store = InflightStore(path)
+    store.add(1, 'agent/some_id/event', b'{"name":"ready"}', 1)
+    store.close()
+
+    client = create_client(session_path=path)
+    client.client.publish.return_value = (MQTT_ERR_NO_CONN, None)
+
+    client._on_connect(None, None, {'session present': 0}, 0)
+
+    assert len(client._inflight_store.restored()) == 1
@@ -0,0 +1,95 @@
+import pytest
+from veides.sdk.agent.topics import TopicTrie
+
+
+@pytest.mark.parametrize('pattern,topic', [
+    ('a/b/c', 'a/b/c'),
+    ('a/+/c', 'a/b/c'),
+    ('+/+/+', 'a/b/c'),
+    ('a/#', 'a/b/c'),
+    ('a/#', 'a'),
+    ('#', 'a/b/c'),
+    ('a/+', 'a/'),
+    ('+/b', '/b'),
+])
+def test_should_match_topic(pattern, topic):
+    trie = TopicTrie()
+    trie.add(pattern, 'handler')
+
+    assert trie.match(topic) == ('handler',)
+
+
+@pytest.mark.parametrize('pattern,topic', [
+    ('a/b/c', 'a/b'),
+    ('a/+', 'a/b/c'),
+    ('a/+', 'a'),
+    ('a/b/#', 'a/c'),
+    ('#', '$SYS/broker'),
+    ('+/broker', '$SYS/broker'),
+])
+def test_should_not_match_topic(pattern, topic):
+    trie = TopicTrie()
+    trie.add(pattern, 'handler')
+
+    assert trie.match(topic) == ()
+
+
+def test_should_match_all_overlapping_patterns():
+    trie = TopicTrie()
+    trie.add('a/b', 1)
+    trie.add('a/+', 2)
+    trie.add('a/#', 3)
+    trie.add('a/c', 4)
+    trie.add('a/b', 5)
+
+    assert sorted(trie.match('a/b')) == [1, 2, 3, 5]
+    assert len(trie) == 5
+
+
+@pytest.mark.parametrize('pattern', ['', 'a/#/b', 'a/b#', 'a/+b', 'a+/b'])
+def test_should_reject_invalid_pattern(pattern):
+    with pytest.raises(ValueError):
+        TopicTrie().add(pattern, 'handler')
+
+
+def test_should_reject_non_string_pattern():
+    with pytest.raises(TypeError):
+        TopicTrie().add(None, 'handler')
+
+
+def test_should_invalidate_cached_matches_on_change():
+    trie = TopicTrie()
+    trie.add('a/+', 1)
+
+    assert trie.match('a/b') == (1,)
+
+    trie.add('a/b', 2)
+
+    assert sorted(trie.match('a/b')) == [1, 2]
+
+    assert trie.remove('a/+') == 0
+
+    assert trie.match('a/b') == (2,)
+
+
+def test_should_remove_single_value():
+    trie = TopicTrie()
+    trie.add('a/b', 1)
+    trie.add('a/b', 2)
+
+    assert trie.remove('a/b', 1) == 1
+    assert trie.match('a/b') == (2,)
+    assert trie.remove('a/b', 2) == 0
+    assert trie.match('a/b') == ()
+    assert len(trie) == 0
+    assert trie.remove('x/y') == 0
+
+
+def test_should_bound_match_cache():
+    trie = TopicTrie(cache_size=2)
+    trie.add('#', 1)
+
+    for i in range(10):
+        assert trie.match('topic/%d' % i) == (1,)
+
+    assert len(trie._cache) <= 2
@@ -0,0 +1,234 @@
+import pytest
+import array
+import json
+import time
+from paho.mqtt.client import MQTT_ERR_SUCCESS
+from veides.sdk.agent import AgentHost, AgentProperties, ConnectionProperties
+from veides.sdk.agent import aggregation
+from veides.sdk.agent.aggregation import TrailAggregator
+from tests.unit.fixtures import (
+    connected_client,
+    mocked_paho_client,
+    agent_key,
+    agent_secret_key,
+    hostname
+)
+
+backends = [False, pytest.param(True, marks=pytest.mark.skipif(aggregation.numpy is None, reason='numpy is not installed'))]
+
+
+def aggregator_with_sink(**kwargs):
+    sent = {}
+
+    def publish(name, value):
+        sent[name] = value
+        return True
+
+    return TrailAggregator(publish, **kwargs), sent
+
+
+def sent_trails(client):
+    return {
+        c[0][0]: json.loads(c[0][1])['value']
+        for c in client.client.publish.call_args_list
+    }
+
+
+@pytest.mark.parametrize('use_numpy', backends)
+def test_should_aggregate_samples_of_window(use_numpy):
+    aggregator, sent = aggregator_with_sink(aggregates=('last', 'mean', 'min', 'max', 'count', 'sum'), use_numpy=use_numpy)
+
+    for value in (3, 1, 4, 1, 5):
+        aggregator.add('speed', value)
+
+    aggregator.add_many('speed', [9, 2, 6])
+    aggregator.emit()
+
+    assert sent == {
+        'speed_last': 6,
+        'speed_mean': 31 / 8,
+        'speed_min': 1,
+        'speed_max': 9,
+        'speed_count': 8,
+        'speed_sum': 31,
+    }
+
+
+@pytest.mark.parametrize('use_numpy', backends)
+def test_should_compute_percentiles_of_last_capacity_samples(use_numpy):
+    aggregator, sent = aggregator_with_sink(aggregates=('p0', 'p50', 'p90', 'p100', 'count'), capacity=11, use_numpy=use_numpy)
+
+    aggregator.add_many('speed', array.array('d', [1000] * 5))
+
+    for value in range(5):
+        aggregator.add('speed', value)
+
+    aggregator.add_many('speed', list(range(5, 11)))
+    aggregator.emit()
+
+    assert sent == {'speed_p0': 0, 'speed_p50': 5, 'speed_p90': 9, 'speed_p100': 10, 'speed_count': 16}
+
+
+@pytest.mark.parametrize('use_numpy', backends)
+def test_should_keep_ring_order_across_wrap_around(use_numpy):
+    aggregator, sent = aggregator_with_sink(aggregates=('p0', 'p100'), trail_name='{name}.{aggregate}', capacity=4, use_numpy=use_numpy)
+
+    aggregator.add_many('speed', [1, 2, 3])
+    aggregator.add_many('speed', [4, 5, 6])
+    aggregator.emit()
+
+    assert sent == {'speed.p0': 3, 'speed.p100': 6}
+
+
+def test_array_and_numpy_percentiles_should_be_equal():
+    if aggregation.numpy is None:
+        pytest.skip('numpy is not installed')
+
+    values = [((i * 7919) % 1000) / 10.0 for i in range(3000)]
+    results = []
+
+    for use_numpy in (False, True):
+        aggregator, sent = aggregator_with_sink(aggregates=('p50', 'p99', 'p99.9'), capacity=2048, use_numpy=use_numpy)
+        aggregator.add_many('speed', values)
+        aggregator.emit()
+        results.append(sent)
+
+    assert results[0] == pytest.approx(results[1])
+
+
+def test_should_start_new_window_after_emit():
+    aggregator, sent = aggregator_with_sink(aggregates=('max', 'count'), use_numpy=False)
+
+    aggregator.add('speed', 10)
+    aggregator.emit()
+    aggregator.add('speed', 1)
+    aggregator.emit()
+
+    assert sent == {'speed_max': 1, 'speed_count': 1}
+
+    sent.clear()
+    aggregator.emit()
+
+    assert sent == {}
+    assert aggregator.stats() == {'trails': 1, 'samples': 2, 'windows': 2, 'published': 4, 'failed': 0}
+
+
+def test_should_emit_when_window_is_over():
+    aggregator, sent = aggregator_with_sink(interval=2, aggregates=('count',), use_numpy=False)
+    start = aggregator._next_emit - 2
+
+    aggregator.add('speed', 1)
+
+    assert aggregator.emit_due(start + 1) is False
+    assert aggregator.emit_due(start + 2) is True
+    assert sent == {'speed_count': 1}
+
+    # Missed windows are skipped
+    assert aggregator.emit_due(start + 7.5) is True
+    assert aggregator.emit_due(start + 7.9) is False
+    assert aggregator.emit_due(start + 8) is True
+
+
+def test_should_count_failed_aggregates():
+    aggregator = TrailAggregator(lambda name, value: False, aggregates=('min', 'max'))
+
+    aggregator.add('speed', 1)
+    aggregator.emit()
+
+    assert aggregator.stats()['failed'] == 2
+
+
+@pytest.mark.parametrize('kwargs,error', [
+    ({'interval': 0}, ValueError),
+    ({'capacity': 0}, ValueError),
+    ({'aggregates': ()}, ValueError),
+    ({'aggregates': ('median',)}, ValueError),
+    ({'aggregates': ('p101',)}, ValueError),
+    ({'aggregates': ('min', 'max'), 'trail_name': '{name}'}, ValueError),
+    ({'trail_name': 'speed_{aggregate}'}, ValueError),
+])
+def test_aggregator_should_validate_arguments(kwargs, error):
+    with pytest.raises(error):
+        aggregator_with_sink(**kwargs)
+
+
+@pytest.mark.parametrize('use_numpy', backends)
+@pytest.mark.parametrize('value', [float('nan'), float('inf'), -float('inf'), 'fast', None])
+def test_should_reject_samples_which_are_not_finite_numbers(use_numpy, value):
+    aggregator, sent = aggregator_with_sink(aggregates=('min', 'max', 'mean'), use_numpy=use_numpy)
+
+    aggregator.add('speed', 2)
+
+    with pytest.raises(ValueError):
+        aggregator.add('speed', value)
+
+    with pytest.raises(ValueError):
+        aggregator.add_many('speed', [1, value])
+
+    with pytest.raises(ValueError):
+        aggregator.add('other', value)
+
+    aggregator.emit()
+
+    assert sent == {'speed_min': 2, 'speed_max': 2, 'speed_mean': 2}
+    assert aggregator.stats()['trails'] == 1
+
+
+def test_aggregator_should_raise_when_numpy_is_missing(mocker):
+    mocker.patch.object(aggregation, 'numpy', None)
+
+    with pytest.raises(ImportError):
+        aggregator_with_sink(use_numpy=True)
+
+
+def test_should_send_aggregates_as_trails(connected_client):
+    connected_client.enable_trail_aggregation(interval=60, aggregates=('mean', 'max'))
+
+    connected_client.add_sample('speed', 1)
+    connected_client.add_samples('speed', [2, 3])
+    connected_client.disconnect()
+
+    assert sent_trails(connected_client) == {
+        'agent/some_id/trail/speed_mean': 2,
+        'agent/some_id/trail/speed_max': 3,
+    }
+
+
+def test_disabling_aggregation_should_send_collected_samples(connected_client):
+    connected_client.enable_trail_aggregation(interval=60, aggregates=('count',), trail_name='{name}')
+
+    connected_client.add_sample('speed', 1)
+    connected_client.disable_trail_aggregation()
+
+    assert sent_trails(connected_client) == {'agent/some_id/trail/speed': 1}
+    assert connected_client.get_trail_aggregation_stats() is None
+
+    with pytest.raises(RuntimeError):
+        connected_client.add_sample('speed', 1)
+
+
+def test_should_validate_sample_trail_name(connected_client):
+    connected_client.enable_trail_aggregation(interval=60)
+
+    with pytest.raises(ValueError):
+        connected_client.add_sample('', 1)
+
+
+def test_hosted_agent_should_send_aggregates_on_tick(mocker, mocked_paho_client, hostname):
+    mocker.patch("paho.mqtt.client.Client", return_value=mocked_paho_client)
+    mocked_paho_client.publish.return_value = (MQTT_ERR_SUCCESS, 1)
+
+    host = AgentHost(ConnectionProperties(host=hostname))
+    agent = host.add_agent(AgentProperties(client_id='some_id', key='key', secret_key='secret'))
+    agent.connected.set()
+    agent.enable_trail_aggregation(interval=1, aggregates=('max',), trail_name='{name}')
+
+    agent.add_sample('speed', 5)
+    agent._tick(time.monotonic())
+
+    assert agent._trail_aggregator._thread is None
+    assert agent.client.publish.call_count == 0
+
+    agent._tick(time.monotonic() + 1)
+
+    assert sent_trails(agent) == {'agent/some_id/trail/speed': 5}
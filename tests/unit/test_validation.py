@@ -0,0 +1,85 @@
+import pytest
+from veides.sdk.agent import AgentClient, AgentProperties, ConnectionProperties, ValidationMode
+from veides.sdk.agent.validation import Validator, validate_facts
+from tests.unit.fixtures import (
+    mocked_paho_client,
+    agent_key,
+    agent_secret_key,
+    hostname
+)
+
+
+@pytest.fixture()
+def client_factory(mocker, mocked_paho_client, agent_key, agent_secret_key, hostname):
+    mocker.patch("paho.mqtt.client.Client", return_value=mocked_paho_client)
+
+    def factory(validation):
+        client = AgentClient(
+            AgentProperties(client_id='some_id', key=agent_key, secret_key=agent_secret_key),
+            ConnectionProperties(host=hostname),
+            validation=validation
+        )
+        client.connected.set()
+
+        return client
+
+    return factory
+
+
+@pytest.mark.parametrize("facts,error", [
+    ([], TypeError),
+    ({'name': {}}, TypeError),
+    ({'': '', 'name': {}}, TypeError),
+    ({1: 'value'}, TypeError),
+    ({'': 'value'}, ValueError),
+    ({'name': ''}, ValueError),
+])
+def test_should_raise_the_same_errors_as_before_when_validating_facts(facts, error):
+    with pytest.raises(error):
+        validate_facts(facts)
+
+
+def test_should_accept_valid_facts():
+    validate_facts({'fact_%d' % i: 'value' for i in range(500)})
+
+
+def test_should_validate_every_message_in_strict_mode(client_factory):
+    client = client_factory(ValidationMode.STRICT)
+
+    client.send_trail('speed', 1)
+
+    with pytest.raises(TypeError):
+        client.send_trail('speed', {})
+
+
+def test_should_validate_first_message_of_a_name_in_once_per_name_mode(client_factory):
+    client = client_factory(ValidationMode.ONCE_PER_NAME)
+
+    with pytest.raises(TypeError):
+        client.send_trail('speed', {})
+
+    client.send_trail('speed', 1)
+    client.send_trail('speed', [])
+
+    with pytest.raises(TypeError):
+        client.send_trail('level', [])
+
+    client.send_facts({'battery': 'full'})
+    client.send_facts({'battery': ''})
+
+    with pytest.raises(ValueError):
+        client.send_facts({'battery': 'full', 'charging': ''})
+
+
+def test_should_not_validate_messages_when_validation_is_off(client_factory):
+    client = client_factory(ValidationMode.OFF)
+
+    client.send_event('')
+    client.send_facts({'battery': ''})
+
+    assert client.client.publish.call_count == 2
+
+
+def test_should_raise_error_when_given_invalid_validation_mode():
+    with pytest.raises(ValueError):
+        Validator('sometimes')
@@ -1,5 +1,15 @@
 __version__ = '0.4.0'
 
 from veides.sdk.agent.client import AgentClient
+from veides.sdk.agent.async_client import AsyncAgentClient
 from veides.sdk.agent.base_client import BaseClient
+from veides.sdk.agent.delivery import DeliveryHandle
+from veides.sdk.agent.dispatcher import HandlerDispatcher
+from veides.sdk.agent.host import AgentHost
+from veides.sdk.agent.methods import MethodCall
+from veides.sdk.agent.metrics import MetricsRegistry
 from veides.sdk.agent.properties import AgentProperties, ConnectionProperties
+from veides.sdk.agent.qos import QosPolicy
+from veides.sdk.agent.ratelimit import RateLimiter
+from veides.sdk.agent.reconnect import ReconnectPolicy
+from veides.sdk.agent.validation import ValidationMode
@@ -0,0 +1,445 @@
+import array
+import math
+import re
+import threading
+import time
+from veides.sdk.agent.validation import validate_name
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+AGGREGATES = ('last', 'mean', 'min', 'max', 'count', 'sum')
+# Percentiles are named p50, p99, p99.9 etc.
+PERCENTILE = re.compile(r'^p(100|\d{1,2}(\.\d+)?)$')
+
+
+class TrailAggregator(object):
+    def __init__(
+            self,
+            publish,
+            interval=1.0,
+            aggregates=('mean', 'min', 'max'),
+            capacity=4096,
+            trail_name='{name}_{aggregate}',
+            use_numpy=None
+    ):
+        """
+        Collects raw samples of numeric trails in preallocated ring buffers and publishes
+        aggregates of every trail once per interval. Count, sum, mean, min, max and last
+        value cover all samples of the window, percentiles the last capacity samples
+
+        :param publish: Callable taking trail name and value, returning False when the trail wasn't sent
+        :type publish: callable
+        :param interval: Window length (in seconds)
+        :type interval: int|float
+        :param aggregates: Aggregates published per trail: last, mean, min, max, count, sum
+            and percentiles, e.g. p50 or p99.9
+        :type aggregates: tuple
+        :param capacity: Number of samples kept per trail for percentiles
+        :type capacity: int
+        :param trail_name: Name of published trails, formatted with trail name and aggregate
+        :type trail_name: str
+        :param use_numpy: Keep samples in NumPy arrays and aggregate them with NumPy.
+            Used when numpy is installed by default
+        :type use_numpy: bool
+        """
+        if not callable(publish):
+            raise TypeError('publish should be callable')
+
+        if isinstance(interval, bool) or not isinstance(interval, (int, float)) or interval <= 0:
+            raise ValueError('interval should be a positive number')
+
+        if isinstance(capacity, bool) or not isinstance(capacity, int) or capacity < 1:
+            raise ValueError('capacity should be a positive integer')
+
+        aggregates = tuple(aggregates)
+
+        if len(aggregates) == 0:
+            raise ValueError('at least one aggregate is required')
+
+        for aggregate in aggregates:
+            if aggregate not in AGGREGATES and PERCENTILE.match(aggregate) is None:
+                raise ValueError('unknown aggregate %s' % aggregate)
+
+        if '{name}' not in trail_name or (len(aggregates) > 1 and '{aggregate}' not in trail_name):
+            raise ValueError('trail_name should contain {name} and {aggregate} when there are many aggregates')
+
+        if use_numpy is None:
+            use_numpy = numpy is not None
+        elif use_numpy and numpy is None:
+            raise ImportError('numpy is not installed')
+
+        self.interval = float(interval)
+        self.aggregates = aggregates
+
+        self._publish = publish
+        self._capacity = capacity
+        self._trail_name = trail_name
+        self._use_numpy = use_numpy
+        self._percentiles = [(aggregate, float(aggregate[1:])) for aggregate in aggregates if aggregate[0] == 'p']
+
+        self._lock = threading.Lock()
+        self._condition = threading.Condition(self._lock)
+        self._series = {}
+        self._next_emit = time.monotonic() + self.interval
+        self._thread = None
+        self._closed = False
+
+        self._samples = 0
+        self._windows = 0
+        self._published = 0
+        self._failed = 0
+
+    def add(self, name, value):
+        """
+        :param name: Trail name
+        :type name: str
+        :param value: Sample value
+        :type value: int|float
+        :raises ValueError: If value is not a finite number
+        :return void
+        """
+        # NaN would stick in min and max, as comparisons with it are false, and make the mean NaN
+        try:
+            finite = math.isfinite(value)
+        except TypeError:
+            finite = False
+
+        if not finite:
+            raise ValueError('sample should be a finite number')
+
+        series = self._series.get(name)
+
+        if series is None:
+            series = self._add_series(name)
+
+        with series.lock:
+            series.window.add(value)
+
+    def add_many(self, name, values):
+        """
+        Adds samples with a few vectorized operations
+
+        :param name: Trail name
+        :type name: str
+        :param values: Sample values, preferably array('d') or NumPy array
+        :type values: array.array|list|numpy.ndarray
+        :raises ValueError: If any value is not a finite number
+        :return void
+        """
+        try:
+            if self._use_numpy:
+                values = numpy.asarray(values, dtype=numpy.float64)
+            elif not isinstance(values, array.array) or values.typecode != 'd':
+                values = array.array('d', values)
+        except (TypeError, ValueError):
+            raise ValueError('samples should be finite numbers')
+
+        if len(values) == 0:
+            return
+
+        # Sum is NaN or infinite when any value is
+        total = float(values.sum()) if self._use_numpy else sum(values)
+
+        if not math.isfinite(total):
+            raise ValueError('samples should be finite numbers')
+
+        series = self._series.get(name)
+
+        if series is None:
+            series = self._add_series(name)
+
+        with series.lock:
+            series.window.add_many(values, total)
+
+    def start(self):
+        """
+        Start publishing aggregates in a background thread
+
+        :return void
+        """
+        with self._condition:
+            if self._thread is None and not self._closed:
+                self._thread = threading.Thread(target=self._run, name='veides-trail-aggregator', daemon=True)
+                self._thread.start()
+
+    def emit_due(self, now=None):
+        """
+        Publish aggregates when the window is over. Called periodically when the
+        aggregator isn't started, e.g. by the host I/O loop
+
+        :param now: Current time.monotonic()
+        :type now: float
+        :return bool True when aggregates were published
+        """
+        now = time.monotonic() if now is None else now
+
+        with self._lock:
+            if now < self._next_emit:
+                return False
+
+            # Windows missed e.g. by a suspended process are skipped
+            self._next_emit += max(1, math.floor((now - self._next_emit) / self.interval) + 1) * self.interval
+
+        self.emit()
+
+        return True
+
+    def emit(self):
+        """
+        Publish aggregates of samples collected so far and start new windows
+
+        :return void
+        """
+        published = 0
+        failed = 0
+
+        for series in list(self._series.values()):
+            with series.lock:
+                window = series.window
+
+                if window.count == 0:
+                    continue
+
+                series.window = series.spare or self._window()
+                series.spare = None
+
+            for aggregate, value in self._aggregate(window):
+                if self._publish(series.trail_names[aggregate], value):
+                    published += 1
+                else:
+                    failed += 1
+
+            window.reset()
+            series.spare = window
+
+        with self._lock:
+            self._published += published
+            self._failed += failed
+
+    def close(self):
+        """
+        Publish aggregates of samples collected so far and stop the background thread
+
+        :return void
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+
+        self.emit()
+
+    def stats(self):
+        """
+        Returns number of aggregated trails, added samples, aggregated windows,
+        and published and failed aggregate trails
+
+        :return dict
+        """
+        with self._lock:
+            samples = self._samples
+
+            for series in self._series.values():
+                samples += series.window.count
+
+            return {
+                'trails': len(self._series),
+                'samples': samples,
+                'windows': self._windows,
+                'published': self._published,
+                'failed': self._failed,
+            }
+
+    def _add_series(self, name):
+        with self._lock:
+            series = self._series.get(name)
+
+            if series is None:
+                validate_name(name, 'trail')
+
+                trail_names = {
+                    aggregate: self._trail_name.format(name=name, aggregate=aggregate)
+                    for aggregate in self.aggregates
+                }
+                series = self._series[name] = _Series(self._window(), trail_names)
+
+            return series
+
+    def _window(self):
+        if self._use_numpy:
+            return _NumpyWindow(self._capacity)
+
+        return _ArrayWindow(self._capacity)
+
+    def _aggregate(self, window):
+        """
+        :param window: Finished window with at least one sample
+        :type window: _Window
+        :return list Aggregate names and values
+        """
+        values = {
+            'last': window.last,
+            'mean': window.total / window.count,
+            'min': window.minimum,
+            'max': window.maximum,
+            'count': window.count,
+            'sum': window.total,
+        }
+
+        if self._percentiles:
+            values.update(zip(
+                [aggregate for aggregate, _ in self._percentiles],
+                window.percentiles([q for _, q in self._percentiles])
+            ))
+
+        with self._lock:
+            self._samples += window.count
+            self._windows += 1
+
+        return [(aggregate, values[aggregate]) for aggregate in self.aggregates]
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._closed:
+                    remaining = self._next_emit - time.monotonic()
+
+                    if remaining <= 0:
+                        break
+
+                    self._condition.wait(remaining)
+
+                if self._closed:
+                    return
+
+            self.emit_due()
+
+
+class _Series(object):
+    __slots__ = ('lock', 'window', 'spare', 'trail_names')
+
+    def __init__(self, window, trail_names):
+        self.lock = threading.Lock()
+        # Window filled by producers and a finished one reused after its aggregates are published
+        self.window = window
+        self.spare = None
+        self.trail_names = trail_names
+
+
+class _Window(object):
+    def __init__(self, capacity):
+        """
+        Samples of a single trail within a window. Count, sum, min, max and last value
+        are kept for all samples, the last capacity samples are kept in a ring buffer
+
+        :param capacity: Ring buffer size
+        :type capacity: int
+        """
+        self.capacity = capacity
+        self.samples = None
+        self.reset()
+
+    def reset(self):
+        self.position = 0
+        self.count = 0
+        self.total = 0.0
+        self.minimum = math.inf
+        self.maximum = -math.inf
+        self.last = None
+
+    def add(self, value):
+        position = self.position
+        self.samples[position] = value
+        position += 1
+        self.position = position if position < self.capacity else 0
+        self.count += 1
+        self.total += value
+        self.last = value
+
+        if value < self.minimum:
+            self.minimum = value
+
+        if value > self.maximum:
+            self.maximum = value
+
+    def add_many(self, values, total):
+        size = len(values)
+        capacity = self.capacity
+
+        if size >= capacity:
+            self.samples[:] = values[size - capacity:]
+            self.position = 0
+        else:
+            head = min(size, capacity - self.position)
+            self.samples[self.position:self.position + head] = values[:head]
+            self.samples[:size - head] = values[head:]
+            self.position = (self.position + size) % capacity
+
+        self.count += size
+        self.total += total
+        self._add_stats(values)
+
+    def kept(self):
+        """
+        :return Ring buffer or its filled part
+        """
+        if self.count >= self.capacity:
+            return self.samples
+
+        return self.samples[:self.count]
+
+    def _add_stats(self, values):
+        raise NotImplementedError()
+
+    def percentiles(self, qs):
+        raise NotImplementedError()
+
+
+class _ArrayWindow(_Window):
+    def __init__(self, capacity):
+        _Window.__init__(self, capacity)
+        self.samples = array.array('d', bytes(8 * capacity))
+
+    def _add_stats(self, values):
+        self.last = values[-1]
+        self.minimum = min(self.minimum, min(values))
+        self.maximum = max(self.maximum, max(values))
+
+    def percentiles(self, qs):
+        """
+        Percentiles with linear interpolation between closest ranks, like numpy.percentile()
+
+        :param qs: Percentiles, from 0 to 100
+        :type qs: list
+        :return list
+        """
+        values = sorted(self.kept())
+        last = len(values) - 1
+        result = []
+
+        for q in qs:
+            rank = q / 100.0 * last
+            low = int(rank)
+            high = min(low + 1, last)
+            result.append(values[low] + (values[high] - values[low]) * (rank - low))
+
+        return result
+
+
+class _NumpyWindow(_Window):
+    def __init__(self, capacity):
+        _Window.__init__(self, capacity)
+        self.samples = numpy.zeros(capacity)
+
+    def _add_stats(self, values):
+        self.last = float(values[-1])
+        self.minimum = min(self.minimum, float(values.min()))
+        self.maximum = max(self.maximum, float(values.max()))
+
+    def percentiles(self, qs):
+        return [float(value) for value in numpy.percentile(self.kept(), qs)]
@@ -0,0 +1,501 @@
+import asyncio
+import functools
+import logging
+import socket
+import threading
+import time
+import paho.mqtt.client as paho
+
+from veides.sdk.agent.client import AgentClient
+from veides.sdk.agent.delivery import DeliveryHandle
+from veides.sdk.agent.exceptions import ConnectionException
+from veides.sdk.agent.ratelimit import RateLimiter
+from veides.sdk.agent.validation import ValidationMode
+
+
+class AsyncAgentClient(AgentClient):
+    def __init__(
+            self,
+            agent_properties,
+            connection_properties,
+            logger=None,
+            mqtt_logger=None,
+            log_level=logging.WARN,
+            mqtt_log_level=logging.ERROR,
+            ssl_context=None,
+            codec=None,
+            validation=ValidationMode.STRICT,
+            qos_policy=None,
+            max_inflight_messages=None,
+            max_queued_messages=None,
+            reconnect_policy=None,
+            persistent_session=False,
+            session_path=None,
+            message_expiry=None,
+            method_timeout=None,
+            loop=None
+    ):
+        """
+        AgentClient driven by asyncio event loop instead of Paho's network thread.
+        Paho's socket is registered in the event loop, send_* methods are coroutines
+        resolving when the message is acknowledged and handlers may be coroutine functions
+
+        :param agent_properties: Properties related to agent
+        :type agent_properties: AgentProperties
+        :param connection_properties: Properties related to Veides connection
+        :type connection_properties: ConnectionProperties
+        :param logger: Custom SDK logger
+        :type logger: logging.Logger
+        :param mqtt_logger: Custom MQTT lib logger
+        :type mqtt_logger: logging.Logger
+        :param log_level: SDK logging level
+        :param mqtt_log_level: MQTT lib logging level
+        :param ssl_context: Custom SSL context (e.g. shared between many agents)
+        :type ssl_context: ssl.SSLContext
+        :param codec: Message payload codec. The fastest available JSON codec is used by default
+        :type codec: Codec
+        :param validation: Validation mode of sent messages, one of ValidationMode values
+        :type validation: str
+        :param qos_policy: QoS of sent messages per message type. QoS 1 is used by default
+        :type qos_policy: QosPolicy
+        :param max_inflight_messages: Maximum number of QoS 1 messages waiting for acknowledgement (Paho's default is 20)
+        :type max_inflight_messages: int
+        :param max_queued_messages: Maximum number of messages queued by Paho when in-flight window is full. 0 means unlimited (default)
+        :type max_queued_messages: int
+        :param reconnect_policy: Delays and limits of connection attempts, may be shared by many agents
+        :type reconnect_policy: ReconnectPolicy
+        :param persistent_session: Keep MQTT session on the broker between connections, so actions and
+            methods sent during short outages aren't lost. Subscriptions are not renewed when the session is present
+        :type persistent_session: bool
+        :param session_path: File keeping sent QoS 1 and 2 messages until they are acknowledged,
+            so they are sent again after process restart
+        :type session_path: str
+        :param message_expiry: Time (in seconds) after which the broker drops undelivered messages,
+            per message type, e.g. {'trail': 60} drops stale trails. Requires MQTT v5
+        :type message_expiry: dict
+        :param method_timeout: Time (in seconds) a method call waits for response. The call is answered
+            with 504 code afterwards and later responses to it are dropped. Calls don't expire by default
+        :type method_timeout: int|float
+        :param loop: Event loop to use. Current event loop is used by default
+        :type loop: asyncio.AbstractEventLoop
+        """
+        AgentClient.__init__(
+            self,
+            agent_properties=agent_properties,
+            connection_properties=connection_properties,
+            logger=logger,
+            mqtt_logger=mqtt_logger,
+            log_level=log_level,
+            mqtt_log_level=mqtt_log_level,
+            ssl_context=ssl_context,
+            codec=codec,
+            validation=validation,
+            qos_policy=qos_policy,
+            max_inflight_messages=max_inflight_messages,
+            max_queued_messages=max_queued_messages,
+            reconnect_policy=reconnect_policy,
+            persistent_session=persistent_session,
+            session_path=session_path,
+            message_expiry=message_expiry,
+            method_timeout=method_timeout,
+        )
+
+        self._loop = loop
+        self._loop_thread_id = None
+        self._misc_task = None
+        self._connect_future = None
+        self._disconnect_future = None
+        self._should_reconnect = False
+
+        self._pending_publishes = set()
+        self._handler_tasks = set()
+
+        self.client.on_socket_open = self._on_socket_open
+        self.client.on_socket_close = self._on_socket_close
+        self.client.on_socket_register_write = self._on_socket_register_write
+        self.client.on_socket_unregister_write = self._on_socket_unregister_write
+
+    async def connect(self, timeout=30):
+        """
+        Connect to Veides. Failed attempts are retried as configured by the reconnect policy
+        (see ReconnectPolicy.connect_attempts)
+
+        :param timeout: Time (in seconds) to wait for the connection to be established
+        :type timeout: float
+        :raises ConnectionException: If there's any connection problem
+        """
+        if self._loop is None:
+            self._loop = asyncio.get_event_loop()
+
+        self._loop_thread_id = threading.get_ident()
+        self._reconnect_attempt = 0
+
+        while True:
+            await self._await_breaker()
+
+            try:
+                await self._connect_once(timeout)
+            except ConnectionException:
+                delay = self._schedule_reconnect(initial=True)
+
+                if delay is None:
+                    raise
+
+                await asyncio.sleep(delay)
+                continue
+
+            break
+
+        self._should_reconnect = True
+
+        if self._misc_task is None:
+            self._misc_task = self._loop.create_task(self._misc_loop())
+
+    async def disconnect(self):
+        self.logger.info("Closing connection to Veides")
+
+        self._should_reconnect = False
+
+        if self._trail_aggregator is not None:
+            self._trail_aggregator.emit()
+
+        if self._trail_batcher is not None:
+            self._trail_batcher.flush()
+
+        if self._misc_task is not None:
+            self._misc_task.cancel()
+            self._misc_task = None
+
+        if self.client.socket() is not None:
+            self._disconnect_future = self._loop.create_future()
+            self.client.disconnect()
+
+            try:
+                await asyncio.wait_for(asyncio.shield(self._disconnect_future), 10)
+            except asyncio.TimeoutError:
+                self.logger.warning("Timeout occurred while disconnecting from Veides")
+
+        self.logger.info("Closed connection to Veides")
+
+    async def send_method_response(self, name, payload, code=200, call_id=None):
+        """
+        Send the response to invoked method. Resolves when the message is acknowledged
+
+        :param name: Method name
+        :type name: str
+        :param payload: A dictionary containing response to the method
+        :type payload: dict|list|str|int|float|bool
+        :param code: HTTP response code
+        :type code: int
+        :param call_id: Id of answered call (see MethodCall)
+        :type call_id: int
+        :return bool False when the call was answered already or timed out
+        """
+        return await self._wait_for(AgentClient.send_method_response(self, name, payload, code, call_id))
+
+    async def send_action_completed(self, name):
+        """
+        Send action completed message. Resolves when the message is acknowledged
+
+        :param name: Completed action name
+        :type name: str
+        :return bool
+        """
+        return await self._wait_for(AgentClient.send_action_completed(self, name))
+
+    async def send_event(self, name):
+        """
+        Send an event. Resolves when the message is acknowledged
+
+        :param name: Event name
+        :type name: str
+        :return bool
+        """
+        return await self._wait_for(AgentClient.send_event(self, name))
+
+    async def send_facts(self, facts):
+        """
+        Send new fact(s) value(s). Resolves when the message is acknowledged
+
+        :param facts: Simple key-value dictionary containing fact name (key) and fact value (value)
+        :type facts: dict
+        :return bool
+        """
+        return await self._wait_for(AgentClient.send_facts(self, facts))
+
+    async def send_trail(self, name, value):
+        """
+        Send a trail. Resolves when the message is acknowledged
+        (or buffered, when trail batching is enabled)
+
+        :param name: Trail name
+        :type name: str
+        :param value: Trail value
+        :type value: str|int|float
+        :return bool
+        """
+        return await self._wait_for(AgentClient.send_trail(self, name, value))
+
+    async def _wait_for(self, result):
+        if isinstance(result, asyncio.Future):
+            return await result
+
+        return result
+
+    def _in_loop_thread(self):
+        return threading.get_ident() == self._loop_thread_id
+
+    def _call_in_loop(self, func, *args):
+        if self._in_loop_thread():
+            func(*args)
+        else:
+            self._loop.call_soon_threadsafe(func, *args)
+
+    def _publish_message(self, topic, data, qos=1, handle=None, kind=None, correlation_data=None):
+        """
+        Publishes the message without blocking. When called from the event loop thread
+        returns a future resolved when the handle of the message is done
+
+        :param topic: Topic to publish message to
+        :type topic: str
+        :param data
+        :type data: dict
+        :param qos
+        :type qos: int
+        :param handle: Delivery handle, created when not given
+        :type handle: DeliveryHandle
+        :param kind: Message kind, e.g. "trail"
+        :type kind: str
+        :param correlation_data: Correlation data property (MQTT v5 only)
+        :type correlation_data: bytes
+        :return asyncio.Future|bool
+        """
+        if self._loop is None:
+            self.logger.warning("Could not send message in disconnected state")
+
+            if handle is not None:
+                handle._set_rc(paho.MQTT_ERR_NO_CONN)
+                handle._complete(False)
+
+            return False
+
+        if not self._in_loop_thread():
+            # e.g. trail batcher flushing from its own thread
+            self._loop.call_soon_threadsafe(functools.partial(self._publish_message, topic, data, qos, handle, kind, correlation_data))
+            return True
+
+        if handle is None:
+            handle = DeliveryHandle()
+
+        future = self._loop.create_future()
+        self._pending_publishes.add(future)
+        future.add_done_callback(self._pending_publishes.discard)
+
+        # Handles of messages queued in the outbox may be completed by the outbox thread
+        handle.add_done_callback(functools.partial(self._call_in_loop, _resolve, future))
+
+        AgentClient._publish_message(self, topic, data, qos, handle, kind, correlation_data)
+
+        return future
+
+    def enable_rate_limiting(self, rates=None, burst=None, overflow=RateLimiter.DROP, max_inflight=None, max_wait=10):
+        """
+        Limit the rate of sent messages per message kind. Blocking the event loop
+        isn't allowed, so overflow should be either RateLimiter.DROP or RateLimiter.COALESCE.
+        When coalescing, messages other than trails and facts sent from the event loop are
+        queued and sent in order when the limit allows it
+
+        :param rates: Maximum number of messages per second per message kind
+            (trail, facts, event, method_response, action_completed), e.g. {'trail': 100}
+        :type rates: dict
+        :param burst: Number of messages which may be sent at once, per kind (dict) or for all kinds
+        :type burst: int|dict
+        :param overflow: RateLimiter.DROP or RateLimiter.COALESCE
+        :type overflow: str
+        :param max_inflight: Number of messages waiting for acknowledgement above which sending is held back
+        :type max_inflight: int
+        :param max_wait: Not used
+        :return void
+        """
+        if overflow == RateLimiter.BLOCK:
+            raise ValueError('AsyncAgentClient can\'t block the event loop, use drop or coalesce overflow')
+
+        AgentClient.enable_rate_limiting(self, rates, burst, overflow, max_inflight, max_wait)
+
+    def _in_network_thread(self):
+        return self._in_loop_thread()
+
+    def _wait_for_connection(self, timeout=10):
+        # Send methods don't block the event loop, messages are dropped when disconnected
+        pass
+
+    async def flush(self, timeout=None):
+        """
+        Send buffered trails and wait until all sent messages are acknowledged
+
+        :param timeout: Maximum time (in seconds) to wait. Waits forever by default
+        :type timeout: float
+        :return bool False on timeout
+        """
+        if self._trail_batcher is not None:
+            self._trail_batcher.flush()
+
+        pending = list(self._pending_publishes)
+
+        if not pending:
+            return True
+
+        _, not_done = await asyncio.wait(pending, timeout=timeout)
+
+        return len(not_done) == 0
+
+    def set_dispatcher(self, dispatcher):
+        raise TypeError('AsyncAgentClient executes handlers on the event loop')
+
+    def _call_handler(self, kind, func, name, payload, pattern=None):
+        label = self._handler_label(kind, name, pattern)
+        metrics = self._metrics
+        started_at = time.monotonic()
+
+        try:
+            result = func(name, payload)
+        except Exception:
+            if metrics is not None:
+                metrics.handler_executed(label, time.monotonic() - started_at, True)
+            raise
+
+        if asyncio.iscoroutine(result):
+            # Coroutine handlers are measured until they finish
+            task = self._loop.create_task(result)
+            self._handler_tasks.add(task)
+            task.add_done_callback(functools.partial(self._on_handler_done, label, started_at))
+        elif metrics is not None:
+            metrics.handler_executed(label, time.monotonic() - started_at, False)
+
+    def _on_handler_done(self, label, started_at, task):
+        self._handler_tasks.discard(task)
+
+        failed = not task.cancelled() and task.exception() is not None
+        metrics = self._metrics
+
+        if failed:
+            self.logger.error("Handler %s failed: %s", label, task.exception(), exc_info=task.exception())
+
+        if metrics is not None:
+            metrics.handler_executed(label, time.monotonic() - started_at, failed)
+
+    def _on_ready(self, error):
+        AgentClient._on_ready(self, error)
+
+        if self._connect_future is None or self._connect_future.done():
+            return
+
+        if error is not None:
+            self._connect_future.set_exception(error)
+        else:
+            self._connect_future.set_result(True)
+
+    def _on_disconnect(self, client, userdata, rc, properties=None):
+        AgentClient._on_disconnect(self, client, userdata, rc, properties)
+
+        if self._disconnect_future is not None and not self._disconnect_future.done():
+            self._disconnect_future.set_result(True)
+
+    def _on_socket_open(self, client, userdata, sock):
+        AgentClient._on_socket_open(self, client, userdata, sock)
+        self._call_in_loop(self._loop.add_reader, sock, self._on_readable)
+
+    def _on_socket_close(self, client, userdata, sock):
+        self._call_in_loop(self._loop.remove_reader, sock)
+
+    def _on_socket_register_write(self, client, userdata, sock):
+        self._call_in_loop(self._loop.add_writer, sock, self._on_writable)
+
+    def _on_socket_unregister_write(self, client, userdata, sock):
+        self._call_in_loop(self._loop.remove_writer, sock)
+
+    def _on_readable(self):
+        self.client.loop_read()
+
+    def _on_writable(self):
+        self.client.loop_write()
+
+    async def _connect_once(self, timeout):
+        self.logger.debug("Connecting to %s:%d with client_id %s", self.host, self.port, self.client_id)
+
+        self.connected.clear()
+        self._ready.clear()
+        self._connect_error = None
+        self._connect_future = self._loop.create_future()
+        self._connecting = True
+        self._reset_topic_aliases()
+
+        try:
+            await self._loop.run_in_executor(
+                None,
+                functools.partial(self.client.connect, self.host, port=self.port, keepalive=60, **self._connect_args)
+            )
+        except socket.error as e:
+            self._connecting = False
+            error = ConnectionException("Failed to connect to Veides: %s" % str(e))
+            self._connection_failed(error)
+            raise error
+
+        try:
+            await asyncio.wait_for(asyncio.shield(self._connect_future), timeout)
+        except asyncio.TimeoutError:
+            self._connecting = False
+            self.client.disconnect()
+            error = ConnectionException("Timeout occurred while connecting to Veides: %s" % self.host)
+            self._connection_failed(error)
+            raise error
+        except ConnectionException:
+            self.client.disconnect()
+            raise
+
+    async def _await_breaker(self):
+        wait = self._reconnect_policy.acquire()
+
+        if wait > 0:
+            self.logger.warning("Circuit breaker is open, not connecting for %.1f seconds", wait)
+
+        while wait > 0:
+            await asyncio.sleep(min(wait, 1))
+            wait = self._reconnect_policy.acquire()
+
+    async def _misc_loop(self):
+        while True:
+            await asyncio.sleep(1)
+
+            if self.client.socket() is not None:
+                self.client.loop_misc()
+                continue
+
+            if not self._should_reconnect:
+                continue
+
+            delay = self._schedule_reconnect()
+
+            if delay is None:
+                continue
+
+            await asyncio.sleep(delay)
+            await self._await_breaker()
+
+            if not self._should_reconnect:
+                continue
+
+            self._connecting = True
+            self._reset_topic_aliases()
+
+            try:
+                await self._loop.run_in_executor(None, self.client.reconnect)
+            except socket.error as e:
+                self._connecting = False
+                self.logger.warning("Failed to reconnect to Veides: %s", e)
+                self._connection_failed(e)
+
+
+def _resolve(future, handle):
+    if not future.done():
+        future.set_result(handle.delivered())
@@ -1,16 +1,45 @@
-import json
+import collections
 import socket
 import ssl
 import logging
 import threading
+import time
 import paho.mqtt.client as paho
 from paho.mqtt import __version__ as paho_version
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
 
 
+from veides.sdk.agent.codecs import Codec, default_codec
+from veides.sdk.agent.compression import Compressor, PayloadCompression, decompress, default_compressor, is_compressed
+from veides.sdk.agent.delivery import DeliveryHandle, DeliveryTracker
 from veides.sdk.agent.exceptions import ConnectionException
+from veides.sdk.agent.lanes import PriorityLanes
+from veides.sdk.agent.metrics import ClientMetrics, MetricsRegistry
+from veides.sdk.agent.outbox import Outbox
+from veides.sdk.agent.ratelimit import RateLimiter
+from veides.sdk.agent.reconnect import ReconnectPolicy
+from veides.sdk.agent.session import InflightStore
+from veides.sdk.agent.topics import TopicAliases
+
+CONNECTION_ERRORS = {
+    1: "Unacceptable protocol version",
+    2: "Identifier rejected",
+    3: "Server unavailable",
+    4: "Bad key or secret key",
+    5: "Agent not authorized",
+}
 
 
 class BaseClient(object):
+    # Maximum number of topics subscribed with a single SUBSCRIBE packet
+    SUBSCRIBE_BATCH_SIZE = 100
+    # MQTT v5 session of persistent_session client never expires, like MQTT 3.1.1 session
+    SESSION_EXPIRY_INTERVAL = 0xFFFFFFFF
+    # Maximum time (in seconds) publishing waits for another thread assigning topic aliases.
+    # Paho's callbacks may publish while Paho holds its locks, so they don't wait forever
+    ALIAS_LOCK_TIMEOUT = 0.01
+
     def __init__(
         self,
         client_id,
@@ -21,7 +50,18 @@ class BaseClient(object):
         log_level=logging.WARN,
         mqtt_log_level=logging.ERROR,
         logger=None,
-        mqtt_logger=None
+        mqtt_logger=None,
+        port=None,
+        use_tls=True,
+        ssl_context=None,
+        codec=None,
+        max_inflight_messages=None,
+        max_queued_messages=None,
+        reconnect_policy=None,
+        persistent_session=False,
+        session_path=None,
+        mqtt_v5=False,
+        message_expiry=None
     ):
         """
         Underlying client implementation featuring Veides communication over MQTT
@@ -37,15 +77,107 @@ class BaseClient(object):
         :param mqtt_log_level: MQTT lib log level
         :param logger: SDK custom logger
         :param mqtt_logger: MQTT lib custom logger
+        :param port: Port to connect to. Defaults to 8883 (TLS) or 1883 (plain TCP)
+        :type port: int
+        :param use_tls: Whether to use encrypted connection
+        :type use_tls: bool
+        :param ssl_context: Custom SSL context (e.g. shared between many clients). Built from capath by default
+        :type ssl_context: ssl.SSLContext
+        :param codec: Message payload codec. The fastest available JSON codec is used by default
+        :type codec: Codec
+        :param max_inflight_messages: Maximum number of QoS 1 messages waiting for acknowledgement (Paho's default is 20)
+        :type max_inflight_messages: int
+        :param max_queued_messages: Maximum number of messages queued by Paho when in-flight window is full. 0 means unlimited (default)
+        :type max_queued_messages: int
+        :param reconnect_policy: Delays and limits of connection attempts, may be shared by many clients.
+            Exponential backoff with full jitter between 1 and 120 seconds is used by default
+        :type reconnect_policy: ReconnectPolicy
+        :param persistent_session: Keep MQTT session (subscriptions and queued messages) on the broker
+            between connections (clean_session=False). Subscriptions are not renewed when the session is present
+        :type persistent_session: bool
+        :param session_path: File keeping sent QoS 1 and 2 messages until they are acknowledged,
+            so they are sent again after process restart
+        :type session_path: str
+        :param mqtt_v5: Use MQTT v5. Repeated topics are sent as topic aliases, message expiry
+            and correlation data of method responses are sent as message properties
+        :type mqtt_v5: bool
+        :param message_expiry: Time (in seconds) after which the broker drops undelivered messages,
+            per message kind, e.g. {'trail': 60}. Requires MQTT v5
+        :type message_expiry: dict
         """
         self.client_id = client_id
         self.key = key
         self.secret_key = secret_key
         self.host = host
 
+        if codec is None:
+            codec = default_codec()
+        elif not isinstance(codec, Codec):
+            raise TypeError('codec should be a Codec instance')
+
+        self.codec = codec
+
         self.connected = threading.Event()
 
+        # Set when connection is established and all subscriptions are acknowledged, or connecting failed
+        self._ready = threading.Event()
+        self._connect_error = None
+
+        if reconnect_policy is None:
+            reconnect_policy = ReconnectPolicy()
+        elif not isinstance(reconnect_policy, ReconnectPolicy):
+            raise TypeError('reconnect_policy should be a ReconnectPolicy instance')
+
+        self._reconnect_policy = reconnect_policy
+        self._reconnect_attempt = 0
+        self._connecting = False
+        self._should_reconnect = False
+        self._connection_listener = None
+        self._loop_thread = None
+        self._loop_stopping = threading.Event()
+
+        self._persistent_session = persistent_session
+        # Subscriptions acknowledged within current broker session
+        self._session_topics = {}
+        self._inflight_store = None
+
+        if session_path is not None:
+            self._inflight_store = InflightStore(session_path)
+
+        if message_expiry is not None and not mqtt_v5:
+            raise ValueError('message_expiry requires MQTT v5')
+
+        for kind, expiry in (message_expiry or {}).items():
+            if not isinstance(expiry, int) or isinstance(expiry, bool) or expiry < 1:
+                raise ValueError('message expiry of %s should be a positive integer' % kind)
+
+        self._mqtt_v5 = mqtt_v5
+        self._message_expiry = dict(message_expiry or {})
+        self._connect_args = {}
+        self._topic_aliases = None
+        self._publish_lock = threading.Lock()
+        self._publish_properties_cache = {}
+
         self._subscribed_topics = {}
+        self._pending_subscriptions = {}
+        self._subscriptions_lock = threading.Lock()
+        self._deliveries = DeliveryTracker()
+
+        self._outbox = None
+        self._outbox_drain_rate = None
+        self._outbox_condition = threading.Condition()
+        self._outbox_thread = None
+
+        self._rate_limiter = None
+        self._lanes = None
+        self._lane_window = None
+        # Thread running a message callback of this client and messages it couldn't hand over to Paho
+        self._message_callback_thread = None
+        self._deferred = collections.deque()
+        self._compression = None
+        self._metrics = None
+        # (name, callable) of gauges registered by this client
+        self._gauges = []
 
         if logger is None:
             self.logger = self._build_logger(self.__module__ + "." + self.__class__.__name__, log_level)
@@ -57,50 +189,340 @@ class BaseClient(object):
         else:
             self.mqtt_logger = mqtt_logger
 
-        self.client = paho.Client(self.client_id, transport="tcp", clean_session=True)
+        if mqtt_v5:
+            connect_properties = None
+
+            if persistent_session:
+                # MQTT v5 session ends with the connection unless its expiry interval is given
+                connect_properties = Properties(PacketTypes.CONNECT)
+                connect_properties.SessionExpiryInterval = self.SESSION_EXPIRY_INTERVAL
+
+            # Topic aliases are enabled when the broker announces its Topic Alias Maximum
+            self._topic_aliases = TopicAliases()
+            self._connect_args = {'clean_start': not persistent_session, 'properties': connect_properties}
+            self.client = paho.Client(self.client_id, transport="tcp", protocol=paho.MQTTv5)
+        else:
+            self.client = paho.Client(self.client_id, transport="tcp", clean_session=not persistent_session)
 
         self.client.username_pw_set(self.key, self.secret_key)
 
-        try:
-            self.client.tls_set_context(ssl.create_default_context(capath=capath))
-            self.port = 8883
-        except Exception as e:
-            self.port = 1883
-            self.logger.warning("Unable to use SSL/TLS: %s" % str(e))
+        if max_inflight_messages is not None:
+            if not isinstance(max_inflight_messages, int) or max_inflight_messages < 1:
+                raise ValueError('max_inflight_messages should be a positive integer')
+
+            self.client.max_inflight_messages_set(max_inflight_messages)
+
+        self._max_inflight_messages = max_inflight_messages or 20
+
+        if max_queued_messages is not None:
+            if not isinstance(max_queued_messages, int) or max_queued_messages < 0:
+                raise ValueError('max_queued_messages should be a non-negative integer')
+
+            self.client.max_queued_messages_set(max_queued_messages)
+
+        self.port = 1883
+
+        if use_tls:
+            try:
+                if ssl_context is None:
+                    ssl_context = ssl.create_default_context(capath=capath)
 
-        self.client.on_log = self._on_log
+                self.client.tls_set_context(ssl_context)
+                self.port = 8883
+            except Exception as e:
+                self.logger.warning("Unable to use SSL/TLS: %s", e)
+
+        if port is not None:
+            self.port = port
+
+        self._attach_mqtt_logger()
         self.client.on_connect = self._on_connect
         self.client.on_disconnect = self._on_disconnect
+        self.client.on_publish = self._on_publish
+        self.client.on_subscribe = self._on_subscribe
+        self.client.on_socket_open = self._on_socket_open
 
     def connect(self):
         """
+        Connect to Veides. Failed attempts are retried as configured by the reconnect policy
+        (see ReconnectPolicy.connect_attempts). Once connected, the client reconnects on its own
+
         :raises ConnectionException: If there's any connection problem
         """
-        self.logger.debug("Connecting to %s:%d with client_id %s" % (self.host, self.port, self.client_id))
-        
-        try:
-            self.connected.clear()
-            self.client.connect(self.host, port=self.port, keepalive=60)
-            self.client.loop_start()
+        self._reconnect_attempt = 0
 
-            if not self.connected.wait(timeout=30):
-                self.client.loop_stop()
-                raise ConnectionException("Timeout occurred while connecting to Veides: %s" % self.host)
+        while True:
+            self._wait_for_breaker(time.sleep)
 
-        except socket.error as e:
-            self.client.loop_stop()
-            raise ConnectionException("Failed to connect to Veides: %s" % str(e))
+            try:
+                self._connect_once()
+            except ConnectionException:
+                delay = self._schedule_reconnect(initial=True)
+
+                if delay is None:
+                    raise
+
+                time.sleep(delay)
+                continue
+
+            self._should_reconnect = True
+            return
+
+    def on_connection_event(self, func):
+        """
+        Register a callback called on every connection attempt outcome with event name, attempt
+        number and details. Events are: "scheduled" (details: delay in seconds before the attempt),
+        "failed" (details: ConnectionException or socket error), "connected" and "gave_up"
+
+        :param func: Callback for connection events
+        :type func: callable
+        :return void
+        """
+        if func is not None and not callable(func):
+            raise TypeError('callback should be callable')
+
+        self._connection_listener = func
 
     def disconnect(self):
         self.logger.info("Closing connection to Veides")
+        self._should_reconnect = False
         self.client.disconnect()
-        self.client.loop_stop()
+        self._stop_loop()
         self.logger.info("Closed connection to Veides")
 
     def is_connected(self):
         return self.connected.isSet()
 
-    def _build_logger(self, name, log_level):
+    def flush(self, timeout=None):
+        """
+        Block until all sent messages are delivered, including messages queued in the outbox
+        and priority lanes
+
+        :param timeout: Maximum time (in seconds) to wait. Waits forever by default
+        :type timeout: float
+        :return bool False on timeout
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        while self._outbox is not None and len(self._outbox) > 0:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+
+            time.sleep(0.01)
+
+        lanes = self._lanes
+
+        if lanes is not None and not lanes.wait(None if deadline is None else max(deadline - time.monotonic(), 0)):
+            return False
+
+        return self._deliveries.wait(None if deadline is None else max(deadline - time.monotonic(), 0))
+
+    def set_mqtt_log_level(self, level):
+        """
+        Change MQTT lib logging level. Paho's log messages are formatted only when their level is enabled
+
+        :param level: Logging level, e.g. logging.DEBUG
+        :type level: int
+        :return void
+        """
+        self.mqtt_logger.setLevel(level)
+        self._attach_mqtt_logger()
+
+    def _attach_mqtt_logger(self):
+        """
+        Hands MQTT logger over to Paho, which passes format arguments to it, so disabled
+        messages are never formatted. Paho's on_log callback is not used, as Paho formats
+        every message (e.g. per published message) before calling it. When even errors
+        are disabled the logger isn't attached at all
+
+        :return void
+        """
+        if self.mqtt_logger.isEnabledFor(logging.ERROR):
+            self.client.enable_logger(self.mqtt_logger)
+        else:
+            self.client.disable_logger()
+
+    def _start_loop(self):
+        """
+        Starts processing network traffic in a network thread. Paho's loop_start() isn't
+        used, as its reconnect delays can't be jittered or limited
+
+        :return void
+        """
+        if self._loop_thread is not None and self._loop_thread.is_alive():
+            return
+
+        self._loop_stopping.clear()
+        self._loop_thread = threading.Thread(target=self._run_loop, name='veides-network', daemon=True)
+        self._loop_thread.start()
+
+    def _stop_loop(self):
+        """
+        Stops processing network traffic
+
+        :return void
+        """
+        self._loop_stopping.set()
+        thread = self._loop_thread
+
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+            self._loop_thread = None
+
+    def _run_loop(self):
+        stop_deadline = None
+
+        while True:
+            if self._loop_stopping.is_set():
+                # Give Paho a moment to write out DISCONNECT packet
+                if stop_deadline is None:
+                    stop_deadline = time.monotonic() + 1
+
+                if self.client.socket() is None or time.monotonic() > stop_deadline:
+                    return
+
+            if self.client.socket() is not None:
+                self.client.loop(timeout=0.1 if stop_deadline is not None else 1.0)
+                self._send_deferred()
+                continue
+
+            if not self._should_reconnect or self._loop_stopping.is_set():
+                return
+
+            delay = self._schedule_reconnect()
+
+            if delay is None or self._loop_stopping.wait(delay):
+                continue
+
+            if not self._wait_for_breaker(self._loop_stopping.wait):
+                continue
+
+            self._connecting = True
+            self._reset_topic_aliases()
+
+            try:
+                self.client.reconnect()
+            except socket.error as e:
+                self._connecting = False
+                self.logger.warning("Failed to reconnect to Veides: %s", e)
+                self._connection_failed(e)
+
+    def _wait_for_breaker(self, sleep):
+        """
+        Block until the circuit breaker of the reconnect policy lets a connection attempt through
+
+        :param sleep: Sleeping function, returning True when waiting should be interrupted
+        :type sleep: callable
+        :return bool False when waiting was interrupted
+        """
+        wait = self._reconnect_policy.acquire()
+
+        if wait > 0:
+            self.logger.warning("Circuit breaker is open, not connecting for %.1f seconds", wait)
+
+        while wait > 0:
+            if sleep(min(wait, 1)):
+                return False
+
+            wait = self._reconnect_policy.acquire()
+
+        return True
+
+    def _schedule_reconnect(self, initial=False):
+        """
+        :param initial: Whether it's a retry of connect()
+        :type initial: bool
+        :return float|None Delay (in seconds) before the next attempt, None when the client gives up
+        """
+        attempt = self._reconnect_attempt + 1
+
+        if initial:
+            delay = self._reconnect_policy.connect_delay(attempt)
+        else:
+            delay = self._reconnect_policy.reconnect_delay(attempt)
+
+        if delay is None:
+            if not initial:
+                self.logger.error("Giving up reconnecting to Veides after %d attempts", self._reconnect_attempt)
+
+            self._should_reconnect = False
+            self._connection_event('gave_up', attempt)
+            return None
+
+        self._reconnect_attempt = attempt
+        self.logger.info("Reconnecting to Veides in %.2f seconds (attempt %d)", delay, attempt)
+
+        if self._metrics is not None:
+            self._metrics.reconnect_scheduled(delay)
+
+        self._connection_event('scheduled', attempt, delay)
+
+        return delay
+
+    def _connection_succeeded(self):
+        self._reconnect_policy.record_success()
+
+        if self._metrics is not None:
+            self._metrics.connect_attempt(True)
+
+        self._connection_event('connected', self._reconnect_attempt)
+        self._reconnect_attempt = 0
+
+    def _connection_failed(self, error):
+        self._reconnect_policy.record_failure()
+
+        if self._metrics is not None:
+            self._metrics.connect_attempt(False)
+
+        self._connection_event('failed', self._reconnect_attempt, error)
+
+    def _connection_event(self, event, attempt, details=None):
+        listener = self._connection_listener
+
+        if listener is None:
+            return
+
+        try:
+            listener(event, attempt, details)
+        except Exception:
+            self.logger.exception("Connection event callback failed")
+
+    def _connect_once(self):
+        """
+        :raises ConnectionException: If there's any connection problem
+        """
+        self.logger.debug("Connecting to %s:%d with client_id %s", self.host, self.port, self.client_id)
+
+        try:
+            self.connected.clear()
+            self._ready.clear()
+            self._connect_error = None
+            self._connecting = True
+            self._reset_topic_aliases()
+            self.client.connect(self.host, port=self.port, keepalive=60, **self._connect_args)
+            self._start_loop()
+
+            if not self._ready.wait(timeout=30):
+                self._connecting = False
+                self._stop_loop()
+                error = ConnectionException("Timeout occurred while connecting to Veides: %s" % self.host)
+                self._connection_failed(error)
+                raise error
+
+            if self._connect_error is not None:
+                self.client.disconnect()
+                self._stop_loop()
+                raise self._connect_error
+
+        except socket.error as e:
+            self._connecting = False
+            self._stop_loop()
+            error = ConnectionException("Failed to connect to Veides: %s" % str(e))
+            self._connection_failed(error)
+            raise error
+
+    @staticmethod
+    def _build_logger(name, log_level):
         logger = logging.getLogger(name)
         logger.handlers = []
         logger.setLevel(log_level)
@@ -114,94 +536,1186 @@ class BaseClient(object):
 
         return logger
 
-    def _publish(self, topic, data, qos=1):
+    def _publish(self, topic, data, qos=1, handle=None, kind=None, correlation_data=None):
+        """
+        :param topic: Topic to publish message to
+        :type topic: str
+        :param data
+        :type data: dict
+        :param qos
+        :type qos: int
+        :param handle: Delivery handle. When given, the call doesn't wait for connection
+        :type handle: DeliveryHandle
+        :param kind: Message kind used by rate limiting, e.g. "trail"
+        :type kind: str
+        :param correlation_data: Correlation data property (MQTT v5 only)
+        :type correlation_data: bytes
+        :return bool
+        """
+        limiter = self._rate_limiter
+
+        if limiter is not None:
+            decision = limiter.acquire(kind, topic, data, qos, correlation_data)
+
+            if decision != RateLimiter.SEND:
+                return self._throttled(decision, topic, handle)
+
+        return self._publish_message(topic, data, qos, handle, kind, correlation_data)
+
+    def _publish_message(self, topic, data, qos=1, handle=None, kind=None, correlation_data=None):
         """
+        Publishes the message bypassing rate limiting
+
         :param topic: Topic to publish message to
         :type topic: str
         :param data
         :type data: dict
         :param qos
         :type qos: int
+        :param handle: Delivery handle. When given, the call doesn't wait for connection
+        :type handle: DeliveryHandle
+        :param kind: Message kind, e.g. "trail"
+        :type kind: str
+        :param correlation_data: Correlation data property (MQTT v5 only)
+        :type correlation_data: bytes
         :return bool
         """
-        if not self.connected.wait(timeout=10):
+        outbox = self._outbox
+
+        if outbox is not None:
+            # Messages queued earlier go first, so outbox is used until it's drained.
+            # Only topic, payload and QoS are queued, message properties are not kept
+            if not self.connected.is_set() or len(outbox) > 0:
+                return self._enqueue(outbox, topic, data, qos, handle, kind)
+        elif not self.connected.is_set() and (handle is not None or not self.connected.wait(timeout=10)):
             self.logger.warning("Could not send message in disconnected state")
+
+            if handle is not None:
+                handle._set_rc(paho.MQTT_ERR_NO_CONN)
+                handle._complete(False)
+
             return False
 
-        self.logger.debug("Sending message to %s with data %s" % (topic, str(data)))
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug("Sending message to %s with data %s", topic, data)
 
-        payload = json.dumps(data)
+        payload = self._encode(data, kind)
+        lanes = self._lanes
 
-        result = self.client.publish(topic, payload, qos=qos, retain=False)
+        if lanes is not None:
+            return self._publish_to_lane(lanes, topic, payload, qos, handle, kind, correlation_data)
 
-        if result[0] == paho.MQTT_ERR_ACL_DENIED:
-            self.logger.warning("No permission to send message on %s" % topic)
-            return False
+        return self._hand_over(topic, payload, qos, handle, kind, correlation_data)
 
-        return result[0] == paho.MQTT_ERR_SUCCESS
+    def _hand_over(self, topic, payload, qos, handle=None, kind=None, correlation_data=None):
+        """
+        Hands encoded message over to Paho and tracks its delivery. Paho 1.5 runs message
+        callbacks holding its callback lock and takes its message lock when publishing, while
+        other threads publishing take them in reverse order. So a handler called in the network
+        thread doesn't wait for the message lock and leaves the message to the network loop
+        when another thread holds it
 
-    def _on_log(self, client, userdata, level, string):
+        :param topic: Topic to publish message to
+        :type topic: str
+        :param payload: Encoded payload
+        :type payload: bytes|str
+        :param qos
+        :type qos: int
+        :param handle: Delivery handle
+        :type handle: DeliveryHandle
+        :param kind: Message kind, e.g. "trail"
+        :type kind: str
+        :param correlation_data: Correlation data property (MQTT v5 only)
+        :type correlation_data: bytes
+        :return bool
         """
-        :param client: Paho client instance
-        :type client: paho.Client
-        :param userdata: User-defined data
-        :type: userdata: object
-        :param level: Severity level of message
-        :type level: int
-        :param string: The message
-        :type string: str
+        if self._message_callback_thread != threading.get_ident():
+            return self._published(self._send_payload(topic, payload, qos, kind, correlation_data), qos, handle, kind)
+
+        mutex = self.client._out_message_mutex
+
+        if not mutex.acquire(blocking=False):
+            self._deferred.append((topic, payload, qos, handle, kind, correlation_data))
+
+            if handle is not None:
+                handle._set_rc(paho.MQTT_ERR_SUCCESS)
+
+            return True
+
+        try:
+            return self._published(self._send_payload(topic, payload, qos, kind, correlation_data), qos, handle, kind)
+        finally:
+            mutex.release()
+
+    def _send_deferred(self):
+        """
+        Hands over messages left by message callbacks. Called by the network loop outside of Paho's callbacks
+
         :return void
         """
-        self.mqtt_logger.log(paho.LOGGING_LEVEL[level], string)
+        deferred = self._deferred
 
-    def _on_connect(self, client, userdata, flags, rc):
+        while deferred:
+            self._hand_over(*deferred.popleft())
+
+    def _published(self, result, qos, handle=None, kind=None):
         """
-        :param client: Paho client instance
-        :type client: paho.Client
-        :param userdata: User-defined data
-        :type userdata: object
-        :param flags: Response flags
-        :type flags: dict
-        :param rc: Connection response code
-        :type rc: int
-        :raises ConnectionException: If there's any connection problem
-        :return void
+        Tracks delivery of the message handed over to Paho
+
+        :param result: Result of publishing
+        :type result: paho.MQTTMessageInfo
+        :param qos
+        :type qos: int
+        :param handle: Delivery handle
+        :type handle: DeliveryHandle
+        :param kind: Message kind, e.g. "trail"
+        :type kind: str
+        :return bool
         """
-        if rc == 0:
-            self.connected.set()
-            self.logger.info("Connected successfully: %s" % self.client_id)
-
-            if len(self._subscribed_topics) > 0:
-                for subscription in self._subscribed_topics:
-                    (result, mid) = self.client.subscribe(subscription, qos=self._subscribed_topics[subscription])
-                    if result != paho.MQTT_ERR_SUCCESS:
-                        raise ConnectionException("Unable to subscribe to %s" % subscription)
-        elif rc == 1:
-            raise ConnectionException("Unacceptable protocol version")
-        elif rc == 2:
-            raise ConnectionException("Identifier rejected")
-        elif rc == 3:
-            raise ConnectionException("Server unavailable")
-        elif rc == 4:
-            raise ConnectionException("Bad key or secret key")
-        elif rc == 5:
-            raise ConnectionException("Agent not authorized")
-        else:
-            raise ConnectionException("Connection failed with unknown reason. (rc=%d)" % rc)
+        metrics = self._metrics
 
-    def _on_disconnect(self, client, userdata, rc):
+        if result[0] != paho.MQTT_ERR_SUCCESS:
+            if handle is not None:
+                handle._set_rc(result[0])
+                handle._complete(False)
+
+            if metrics is not None:
+                metrics.message_failed(kind)
+
+            return False
+
+        if handle is not None:
+            handle._set_rc(result[0], result[1])
+
+        self._deliveries.track(result[1], qos, handle)
+
+        if metrics is not None:
+            metrics.message_sent(kind)
+
+        return True
+
+    def _publish_to_lane(self, lanes, topic, payload, qos, handle=None, kind=None, correlation_data=None):
         """
-        :param client: Paho client instance
-        :type client: paho.Client
-        :param userdata: User-defined data
-        :type: userdata: object
-        :param rc: Disconnection state. Value different than `0` means that connection closed unexepected
-        :type rc: int
+        Hands the message over to Paho or queues it in its priority lane when Paho has enough messages to send
+
+        :param lanes: Priority lanes
+        :type lanes: PriorityLanes
+        :param topic: Topic to publish message to
+        :type topic: str
+        :param payload: Encoded payload
+        :type payload: bytes|str
+        :param qos
+        :type qos: int
+        :param handle: Delivery handle
+        :type handle: DeliveryHandle
+        :param kind: Message kind, e.g. "trail"
+        :type kind: str
+        :param correlation_data: Correlation data property (MQTT v5 only)
+        :type correlation_data: bytes
+        :return bool
+        """
+        message = (topic, payload, qos, handle, kind, correlation_data)
+        (decision, dropped) = lanes.put(kind, message)
+
+        if decision == PriorityLanes.SEND:
+            return self._hand_over(*message)
+
+        if dropped is not None:
+            self._lane_message_dropped(dropped)
+
+        if decision == PriorityLanes.DROPPED:
+            self._lane_message_dropped(message)
+            return False
+
+        if handle is not None:
+            handle._set_rc(paho.MQTT_ERR_SUCCESS)
+
+        lanes.drain()
+
+        return True
+
+    def _send_from_lane(self, lane, message, waited):
+        """
+        Hands over a message which waited in a priority lane to Paho
+
+        :param lane: Lane name
+        :type lane: str
+        :param message: Queued message
+        :type message: tuple
+        :param waited: Time (in seconds) the message waited in the lane
+        :type waited: float
         :return void
         """
-        self.connected.clear()
+        metrics = self._metrics
 
-        if rc != 0:
-            self.logger.error("Unexpected disconnection from Veides: %d" % rc)
-        else:
-            self.logger.info("Disconnected from Veides")
+        if metrics is not None:
+            metrics.lane_waited(lane, waited)
+
+        self._hand_over(*message)
+
+    def _lane_message_dropped(self, message):
+        (topic, _, _, handle, kind, _) = message
+
+        self.logger.warning("Priority lane is full, message to %s dropped", topic)
+
+        if handle is not None:
+            handle._set_rc(paho.MQTT_ERR_QUEUE_SIZE)
+            handle._complete(False)
+
+        if self._metrics is not None:
+            self._metrics.message_failed(kind)
+
+    def _can_send_to_paho(self):
+        """
+        :return bool True when connected and fewer than lane window messages wait for delivery
+        """
+        return self.connected.is_set() and len(self._deliveries) < self._lane_window
+
+    def _publish_nowait(self, topic, data, qos=1, kind=None, correlation_data=None):
+        """
+        Publishes the message without waiting for connection
+
+        :param topic: Topic to publish message to
+        :type topic: str
+        :param data
+        :type data: dict
+        :param qos
+        :type qos: int
+        :param kind: Message kind used by rate limiting, e.g. "trail"
+        :type kind: str
+        :param correlation_data: Correlation data property (MQTT v5 only)
+        :type correlation_data: bytes
+        :return DeliveryHandle
+        """
+        handle = DeliveryHandle()
+
+        self._publish(topic, data, qos, handle, kind, correlation_data)
+
+        return handle
+
+    def _throttled(self, decision, topic, handle):
+        """
+        :param decision: Rate limiter decision: RateLimiter.DROPPED, RateLimiter.COALESCED or RateLimiter.QUEUED
+        :type decision: str
+        :param topic: Message topic
+        :type topic: str
+        :param handle: Delivery handle
+        :type handle: DeliveryHandle
+        :return bool True when the message was coalesced or queued
+        """
+        kept = decision != RateLimiter.DROPPED
+
+        if not kept:
+            self.logger.warning("Rate limit exceeded, message to %s dropped", topic)
+
+        if handle is not None:
+            # Coalesced message may be replaced by a newer one and queued one is sent by
+            # the rate limiter thread, so they're not tracked
+            handle._set_rc(paho.MQTT_ERR_SUCCESS if kept else paho.MQTT_ERR_QUEUE_SIZE)
+            handle._complete(False)
+
+        return kept
+
+    def _send(self, topic, data, qos, kind=None, correlation_data=None):
+        """
+        Encodes the message and hands it over to Paho without checking connection state
+
+        :param topic: Topic to publish message to
+        :type topic: str
+        :param data
+        :type data: dict
+        :param qos
+        :type qos: int
+        :param kind: Message kind, e.g. "trail"
+        :type kind: str
+        :param correlation_data: Correlation data property (MQTT v5 only)
+        :type correlation_data: bytes
+        :return paho.MQTTMessageInfo
+        """
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug("Sending message to %s with data %s", topic, data)
+
+        return self._send_payload(topic, self._encode(data, kind), qos, kind, correlation_data)
+
+    def _send_payload(self, topic, payload, qos, kind=None, correlation_data=None):
+        """
+        Hands encoded message over to Paho without checking connection state
+
+        :param topic: Topic to publish message to
+        :type topic: str
+        :param payload: Encoded payload
+        :type payload: bytes|str
+        :param qos
+        :type qos: int
+        :param kind: Message kind, e.g. "trail"
+        :type kind: str
+        :param correlation_data: Correlation data property (MQTT v5 only)
+        :type correlation_data: bytes
+        :return paho.MQTTMessageInfo
+        """
+        result = self._publish_payload(topic, payload, qos, kind, correlation_data)
+
+        if result[0] == paho.MQTT_ERR_ACL_DENIED:
+            self.logger.warning("No permission to send message on %s", topic)
+        elif result[0] == paho.MQTT_ERR_SUCCESS:
+            if self._metrics is not None:
+                self._metrics.bytes_sent(len(topic) + len(payload))
+
+            if qos > 0 and self._inflight_store is not None:
+                self._inflight_store.add(result[1], topic, payload, qos)
+
+        return result
+
+    def _encode(self, data, kind):
+        """
+        :param data
+        :type data: dict
+        :param kind: Message kind, e.g. "trail"
+        :type kind: str
+        :return bytes|str Encoded payload, compressed when compression is enabled for the kind
+        """
+        payload = self.codec.encode(data)
+        compression = self._compression
+
+        if compression is not None:
+            payload = compression.compress(payload, kind)
+
+        return payload
+
+    def _decode(self, topic, payload):
+        """
+        Decompresses received payload when it's compressed
+
+        :param topic: Topic of received message
+        :type topic: str
+        :param payload: Received payload
+        :type payload: bytes
+        :return bytes|None Payload or None when it couldn't be decompressed
+        """
+        if not is_compressed(payload):
+            return payload
+
+        compression = self._compression
+
+        try:
+            return decompress(payload, compression.compressor if compression is not None else None)
+        except ValueError as e:
+            self.logger.warning("Dropping message on %s: %s", topic, e)
+            return None
+
+    def _publish_payload(self, topic, payload, qos, kind=None, correlation_data=None):
+        """
+        Hands encoded message over to Paho. Under MQTT v5 the topic is replaced with
+        its alias and message properties are added
+
+        :param topic: Topic to publish message to
+        :type topic: str
+        :param payload: Encoded payload
+        :type payload: bytes|str
+        :param qos
+        :type qos: int
+        :param kind: Message kind, e.g. "trail"
+        :type kind: str
+        :param correlation_data: Correlation data property
+        :type correlation_data: bytes
+        :return paho.MQTTMessageInfo
+        """
+        if self._topic_aliases is None:
+            return self.client.publish(topic, payload, qos=qos, retain=False)
+
+        expiry = self._message_expiry.get(kind)
+
+        if not self._publish_lock.acquire(timeout=self.ALIAS_LOCK_TIMEOUT):
+            properties = self._publish_properties(expiry, None, correlation_data)
+
+            return self.client.publish(topic, payload, qos=qos, retain=False, properties=properties)
+
+        try:
+            # Aliases are assigned and sent in the same order
+            aliases = self._topic_aliases
+            (wire_topic, alias) = aliases.resolve(topic, qos)
+            properties = self._publish_properties(expiry, alias, correlation_data)
+
+            result = self.client.publish(wire_topic, payload, qos=qos, retain=False, properties=properties)
+
+            if alias is not None and wire_topic and result[0] == paho.MQTT_ERR_SUCCESS:
+                aliases.sent(result[1], qos, alias)
+
+            return result
+        finally:
+            self._publish_lock.release()
+
+    def _publish_properties(self, expiry, alias, correlation_data):
+        """
+        :param expiry: Message expiry interval (in seconds)
+        :type expiry: int
+        :param alias: Topic alias
+        :type alias: int
+        :param correlation_data: Correlation data
+        :type correlation_data: bytes
+        :return Properties|None
+        """
+        if expiry is None and alias is None and correlation_data is None:
+            return None
+
+        key = (expiry, alias)
+
+        if correlation_data is None:
+            # Paho doesn't modify properties, so they're shared by messages
+            properties = self._publish_properties_cache.get(key)
+
+            if properties is not None:
+                return properties
+
+        properties = Properties(PacketTypes.PUBLISH)
+
+        if expiry is not None:
+            properties.MessageExpiryInterval = expiry
+
+        if alias is not None:
+            properties.TopicAlias = alias
+
+        if correlation_data is None:
+            self._publish_properties_cache[key] = properties
+        else:
+            properties.CorrelationData = correlation_data
+
+        return properties
+
+    def _reset_topic_aliases(self):
+        """
+        Topic aliases are valid within a single connection, so they're dropped before every
+        connection attempt. Messages waiting in Paho to be sent again get their topics back
+
+        :return void
+        """
+        if self._topic_aliases is None:
+            return
+
+        with self._publish_lock:
+            aliases = self._topic_aliases
+            self._topic_aliases = TopicAliases()
+
+            if len(aliases) == 0:
+                return
+
+            with self.client._out_message_mutex:
+                for message in self.client._out_messages.values():
+                    properties = message.properties
+                    alias = getattr(properties, 'TopicAlias', None)
+
+                    if alias is None:
+                        continue
+
+                    if not message.topic:
+                        message.topic = aliases.topic(alias).encode('utf-8')
+
+                    message.properties = self._publish_properties(
+                        getattr(properties, 'MessageExpiryInterval', None),
+                        None,
+                        getattr(properties, 'CorrelationData', None)
+                    )
+
+    def enable_outbox(self, path=None, max_messages=10000, overflow=Outbox.DROP_OLDEST, drain_rate=None, fsync=False):
+        """
+        Queue messages sent in disconnected state instead of waiting for connection.
+        Queued messages are sent after (re)connecting. When path is given, queued
+        messages are also stored in a file and sent after process restart
+
+        :param path: Path to outbox file. Messages are kept in memory only by default
+        :type path: str
+        :param max_messages: Maximum number of queued messages
+        :type max_messages: int
+        :param overflow: What to drop when the outbox is full, Outbox.DROP_OLDEST or Outbox.DROP_NEWEST
+        :type overflow: str
+        :param drain_rate: Maximum number of queued messages sent per second after reconnecting. Unlimited by default
+        :type drain_rate: int|float
+        :param fsync: Flush outbox file to disk after every queued message
+        :type fsync: bool
+        :return void
+        """
+        if drain_rate is not None and (not isinstance(drain_rate, (int, float)) or drain_rate <= 0):
+            raise ValueError('drain_rate should be a positive number')
+
+        outbox = Outbox(path=path, max_messages=max_messages, overflow=overflow, fsync=fsync)
+
+        with self._outbox_condition:
+            if self._outbox is not None:
+                self._outbox.close()
+
+            self._outbox = outbox
+            self._outbox_drain_rate = drain_rate
+
+            if self._outbox_thread is None:
+                self._outbox_thread = threading.Thread(target=self._drain_outbox, name='veides-outbox', daemon=True)
+                self._outbox_thread.start()
+
+            self._outbox_condition.notify()
+
+    def disable_outbox(self):
+        """
+        Stop queueing messages. Messages still queued in the outbox file are kept
+        and sent when the outbox is enabled again
+
+        :return void
+        """
+        with self._outbox_condition:
+            if self._outbox is not None:
+                self._outbox.close()
+                self._outbox = None
+
+            self._outbox_condition.notify()
+
+    def get_outbox_stats(self):
+        """
+        Returns number of queued, sent, dropped and pending messages or None when outbox is disabled
+
+        :return dict|None
+        """
+        outbox = self._outbox
+
+        if outbox is None:
+            return None
+
+        return outbox.stats()
+
+    def enable_rate_limiting(
+            self,
+            rates=None,
+            burst=None,
+            overflow=RateLimiter.BLOCK,
+            max_inflight=None,
+            max_wait=10
+    ):
+        """
+        Limit the rate of sent messages per message kind and hold messages back while
+        too many of them wait for acknowledgement
+
+        :param rates: Maximum number of messages per second per message kind
+            (trail, facts, event, method_response, action_completed), e.g. {'trail': 100}
+        :type rates: dict
+        :param burst: Number of messages which may be sent at once, per kind (dict) or for all kinds.
+            Defaults to one second worth of messages
+        :type burst: int|dict
+        :param overflow: What to do with a message above the limit: RateLimiter.BLOCK the caller,
+            RateLimiter.DROP the message or RateLimiter.COALESCE it (only the latest value of every
+            trail and merged facts are sent when the limit allows it, other kinds block the caller).
+            Messages sent by handlers executed in the network thread are queued instead of blocking it
+        :type overflow: str
+        :param max_inflight: Number of messages waiting for acknowledgement above which sending is held back
+        :type max_inflight: int
+        :param max_wait: Maximum time (in seconds) a caller is blocked. The message is dropped afterwards
+        :type max_wait: float
+        :return void
+        """
+        limiter = RateLimiter(
+            self._publish_message,
+            rates or {},
+            burst=burst,
+            overflow=overflow,
+            max_inflight=max_inflight,
+            inflight=self._inflight_count,
+            max_wait=max_wait,
+            can_block=lambda: not self._in_network_thread(),
+        )
+
+        self.disable_rate_limiting()
+        self._rate_limiter = limiter
+
+    def disable_rate_limiting(self):
+        """
+        Stop limiting sent messages. Coalesced messages which weren't sent yet are dropped
+
+        :return void
+        """
+        limiter = self._rate_limiter
+        self._rate_limiter = None
+
+        if limiter is not None:
+            limiter.close()
+
+    def get_rate_limiting_stats(self):
+        """
+        Returns numbers of throttled, dropped and coalesced messages or None when rate limiting is disabled
+
+        :return dict|None
+        """
+        limiter = self._rate_limiter
+
+        if limiter is None:
+            return None
+
+        return limiter.stats()
+
+    def enable_priority_lanes(
+            self,
+            weights=None,
+            max_queued=None,
+            overflow=PriorityLanes.DROP_OLDEST,
+            window=None,
+            control_kinds=PriorityLanes.CONTROL_KINDS
+    ):
+        """
+        Keep at most window messages in Paho's queue and hold other messages back in a control
+        lane (method responses, action completions and events) and a telemetry lane (trails
+        and facts). Control messages don't wait behind telemetry backlog, as both lanes are
+        drained with weighted round robin whenever Paho sends a message
+
+        :param weights: Share of sent messages per lane when both lanes have messages waiting,
+            {'control': 8, 'telemetry': 1} by default
+        :type weights: dict
+        :param max_queued: Maximum number of messages waiting per lane, {'control': 1000, 'telemetry': 10000} by default
+        :type max_queued: dict
+        :param overflow: What to drop when a lane is full, PriorityLanes.DROP_OLDEST or PriorityLanes.DROP_NEWEST message
+        :type overflow: str
+        :param window: Number of sent messages waiting for delivery above which messages wait in lanes.
+            Defaults to max_inflight_messages
+        :type window: int
+        :param control_kinds: Message kinds sent through the control lane
+        :type control_kinds: tuple
+        :return void
+        """
+        if window is not None and (isinstance(window, bool) or not isinstance(window, int) or window < 1):
+            raise ValueError('window should be a positive integer')
+
+        lanes = PriorityLanes(
+            self._send_from_lane,
+            self._can_send_to_paho,
+            weights=weights,
+            max_queued=max_queued,
+            overflow=overflow,
+            control_kinds=control_kinds,
+        )
+
+        self.disable_priority_lanes()
+        self._lane_window = window or self._max_inflight_messages
+        self._lanes = lanes
+
+    def disable_priority_lanes(self):
+        """
+        Hand messages waiting in lanes over to Paho and send next messages in order of sending
+
+        :return void
+        """
+        lanes = self._lanes
+        self._lanes = None
+
+        if lanes is None:
+            return
+
+        for message in lanes.close():
+            self._hand_over(*message)
+
+    def get_priority_lanes_stats(self):
+        """
+        Returns numbers of queued, sent, dropped and pending messages per lane or None when lanes are disabled
+
+        :return dict|None
+        """
+        lanes = self._lanes
+
+        if lanes is None:
+            return None
+
+        return lanes.stats()
+
+    def enable_compression(self, compressor=None, threshold=1024, kinds=('facts', 'method_response')):
+        """
+        Compress payloads of given message kinds above the size threshold. Compressed payloads
+        start with a marker naming the compressor and the dictionary, so the receiving side
+        decompresses them transparently. Received compressed payloads are always decompressed
+
+        :param compressor: Compressor to use, e.g. ZlibCompressor(dictionary=train_dictionary(samples)).
+            Zstandard is used when zstandard package is installed, zlib otherwise
+        :type compressor: Compressor
+        :param threshold: Minimum size (in bytes) of compressed payload
+        :type threshold: int
+        :param kinds: Compressed message kinds (trail, facts, event, method_response, action_completed)
+        :type kinds: tuple
+        :return void
+        """
+        if compressor is None:
+            compressor = default_compressor()
+        elif not isinstance(compressor, Compressor):
+            raise TypeError('compressor should be a Compressor instance')
+
+        self._compression = PayloadCompression(compressor, threshold=threshold, kinds=kinds)
+
+    def disable_compression(self):
+        """
+        Stop compressing sent payloads. Received compressed payloads are still decompressed,
+        but those compressed with a dictionary can't be decompressed anymore
+
+        :return void
+        """
+        self._compression = None
+
+    def get_compression_stats(self):
+        """
+        Returns number of compressed payloads and their size before and after compression
+        or None when compression is disabled
+
+        :return dict|None
+        """
+        compression = self._compression
+
+        if compression is None:
+            return None
+
+        return compression.stats()
+
+    def enable_metrics(self, registry=None):
+        """
+        Collect metrics: sent and received messages, publish latency, handlers execution
+        time, connection attempts, reconnects and their delays, bytes sent and received and queue depths
+
+        :param registry: Registry to store metrics in, e.g. shared by many clients. New one is created by default
+        :type registry: MetricsRegistry
+        :return MetricsRegistry
+        """
+        if registry is None:
+            registry = MetricsRegistry()
+        elif not isinstance(registry, MetricsRegistry):
+            raise TypeError('registry should be a MetricsRegistry instance')
+
+        # Gauges registered before would be summed up with the new ones
+        self.disable_metrics()
+
+        self._add_gauge(registry, 'veides_inflight_messages', 'Messages waiting for acknowledgement', self._inflight_count)
+        self._add_gauge(
+            registry,
+            'veides_outbox_messages',
+            'Messages queued in the outbox',
+            lambda: len(self._outbox) if self._outbox is not None else 0
+        )
+        self._add_gauge(
+            registry,
+            'veides_rate_limiter_pending_messages',
+            'Coalesced messages waiting for rate limit',
+            lambda: self._rate_limiter.stats()['pending'] if self._rate_limiter is not None else 0
+        )
+
+        for lane in (PriorityLanes.CONTROL, PriorityLanes.TELEMETRY):
+            self._add_gauge(
+                registry,
+                'veides_%s_lane_messages' % lane,
+                'Messages waiting in %s priority lane' % lane,
+                lambda lane=lane: self._lanes.pending(lane) if self._lanes is not None else 0
+            )
+
+        self._metrics = ClientMetrics(registry)
+
+        return registry
+
+    def disable_metrics(self):
+        """
+        Stop collecting metrics and unregister gauges of this client
+
+        :return void
+        """
+        metrics = self._metrics
+        self._metrics = None
+
+        if metrics is None:
+            return
+
+        for name, func in self._gauges:
+            metrics.registry.remove_gauge(name, func)
+
+        self._gauges = []
+
+    def get_metrics(self):
+        """
+        Returns snapshot of collected metrics or None when metrics are disabled
+
+        :return dict|None
+        """
+        metrics = self._metrics
+
+        if metrics is None:
+            return None
+
+        return metrics.registry.snapshot()
+
+    def _add_gauge(self, registry, name, description, func):
+        """
+        Register a gauge unregistered by disable_metrics()
+
+        :param registry: Metrics registry
+        :type registry: MetricsRegistry
+        :param name: Metric name
+        :type name: str
+        :param description: Help text
+        :type description: str
+        :param func: Callable returning current value
+        :type func: callable
+        :return void
+        """
+        registry.gauge(name, description, func)
+        self._gauges.append((name, func))
+
+    def _inflight_count(self):
+        """
+        :return int Number of sent messages waiting for acknowledgement
+        """
+        return len(self._deliveries)
+
+    def _wait_for_connection(self, timeout=10):
+        """
+        Blocks until connected, unless messages sent in disconnected state are queued in the outbox
+
+        :param timeout: Maximum time (in seconds) to wait
+        :type timeout: float
+        :return void
+        """
+        if self._outbox is None and not self.connected.is_set():
+            self.connected.wait(timeout=timeout)
+
+    def _in_network_thread(self):
+        """
+        :return bool True when called by the thread processing network traffic, e.g. by a handler executed in it
+        """
+        return threading.current_thread() is self._loop_thread or self._message_callback_thread == threading.get_ident()
+
+    def _enqueue(self, outbox, topic, data, qos, handle=None, kind=None):
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug("Queueing message to %s with data %s", topic, data)
+
+        with self._outbox_condition:
+            queued = outbox.put(topic, self._encode(data, kind), qos, handle)
+            self._outbox_condition.notify()
+
+        if not queued:
+            self.logger.warning("Outbox is full, message to %s dropped", topic)
+
+        if handle is not None:
+            handle._set_rc(paho.MQTT_ERR_SUCCESS if queued else paho.MQTT_ERR_QUEUE_SIZE)
+
+            if not queued:
+                handle._complete(False)
+
+        return queued
+
+    def _drain_outbox(self):
+        next_send = time.monotonic()
+
+        while True:
+            with self._outbox_condition:
+                while self._outbox is None or len(self._outbox) == 0 or not self.connected.is_set():
+                    self._outbox_condition.wait(timeout=1)
+
+                outbox = self._outbox
+                drain_rate = self._outbox_drain_rate
+
+            if drain_rate is not None:
+                delay = next_send - time.monotonic()
+
+                if delay > 0:
+                    time.sleep(delay)
+
+                next_send = max(next_send, time.monotonic() - 1) + 1.0 / drain_rate
+
+            # Kept in the outbox until it's handed over, so it isn't dropped while being sent
+            message = outbox.sending()
+
+            if message is None:
+                continue
+
+            topic, payload, qos = message
+            result = self._publish_payload(topic, payload, qos)
+
+            if result[0] == paho.MQTT_ERR_SUCCESS:
+                handle = outbox.pop()
+                metrics = self._metrics
+
+                if metrics is not None:
+                    metrics.message_sent('outbox')
+                    metrics.bytes_sent(len(topic) + len(payload))
+
+                if handle is not None:
+                    handle._set_rc(result[0], result[1])
+
+                self._deliveries.track(result[1], qos, handle)
+
+                if qos > 0 and self._inflight_store is not None:
+                    self._inflight_store.add(result[1], topic, payload, qos)
+            elif result[0] == paho.MQTT_ERR_ACL_DENIED:
+                handle = outbox.pop()
+
+                if handle is not None:
+                    handle._set_rc(result[0])
+                    handle._complete(False)
+            else:
+                # Connection lost or Paho queue is full. Try again later
+                outbox.release()
+                time.sleep(0.1)
+
+    def _on_connect(self, client, userdata, flags, rc, properties=None):
+        """
+        :param client: Paho client instance
+        :type client: paho.Client
+        :param userdata: User-defined data
+        :type userdata: object
+        :param flags: Response flags
+        :type flags: dict
+        :param rc: Connection response code (reason code in MQTT v5)
+        :type rc: int|paho.mqtt.reasoncodes.ReasonCodes
+        :param properties: CONNACK properties (MQTT v5 only)
+        :type properties: Properties
+        :return void
+        """
+        if rc != 0:
+            # Raising here would stop the network thread, connect() raises the error instead
+            if self._mqtt_v5:
+                error = ConnectionException("Connection refused: %s (rc=%d)" % (rc, rc.value))
+            else:
+                error = ConnectionException(
+                    CONNECTION_ERRORS.get(rc, "Connection failed with unknown reason. (rc=%d)" % rc)
+                )
+
+            self.logger.error("%s", error)
+            self._on_ready(error)
+            return
+
+        if self._topic_aliases is not None:
+            # Set without the publish lock, which may be held by a thread waiting for Paho's callback lock
+            self._topic_aliases.maximum = getattr(properties, 'TopicAliasMaximum', 0)
+            self.logger.debug("Broker accepts %d topic aliases", self._topic_aliases.maximum)
+
+        self.connected.set()
+        self.logger.info("Connected successfully: %s", self.client_id)
+
+        if self._metrics is not None:
+            self._metrics.connected()
+
+        with self._outbox_condition:
+            self._outbox_condition.notify()
+
+        session_present = bool(flags and flags.get('session present'))
+
+        self._resubscribe(session_present)
+        self._resend_restored()
+
+        if self._lanes is not None:
+            # Messages held back while disconnected
+            self._lanes.drain()
+
+    def _resubscribe(self, session_present=False):
+        """
+        Subscribe to all topics with as few SUBSCRIBE packets as possible. The client
+        is ready when all of them are acknowledged (see _on_subscribe())
+
+        :param session_present: Whether the broker kept the session, including subscriptions
+            acknowledged before
+        :type session_present: bool
+        :return void
+        """
+        # Subscriptions may be added from other threads in the meantime
+        subscriptions = list(self._subscribed_topics.items())
+        error = None
+
+        if session_present:
+            subscriptions = [(topic, qos) for topic, qos in subscriptions if self._session_topics.get(topic) != qos]
+            self.logger.debug(
+                "Session present, %d subscriptions kept by the broker",
+                len(self._subscribed_topics) - len(subscriptions)
+            )
+        else:
+            self._session_topics = {}
+
+        with self._subscriptions_lock:
+            self._pending_subscriptions = {}
+
+            for start in range(0, len(subscriptions), self.SUBSCRIBE_BATCH_SIZE):
+                batch = subscriptions[start:start + self.SUBSCRIBE_BATCH_SIZE]
+                (result, mid) = self.client.subscribe(batch)
+
+                if result != paho.MQTT_ERR_SUCCESS:
+                    error = ConnectionException(
+                        "Unable to subscribe to %s (rc=%d)" % (', '.join(topic for topic, _ in batch), result)
+                    )
+                    self._pending_subscriptions = {}
+                    break
+
+                self._pending_subscriptions[mid] = batch
+
+            pending = len(self._pending_subscriptions)
+
+        if error is not None:
+            self.logger.error("%s", error)
+            self._on_ready(error)
+        elif pending == 0:
+            self._on_ready(None)
+        else:
+            self.logger.debug("Subscribing to %d topics with %d packets", len(subscriptions), pending)
+
+    def _resend_restored(self):
+        """
+        Send messages left unacknowledged by previous process (see session_path)
+
+        :return void
+        """
+        store = self._inflight_store
+
+        if store is None:
+            return
+
+        restored = store.restored()
+
+        if restored:
+            self.logger.info("Sending %d messages left unacknowledged by previous session", len(restored))
+
+        for key, topic, payload, qos in restored:
+            # Sent with full topics, as aliases can't be assigned in Paho's callback
+            result = self.client.publish(topic, payload, qos=qos, retain=False)
+
+            if result[0] != paho.MQTT_ERR_SUCCESS:
+                # Left in the store until next connection
+                break
+
+            self._deliveries.track(result[1], qos)
+            store.add(result[1], topic, payload, qos)
+            store.remove(key)
+
+    def _on_subscribe(self, client, userdata, mid, granted_qos, properties=None):
+        """
+        :param client: Paho client instance
+        :type client: paho.Client
+        :param userdata: User-defined data
+        :type userdata: object
+        :param mid: Subscribe message id
+        :type mid: int
+        :param granted_qos: QoS granted per subscribed topic, 128 when the subscription was rejected.
+            Reason codes in MQTT v5, 128 and above when rejected
+        :type granted_qos: tuple
+        :param properties: SUBACK properties (MQTT v5 only)
+        :type properties: Properties
+        :return void
+        """
+        with self._subscriptions_lock:
+            batch = self._pending_subscriptions.pop(mid, None)
+
+            if batch is None:
+                return
+
+            rejected = [topic for (topic, _), qos in zip(batch, granted_qos) if _rejected(qos)]
+
+            if rejected:
+                self._pending_subscriptions = {}
+
+            pending = len(self._pending_subscriptions)
+
+        if self._persistent_session:
+            for (topic, qos), granted in zip(batch, granted_qos):
+                if not _rejected(granted):
+                    self._session_topics[topic] = qos
+
+        if rejected:
+            error = ConnectionException("Subscription rejected: %s" % ', '.join(rejected))
+            self.logger.error("%s", error)
+            self._on_ready(error)
+        elif pending == 0:
+            self.logger.debug("All subscriptions acknowledged")
+            self._on_ready(None)
+
+    def _on_ready(self, error):
+        """
+        Called in the network thread when connecting (including subscribing) is finished
+
+        :param error: Connection or subscription error, None on success
+        :type error: ConnectionException
+        :return void
+        """
+        self._connecting = False
+        self._connect_error = error
+
+        if error is None:
+            self._connection_succeeded()
+        else:
+            self._connection_failed(error)
+
+        self._ready.set()
+
+    def _on_publish(self, client, userdata, mid):
+        """
+        :param client: Paho client instance
+        :type client: paho.Client
+        :param userdata: User-defined data
+        :type: userdata: object
+        :param mid: Id of delivered message
+        :type mid: int
+        :return void
+        """
+        delivery = self._deliveries.published(mid)
+        metrics = self._metrics
+
+        if self._inflight_store is not None:
+            self._inflight_store.remove(mid)
+
+        if self._topic_aliases is not None:
+            self._topic_aliases.published(mid)
+
+        if delivery is not None and metrics is not None:
+            metrics.message_delivered(*delivery)
+
+        lanes = self._lanes
+
+        if lanes is not None:
+            lanes.drain()
+
+    def _on_socket_open(self, client, userdata, sock):
+        """
+        Disables Nagle's algorithm. Otherwise a small message written right after
+        another one (e.g. method response after PUBACK of the call) waits up to 40 ms
+        for delayed ACK of the broker
+
+        :param client: Paho client instance
+        :type client: paho.Client
+        :param userdata: User-defined data
+        :type: userdata: object
+        :param sock: Connected socket
+        :type sock: socket.socket
+        :return void
+        """
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except (OSError, AttributeError):
+            pass
+
+    def _on_disconnect(self, client, userdata, rc, properties=None):
+        """
+        :param client: Paho client instance
+        :type client: paho.Client
+        :param userdata: User-defined data
+        :type: userdata: object
+        :param rc: Disconnection state. Value different than `0` means that connection closed unexepected
+        :type rc: int|paho.mqtt.reasoncodes.ReasonCodes
+        :param properties: DISCONNECT properties (MQTT v5 only)
+        :type properties: Properties
+        :return void
+        """
+        self.connected.clear()
+        self._ready.clear()
+
+        if self._connecting:
+            self._on_ready(ConnectionException("Connection closed before it was established (rc=%s)" % rc))
+
+        # QoS 0 messages which weren't written out are lost, QoS 1 messages are sent again after reconnecting
+        self._deliveries.fail(0)
+
+        if rc != 0:
+            self.logger.error("Unexpected disconnection from Veides: %s", rc)
+
+            if self._metrics is not None:
+                self._metrics.disconnected()
+        else:
+            self.logger.info("Disconnected from Veides")
+
+
+def _rejected(granted):
+    """
+    :param granted: Granted QoS or MQTT v5 reason code of a subscription
+    :type granted: int|paho.mqtt.reasoncodes.ReasonCodes
+    :return bool
+    """
+    return getattr(granted, 'value', granted) >= 0x80
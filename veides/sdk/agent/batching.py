@@ -0,0 +1,168 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class TrailBatcher(object):
+    def __init__(self, publish, max_size=100, max_latency=0.1):
+        """
+        Buffers trails in memory and flushes them when size or latency budget is hit.
+        Within a single window only the last value of every trail is kept. Veides
+        receives every trail on its own topic, so a flush publishes each buffered
+        trail separately. Batching reduces the number of messages, not their size
+
+        :param publish: Callable taking trail name and value. Should return True when trail was sent
+        :type publish: callable
+        :param max_size: Number of distinct trails buffered before the buffer is flushed
+        :type max_size: int
+        :param max_latency: Maximum time (in seconds) a trail may wait in the buffer
+        :type max_latency: float
+        """
+        if not callable(publish):
+            raise TypeError('publish should be callable')
+
+        if not isinstance(max_size, int) or max_size < 1:
+            raise ValueError('max_size should be a positive integer')
+
+        if not isinstance(max_latency, (int, float)) or max_latency <= 0:
+            raise ValueError('max_latency should be a positive number')
+
+        self._publish = publish
+        self._max_size = max_size
+        self._max_latency = max_latency
+
+        self._buffer = OrderedDict()
+        self._window_started = None
+        self._closed = False
+
+        self._lock = threading.Lock()
+        self._condition = threading.Condition(self._lock)
+        self._thread = None
+
+        self._flushed = 0
+        self._merged = 0
+        self._dropped = 0
+
+    def add(self, name, value):
+        """
+        Put a trail into the buffer. If the trail is already buffered its value is replaced.
+        When the buffer reaches its size budget it's flushed in the calling thread
+
+        :param name: Trail name
+        :type name: str
+        :param value: Trail value
+        :type value: str|int|float
+        :return bool
+        """
+        with self._condition:
+            if self._closed:
+                self._dropped += 1
+                return False
+
+            if name in self._buffer:
+                self._buffer[name] = value
+                self._merged += 1
+                return True
+
+            if len(self._buffer) == 0:
+                self._window_started = time.monotonic()
+
+            self._buffer[name] = value
+
+            if len(self._buffer) < self._max_size:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='veides-trail-batcher', daemon=True)
+                    self._thread.start()
+
+                self._condition.notify()
+
+                return True
+
+            batch = self._take()
+
+        self._send(batch)
+
+        return True
+
+    def flush(self):
+        """
+        Publish all buffered trails immediately
+
+        :return void
+        """
+        with self._condition:
+            batch = self._take()
+
+        self._send(batch)
+
+    def close(self):
+        """
+        Flush buffered trails and stop the background flusher
+
+        :return void
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+
+        self.flush()
+
+    def stats(self):
+        """
+        Returns batching counters: number of flushed, merged and dropped trails
+
+        :return dict
+        """
+        with self._lock:
+            return {
+                'flushed': self._flushed,
+                'merged': self._merged,
+                'dropped': self._dropped,
+                'buffered': len(self._buffer),
+            }
+
+    def _take(self):
+        batch = self._buffer
+        self._buffer = OrderedDict()
+        self._window_started = None
+
+        return batch
+
+    def _send(self, batch):
+        flushed = 0
+        dropped = 0
+
+        for name, value in batch.items():
+            if self._publish(name, value):
+                flushed += 1
+            else:
+                dropped += 1
+
+        with self._lock:
+            self._flushed += flushed
+            self._dropped += dropped
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._closed:
+                    if len(self._buffer) == 0:
+                        self._condition.wait()
+                        continue
+
+                    remaining = self._window_started + self._max_latency - time.monotonic()
+
+                    if remaining <= 0:
+                        break
+
+                    self._condition.wait(remaining)
+
+                if self._closed:
+                    return
+
+                batch = self._take()
+
+            self._send(batch)
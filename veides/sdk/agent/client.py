@@ -1,12 +1,29 @@
-import json
+import functools
 import logging
+import threading
+import time
 import paho.mqtt.client as paho
 
+from veides.sdk.agent.aggregation import TrailAggregator
 from veides.sdk.agent.base_client import BaseClient
+from veides.sdk.agent.batching import TrailBatcher
+from veides.sdk.agent.dedup import DedupCache, message_key
+from veides.sdk.agent.delivery import DeliveryHandle
+from veides.sdk.agent.dispatcher import HandlerDispatcher
+from veides.sdk.agent.methods import MethodCallTable
 from veides.sdk.agent.properties import AgentProperties, ConnectionProperties
+from veides.sdk.agent.qos import QosPolicy
+from veides.sdk.agent.topics import TopicCache, TopicTrie, validate_topic_filter
+from veides.sdk.agent.validation import ValidationMode, Validator, validate_name
 
 
 class AgentClient(BaseClient):
+    # Maximum number of not answered calls remembered per method
+    MAX_PENDING_METHOD_CALLS = 100
+    # Code and payload of responses sent when a method call deadline passes
+    METHOD_TIMEOUT_CODE = 504
+    METHOD_TIMEOUT_PAYLOAD = {'error': 'method call timed out'}
+
     def __init__(
             self,
             agent_properties,
@@ -14,10 +31,21 @@ class AgentClient(BaseClient):
             logger=None,
             mqtt_logger=None,
             log_level=logging.WARN,
-            mqtt_log_level=logging.ERROR
+            mqtt_log_level=logging.ERROR,
+            ssl_context=None,
+            codec=None,
+            validation=ValidationMode.STRICT,
+            qos_policy=None,
+            max_inflight_messages=None,
+            max_queued_messages=None,
+            reconnect_policy=None,
+            persistent_session=False,
+            session_path=None,
+            message_expiry=None,
+            method_timeout=None
     ):
         """
-        Extends BaseClient with Veides features
+        Extends BaseClient with Veides features. MQTT v5 is used when enabled in connection properties
 
         :param agent_properties: Properties related to agent
         :type agent_properties: AgentProperties
@@ -29,8 +57,35 @@ class AgentClient(BaseClient):
         :type mqtt_logger: logging.Logger
         :param log_level: SDK logging level
         :param mqtt_log_level: MQTT lib logging level
-        :param capath: Path to certificates directory
+        :param ssl_context: Custom SSL context (e.g. shared between many agents)
+        :type ssl_context: ssl.SSLContext
+        :param codec: Message payload codec. The fastest available JSON codec is used by default
+        :type codec: Codec
+        :param validation: Validation mode of sent messages, one of ValidationMode values
+        :type validation: str
+        :param qos_policy: QoS of sent messages per message type. QoS 1 is used by default
+        :type qos_policy: QosPolicy
+        :param max_inflight_messages: Maximum number of QoS 1 messages waiting for acknowledgement (Paho's default is 20)
+        :type max_inflight_messages: int
+        :param max_queued_messages: Maximum number of messages queued by Paho when in-flight window is full. 0 means unlimited (default)
+        :type max_queued_messages: int
+        :param reconnect_policy: Delays and limits of connection attempts, may be shared by many agents
+        :type reconnect_policy: ReconnectPolicy
+        :param persistent_session: Keep MQTT session on the broker between connections, so actions and
+            methods sent during short outages aren't lost. Subscriptions are not renewed when the session is present
+        :type persistent_session: bool
+        :param session_path: File keeping sent QoS 1 and 2 messages until they are acknowledged,
+            so they are sent again after process restart
+        :type session_path: str
+        :param message_expiry: Time (in seconds) after which the broker drops undelivered messages,
+            per message type, e.g. {'trail': 60} drops stale trails. Requires MQTT v5
+        :type message_expiry: dict
+        :param method_timeout: Time (in seconds) a method call waits for response. The call is answered
+            with 504 code afterwards and later responses to it are dropped. Calls don't expire by default
+        :type method_timeout: int|float
         """
+        _validate_method_timeout(method_timeout)
+
         BaseClient.__init__(
             self,
             client_id=agent_properties.client_id,
@@ -42,12 +97,51 @@ class AgentClient(BaseClient):
             mqtt_logger=mqtt_logger,
             log_level=log_level,
             mqtt_log_level=mqtt_log_level,
+            port=connection_properties.port,
+            use_tls=connection_properties.use_tls,
+            ssl_context=ssl_context,
+            codec=codec,
+            max_inflight_messages=max_inflight_messages,
+            max_queued_messages=max_queued_messages,
+            reconnect_policy=reconnect_policy,
+            persistent_session=persistent_session,
+            session_path=session_path,
+            mqtt_v5=connection_properties.mqtt_v5,
+            message_expiry=message_expiry,
         )
 
+        if qos_policy is None:
+            qos_policy = QosPolicy()
+        elif not isinstance(qos_policy, QosPolicy):
+            raise TypeError('qos_policy should be a QosPolicy instance')
+
         self._any_action_handler = None
         self._action_handlers = {}
         self._any_method_handler = None
         self._method_handlers = {}
+        self._trail_batcher = None
+        self._trail_aggregator = None
+        self._dispatcher = None
+        self._validator = Validator(validation)
+        self._qos = qos_policy
+        self._fact_cache = None
+        self._fact_cache_lock = threading.Lock()
+        self._resync_facts_on_connect = False
+        self._dedup = None
+        self._method_timeout = method_timeout
+        self._method_timeouts = {}
+        self._method_call_handlers = set()
+        self._method_calls = MethodCallTable(max_pending=self.MAX_PENDING_METHOD_CALLS)
+        self._method_deadlines_condition = threading.Condition()
+        self._method_deadlines_thread = None
+
+        self._action_completed_topic = 'agent/{}/action_completed'.format(agent_properties.client_id)
+        self._event_topic = 'agent/{}/event'.format(agent_properties.client_id)
+        self._facts_topic = 'agent/{}/facts'.format(agent_properties.client_id)
+        self._trail_topics = TopicCache('agent/{}/trail/'.format(agent_properties.client_id))
+        self._method_response_topics = TopicCache('agent/{}/method_response/'.format(agent_properties.client_id))
+        self._routes = TopicTrie()
+        self._routes_lock = threading.Lock()
 
         action_received_topic = 'agent/{}/action_received'.format(agent_properties.client_id)
         method_called_topic = 'agent/{}/method/+'.format(agent_properties.client_id)
@@ -56,6 +150,296 @@ class AgentClient(BaseClient):
         self.client.message_callback_add(method_called_topic, self._on_method)
         self._subscribed_topics[action_received_topic] = 1
         self._subscribed_topics[method_called_topic] = 1
+        self._reserved_topics = (action_received_topic, method_called_topic)
+
+        # Messages not matching topics above are routed with the topic trie
+        self.client.on_message = self._on_message
+
+    def disconnect(self):
+        if self._trail_aggregator is not None:
+            self._trail_aggregator.emit()
+
+        if self._trail_batcher is not None:
+            self._trail_batcher.flush()
+
+        BaseClient.disconnect(self)
+
+    def flush(self, timeout=None):
+        """
+        Send buffered trails and block until all sent messages are delivered
+
+        :param timeout: Maximum time (in seconds) to wait. Waits forever by default
+        :type timeout: float
+        :return bool False on timeout
+        """
+        if self._trail_batcher is not None:
+            self._trail_batcher.flush()
+
+        return BaseClient.flush(self, timeout)
+
+    def enable_trail_batching(self, max_size=100, max_latency=0.1):
+        """
+        Buffer trails in memory and send them in batches. Within a single batch only
+        the last value of every trail is sent, still as a separate message on the trail's
+        topic, as there's no topic for many trails. Buffered trails are flushed on disconnect()
+
+        :param max_size: Number of distinct trails buffered before sending them
+        :type max_size: int
+        :param max_latency: Maximum time (in seconds) a trail may wait before it's sent
+        :type max_latency: float
+        :return void
+        """
+        self.disable_trail_batching()
+
+        self._trail_batcher = TrailBatcher(self._publish_trail, max_size=max_size, max_latency=max_latency)
+
+    def disable_trail_batching(self):
+        """
+        Flush buffered trails and send next trails immediately
+
+        :return void
+        """
+        if self._trail_batcher is not None:
+            batcher = self._trail_batcher
+            self._trail_batcher = None
+            batcher.close()
+
+    def get_trail_batching_stats(self):
+        """
+        Returns number of flushed, merged and dropped trails or None when batching is disabled
+
+        :return dict|None
+        """
+        if self._trail_batcher is None:
+            return None
+
+        return self._trail_batcher.stats()
+
+    def enable_trail_aggregation(
+            self,
+            interval=1.0,
+            aggregates=('mean', 'min', 'max'),
+            capacity=4096,
+            trail_name='{name}_{aggregate}',
+            use_numpy=None
+    ):
+        """
+        Collect raw samples added with add_sample() and add_samples() in preallocated ring
+        buffers and send aggregates of every trail once per interval, e.g. speed_mean,
+        speed_min and speed_max trails. Samples collected so far are sent on disconnect()
+
+        :param interval: Window length (in seconds). Hosted agents send aggregates on the host's one second tick
+        :type interval: int|float
+        :param aggregates: Aggregates sent per trail: last, mean, min, max, count, sum
+            and percentiles of the last capacity samples, e.g. p50 or p99.9
+        :type aggregates: tuple
+        :param capacity: Number of samples kept per trail for percentiles
+        :type capacity: int
+        :param trail_name: Name of sent trails, formatted with trail name and aggregate, e.g. "{name}.{aggregate}"
+        :type trail_name: str
+        :param use_numpy: Aggregate samples with NumPy. Used when numpy is installed by default
+        :type use_numpy: bool
+        :return void
+        """
+        aggregator = TrailAggregator(
+            self._publish_aggregate,
+            interval=interval,
+            aggregates=aggregates,
+            capacity=capacity,
+            trail_name=trail_name,
+            use_numpy=use_numpy
+        )
+
+        self.disable_trail_aggregation()
+
+        self._trail_aggregator = aggregator
+        self._watch_trail_aggregation(aggregator)
+
+    def disable_trail_aggregation(self):
+        """
+        Send aggregates of samples collected so far and stop aggregating
+
+        :return void
+        """
+        if self._trail_aggregator is not None:
+            aggregator = self._trail_aggregator
+            self._trail_aggregator = None
+            aggregator.close()
+
+    def get_trail_aggregation_stats(self):
+        """
+        Returns number of aggregated trails, added samples, aggregated windows, and sent and failed
+        aggregate trails or None when aggregation is disabled
+
+        :return dict|None
+        """
+        aggregator = self._trail_aggregator
+
+        if aggregator is None:
+            return None
+
+        return aggregator.stats()
+
+    def add_sample(self, name, value):
+        """
+        Add a raw sample of a numeric trail, sent as aggregates at the end of the window
+
+        :param name: Trail name
+        :type name: str
+        :param value: Sample value
+        :type value: int|float
+        :raises RuntimeError: If trail aggregation is not enabled
+        :raises ValueError: If value is not a finite number
+        :return void
+        """
+        aggregator = self._trail_aggregator
+
+        if aggregator is None:
+            raise RuntimeError('trail aggregation is not enabled')
+
+        aggregator.add(name, value)
+
+    def add_samples(self, name, values):
+        """
+        Add many raw samples of a numeric trail at once, e.g. read from a sensor buffer.
+        Samples are copied and aggregated with a few vectorized operations
+
+        :param name: Trail name
+        :type name: str
+        :param values: Sample values, preferably array('d') or NumPy array
+        :type values: array.array|list|numpy.ndarray
+        :raises RuntimeError: If trail aggregation is not enabled
+        :raises ValueError: If any value is not a finite number
+        :return void
+        """
+        aggregator = self._trail_aggregator
+
+        if aggregator is None:
+            raise RuntimeError('trail aggregation is not enabled')
+
+        aggregator.add_many(name, values)
+
+    def enable_fact_cache(self, resync_on_reconnect=True):
+        """
+        Remember last delivered facts values and send only facts which values changed.
+        Facts dropped or held back on the way (e.g. by rate limiting) are sent again
+
+        :param resync_on_reconnect: Send all remembered facts after (re)connecting to Veides
+        :type resync_on_reconnect: bool
+        :return void
+        """
+        with self._fact_cache_lock:
+            if self._fact_cache is None:
+                self._fact_cache = {}
+
+            self._resync_facts_on_connect = resync_on_reconnect
+
+    def disable_fact_cache(self):
+        """
+        Forget sent facts values and send all given facts on every send_facts() call
+
+        :return void
+        """
+        with self._fact_cache_lock:
+            self._fact_cache = None
+            self._resync_facts_on_connect = False
+
+    def invalidate_fact_cache(self, names=None):
+        """
+        Forget last sent values of given facts, so they're sent with next send_facts() call
+
+        :param names: Fact names to forget. All facts are forgotten by default
+        :type names: list
+        :return void
+        """
+        with self._fact_cache_lock:
+            if self._fact_cache is None:
+                return
+
+            if names is None:
+                self._fact_cache.clear()
+                return
+
+            for name in names:
+                self._fact_cache.pop(name, None)
+
+    def enable_deduplication(self, ttl=60, max_size=10000):
+        """
+        Drop actions and method calls redelivered by the broker (e.g. after reconnecting
+        before they were acknowledged) before their handlers are called. Messages flagged
+        as redelivered (DUP) are matched with earlier messages by topic, packet id and
+        payload, messages not flagged are always handled, so repeated actions are too
+
+        :param ttl: Time (in seconds) a received message is remembered
+        :type ttl: int|float
+        :param max_size: Maximum number of remembered messages, the least recently received are forgotten first
+        :type max_size: int
+        :return void
+        """
+        self._dedup = DedupCache(ttl=ttl, max_size=max_size)
+
+    def disable_deduplication(self):
+        """
+        Forget received messages and handle every received action and method call
+
+        :return void
+        """
+        self._dedup = None
+
+    def get_deduplication_stats(self):
+        """
+        Returns number of remembered messages, dropped duplicates (hits), new messages (misses)
+        and forgotten messages or None when deduplication is disabled
+
+        :return dict|None
+        """
+        dedup = self._dedup
+
+        if dedup is None:
+            return None
+
+        return dedup.stats()
+
+    def enable_metrics(self, registry=None):
+        """
+        Collect metrics: sent and received messages, publish latency, handlers execution
+        time, reconnects, bytes sent and received and queue depths
+
+        :param registry: Registry to store metrics in, e.g. shared by many clients. New one is created by default
+        :type registry: MetricsRegistry
+        :return MetricsRegistry
+        """
+        registry = BaseClient.enable_metrics(self, registry)
+
+        self._add_gauge(
+            registry,
+            'veides_dispatcher_queue_depth',
+            'Handler calls waiting for execution',
+            lambda: self._dispatcher.queue_depth() if self._dispatcher is not None else 0
+        )
+        self._add_gauge(registry, 'veides_pending_method_calls', 'Method calls waiting for response', self._method_calls.__len__)
+        self._add_gauge(
+            registry,
+            'veides_dedup_cache_size',
+            'Received messages remembered for deduplication',
+            lambda: len(self._dedup) if self._dedup is not None else 0
+        )
+
+        return registry
+
+    def set_dispatcher(self, dispatcher):
+        """
+        Set a dispatcher executing action and method handlers. By default handlers are
+        executed directly in the network thread
+
+        :param dispatcher: Dispatcher or None to execute handlers directly
+        :type dispatcher: HandlerDispatcher
+        :return void
+        """
+        if dispatcher is not None and not isinstance(dispatcher, HandlerDispatcher):
+            raise TypeError('dispatcher should be a HandlerDispatcher instance')
+
+        self._dispatcher = dispatcher
 
     def on_any_action(self, func):
         """
@@ -92,13 +476,15 @@ class AgentClient(BaseClient):
 
         self._action_handlers[name] = func
 
-    def on_any_method(self, func):
+    def on_any_method(self, func, with_call=False):
         """
         Register a callback for any method. It will execute when there's no
         callback set for the particular method (see on_method())
 
         :param func: Callback for methods
         :type func: callable
+        :param with_call: Pass MethodCall instead of method payload to the callback
+        :type with_call: bool
         :return void
         """
         if not callable(func):
@@ -106,14 +492,26 @@ class AgentClient(BaseClient):
 
         self._any_method_handler = func
 
-    def on_method(self, name, func):
+        if with_call:
+            self._method_call_handlers.add(None)
+        else:
+            self._method_call_handlers.discard(None)
+
+    def on_method(self, name, func, timeout=None, with_call=False):
         """
-        Register a callback for the particular method
+        Register a callback for the particular method. The callback is called with method
+        name and payload. With with_call=True it's called with method name and MethodCall,
+        so concurrent calls of the method are answered with
+        send_method_response(name, payload, call_id=call.id)
 
         :param name: Expected method name
         :type name: str
         :param func: Callback for method
         :type func: callable
+        :param timeout: Time (in seconds) a call of the method waits for response, overriding method_timeout
+        :type timeout: int|float
+        :param with_call: Pass MethodCall instead of method payload to the callback
+        :type with_call: bool
         :return void
         """
         if not isinstance(name, str):
@@ -125,11 +523,99 @@ class AgentClient(BaseClient):
         if not callable(func):
             raise TypeError('callback should be callable')
 
+        _validate_method_timeout(timeout)
+
         self._method_handlers[name] = func
 
-    def send_method_response(self, name, payload, code=200):
+        if timeout is not None:
+            self._method_timeouts[name] = timeout
+        else:
+            self._method_timeouts.pop(name, None)
+
+        if with_call:
+            self._method_call_handlers.add(name)
+        else:
+            self._method_call_handlers.discard(name)
+
+    def subscribe(self, pattern, func, qos=1, raw=False):
+        """
+        Subscribe to a topic filter and register a callback for messages matching it.
+        The callback is called with message topic and payload. Many callbacks may be
+        registered for the same topic filter. Subscriptions are renewed on every reconnect
+
+        :param pattern: Topic filter, may contain "+" and "#" wildcards
+        :type pattern: str
+        :param func: Callback for messages
+        :type func: callable
+        :param qos: Subscription QoS
+        :type qos: int
+        :param raw: Pass payload as received bytes, without decompressing and decoding it with the codec
+        :type raw: bool
+        :return bool False when subscribing failed. The subscription is retried on reconnect
+        """
+        validate_topic_filter(pattern)
+
+        if pattern in self._reserved_topics:
+            raise ValueError('%s is reserved for actions and methods' % pattern)
+
+        if not callable(func):
+            raise TypeError('callback should be callable')
+
+        if isinstance(qos, bool) or qos not in (0, 1, 2):
+            raise ValueError('qos should be one of: 0, 1, 2')
+
+        with self._routes_lock:
+            self._routes.add(pattern, (func, raw, pattern))
+
+            if self._subscribed_topics.get(pattern, -1) >= qos:
+                return True
+
+            self._subscribed_topics[pattern] = qos
+
+        if not self.connected.is_set():
+            return True
+
+        (result, mid) = self.client.subscribe(pattern, qos=qos)
+
+        if result != paho.MQTT_ERR_SUCCESS:
+            self.logger.warning("Unable to subscribe to %s (rc=%d)", pattern, result)
+            return False
+
+        return True
+
+    def unsubscribe(self, pattern, func=None):
+        """
+        Remove callbacks registered with subscribe(). The client unsubscribes from
+        the topic filter when no callback is left
+
+        :param pattern: Topic filter
+        :type pattern: str
+        :param func: Callback to remove. All callbacks of the topic filter are removed by default
+        :type func: callable
+        :return void
         """
-        Send the response to invoked method
+        with self._routes_lock:
+            if func is None:
+                left = self._routes.remove(pattern)
+            else:
+                self._routes.remove(pattern, (func, False, pattern))
+                left = self._routes.remove(pattern, (func, True, pattern))
+
+            if left > 0 or pattern not in self._subscribed_topics or pattern in self._reserved_topics:
+                return
+
+            del self._subscribed_topics[pattern]
+            self._session_topics.pop(pattern, None)
+
+        if self.connected.is_set():
+            self.client.unsubscribe(pattern)
+
+    def send_method_response(self, name, payload, code=200, call_id=None):
+        """
+        Send the response to invoked method. It answers the call with given id or the oldest
+        not answered call of the method. Under MQTT v5 the response carries correlation data
+        of the answered call. When method calls have a deadline, responses to calls answered
+        already or timed out are dropped
 
         :param name: Method name
         :type name: str
@@ -137,26 +623,62 @@ class AgentClient(BaseClient):
         :type payload: dict|list|str|int|float|bool
         :param code: HTTP response code
         :type code: int
-        :return bool
+        :param call_id: Id of answered call (see MethodCall)
+        :type call_id: int
+        :return bool False when the call was answered already or timed out
         """
-        if not isinstance(name, str):
-            raise TypeError('method name should be a string')
-
-        if len(name) == 0:
-            raise ValueError('method name should be at least 1 length')
+        self._validator.method_response(name, payload, code)
 
-        if payload is None:
-            raise TypeError('body is required')
+        call, dropped = self._answered_call(name, call_id)
 
-        if not isinstance(code, int):
-            raise TypeError('code should be an integer')
+        if dropped:
+            return False
 
         return self._publish(
-            'agent/{}/method_response/{}'.format(self.client_id, name),
+            self._method_response_topics.get(name),
+            {
+                "payload": payload,
+                "code": code
+            },
+            self._qos.method_response,
+            kind='method_response',
+            correlation_data=call.correlation_data if call is not None else None
+        )
+
+    def send_method_response_nowait(self, name, payload, code=200, call_id=None):
+        """
+        Send the response to invoked method without waiting for connection
+
+        :param name: Method name
+        :type name: str
+        :param payload: A dictionary containing response to the method
+        :type payload: dict|list|str|int|float|bool
+        :param code: HTTP response code
+        :type code: int
+        :param call_id: Id of answered call (see MethodCall)
+        :type call_id: int
+        :return DeliveryHandle Failed when the call was answered already or timed out
+        """
+        self._validator.method_response(name, payload, code)
+
+        call, dropped = self._answered_call(name, call_id)
+
+        if dropped:
+            handle = DeliveryHandle()
+            handle._set_rc(paho.MQTT_ERR_INVAL)
+            handle._complete(False)
+
+            return handle
+
+        return self._publish_nowait(
+            self._method_response_topics.get(name),
             {
                 "payload": payload,
                 "code": code
-            }
+            },
+            self._qos.method_response,
+            kind='method_response',
+            correlation_data=call.correlation_data if call is not None else None
         )
 
     def send_action_completed(self, name):
@@ -167,17 +689,34 @@ class AgentClient(BaseClient):
         :type name: str
         :return bool
         """
-        if not isinstance(name, str):
-            raise TypeError('completed action name should be a string')
-
-        if len(name) == 0:
-            raise ValueError('completed action name should be at least 1 length')
+        self._validator.action_completed(name)
 
         return self._publish(
-            'agent/{}/action_completed'.format(self.client_id),
+            self._action_completed_topic,
             {
                 'name': name,
-            }
+            },
+            self._qos.action_completed,
+            kind='action_completed'
+        )
+
+    def send_action_completed_nowait(self, name):
+        """
+        Send action completed message without waiting for connection
+
+        :param name: Completed action name
+        :type name: str
+        :return DeliveryHandle
+        """
+        self._validator.action_completed(name)
+
+        return self._publish_nowait(
+            self._action_completed_topic,
+            {
+                'name': name,
+            },
+            self._qos.action_completed,
+            kind='action_completed'
         )
 
     def send_event(self, name):
@@ -188,17 +727,34 @@ class AgentClient(BaseClient):
         :type name: str
         :return bool
         """
-        if not isinstance(name, str):
-            raise TypeError('event name should be a string')
-
-        if len(name) == 0:
-            raise ValueError('event name should be at least 1 length')
+        self._validator.event(name)
 
         return self._publish(
-            'agent/{}/event'.format(self.client_id),
+            self._event_topic,
             {
                 'name': name,
-            }
+            },
+            self._qos.event,
+            kind='event'
+        )
+
+    def send_event_nowait(self, name):
+        """
+        Send an event without waiting for connection
+
+        :param name: Event name
+        :type name: str
+        :return DeliveryHandle
+        """
+        self._validator.event(name)
+
+        return self._publish_nowait(
+            self._event_topic,
+            {
+                'name': name,
+            },
+            self._qos.event,
+            kind='event'
         )
 
     def send_facts(self, facts):
@@ -209,22 +765,26 @@ class AgentClient(BaseClient):
         :type facts: dict
         :return bool
         """
-        if not isinstance(facts, dict):
-            raise TypeError('facts should be a dictionary')
+        self._validator.facts(facts)
+
+        return self._publish_facts(facts, None)
+
+    def send_facts_nowait(self, facts):
+        """
+        Send new fact(s) value(s) without waiting for connection. When facts cache is
+        enabled and no fact changed, returned handle is already delivered
 
-        if not all(map(lambda v: isinstance(v, str), facts.values())):
-            raise TypeError('facts should be key-value string pairs')
+        :param facts: Simple key-value dictionary containing fact name (key) and fact value (value)
+        :type facts: dict
+        :return DeliveryHandle
+        """
+        self._validator.facts(facts)
 
-        if not all(map(lambda v: len(v) > 0, facts.keys())):
-            raise ValueError('fact names should be at least 1 length')
+        handle = DeliveryHandle()
 
-        if not all(map(lambda v: len(v) > 0, facts.values())):
-            raise ValueError('fact values should be at least 1 length')
+        self._publish_facts(facts, handle)
 
-        return self._publish(
-            'agent/{}/facts'.format(self.client_id),
-            facts
-        )
+        return handle
 
     def send_trail(self, name, value):
         """
@@ -236,25 +796,144 @@ class AgentClient(BaseClient):
         :type value: str|int|float
         :return bool
         """
-        if not isinstance(name, str):
-            raise TypeError('trail name should be a string')
+        self._validator.trail(name, value)
 
-        if len(name) == 0:
-            raise ValueError('trail name should be at least 1 length')
+        batcher = self._trail_batcher
+
+        if batcher is not None:
+            return batcher.add(name, value)
+
+        return self._publish_trail(name, value)
+
+    def send_trail_nowait(self, name, value):
+        """
+        Send a trail without waiting for connection. When trail batching is enabled
+        the value may be merged with next values, so returned handle is done
+        (but not delivered) as soon as the value is buffered
+
+        :param name: Trail name
+        :type name: str
+        :param value: Trail value
+        :type value: str|int|float
+        :return DeliveryHandle
+        """
+        self._validator.trail(name, value)
+
+        batcher = self._trail_batcher
+
+        if batcher is None:
+            return self._publish_nowait(self._trail_topics.get(name), {'value': value}, self._qos.trail_qos(name), kind='trail')
+
+        handle = DeliveryHandle()
+        handle._set_rc(paho.MQTT_ERR_SUCCESS if batcher.add(name, value) else paho.MQTT_ERR_QUEUE_SIZE)
+        handle._complete(False)
+
+        return handle
+
+    def trail_publisher(self, name):
+        """
+        Returns a callable sending values of the particular trail. Trail name is validated
+        and its topic is built once, values are not validated
+
+        :param name: Trail name
+        :type name: str
+        :return TrailPublisher
+        """
+        validate_name(name, 'trail')
+
+        return TrailPublisher(self, name, self._trail_topics.get(name), self._qos.trail_qos(name))
+
+    def _publish_facts(self, facts, handle):
+        cache = self._fact_cache
+
+        if cache is None:
+            return self._publish(self._facts_topic, facts, self._qos.facts, handle, 'facts')
+
+        with self._fact_cache_lock:
+            changed = {name: value for name, value in facts.items() if cache.get(name) != value}
+
+        if len(changed) == 0:
+            if handle is not None:
+                handle._set_rc(paho.MQTT_ERR_SUCCESS)
+                handle._complete(True)
+
+            return True
+
+        if handle is None:
+            # Handle makes the call return at once when disconnected, so wait as other send methods do
+            self._wait_for_connection()
+            handle = DeliveryHandle()
 
-        if not isinstance(value, str) and not isinstance(value, int) and not isinstance(value, float):
-            raise TypeError('value name should be a string or number')
+        # Facts are remembered once delivered, so facts dropped or held back on the way are sent again
+        handle.add_done_callback(functools.partial(self._facts_delivered, cache, changed))
 
-        if isinstance(value, str) and len(value) == 0:
-            raise ValueError('value name should be at least 1 length')
+        return self._publish(self._facts_topic, changed, self._qos.facts, handle, 'facts')
 
+    def _facts_delivered(self, cache, facts, handle):
+        """
+        :param cache: Facts cache the facts were compared with
+        :type cache: dict
+        :param facts: Sent facts
+        :type facts: dict
+        :param handle: Completed delivery handle of the facts message
+        :type handle: DeliveryHandle
+        :return void
+        """
+        if not handle.delivered():
+            return
+
+        with self._fact_cache_lock:
+            if self._fact_cache is cache:
+                cache.update(facts)
+
+    def _publish_trail(self, name, value):
         return self._publish(
-            'agent/{}/trail/{}'.format(self.client_id, name),
+            self._trail_topics.get(name),
             {
                 'value': value,
-            }
+            },
+            self._qos.trail_qos(name),
+            kind='trail'
         )
 
+    def _publish_aggregate(self, name, value):
+        # Handle makes the call return at once when disconnected, so aggregates of other trails are sent on time
+        return self._publish(
+            self._trail_topics.get(name),
+            {
+                'value': value,
+            },
+            self._qos.trail_qos(name),
+            DeliveryHandle(),
+            kind='trail'
+        )
+
+    def _watch_trail_aggregation(self, aggregator):
+        """
+        Starts the thread sending aggregates at the end of every window
+
+        :param aggregator: Enabled trail aggregator
+        :type aggregator: TrailAggregator
+        """
+        aggregator.start()
+
+    def _on_connect(self, client, userdata, flags, rc, properties=None):
+        BaseClient._on_connect(self, client, userdata, flags, rc, properties)
+
+        if self._resync_facts_on_connect:
+            self._resync_facts()
+
+    def _resync_facts(self):
+        with self._fact_cache_lock:
+            if not self._fact_cache:
+                return
+
+            facts = dict(self._fact_cache)
+
+        self.logger.debug("Sending %d cached facts after connecting", len(facts))
+
+        self._publish(self._facts_topic, facts, self._qos.facts, kind='facts')
+
     def _on_action(self, client, userdata, msg):
         """
         Dispatches received action to appropriate handler
@@ -267,7 +946,18 @@ class AgentClient(BaseClient):
         :type msg: paho.MQTTMessage
         :return void
         """
-        payload = json.loads(msg.payload)
+        if self._metrics is not None:
+            self._metrics.message_received('action', len(msg.topic) + len(msg.payload))
+
+        if self._dedup is not None and self._is_duplicate('action', msg):
+            return
+
+        payload = self._decode(msg.topic, msg.payload)
+
+        if payload is None:
+            return
+
+        payload = self.codec.decode(payload)
 
         func = self._action_handlers.get(payload.get('name'), None)
 
@@ -275,7 +965,7 @@ class AgentClient(BaseClient):
             func = self._any_action_handler
 
         if func is not None:
-            func(payload.get('name'), payload.get('entities', []))
+            self._call_handler('action', func, payload.get('name'), payload.get('entities', []))
 
     def _on_method(self, client, userdata, msg):
         """
@@ -289,13 +979,321 @@ class AgentClient(BaseClient):
         :type msg: paho.MQTTMessage
         :return void
         """
-        method_name = msg.topic.split('/')[-1]
-        payload = json.loads(msg.payload)
+        if self._metrics is not None:
+            self._metrics.message_received('method', len(msg.topic) + len(msg.payload))
+
+        if self._dedup is not None and self._is_duplicate('method', msg):
+            return
+
+        method_name = msg.topic.rpartition('/')[2]
+        payload = self._decode(msg.topic, msg.payload)
+
+        if payload is None:
+            return
+
+        payload = self.codec.decode(payload)
+
+        # Every call is remembered, so responses stay matched with calls
+        call = self._track_method_call(method_name, payload, msg)
 
         func = self._method_handlers.get(method_name, None)
+        handler = method_name
 
         if func is None and callable(self._any_method_handler):
             func = self._any_method_handler
+            handler = None
 
         if func is not None:
-            func(method_name, payload)
+            self._call_handler('method', func, method_name, call if handler in self._method_call_handlers else payload)
+
+    def _is_duplicate(self, kind, msg):
+        """
+        :param kind: Message kind, either "action" or "method"
+        :type kind: str
+        :param msg: Received Paho message
+        :type msg: paho.MQTTMessage
+        :return bool True when the message was received already
+        """
+        dedup = self._dedup
+
+        # QoS 0 messages are never redelivered and have no packet id
+        if dedup is None or msg.qos == 0:
+            return False
+
+        key = message_key(msg.topic, msg.mid, msg.payload)
+
+        if msg.dup:
+            duplicate = dedup.seen(key)
+        else:
+            # Broker may reuse the packet id right after acknowledgement, so it's a new message
+            dedup.add(key)
+            duplicate = False
+
+        if self._metrics is not None:
+            self._metrics.message_deduplicated(kind, duplicate)
+
+        if duplicate:
+            self.logger.info("Dropped redelivered %s message on %s", kind, msg.topic)
+
+        return duplicate
+
+    def _track_method_call(self, name, payload, msg):
+        """
+        :param name: Method name
+        :type name: str
+        :param payload: Decoded method payload
+        :param msg: Received Paho message
+        :type msg: paho.MQTTMessage
+        :return MethodCall
+        """
+        correlation_data = None
+
+        if self._mqtt_v5:
+            correlation_data = getattr(getattr(msg, 'properties', None), 'CorrelationData', None)
+
+        timeout = self._method_timeouts.get(name, self._method_timeout)
+        call, dropped = self._method_calls.add(name, payload, correlation_data, timeout)
+
+        if dropped is not None:
+            # Without deadlines calls which are never answered are forgotten on purpose, so it's not worth a warning
+            self.logger.log(
+                logging.WARNING if timeout is not None else logging.DEBUG,
+                "Too many calls of method %s waiting for response, forgot call %d",
+                name,
+                dropped.id
+            )
+
+        if timeout is not None:
+            self._watch_method_deadlines()
+
+        return call
+
+    def _answered_call(self, name, call_id):
+        """
+        :param name: Method name
+        :type name: str
+        :param call_id: Id of answered call or None for the oldest call
+        :type call_id: int
+        :return tuple Answered call (None when it's not tracked) and whether the response should be dropped
+        """
+        call = self._method_calls.pop(name, call_id)
+
+        if call is not None:
+            return call, False
+
+        # Without deadlines a response is sent even when no call waits for it, as it was before calls were tracked
+        if call_id is None and self._method_timeouts.get(name, self._method_timeout) is None:
+            return None, False
+
+        self.logger.warning(
+            "Method %s call %s was answered already or timed out, response dropped",
+            name,
+            call_id if call_id is not None else '(oldest)'
+        )
+
+        return None, True
+
+    def _watch_method_deadlines(self):
+        """
+        Starts the thread answering expired method calls or wakes it up for a new deadline
+        """
+        with self._method_deadlines_condition:
+            if self._method_deadlines_thread is None:
+                self._method_deadlines_thread = threading.Thread(
+                    target=self._expire_method_calls,
+                    name='veides-method-deadlines',
+                    daemon=True
+                )
+                self._method_deadlines_thread.start()
+
+            self._method_deadlines_condition.notify()
+
+    def _expire_method_calls(self):
+        while True:
+            with self._method_deadlines_condition:
+                deadline = self._method_calls.next_deadline()
+
+                while deadline is None or deadline > time.monotonic():
+                    self._method_deadlines_condition.wait(
+                        deadline - time.monotonic() if deadline is not None else None
+                    )
+                    deadline = self._method_calls.next_deadline()
+
+            self._answer_expired_method_calls()
+
+    def _answer_expired_method_calls(self):
+        """
+        Answers method calls which deadline passed with METHOD_TIMEOUT_CODE
+
+        :return void
+        """
+        metrics = self._metrics
+        on_expired = None
+
+        if metrics is not None:
+            on_expired = functools.partial(_count_timeout, metrics)
+
+        for call in self._method_calls.expired(on_expired=on_expired):
+            self.logger.warning("Method %s call %d timed out", call.name, call.id)
+
+            # Handle makes the call return at once when disconnected, so other calls expire on time
+            self._publish(
+                self._method_response_topics.get(call.name),
+                {
+                    "payload": self.METHOD_TIMEOUT_PAYLOAD,
+                    "code": self.METHOD_TIMEOUT_CODE
+                },
+                self._qos.method_response,
+                DeliveryHandle(),
+                kind='method_response',
+                correlation_data=call.correlation_data
+            )
+
+    def _on_message(self, client, userdata, msg):
+        """
+        Dispatches received message to callbacks registered with subscribe()
+
+        :param client: Paho client instance
+        :type client: paho.Client
+        :param userdata: User-defined data
+        :type: userdata: object
+        :param msg: Received Paho message
+        :type msg: paho.MQTTMessage
+        :return void
+        """
+        routes = self._routes.match(msg.topic)
+
+        if not routes:
+            self.logger.debug("No callback for message on %s", msg.topic)
+            return
+
+        if self._metrics is not None:
+            self._metrics.message_received('topic', len(msg.topic) + len(msg.payload))
+
+        received = msg.payload
+        payload = None
+
+        for func, raw, pattern in routes:
+            if raw:
+                # Payloads of other publishers may look like compressed ones, so raw routes get them as received
+                self._call_handler('topic', func, msg.topic, msg.payload, pattern)
+                continue
+
+            if payload is None:
+                if received is not None:
+                    received = self._decode(msg.topic, received)
+
+                if received is None:
+                    continue
+
+                payload = self.codec.decode(received)
+
+            self._call_handler('topic', func, msg.topic, payload, pattern)
+
+    def _call_handler(self, kind, func, name, payload, pattern=None):
+        """
+        Executes action or method handler directly or through the dispatcher
+
+        :param kind: Handler kind, either "action", "method" or "topic"
+        :type kind: str
+        :param func: Registered handler
+        :type func: callable
+        :param name: Action or method name, or message topic
+        :type name: str
+        :param payload: Action entities or method payload
+        :param pattern: Subscribed topic filter of topic handlers, used instead of the topic in metrics
+        :type pattern: str
+        :return void
+        """
+        # Messages sent by handlers executed here are left to the network loop when Paho's lock is taken
+        self._message_callback_thread = threading.get_ident()
+
+        try:
+            self._execute_handler(kind, func, name, payload, pattern)
+        finally:
+            self._message_callback_thread = None
+
+    def _execute_handler(self, kind, func, name, payload, pattern=None):
+        dispatcher = self._dispatcher
+        metrics = self._metrics
+        label = self._handler_label(kind, name, pattern)
+
+        if dispatcher is not None:
+            on_done = functools.partial(_handler_executed, metrics, label) if metrics is not None else None
+
+            if not dispatcher.dispatch('%s:%s' % (kind, name), func, name, payload, on_done=on_done):
+                self.logger.warning("Dropped %s %s, dispatcher queue is full", kind, name)
+        elif metrics is None:
+            func(name, payload)
+        else:
+            started_at = time.monotonic()
+
+            try:
+                func(name, payload)
+            except Exception:
+                metrics.handler_executed(label, time.monotonic() - started_at, True)
+                raise
+
+            metrics.handler_executed(label, time.monotonic() - started_at, False)
+
+    def _handler_label(self, kind, name, pattern=None):
+        """
+        :return str Handler label in metrics, e.g. "action:open_door"
+        """
+        # Topics matched by wildcard filters would make a metric per topic
+        return '%s:%s' % (kind, name if pattern is None else pattern)
+
+
+class TrailPublisher(object):
+    __slots__ = ('_client', '_name', '_topic', '_qos')
+
+    def __init__(self, client, name, topic, qos=1):
+        """
+        Sends values of a single trail (see AgentClient.trail_publisher())
+
+        :param client: Agent client
+        :type client: AgentClient
+        :param name: Trail name
+        :type name: str
+        :param topic: Trail topic
+        :type topic: str
+        :param qos: Trail QoS
+        :type qos: int
+        """
+        self._client = client
+        self._name = name
+        self._topic = topic
+        self._qos = qos
+
+    @property
+    def name(self):
+        return self._name
+
+    def __call__(self, value):
+        """
+        Send a trail value
+
+        :param value: Trail value
+        :type value: str|int|float
+        :return bool
+        """
+        batcher = self._client._trail_batcher
+
+        if batcher is not None:
+            return batcher.add(self._name, value)
+
+        return self._client._publish(self._topic, {'value': value}, self._qos, kind='trail')
+
+
+def _validate_method_timeout(timeout):
+    if timeout is not None and (isinstance(timeout, bool) or not isinstance(timeout, (int, float)) or timeout <= 0):
+        raise ValueError('method timeout should be a positive number')
+
+
+def _count_timeout(metrics, call):
+    metrics.method_timed_out(call.name)
+
+
+def _handler_executed(metrics, label, key, execution_time, failed):
+    # Dispatcher reports its key, which is the topic for topic handlers
+    metrics.handler_executed(label, execution_time, failed)
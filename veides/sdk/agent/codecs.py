@@ -0,0 +1,92 @@
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+
+class Codec(object):
+    """
+    Serializes outgoing and deserializes incoming message payloads.
+    Custom codecs (e.g. MessagePack based) should extend this class
+    """
+    name = None
+
+    def encode(self, data):
+        """
+        :param data: Message to encode
+        :type data: dict|list|str|int|float|bool
+        :return bytes|str
+        """
+        raise NotImplementedError()
+
+    def decode(self, payload):
+        """
+        :param payload: Received message payload
+        :type payload: bytes
+        :return dict|list|str|int|float|bool
+        """
+        raise NotImplementedError()
+
+
+class JsonCodec(Codec):
+    name = 'json'
+
+    def encode(self, data):
+        return json.dumps(data)
+
+    def decode(self, payload):
+        return json.loads(payload)
+
+
+class OrjsonCodec(Codec):
+    name = 'orjson'
+
+    def __init__(self):
+        """
+        Encodes straight to bytes and decodes bytes without intermediate str.
+        Non-str dict keys are converted to strings, like json does
+        """
+        if orjson is None:
+            raise ImportError('orjson is not installed')
+
+    def encode(self, data):
+        return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS)
+
+    def decode(self, payload):
+        return orjson.loads(payload)
+
+
+class UjsonCodec(Codec):
+    name = 'ujson'
+
+    def __init__(self):
+        if ujson is None:
+            raise ImportError('ujson is not installed')
+
+    def encode(self, data):
+        return ujson.dumps(data, ensure_ascii=False)
+
+    def decode(self, payload):
+        return ujson.loads(payload)
+
+
+def default_codec():
+    """
+    Returns the fastest available JSON codec: orjson, ujson or stdlib json
+
+    :return Codec
+    """
+    if orjson is not None:
+        return OrjsonCodec()
+
+    if ujson is not None:
+        return UjsonCodec()
+
+    return JsonCodec()
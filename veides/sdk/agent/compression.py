@@ -0,0 +1,305 @@
+import collections
+import struct
+import threading
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Compressed payloads start with the marker followed by compressor id and dictionary id.
+# JSON (and UTF-8 text in general) never starts with a NUL byte, so plain payloads
+# are told apart from compressed ones by the first byte
+MARKER = b'\x00\xc5'
+HEADER = struct.Struct('!2sBI')
+
+# Upper limit of decompressed payload size, protecting from decompression bombs
+MAX_DECOMPRESSED_SIZE = 64 * 1024 * 1024
+
+
+class Compressor(object):
+    """
+    Compresses payloads of sent messages and decompresses received ones.
+    Both sides have to use the same dictionary
+    """
+    id = None
+    name = None
+
+    def __init__(self, dictionary=None):
+        """
+        :param dictionary: Preset dictionary, e.g. returned by train_dictionary()
+        :type dictionary: bytes
+        """
+        self.dictionary = dictionary
+        self.dictionary_id = dictionary_id(dictionary)
+
+    def compress(self, data):
+        """
+        :param data: Encoded payload
+        :type data: bytes
+        :return bytes
+        """
+        raise NotImplementedError()
+
+    def decompress(self, data, max_size=MAX_DECOMPRESSED_SIZE):
+        """
+        :param data: Compressed payload, without the header
+        :type data: bytes
+        :param max_size: Maximum size of decompressed payload
+        :type max_size: int
+        :raises ValueError: If the payload is corrupted or too large
+        :return bytes
+        """
+        raise NotImplementedError()
+
+
+class ZlibCompressor(Compressor):
+    id = 1
+    name = 'zlib'
+
+    def __init__(self, dictionary=None, level=6):
+        """
+        :param dictionary: Preset dictionary (up to 32 KiB is used)
+        :type dictionary: bytes
+        :param level: Compression level, from 1 (fastest) to 9 (smallest)
+        :type level: int
+        """
+        Compressor.__init__(self, dictionary)
+        self.level = level
+
+    def compress(self, data):
+        if self.dictionary is None:
+            return zlib.compress(data, self.level)
+
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, zlib.MAX_WBITS, 9, zlib.Z_DEFAULT_STRATEGY, self.dictionary)
+
+        return compressor.compress(data) + compressor.flush()
+
+    def decompress(self, data, max_size=MAX_DECOMPRESSED_SIZE):
+        if self.dictionary is None:
+            decompressor = zlib.decompressobj()
+        else:
+            decompressor = zlib.decompressobj(zdict=self.dictionary)
+
+        try:
+            decompressed = decompressor.decompress(data, max_size)
+        except zlib.error as e:
+            raise ValueError('corrupted zlib payload: %s' % e)
+
+        if decompressor.unconsumed_tail:
+            raise ValueError('decompressed payload exceeds %d bytes' % max_size)
+
+        return decompressed
+
+
+class ZstdCompressor(Compressor):
+    id = 2
+    name = 'zstd'
+
+    def __init__(self, dictionary=None, level=3):
+        """
+        Compresses with Zstandard. Requires zstandard package (pip3 install veides-agent-sdk[zstd])
+
+        :param dictionary: Preset dictionary, e.g. returned by train_dictionary()
+        :type dictionary: bytes
+        :param level: Compression level, from 1 (fastest) to 22 (smallest)
+        :type level: int
+        """
+        if zstandard is None:
+            raise ImportError('zstandard is not installed')
+
+        Compressor.__init__(self, dictionary)
+        self.level = level
+        self._dictionary = None if dictionary is None else zstandard.ZstdCompressionDict(dictionary)
+        # Zstandard contexts can't be shared between threads
+        self._local = threading.local()
+
+    def compress(self, data):
+        compressor = getattr(self._local, 'compressor', None)
+
+        if compressor is None:
+            compressor = self._local.compressor = zstandard.ZstdCompressor(level=self.level, dict_data=self._dictionary)
+
+        return compressor.compress(data)
+
+    def decompress(self, data, max_size=MAX_DECOMPRESSED_SIZE):
+        decompressor = getattr(self._local, 'decompressor', None)
+
+        if decompressor is None:
+            decompressor = self._local.decompressor = zstandard.ZstdDecompressor(dict_data=self._dictionary)
+
+        try:
+            if zstandard.frame_content_size(data) > max_size:
+                raise ValueError('decompressed payload exceeds %d bytes' % max_size)
+
+            return decompressor.decompress(data, max_output_size=max_size)
+        except zstandard.ZstdError as e:
+            raise ValueError('corrupted zstd payload: %s' % e)
+
+
+class PayloadCompression(object):
+    def __init__(self, compressor, threshold=1024, kinds=('facts', 'method_response')):
+        """
+        Compresses payloads of given message kinds above the size threshold. Payloads
+        which don't get smaller are sent uncompressed
+
+        :param compressor: Compressor to use
+        :type compressor: Compressor
+        :param threshold: Minimum size (in bytes) of compressed payload
+        :type threshold: int
+        :param kinds: Compressed message kinds
+        :type kinds: tuple
+        """
+        if not isinstance(compressor, Compressor):
+            raise TypeError('compressor should be a Compressor instance')
+
+        if not isinstance(threshold, int) or threshold < 0:
+            raise ValueError('threshold should be a non-negative integer')
+
+        self.compressor = compressor
+        self.threshold = threshold
+        self.kinds = frozenset(kinds)
+        self._header = HEADER.pack(MARKER, compressor.id, compressor.dictionary_id)
+
+        self._lock = threading.Lock()
+        self._compressed = 0
+        self._bytes_in = 0
+        self._bytes_out = 0
+
+    def compress(self, payload, kind):
+        """
+        :param payload: Encoded payload
+        :type payload: bytes|str
+        :param kind: Message kind, e.g. "facts"
+        :type kind: str
+        :return bytes|str Compressed payload with the header, or given payload
+        """
+        if kind not in self.kinds or len(payload) < self.threshold:
+            return payload
+
+        data = payload.encode('utf-8') if isinstance(payload, str) else payload
+        compressed = self._header + self.compressor.compress(data)
+
+        if len(compressed) >= len(data):
+            return payload
+
+        with self._lock:
+            self._compressed += 1
+            self._bytes_in += len(data)
+            self._bytes_out += len(compressed)
+
+        return compressed
+
+    def stats(self):
+        """
+        Returns number of compressed payloads and their size before and after compression
+
+        :return dict
+        """
+        with self._lock:
+            return {
+                'compressed': self._compressed,
+                'bytes_in': self._bytes_in,
+                'bytes_out': self._bytes_out,
+            }
+
+
+def is_compressed(payload):
+    """
+    :param payload: Received payload
+    :type payload: bytes
+    :return bool
+    """
+    return payload[:2] == MARKER
+
+
+def decompress(payload, compressor=None, max_size=MAX_DECOMPRESSED_SIZE):
+    """
+    Decompresses payload compressed by PayloadCompression. Payloads compressed with
+    a dictionary require a compressor using the same dictionary
+
+    :param payload: Received payload, starting with the header
+    :type payload: bytes
+    :param compressor: Compressor holding the dictionary
+    :type compressor: Compressor
+    :param max_size: Maximum size of decompressed payload
+    :type max_size: int
+    :raises ValueError: If the payload is corrupted, too large or compressed with unknown dictionary
+    :return bytes
+    """
+    if len(payload) < HEADER.size:
+        raise ValueError('truncated compressed payload')
+
+    _, compressor_id, payload_dictionary_id = HEADER.unpack_from(payload)
+
+    if compressor is None or compressor.id != compressor_id or compressor.dictionary_id != payload_dictionary_id:
+        if payload_dictionary_id != 0:
+            raise ValueError('payload compressed with unknown dictionary %d' % payload_dictionary_id)
+
+        compressor = _plain_compressor(compressor_id)
+
+    return compressor.decompress(bytes(payload[HEADER.size:]), max_size)
+
+
+def default_compressor(dictionary=None):
+    """
+    Returns Zstandard compressor when zstandard package is installed, zlib compressor otherwise
+
+    :param dictionary: Preset dictionary
+    :type dictionary: bytes
+    :return Compressor
+    """
+    if zstandard is not None:
+        return ZstdCompressor(dictionary)
+
+    return ZlibCompressor(dictionary)
+
+
+def train_dictionary(samples, size=16384):
+    """
+    Builds a dictionary from typical payloads. Zstandard's trainer is used when zstandard
+    package is installed (it needs at least a few hundred samples). Otherwise the dictionary
+    is made of distinct samples, the most frequent ones at the end, where zlib finds them
+    at the smallest distance. Either dictionary may be used with any compressor
+
+    :param samples: Encoded payloads
+    :type samples: list
+    :param size: Maximum dictionary size (in bytes)
+    :type size: int
+    :return bytes
+    """
+    samples = [sample.encode('utf-8') if isinstance(sample, str) else bytes(sample) for sample in samples]
+
+    if zstandard is not None:
+        return zstandard.train_dictionary(size, samples).as_bytes()
+
+    counts = collections.Counter(samples)
+    dictionary = b''.join(sample for sample, _ in reversed(counts.most_common()))
+
+    return dictionary[-size:]
+
+
+def dictionary_id(dictionary):
+    """
+    :param dictionary: Preset dictionary
+    :type dictionary: bytes
+    :return int Id stored in headers of payloads compressed with the dictionary, 0 without dictionary
+    """
+    if dictionary is None:
+        return 0
+
+    return zlib.crc32(dictionary) or 1
+
+
+def _plain_compressor(compressor_id):
+    if compressor_id == ZlibCompressor.id:
+        return ZlibCompressor()
+
+    if compressor_id == ZstdCompressor.id:
+        if zstandard is None:
+            raise ValueError('payload compressed with zstd, but zstandard is not installed')
+
+        return ZstdCompressor()
+
+    raise ValueError('unknown compressor %d' % compressor_id)
@@ -0,0 +1,178 @@
+import hashlib
+import math
+import threading
+import time
+from collections import OrderedDict
+
+
+class DedupCache(object):
+    def __init__(self, ttl=60, max_size=10000, resolution=1.0):
+        """
+        Remembers keys of seen messages for ttl seconds. The least recently seen key is
+        forgotten when the cache is full. Expired keys are dropped by a time wheel of
+        ttl / resolution slots advanced on every lookup, so no thread is needed
+
+        :param ttl: Time (in seconds) a key is remembered after it was first seen
+        :type ttl: int|float
+        :param max_size: Maximum number of remembered keys
+        :type max_size: int
+        :param resolution: Width (in seconds) of a time wheel slot. Keys expire up to resolution seconds late
+        :type resolution: int|float
+        """
+        if isinstance(ttl, bool) or not isinstance(ttl, (int, float)) or ttl <= 0:
+            raise ValueError('ttl should be a positive number')
+
+        if isinstance(max_size, bool) or not isinstance(max_size, int) or max_size < 1:
+            raise ValueError('max_size should be a positive integer')
+
+        if isinstance(resolution, bool) or not isinstance(resolution, (int, float)) or resolution <= 0:
+            raise ValueError('resolution should be a positive number')
+
+        self._max_size = max_size
+        self._resolution = float(resolution)
+        self._slots = int(math.ceil(ttl / self._resolution)) + 1
+
+        self._lock = threading.Lock()
+        # Key -> tick after which it expires, in order of last lookup
+        self._entries = OrderedDict()
+        # Keys by tick they expire at, modulo number of slots
+        self._wheel = [[] for _ in range(self._slots)]
+        # Last tick the wheel was advanced to, set on first lookup
+        self._tick = None
+
+        self._hits = 0
+        self._misses = 0
+        self._expired = 0
+        self._evicted = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def seen(self, key, now=None):
+        """
+        Checks whether the key was seen within ttl and remembers it
+
+        :param key: Hashable message identity, e.g. from message_key()
+        :param now: Current time.monotonic()
+        :type now: float
+        :return bool True when the key was seen before
+        """
+        return self._lookup(key, now, True)
+
+    def add(self, key, now=None):
+        """
+        Remembers the key for ttl seconds as a new one, even when the same key was seen before
+
+        :param key: Hashable message identity, e.g. from message_key()
+        :param now: Current time.monotonic()
+        :type now: float
+        :return void
+        """
+        self._lookup(key, now, False)
+
+    def _lookup(self, key, now, check):
+        """
+        :param key: Hashable message identity
+        :param now: Current time.monotonic()
+        :type now: float
+        :param check: Whether a known key is a hit, otherwise it's remembered again as a new one
+        :type check: bool
+        :return bool True when the key was seen before and check is True
+        """
+        tick = self._current_tick(time.monotonic() if now is None else now)
+
+        with self._lock:
+            if self._tick is None:
+                self._tick = tick
+            elif tick > self._tick:
+                self._advance(tick)
+
+            entries = self._entries
+
+            if check and key in entries:
+                entries.move_to_end(key)
+                self._hits += 1
+                return True
+
+            expires_at = tick + self._slots - 1
+            entries[key] = expires_at
+            entries.move_to_end(key)
+            self._wheel[expires_at % self._slots].append(key)
+            self._misses += 1
+
+            if len(entries) > self._max_size:
+                entries.popitem(last=False)
+                self._evicted += 1
+
+            return False
+
+    def clear(self):
+        """
+        Forget all keys
+
+        :return void
+        """
+        with self._lock:
+            self._entries.clear()
+
+            for bucket in self._wheel:
+                del bucket[:]
+
+    def stats(self):
+        """
+        Returns number of remembered keys, duplicates found (hits), new keys (misses),
+        and keys forgotten after ttl (expired) or to make room for new ones (evicted)
+
+        :return dict
+        """
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'hits': self._hits,
+                'misses': self._misses,
+                'expired': self._expired,
+                'evicted': self._evicted,
+            }
+
+    def _current_tick(self, now):
+        return int(now / self._resolution)
+
+    def _advance(self, tick):
+        """
+        Drops keys which expired at ticks up to the given one. Every slot is visited at most once
+
+        :param tick: Current tick
+        :type tick: int
+        :return void
+        """
+        entries = self._entries
+
+        for passed in range(self._tick + 1, min(tick, self._tick + self._slots) + 1):
+            bucket = self._wheel[passed % self._slots]
+
+            for key in bucket:
+                # Evicted keys seen again are in a later slot too, with a later expiry
+                if entries.get(key, tick + 1) <= tick:
+                    del entries[key]
+                    self._expired += 1
+
+            del bucket[:]
+
+        self._tick = tick
+
+
+def message_key(topic, mid, payload):
+    """
+    Identity of a received message. Redelivered messages keep their packet id, but brokers
+    may reuse a packet id as soon as the previous message with it was acknowledged, so
+    the key identifies a duplicate only of a message flagged as redelivered (DUP)
+
+    :param topic: Message topic
+    :type topic: str
+    :param mid: MQTT packet id
+    :type mid: int
+    :param payload: Raw message payload
+    :type payload: bytes
+    :return tuple
+    """
+    return topic, mid, hashlib.blake2b(payload, digest_size=8).digest()
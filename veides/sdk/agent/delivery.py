@@ -0,0 +1,209 @@
+import logging
+import threading
+import time
+import paho.mqtt.client as paho
+
+
+class DeliveryHandle(object):
+    __slots__ = ('_rc', '_mid', '_delivered', '_event', '_callbacks', '_lock')
+
+    def __init__(self):
+        """
+        Tracks delivery of a single message sent with one of send_*_nowait() methods.
+        QoS 1 message is delivered when the broker acknowledged it, QoS 0 message
+        when it was written to the socket
+        """
+        self._rc = None
+        self._mid = None
+        self._delivered = False
+        self._event = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    @property
+    def rc(self):
+        """
+        Paho result code of handing the message over, None until it's known
+
+        :return int|None
+        """
+        return self._rc
+
+    @property
+    def mid(self):
+        """
+        Paho message id, None until the message is handed over to Paho
+
+        :return int|None
+        """
+        return self._mid
+
+    def accepted(self):
+        """
+        :return bool True when the message was handed over to Paho or queued in the outbox
+        """
+        return self._rc == paho.MQTT_ERR_SUCCESS
+
+    def done(self):
+        """
+        :return bool True when the message was delivered or failed
+        """
+        return self._event.is_set()
+
+    def delivered(self):
+        """
+        :return bool True when the message was delivered
+        """
+        return self._delivered
+
+    def wait(self, timeout=None):
+        """
+        Block until the message is delivered or failed
+
+        :param timeout: Maximum time (in seconds) to wait. Waits forever by default
+        :type timeout: float
+        :return bool True when the message was delivered
+        """
+        self._event.wait(timeout)
+
+        return self._delivered
+
+    def add_done_callback(self, func):
+        """
+        Register a callback called with this handle when the message is delivered or failed.
+        It's called in the thread completing the handle (usually the network thread)
+        or immediately when the handle is already done
+
+        :param func: Callback
+        :type func: callable
+        :return void
+        """
+        if not callable(func):
+            raise TypeError('callback should be callable')
+
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(func)
+                return
+
+        self._call(func)
+
+    def _set_rc(self, rc, mid=None):
+        self._rc = rc
+        self._mid = mid
+
+    def _complete(self, delivered):
+        with self._lock:
+            if self._event.is_set():
+                return
+
+            self._delivered = delivered
+            self._event.set()
+            callbacks = self._callbacks
+            self._callbacks = None
+
+        for func in callbacks:
+            self._call(func)
+
+    def _call(self, func):
+        try:
+            func(self)
+        except Exception:
+            logging.getLogger(__name__).exception("Delivery callback failed")
+
+
+class DeliveryTracker(object):
+    def __init__(self):
+        """
+        Matches Paho's on_publish notifications with sent messages
+        """
+        self._condition = threading.Condition()
+        self._pending = {}
+        # Paho may notify about a message before publish() returns its mid
+        self._early = set()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def track(self, mid, qos, handle=None):
+        """
+        :param mid: Paho message id
+        :type mid: int
+        :param qos: Message QoS
+        :type qos: int
+        :param handle: Handle completed on delivery
+        :type handle: DeliveryHandle
+        :return void
+        """
+        with self._condition:
+            if mid in self._early:
+                self._early.discard(mid)
+            else:
+                self._pending[mid] = (qos, handle, time.monotonic())
+                return
+
+        if handle is not None:
+            handle._complete(True)
+
+    def published(self, mid):
+        """
+        :param mid: Paho message id
+        :type mid: int
+        :return tuple|None QoS of the message and time (in seconds) it took to deliver it,
+            None when the message isn't tracked yet
+        """
+        with self._condition:
+            entry = self._pending.pop(mid, None)
+
+            if entry is None:
+                self._early.add(mid)
+                return None
+
+            if not self._pending:
+                self._condition.notify_all()
+
+        if entry[1] is not None:
+            entry[1]._complete(True)
+
+        return entry[0], time.monotonic() - entry[2]
+
+    def fail(self, qos):
+        """
+        Fail pending messages of the given QoS, e.g. QoS 0 messages lost with the connection
+
+        :param qos: Message QoS
+        :type qos: int
+        :return void
+        """
+        with self._condition:
+            failed = [mid for mid, entry in self._pending.items() if entry[0] == qos]
+            handles = [self._pending.pop(mid)[1] for mid in failed]
+            self._early.clear()
+
+            if not self._pending:
+                self._condition.notify_all()
+
+        for handle in handles:
+            if handle is not None:
+                handle._complete(False)
+
+    def wait(self, timeout=None):
+        """
+        Block until all tracked messages are delivered
+
+        :param timeout: Maximum time (in seconds) to wait. Waits forever by default
+        :type timeout: float
+        :return bool False on timeout
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        with self._condition:
+            while self._pending:
+                remaining = None if deadline is None else deadline - time.monotonic()
+
+                if remaining is not None and remaining <= 0:
+                    return False
+
+                self._condition.wait(remaining)
+
+        return True
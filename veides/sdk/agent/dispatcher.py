@@ -0,0 +1,258 @@
+import collections
+import logging
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+
+class HandlerDispatcher(object):
+    INLINE = 'inline'
+    THREAD_POOL = 'thread'
+    PROCESS_POOL = 'process'
+
+    def __init__(
+            self,
+            mode=INLINE,
+            max_workers=4,
+            max_queue_size=1000,
+            max_concurrency=None,
+            concurrency_limits=None,
+            ordered=False,
+            logger=None
+    ):
+        """
+        Executes action and method handlers outside of the network thread
+
+        Handlers are identified by keys in form of "action:<name>" or "method:<name>".
+        In process pool mode handlers and their arguments have to be picklable.
+
+        :param mode: One of INLINE, THREAD_POOL or PROCESS_POOL
+        :type mode: str
+        :param max_workers: Number of workers executing handlers
+        :type max_workers: int
+        :param max_queue_size: Maximum number of queued handler calls. New calls are dropped when reached
+        :type max_queue_size: int
+        :param max_concurrency: Maximum number of concurrent calls of a single handler. Unlimited by default
+        :type max_concurrency: int
+        :param concurrency_limits: Per handler key concurrency limits, overriding max_concurrency
+        :type concurrency_limits: dict
+        :param ordered: Execute calls of a single handler one by one in the order they were received
+        :type ordered: bool
+        :param logger: Logger used to report failed handlers
+        :type logger: logging.Logger
+        """
+        if mode not in (self.INLINE, self.THREAD_POOL, self.PROCESS_POOL):
+            raise ValueError('mode should be one of: inline, thread, process')
+
+        if not isinstance(max_workers, int) or max_workers < 1:
+            raise ValueError('max_workers should be a positive integer')
+
+        if not isinstance(max_queue_size, int) or max_queue_size < 1:
+            raise ValueError('max_queue_size should be a positive integer')
+
+        if max_concurrency is not None and (not isinstance(max_concurrency, int) or max_concurrency < 1):
+            raise ValueError('max_concurrency should be a positive integer')
+
+        self._mode = mode
+        self._max_workers = max_workers
+        self._max_queue_size = max_queue_size
+        self._max_concurrency = 1 if ordered else max_concurrency
+        self._concurrency_limits = dict(concurrency_limits or {})
+        self._logger = logger or logging.getLogger(__name__)
+
+        self._lock = threading.Lock()
+        self._condition = threading.Condition(self._lock)
+        self._pending = {}
+        self._running = collections.Counter()
+        self._runnable = collections.deque()
+        self._runnable_keys = set()
+        self._queued = 0
+        self._shutdown = False
+
+        self._workers = []
+        self._executor = None
+
+        self._dropped = 0
+        self._max_queue_depth = 0
+        self._handler_stats = {}
+
+    def dispatch(self, key, func, *args, on_done=None):
+        """
+        Execute or enqueue handler call
+
+        :param key: Handler key, e.g. "action:open_door" or "method:shutdown"
+        :type key: str
+        :param func: Handler
+        :type func: callable
+        :param on_done: Callable taking handler key, execution time and failure flag, called after the handler
+        :type on_done: callable
+        :return bool False when the call was dropped
+        """
+        if self._mode == self.INLINE:
+            self._execute(key, func, args, time.monotonic(), on_done)
+            return True
+
+        with self._condition:
+            if self._shutdown or self._queued >= self._max_queue_size:
+                self._dropped += 1
+                return False
+
+            if not self._workers:
+                self._start()
+
+            self._pending.setdefault(key, collections.deque()).append((func, args, time.monotonic(), on_done))
+            self._queued += 1
+            self._max_queue_depth = max(self._max_queue_depth, self._queued)
+
+            self._schedule(key)
+
+            return True
+
+    def shutdown(self, wait=True):
+        """
+        Stop accepting new calls. Already queued calls are executed
+
+        :param wait: Wait until all queued calls are executed
+        :type wait: bool
+        :return void
+        """
+        with self._condition:
+            self._shutdown = True
+            self._condition.notify_all()
+            workers = list(self._workers)
+
+        if wait:
+            for worker in workers:
+                worker.join()
+
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+
+    def queue_depth(self):
+        """
+        :return int Number of calls waiting for execution
+        """
+        return self._queued
+
+    def stats(self):
+        """
+        Returns queue depth metrics and execution time statistics per handler key
+
+        :return dict
+        """
+        with self._lock:
+            handlers = {}
+
+            for key, stats in self._handler_stats.items():
+                handlers[key] = dict(stats)
+                handlers[key]['avg_time'] = stats['total_time'] / stats['calls'] if stats['calls'] else 0.0
+
+            return {
+                'queue_depth': self._queued,
+                'max_queue_depth': self._max_queue_depth,
+                'dropped': self._dropped,
+                'handlers': handlers,
+            }
+
+    def _limit(self, key):
+        return self._concurrency_limits.get(key, self._max_concurrency)
+
+    def _schedule(self, key):
+        if key in self._runnable_keys or not self._pending.get(key):
+            return
+
+        limit = self._limit(key)
+
+        if limit is not None and self._running[key] >= limit:
+            return
+
+        self._runnable.append(key)
+        self._runnable_keys.add(key)
+        self._condition.notify()
+
+    def _start(self):
+        if self._mode == self.PROCESS_POOL:
+            self._executor = ProcessPoolExecutor(max_workers=self._max_workers)
+
+        for i in range(self._max_workers):
+            worker = threading.Thread(target=self._work, name='veides-dispatcher-%d' % i, daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def _work(self):
+        while True:
+            with self._condition:
+                while not self._runnable and not (self._shutdown and self._queued == 0):
+                    self._condition.wait()
+
+                if not self._runnable:
+                    return
+
+                key = self._runnable.popleft()
+                self._runnable_keys.discard(key)
+
+                func, args, enqueued_at, on_done = self._pending[key].popleft()
+
+                if not self._pending[key]:
+                    del self._pending[key]
+
+                self._queued -= 1
+                self._running[key] += 1
+
+                # Other calls of the same handler may run in parallel if the limit allows it
+                self._schedule(key)
+
+            try:
+                self._execute(key, func, args, enqueued_at, on_done)
+            finally:
+                with self._condition:
+                    self._running[key] -= 1
+
+                    if self._running[key] == 0:
+                        del self._running[key]
+
+                    self._schedule(key)
+
+                    if self._shutdown and self._queued == 0:
+                        self._condition.notify_all()
+
+    def _execute(self, key, func, args, enqueued_at, on_done=None):
+        started_at = time.monotonic()
+        failed = False
+
+        try:
+            if self._executor is not None:
+                self._executor.submit(func, *args).result()
+            else:
+                func(*args)
+        except Exception as e:
+            failed = True
+            self._logger.error("Handler %s failed: %s", key, e)
+
+        execution_time = time.monotonic() - started_at
+
+        self._record(key, started_at - enqueued_at, execution_time, failed)
+
+        if on_done is not None:
+            on_done(key, execution_time, failed)
+
+    def _record(self, key, wait_time, execution_time, failed):
+        with self._lock:
+            stats = self._handler_stats.get(key)
+
+            if stats is None:
+                stats = self._handler_stats[key] = {
+                    'calls': 0,
+                    'errors': 0,
+                    'total_time': 0.0,
+                    'max_time': 0.0,
+                    'max_wait_time': 0.0,
+                }
+
+            stats['calls'] += 1
+            stats['total_time'] += execution_time
+            stats['max_time'] = max(stats['max_time'], execution_time)
+            stats['max_wait_time'] = max(stats['max_wait_time'], wait_time)
+
+            if failed:
+                stats['errors'] += 1
@@ -0,0 +1,548 @@
+import collections
+import logging
+import os
+import selectors
+import socket
+import ssl
+import threading
+import time
+from paho.mqtt import __version__ as paho_version
+
+from veides.sdk.agent.base_client import BaseClient
+from veides.sdk.agent.client import AgentClient
+from veides.sdk.agent.codecs import default_codec
+from veides.sdk.agent.exceptions import ConnectionException
+from veides.sdk.agent.reconnect import ReconnectPolicy
+
+
+class AgentHost(object):
+    def __init__(
+            self,
+            connection_properties,
+            io_threads=1,
+            logger=None,
+            mqtt_logger=None,
+            log_level=logging.WARN,
+            mqtt_log_level=logging.ERROR,
+            codec=None,
+            qos_policy=None,
+            max_inflight_messages=None,
+            max_queued_messages=None,
+            reconnect_policy=None,
+            persistent_session=False,
+            session_dir=None,
+            message_expiry=None,
+            method_timeout=None
+    ):
+        """
+        Hosts many agents sharing a small, fixed number of I/O threads. Agents share
+        loggers and SSL context, and their sockets are driven by selector loops instead
+        of a Paho network thread per agent
+
+        :param connection_properties: Properties related to Veides connection
+        :type connection_properties: ConnectionProperties
+        :param io_threads: Number of I/O threads agents are spread across
+        :type io_threads: int
+        :param logger: Custom SDK logger shared by all agents
+        :type logger: logging.Logger
+        :param mqtt_logger: Custom MQTT lib logger shared by all agents
+        :type mqtt_logger: logging.Logger
+        :param log_level: SDK logging level
+        :param mqtt_log_level: MQTT lib logging level
+        :param codec: Message payload codec shared by all agents
+        :type codec: Codec
+        :param qos_policy: QoS of sent messages per message type used by all agents
+        :type qos_policy: QosPolicy
+        :param max_inflight_messages: Maximum number of QoS 1 messages waiting for acknowledgement per agent
+        :type max_inflight_messages: int
+        :param max_queued_messages: Maximum number of messages queued by Paho per agent. 0 means unlimited (default)
+        :type max_queued_messages: int
+        :param reconnect_policy: Reconnect policy shared by all agents, so its circuit breaker protects
+            the broker from the whole fleet. Exponential backoff with full jitter is used by default
+        :type reconnect_policy: ReconnectPolicy
+        :param persistent_session: Keep MQTT sessions of agents on the broker between connections
+        :type persistent_session: bool
+        :param session_dir: Directory of files keeping sent QoS 1 and 2 messages until they are
+            acknowledged, one file per agent
+        :type session_dir: str
+        :param message_expiry: Time (in seconds) after which the broker drops undelivered messages,
+            per message type, e.g. {'trail': 60}. Requires MQTT v5
+        :type message_expiry: dict
+        :param method_timeout: Time (in seconds) a method call waits for response before it's answered
+            with 504 code. Deadlines of hosted agents are checked every second
+        :type method_timeout: int|float
+        """
+        if not isinstance(io_threads, int) or io_threads < 1:
+            raise ValueError('io_threads should be a positive integer')
+
+        self._connection_properties = connection_properties
+        self._codec = codec or default_codec()
+        self._qos_policy = qos_policy
+        self._max_inflight_messages = max_inflight_messages
+        self._max_queued_messages = max_queued_messages
+        self._reconnect_policy = reconnect_policy or ReconnectPolicy()
+        self._persistent_session = persistent_session
+        self._session_dir = session_dir
+        self._message_expiry = message_expiry
+        self._method_timeout = method_timeout
+
+        if logger is None:
+            self.logger = BaseClient._build_logger(self.__module__ + "." + self.__class__.__name__, log_level)
+        else:
+            self.logger = logger
+
+        if mqtt_logger is None:
+            self.mqtt_logger = BaseClient._build_logger("Paho/{}".format(paho_version), mqtt_log_level)
+        else:
+            self.mqtt_logger = mqtt_logger
+
+        self._ssl_context = None
+
+        if connection_properties.use_tls:
+            try:
+                self._ssl_context = ssl.create_default_context(capath=connection_properties.capath)
+            except Exception as e:
+                self.logger.warning("Unable to use SSL/TLS: %s", e)
+
+        self._io_loops = [_IoLoop('veides-agent-host-%d' % i, self.logger) for i in range(io_threads)]
+        self._agents = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def add_agent(self, agent_properties):
+        """
+        Create an agent driven by this host. Handlers are registered on returned
+        client the same way as on standalone AgentClient
+
+        :param agent_properties: Properties related to agent
+        :type agent_properties: AgentProperties
+        :return AgentClient
+        """
+        with self._lock:
+            if agent_properties.client_id in self._agents:
+                raise ValueError('agent %s is already hosted' % agent_properties.client_id)
+
+            io_loop = self._io_loops[len(self._agents) % len(self._io_loops)]
+
+            agent = _HostedAgentClient(
+                io_loop,
+                agent_properties,
+                self._connection_properties,
+                logger=self.logger,
+                mqtt_logger=self.mqtt_logger,
+                ssl_context=self._ssl_context,
+                codec=self._codec,
+                qos_policy=self._qos_policy,
+                max_inflight_messages=self._max_inflight_messages,
+                max_queued_messages=self._max_queued_messages,
+                reconnect_policy=self._reconnect_policy,
+                persistent_session=self._persistent_session,
+                session_path=self._session_path(agent_properties.client_id),
+                message_expiry=self._message_expiry,
+                method_timeout=self._method_timeout,
+            )
+
+            self._agents[agent_properties.client_id] = agent
+
+        return agent
+
+    def get_agent(self, client_id):
+        """
+        :param client_id: Agent's client id
+        :type client_id: str
+        :return AgentClient|None
+        """
+        return self._agents.get(client_id)
+
+    def remove_agent(self, client_id):
+        """
+        Disconnect the agent and stop hosting it
+
+        :param client_id: Agent's client id
+        :type client_id: str
+        :return void
+        """
+        with self._lock:
+            agent = self._agents.pop(client_id, None)
+
+        if agent is not None:
+            if agent.is_connected():
+                agent.disconnect()
+
+            agent._stop_loop()
+            agent._io_loop.remove_client(agent)
+
+    def agents(self):
+        """
+        :return list
+        """
+        return list(self._agents.values())
+
+    def connect(self, timeout=30):
+        """
+        Connect all hosted agents. Connections are initiated one by one and
+        acknowledgements are awaited concurrently. Failed attempts are retried as
+        configured by the reconnect policy (see ReconnectPolicy.connect_attempts)
+
+        :param timeout: Time (in seconds) to wait for all agents to be connected
+        :type timeout: float
+        :raises ConnectionException: If any of the agents failed to connect
+        :return void
+        """
+        self.start()
+
+        deadline = time.monotonic() + timeout
+        # Time of the next connection attempt per agent
+        pending = collections.OrderedDict()
+
+        for agent in self.agents():
+            if not agent.is_connected():
+                agent._reconnect_attempt = 0
+                pending[agent] = 0
+
+        while pending:
+            now = time.monotonic()
+            due = [agent for agent, attempt_at in pending.items() if attempt_at <= now]
+
+            if not due:
+                (agent, attempt_at) = min(pending.items(), key=lambda item: item[1])
+
+                if attempt_at > deadline:
+                    raise ConnectionException(
+                        "Timeout occurred while connecting agent %s to Veides: %s" % (agent.client_id, agent.host)
+                    )
+
+                time.sleep(attempt_at - now)
+                continue
+
+            failed = []
+            started = []
+
+            for agent in due:
+                agent._wait_for_breaker(time.sleep)
+                error = _start_connecting(agent)
+
+                if error is None:
+                    started.append(agent)
+                else:
+                    failed.append((agent, error))
+
+            for agent in started:
+                if not agent._ready.wait(timeout=max(deadline - time.monotonic(), 0)):
+                    raise ConnectionException(
+                        "Timeout occurred while connecting agent %s to Veides: %s" % (agent.client_id, agent.host)
+                    )
+
+                if agent._connect_error is None:
+                    del pending[agent]
+                else:
+                    # Retried below instead of by the I/O loop
+                    agent.client.disconnect()
+                    agent._stop_loop()
+                    failed.append((agent, agent._connect_error))
+
+            for agent, error in failed:
+                delay = agent._schedule_reconnect(initial=True)
+
+                if delay is None:
+                    raise ConnectionException("Agent %s failed to connect: %s" % (agent.client_id, error))
+
+                pending[agent] = time.monotonic() + delay
+
+    def disconnect(self):
+        """
+        Disconnect all hosted agents and stop I/O threads
+
+        :return void
+        """
+        for agent in self.agents():
+            if agent.is_connected():
+                agent.disconnect()
+            else:
+                agent._stop_loop()
+
+        self.stop()
+
+    def start(self):
+        """
+        Start I/O threads. Called by connect()
+
+        :return void
+        """
+        for io_loop in self._io_loops:
+            io_loop.start()
+
+    def stop(self):
+        """
+        Stop I/O threads
+
+        :return void
+        """
+        for io_loop in self._io_loops:
+            io_loop.stop()
+
+    def _session_path(self, client_id):
+        if self._session_dir is None:
+            return None
+
+        return os.path.join(self._session_dir, '%s.session' % client_id)
+
+
+class _HostedAgentClient(AgentClient):
+    def __init__(self, io_loop, *args, **kwargs):
+        AgentClient.__init__(self, *args, **kwargs)
+
+        self._io_loop = io_loop
+        self._next_reconnect = None
+
+        self.client.on_socket_open = self._on_socket_open
+        self.client.on_socket_close = self._on_socket_close
+        self.client.on_socket_register_write = self._on_socket_register_write
+        self.client.on_socket_unregister_write = self._on_socket_unregister_write
+
+        io_loop.add_client(self)
+
+    def _start_loop(self):
+        self._should_reconnect = True
+        self._io_loop.start()
+
+    def _stop_loop(self):
+        self._should_reconnect = False
+
+    def _on_socket_open(self, client, userdata, sock):
+        AgentClient._on_socket_open(self, client, userdata, sock)
+        self._io_loop.call_soon(self._io_loop.register, sock, self)
+
+    def _on_socket_close(self, client, userdata, sock):
+        self._io_loop.call_soon(self._io_loop.unregister, sock)
+
+    def _on_socket_register_write(self, client, userdata, sock):
+        self._io_loop.call_soon(self._io_loop.set_write, sock, self, True)
+
+    def _on_socket_unregister_write(self, client, userdata, sock):
+        self._io_loop.call_soon(self._io_loop.set_write, sock, self, False)
+
+    def _in_network_thread(self):
+        return self._io_loop.in_io_thread()
+
+    def _watch_method_deadlines(self):
+        # Expired calls are answered by _tick(), without a thread per agent
+        pass
+
+    def _watch_trail_aggregation(self, aggregator):
+        # Aggregates are sent by _tick(), without a thread per agent
+        pass
+
+    def _tick(self, now):
+        self._answer_expired_method_calls()
+
+        aggregator = self._trail_aggregator
+
+        if aggregator is not None:
+            aggregator.emit_due(now)
+
+        if self.client.socket() is not None:
+            self.client.loop_misc()
+            return
+
+        if not self._should_reconnect:
+            return
+
+        if self._next_reconnect is None:
+            delay = self._schedule_reconnect()
+
+            if delay is not None:
+                self._next_reconnect = now + delay
+
+            return
+
+        if now < self._next_reconnect:
+            return
+
+        wait = self._reconnect_policy.acquire()
+
+        if wait > 0:
+            self._next_reconnect = now + wait
+            return
+
+        self._next_reconnect = None
+        self._connecting = True
+        self._reset_topic_aliases()
+
+        try:
+            self.client.reconnect()
+        except socket.error as e:
+            self._connecting = False
+            self.logger.warning("Failed to reconnect %s to Veides: %s", self.client_id, e)
+            self._connection_failed(e)
+
+
+class _IoLoop(object):
+    def __init__(self, name, logger):
+        """
+        Selector loop driving sockets of many Paho clients from a single thread
+
+        :param name: Thread name
+        :type name: str
+        :param logger: SDK logger
+        :type logger: logging.Logger
+        """
+        self._name = name
+        self._logger = logger
+        self._selector = selectors.DefaultSelector()
+        self._calls = collections.deque()
+        self._clients = set()
+        self._thread = None
+        self._running = False
+        self._lock = threading.Lock()
+
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._wake_w.setblocking(False)
+        self._selector.register(self._wake_r, selectors.EVENT_READ)
+
+    def start(self):
+        with self._lock:
+            if self._running:
+                return
+
+            self._running = True
+            self._thread = threading.Thread(target=self._run, name=self._name, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        with self._lock:
+            if not self._running:
+                return
+
+            self._running = False
+
+        self._wake()
+
+        if self._thread is not threading.current_thread():
+            self._thread.join()
+
+        self._run_calls()
+
+    def add_client(self, client):
+        self.call_soon(self._clients.add, client)
+
+    def remove_client(self, client):
+        self.call_soon(self._clients.discard, client)
+
+    def in_io_thread(self):
+        """
+        :return bool True when called by the I/O thread
+        """
+        return self._thread is threading.current_thread()
+
+    def call_soon(self, func, *args):
+        """
+        Schedule a call in I/O thread. Executed immediately when already in I/O thread
+
+        :return void
+        """
+        if self.in_io_thread():
+            func(*args)
+            return
+
+        self._calls.append((func, args))
+        self._wake()
+
+    def register(self, sock, client):
+        try:
+            self._selector.register(sock, selectors.EVENT_READ, client)
+        except (KeyError, ValueError):
+            self._selector.modify(sock, selectors.EVENT_READ, client)
+
+    def unregister(self, sock):
+        try:
+            self._selector.unregister(sock)
+        except (KeyError, ValueError):
+            pass
+
+    def set_write(self, sock, client, enabled):
+        events = selectors.EVENT_READ | selectors.EVENT_WRITE if enabled else selectors.EVENT_READ
+
+        try:
+            self._selector.modify(sock, events, client)
+        except (KeyError, ValueError):
+            pass
+
+    def _wake(self):
+        try:
+            self._wake_w.send(b'\x00')
+        except socket.error:
+            # Buffer is full so the loop is going to wake up anyway
+            pass
+
+    def _run_calls(self):
+        while self._calls:
+            func, args = self._calls.popleft()
+            func(*args)
+
+    def _run(self):
+        last_tick = 0
+
+        while self._running:
+            self._run_calls()
+
+            for key, mask in self._selector.select(timeout=1):
+                if key.fileobj is self._wake_r:
+                    try:
+                        while self._wake_r.recv(4096):
+                            pass
+                    except socket.error:
+                        pass
+                    continue
+
+                client = key.data.client
+
+                try:
+                    if mask & selectors.EVENT_READ:
+                        client.loop_read()
+                        key.data._send_deferred()
+
+                    if mask & selectors.EVENT_WRITE and client.socket() is not None:
+                        client.loop_write()
+                except Exception as e:
+                    self._logger.error("Unexpected error in %s: %s", self._name, e)
+
+            now = time.monotonic()
+
+            if now - last_tick >= 1:
+                last_tick = now
+
+                for client in list(self._clients):
+                    try:
+                        client._tick(now)
+                    except Exception as e:
+                        self._logger.error("Unexpected error in %s: %s", self._name, e)
+
+
+def _start_connecting(agent):
+    """
+    Initiates connection of the hosted agent without waiting for acknowledgement
+
+    :param agent: Hosted agent
+    :type agent: _HostedAgentClient
+    :return ConnectionException|None Error when the connection couldn't be initiated
+    """
+    agent.logger.debug("Connecting to %s:%d with client_id %s", agent.host, agent.port, agent.client_id)
+
+    agent.connected.clear()
+    agent._ready.clear()
+    agent._connect_error = None
+    agent._connecting = True
+    agent._reset_topic_aliases()
+
+    try:
+        agent.client.connect(agent.host, port=agent.port, keepalive=60, **agent._connect_args)
+    except socket.error as e:
+        agent._connecting = False
+        error = ConnectionException("Failed to connect to Veides: %s" % str(e))
+        agent._connection_failed(error)
+        return error
+
+    agent._start_loop()
+
+    return None
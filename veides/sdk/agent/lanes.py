@@ -0,0 +1,258 @@
+import collections
+import threading
+import time
+
+
+class PriorityLanes(object):
+    CONTROL = 'control'
+    TELEMETRY = 'telemetry'
+
+    DROP_OLDEST = 'drop_oldest'
+    DROP_NEWEST = 'drop_newest'
+
+    # put() results
+    SEND = 'send'
+    QUEUED = 'queued'
+    DROPPED = 'dropped'
+
+    # Message kinds sent through the control lane by default, other kinds use the telemetry lane
+    CONTROL_KINDS = ('method_response', 'action_completed', 'event')
+
+    def __init__(
+            self,
+            send,
+            can_send,
+            weights=None,
+            max_queued=None,
+            overflow=DROP_OLDEST,
+            control_kinds=CONTROL_KINDS
+    ):
+        """
+        Holds outbound messages back in a control and a telemetry lane while Paho has enough
+        messages to send, so a control message waits for a few messages instead of the whole
+        telemetry backlog. Lanes are drained with smooth weighted round robin, so telemetry
+        isn't starved by a stream of control messages
+
+        :param send: Callable taking lane name, queued message and time (in seconds) it waited in the lane.
+            It's called without holding any lock
+        :type send: callable
+        :param can_send: Callable returning whether another message may be handed over to Paho
+        :type can_send: callable
+        :param weights: Share of sent messages per lane when both lanes have messages waiting,
+            {'control': 8, 'telemetry': 1} by default
+        :type weights: dict
+        :param max_queued: Maximum number of messages waiting per lane,
+            {'control': 1000, 'telemetry': 10000} by default
+        :type max_queued: dict
+        :param overflow: What to drop when a lane is full, DROP_OLDEST or DROP_NEWEST message
+        :type overflow: str
+        :param control_kinds: Message kinds sent through the control lane
+        :type control_kinds: tuple
+        """
+        if not callable(send) or not callable(can_send):
+            raise TypeError('send and can_send should be callable')
+
+        if overflow not in (self.DROP_OLDEST, self.DROP_NEWEST):
+            raise ValueError('overflow should be one of: drop_oldest, drop_newest')
+
+        limits = {self.CONTROL: 1000, self.TELEMETRY: 10000}
+        limits.update(max_queued or {})
+        shares = {self.CONTROL: 8, self.TELEMETRY: 1}
+        shares.update(weights or {})
+
+        for lane in set(limits) | set(shares):
+            if lane not in (self.CONTROL, self.TELEMETRY):
+                raise ValueError('lane should be one of: control, telemetry')
+
+            if isinstance(limits[lane], bool) or not isinstance(limits[lane], int) or limits[lane] < 1:
+                raise ValueError('%s lane limit should be a positive integer' % lane)
+
+            if isinstance(shares[lane], bool) or not isinstance(shares[lane], int) or shares[lane] < 1:
+                raise ValueError('%s lane weight should be a positive integer' % lane)
+
+        self._send = send
+        self._can_send = can_send
+        self._overflow = overflow
+        self._control_kinds = frozenset(control_kinds)
+        self._lanes = {lane: _Lane(lane, shares[lane], limits[lane]) for lane in (self.CONTROL, self.TELEMETRY)}
+        self._weight = sum(shares.values())
+
+        self._lock = threading.Lock()
+        self._condition = threading.Condition(self._lock)
+        self._queued = 0
+        self._draining = False
+        self._closed = False
+
+    def __len__(self):
+        return self._queued
+
+    def lane(self, kind):
+        """
+        :param kind: Message kind, e.g. "trail"
+        :type kind: str
+        :return str Lane name
+        """
+        return self.CONTROL if kind in self._control_kinds else self.TELEMETRY
+
+    def put(self, kind, message):
+        """
+        Queues the message in its lane, unless lanes are empty and it may be sent at once
+
+        :param kind: Message kind, e.g. "trail"
+        :type kind: str
+        :param message: Message passed to send callable
+        :return tuple SEND, QUEUED or DROPPED and the message dropped to make room for this one (or None)
+        """
+        lane = self._lanes[self.lane(kind)]
+
+        with self._lock:
+            # Messages mustn't overtake queued ones or ones being handed over by the draining thread
+            if self._queued == 0 and not self._draining and not self._closed and self._can_send():
+                lane.sent += 1
+                return self.SEND, None
+
+            dropped = None
+
+            if len(lane.messages) >= lane.max_queued:
+                lane.dropped += 1
+
+                if self._overflow == self.DROP_NEWEST:
+                    return self.DROPPED, None
+
+                dropped = lane.messages.popleft()[0]
+                self._queued -= 1
+
+            lane.messages.append((message, time.monotonic()))
+            lane.queued += 1
+            self._queued += 1
+
+        return self.QUEUED, dropped
+
+    def drain(self):
+        """
+        Sends queued messages while can_send allows it. Only one thread drains at a time,
+        others return at once and their messages are sent by the draining thread
+
+        :return void
+        """
+        with self._lock:
+            if self._draining:
+                return
+
+            self._draining = True
+
+        try:
+            while True:
+                with self._lock:
+                    if self._queued == 0 or self._closed or not self._can_send():
+                        self._draining = False
+
+                        if self._queued == 0:
+                            self._condition.notify_all()
+
+                        return
+
+                    lane = self._next_lane()
+                    message, queued_at = lane.messages.popleft()
+                    lane.sent += 1
+                    self._queued -= 1
+
+                self._send(lane.name, message, time.monotonic() - queued_at)
+        except BaseException:
+            with self._lock:
+                self._draining = False
+
+            raise
+
+    def wait(self, timeout=None):
+        """
+        Block until all queued messages are handed over to Paho
+
+        :param timeout: Maximum time (in seconds) to wait. Waits forever by default
+        :type timeout: float
+        :return bool False on timeout
+        """
+        with self._condition:
+            return self._condition.wait_for(lambda: self._queued == 0 or self._closed, timeout)
+
+    def close(self):
+        """
+        Stop draining lanes
+
+        :return list Messages still queued, in order of sending
+        """
+        with self._condition:
+            self._closed = True
+            messages = []
+
+            while self._queued > 0:
+                lane = self._next_lane()
+                messages.append(lane.messages.popleft()[0])
+                self._queued -= 1
+
+            self._condition.notify_all()
+
+        return messages
+
+    def stats(self):
+        """
+        Returns numbers of queued, sent, dropped and pending messages per lane
+
+        :return dict
+        """
+        with self._lock:
+            return {
+                lane.name: {
+                    'queued': lane.queued,
+                    'sent': lane.sent,
+                    'dropped': lane.dropped,
+                    'pending': len(lane.messages),
+                }
+                for lane in self._lanes.values()
+            }
+
+    def pending(self, lane):
+        """
+        :param lane: Lane name
+        :type lane: str
+        :return int Number of messages waiting in the lane
+        """
+        return len(self._lanes[lane].messages)
+
+    def _next_lane(self):
+        """
+        Picks a non-empty lane with smooth weighted round robin
+
+        :return _Lane
+        """
+        best = None
+        weight = 0
+
+        for lane in self._lanes.values():
+            if not lane.messages:
+                continue
+
+            lane.credit += lane.weight
+            weight += lane.weight
+
+            if best is None or lane.credit > best.credit:
+                best = lane
+
+        best.credit -= weight
+
+        return best
+
+
+class _Lane(object):
+    __slots__ = ('name', 'weight', 'max_queued', 'messages', 'credit', 'queued', 'sent', 'dropped')
+
+    def __init__(self, name, weight, max_queued):
+        self.name = name
+        self.weight = weight
+        self.max_queued = max_queued
+        # (message, time.monotonic() it was queued at)
+        self.messages = collections.deque()
+        self.credit = 0
+        self.queued = 0
+        self.sent = 0
+        self.dropped = 0
@@ -0,0 +1,176 @@
+import collections
+import heapq
+import itertools
+import threading
+import time
+
+
+class MethodCall(object):
+    __slots__ = ('id', 'name', 'payload', 'correlation_data', 'deadline')
+
+    def __init__(self, id, name, payload, correlation_data=None, deadline=None):
+        """
+        Received method call waiting for response. Handlers registered with
+        on_method(..., with_call=True) get it instead of the payload and answer
+        the call with send_method_response(name, payload, call_id=call.id)
+
+        :param id: Call id, unique within the client
+        :type id: int
+        :param name: Method name
+        :type name: str
+        :param payload: Decoded method payload
+        :param correlation_data: Correlation data of the call (MQTT v5 only), sent back with the response
+        :type correlation_data: bytes
+        :param deadline: time.monotonic() after which the call is answered with 504 code, None without deadline
+        :type deadline: float
+        """
+        self.id = id
+        self.name = name
+        self.payload = payload
+        self.correlation_data = correlation_data
+        self.deadline = deadline
+
+    def __repr__(self):
+        return 'MethodCall(id=%d, name=%r)' % (self.id, self.name)
+
+    def time_left(self):
+        """
+        :return float|None Seconds left until the deadline, None without deadline
+        """
+        if self.deadline is None:
+            return None
+
+        return max(0.0, self.deadline - time.monotonic())
+
+
+class MethodCallTable(object):
+    def __init__(self, max_pending=100):
+        """
+        Method calls waiting for response, in order of arrival per method name. Calls with
+        a deadline are returned by expired() once it passes and can't be popped afterwards,
+        so they're answered only once. A response without call id answers the oldest call,
+        so handlers answering concurrent calls of one method out of order should pass call ids
+
+        :param max_pending: Maximum number of calls of a single method waiting for response.
+            The oldest call is forgotten when a new one exceeds the limit
+        :type max_pending: int
+        """
+        self._max_pending = max_pending
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        # Method name -> call id -> call, in order of arrival
+        self._calls = {}
+        # (deadline, call id, method name) of calls with deadline
+        self._deadlines = []
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(calls) for calls in self._calls.values())
+
+    def add(self, name, payload, correlation_data=None, timeout=None):
+        """
+        :param name: Method name
+        :type name: str
+        :param payload: Decoded method payload
+        :param correlation_data: Correlation data of the call (MQTT v5 only)
+        :type correlation_data: bytes
+        :param timeout: Time (in seconds) the call waits for response, no deadline by default
+        :type timeout: float
+        :return tuple Added call and the call forgotten to make room for it (or None)
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        call = MethodCall(next(self._ids), name, payload, correlation_data, deadline)
+        dropped = None
+
+        with self._lock:
+            calls = self._calls.get(name)
+
+            if calls is None:
+                calls = self._calls[name] = collections.OrderedDict()
+            elif len(calls) >= self._max_pending:
+                dropped = calls.popitem(last=False)[1]
+
+            calls[call.id] = call
+
+            if deadline is not None:
+                heapq.heappush(self._deadlines, (deadline, call.id, name))
+
+        return call, dropped
+
+    def pop(self, name, call_id=None, now=None):
+        """
+        :param name: Method name
+        :type name: str
+        :param call_id: Id of the call, the oldest call of the method which deadline didn't pass by default
+        :type call_id: int
+        :param now: Current time.monotonic()
+        :type now: float
+        :return MethodCall|None The call or None when it was answered, expired or never received
+        """
+        now = time.monotonic() if now is None else now
+
+        with self._lock:
+            calls = self._calls.get(name)
+
+            if not calls:
+                return None
+
+            if call_id is None:
+                call = next((call for call in calls.values() if not _expired(call, now)), None)
+            else:
+                call = calls.get(call_id)
+
+            # Calls which deadline passed are left to expired(), so they're answered with timeout
+            if call is None or _expired(call, now):
+                return None
+
+            del calls[call.id]
+
+            if not calls:
+                del self._calls[name]
+
+            return call
+
+    def expired(self, now=None, on_expired=None):
+        """
+        Removes and returns calls which deadline passed
+
+        :param now: Current time.monotonic()
+        :type now: float
+        :param on_expired: Called with every expired call before it's removed,
+            e.g. to count timeouts consistently with the number of pending calls
+        :type on_expired: callable
+        :return list
+        """
+        now = time.monotonic() if now is None else now
+        expired = []
+
+        with self._lock:
+            while self._deadlines and self._deadlines[0][0] <= now:
+                _, call_id, name = heapq.heappop(self._deadlines)
+                calls = self._calls.get(name)
+
+                # Already answered or forgotten
+                if calls is None or call_id not in calls:
+                    continue
+
+                if on_expired is not None:
+                    on_expired(calls[call_id])
+
+                expired.append(calls.pop(call_id))
+
+                if not calls:
+                    del self._calls[name]
+
+        return expired
+
+    def next_deadline(self):
+        """
+        :return float|None Earliest deadline of pending calls (it may be answered already)
+        """
+        with self._lock:
+            return self._deadlines[0][0] if self._deadlines else None
+
+
+def _expired(call, now):
+    return call.deadline is not None and call.deadline <= now
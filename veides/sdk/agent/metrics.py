@@ -0,0 +1,445 @@
+import bisect
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+# Upper bounds (in seconds) of latency histogram buckets
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+RECONNECT_DELAY_BUCKETS = (0.1, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+
+class Counter(object):
+    __slots__ = ('_value', '_lock')
+
+    def __init__(self):
+        self._value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self._value += amount
+
+    def value(self):
+        return self._value
+
+
+class Histogram(object):
+    __slots__ = ('_bounds', '_counts', '_sum', '_count', '_lock')
+
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        """
+        :param bounds: Sorted upper bounds of buckets. Values above the last one fall into +Inf bucket
+        :type bounds: tuple
+        """
+        self._bounds = tuple(bounds)
+        self._counts = [0] * (len(self._bounds) + 1)
+        self._sum = 0.0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self._bounds, value)
+
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+            self._count += 1
+
+    def value(self):
+        """
+        Returns number and sum of observed values and cumulative bucket counts
+
+        :return dict
+        """
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+            count = self._count
+
+        buckets = {}
+        cumulative = 0
+
+        for bound, bucket_count in zip(self._bounds + (float('inf'),), counts):
+            cumulative += bucket_count
+            buckets[bound] = cumulative
+
+        return {'count': count, 'sum': total, 'buckets': buckets}
+
+
+class Gauge(object):
+    __slots__ = ('_funcs',)
+
+    def __init__(self):
+        """
+        Sum of values returned by registered callables, e.g. queue depths of all clients sharing a registry
+        """
+        self._funcs = []
+
+    def add(self, func):
+        """
+        :param func: Callable returning current value, called on every export
+        :type func: callable
+        :return void
+        """
+        self._funcs.append(func)
+
+    def remove(self, func):
+        """
+        :param func: Registered callable
+        :type func: callable
+        :return int Number of callables left
+        """
+        if func in self._funcs:
+            self._funcs.remove(func)
+
+        return len(self._funcs)
+
+    def value(self):
+        return sum(func() for func in list(self._funcs))
+
+
+class MetricFamily(object):
+    def __init__(self, name, description, kind, label=None, factory=None):
+        """
+        Metrics of the same name, optionally split by a single label
+
+        :param name: Metric name
+        :type name: str
+        :param description: Help text
+        :type description: str
+        :param kind: Prometheus metric type: counter, histogram or gauge
+        :type kind: str
+        :param label: Label name, e.g. "kind"
+        :type label: str
+        :param factory: Callable creating metric of a label value
+        :type factory: callable
+        """
+        self.name = name
+        self.description = description
+        self.kind = kind
+        self.label = label
+        self._factory = factory
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def labels(self, value=None):
+        """
+        :param value: Label value
+        :type value: str
+        :return Counter|Histogram|Gauge
+        """
+        metric = self._metrics.get(value)
+
+        if metric is None:
+            with self._lock:
+                metric = self._metrics.get(value)
+
+                if metric is None:
+                    metric = self._metrics[value] = self._factory()
+
+        return metric
+
+    def items(self):
+        with self._lock:
+            return list(self._metrics.items())
+
+
+class MetricsRegistry(object):
+    def __init__(self):
+        """
+        Collects SDK metrics. Exported as a dictionary (snapshot()) or in Prometheus
+        text format (prometheus_text(), start_http_server())
+        """
+        self._families = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name, description, label=None):
+        """
+        :param name: Metric name
+        :type name: str
+        :param description: Help text
+        :type description: str
+        :param label: Label name
+        :type label: str
+        :return MetricFamily
+        """
+        return self._family(name, description, 'counter', label, Counter)
+
+    def histogram(self, name, description, label=None, bounds=LATENCY_BUCKETS):
+        """
+        :param name: Metric name
+        :type name: str
+        :param description: Help text
+        :type description: str
+        :param label: Label name
+        :type label: str
+        :param bounds: Sorted upper bounds of buckets
+        :type bounds: tuple
+        :return MetricFamily
+        """
+        return self._family(name, description, 'histogram', label, lambda: Histogram(bounds))
+
+    def gauge(self, name, description, func):
+        """
+        Register a gauge which value is read when metrics are exported. When the gauge
+        is already registered, values of both callables are summed up
+
+        :param name: Metric name
+        :type name: str
+        :param description: Help text
+        :type description: str
+        :param func: Callable returning current value
+        :type func: callable
+        :return MetricFamily
+        """
+        family = self._family(name, description, 'gauge', None, Gauge)
+        family.labels().add(func)
+
+        return family
+
+    def remove_gauge(self, name, func):
+        """
+        Unregister the callable of a gauge, e.g. of a client which stopped collecting metrics.
+        The gauge is removed when no callable is left
+
+        :param name: Metric name
+        :type name: str
+        :param func: Callable registered with gauge()
+        :type func: callable
+        :return void
+        """
+        with self._lock:
+            family = self._families.get(name)
+
+            if family is not None and family.kind == 'gauge' and family.labels().remove(func) == 0:
+                del self._families[name]
+
+    def snapshot(self):
+        """
+        Returns current values of all metrics. Metrics with a label are returned
+        as dictionaries keyed by label value
+
+        :return dict
+        """
+        snapshot = {}
+
+        for family in self._sorted_families():
+            if family.label is None:
+                snapshot[family.name] = family.labels().value()
+            else:
+                snapshot[family.name] = {value: metric.value() for value, metric in family.items()}
+
+        return snapshot
+
+    def prometheus_text(self):
+        """
+        Returns all metrics in Prometheus text exposition format
+
+        :return str
+        """
+        lines = []
+
+        for family in self._sorted_families():
+            lines.append('# HELP %s %s' % (family.name, family.description))
+            lines.append('# TYPE %s %s' % (family.name, family.kind))
+
+            for value, metric in sorted(family.items(), key=lambda item: str(item[0])):
+                labels = [] if family.label is None else [(family.label, value)]
+
+                if family.kind != 'histogram':
+                    lines.append('%s%s %s' % (family.name, _format_labels(labels), _format_value(metric.value())))
+                    continue
+
+                histogram = metric.value()
+
+                for bound, count in histogram['buckets'].items():
+                    bucket_labels = labels + [('le', '+Inf' if bound == float('inf') else repr(bound))]
+                    lines.append('%s_bucket%s %d' % (family.name, _format_labels(bucket_labels), count))
+
+                lines.append('%s_sum%s %s' % (family.name, _format_labels(labels), _format_value(histogram['sum'])))
+                lines.append('%s_count%s %d' % (family.name, _format_labels(labels), histogram['count']))
+
+        return '\n'.join(lines) + '\n'
+
+    def start_http_server(self, port, host='127.0.0.1'):
+        """
+        Serve metrics in Prometheus text format from a background thread
+
+        :param port: Port to listen on. 0 picks a free port
+        :type port: int
+        :param host: Address to listen on
+        :type host: str
+        :return http.server.HTTPServer Server, stopped with shutdown()
+        """
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = registry.prometheus_text().encode('utf-8')
+
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = _ThreadingHTTPServer((host, port), Handler)
+
+        thread = threading.Thread(target=server.serve_forever, name='veides-metrics', daemon=True)
+        thread.start()
+
+        return server
+
+    def _family(self, name, description, kind, label, factory):
+        with self._lock:
+            family = self._families.get(name)
+
+            if family is None:
+                family = self._families[name] = MetricFamily(name, description, kind, label, factory)
+            elif family.kind != kind or family.label != label:
+                raise ValueError('metric %s is already registered with different type or label' % name)
+
+            return family
+
+    def _sorted_families(self):
+        with self._lock:
+            return [self._families[name] for name in sorted(self._families)]
+
+
+class ClientMetrics(object):
+    def __init__(self, registry):
+        """
+        Metrics collected by a single client
+
+        :param registry: Registry metrics are stored in
+        :type registry: MetricsRegistry
+        """
+        self.registry = registry
+
+        self._sent = registry.counter('veides_messages_sent_total', 'Messages handed over to Paho', 'kind')
+        self._failed = registry.counter('veides_messages_failed_total', 'Messages which could not be sent', 'kind')
+        self._received = registry.counter('veides_messages_received_total', 'Received messages', 'kind')
+        self._bytes_sent = registry.counter('veides_bytes_sent_total', 'Topic and payload bytes of sent messages')
+        self._bytes_received = registry.counter(
+            'veides_bytes_received_total',
+            'Topic and payload bytes of received messages'
+        )
+        self._latency = registry.histogram(
+            'veides_publish_latency_seconds',
+            'Time from publishing to acknowledgement (QoS 1) or writing to the socket (QoS 0)',
+            'qos'
+        )
+        self._handler_time = registry.histogram(
+            'veides_handler_duration_seconds',
+            'Action and method handlers execution time',
+            'handler'
+        )
+        self._handler_errors = registry.counter('veides_handler_errors_total', 'Failed handler calls', 'handler')
+        self._method_timeouts = registry.counter(
+            'veides_method_timeouts_total',
+            'Method calls answered with timeout code',
+            'method'
+        )
+        self._lane_wait = registry.histogram(
+            'veides_lane_wait_seconds',
+            'Time messages waited in priority lanes before they were handed over to Paho',
+            'lane'
+        )
+        self._dedup_hits = registry.counter(
+            'veides_dedup_hits_total',
+            'Received messages dropped as redelivered',
+            'kind'
+        )
+        self._dedup_misses = registry.counter(
+            'veides_dedup_misses_total',
+            'Received messages checked for redelivery and handled',
+            'kind'
+        )
+        self._connects = registry.counter('veides_connects_total', 'Successful connections')
+        self._reconnects = registry.counter('veides_reconnects_total', 'Successful connections after the first one')
+        self._disconnects = registry.counter('veides_disconnects_total', 'Unexpected disconnections')
+        self._connect_attempts = registry.counter(
+            'veides_connect_attempts_total',
+            'Finished connection attempts',
+            'result'
+        )
+        self._reconnect_delay = registry.histogram(
+            'veides_reconnect_delay_seconds',
+            'Delays before connection attempts chosen by reconnect policy',
+            bounds=RECONNECT_DELAY_BUCKETS
+        )
+
+        self._ever_connected = False
+
+    def message_sent(self, kind):
+        self._sent.labels(kind).inc()
+
+    def bytes_sent(self, size):
+        self._bytes_sent.labels().inc(size)
+
+    def message_failed(self, kind):
+        self._failed.labels(kind).inc()
+
+    def message_received(self, kind, size):
+        self._received.labels(kind).inc()
+        self._bytes_received.labels().inc(size)
+
+    def message_delivered(self, qos, latency):
+        self._latency.labels(str(qos)).observe(latency)
+
+    def handler_executed(self, key, execution_time, failed):
+        self._handler_time.labels(key).observe(execution_time)
+
+        if failed:
+            self._handler_errors.labels(key).inc()
+
+    def method_timed_out(self, name):
+        self._method_timeouts.labels(name).inc()
+
+    def lane_waited(self, lane, waited):
+        self._lane_wait.labels(lane).observe(waited)
+
+    def message_deduplicated(self, kind, duplicate):
+        if duplicate:
+            self._dedup_hits.labels(kind).inc()
+        else:
+            self._dedup_misses.labels(kind).inc()
+
+    def connected(self):
+        self._connects.labels().inc()
+
+        if self._ever_connected:
+            self._reconnects.labels().inc()
+
+        self._ever_connected = True
+
+    def disconnected(self):
+        self._disconnects.labels().inc()
+
+    def connect_attempt(self, succeeded):
+        self._connect_attempts.labels('success' if succeeded else 'failure').inc()
+
+    def reconnect_scheduled(self, delay):
+        self._reconnect_delay.labels().observe(delay)
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+
+    return '{%s}' % ','.join('%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                             for name, value in labels)
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        return repr(value)
+
+    return str(value)
@@ -0,0 +1,338 @@
+import collections
+import os
+import struct
+import threading
+
+
+class Outbox(object):
+    DROP_OLDEST = 'drop_oldest'
+    DROP_NEWEST = 'drop_newest'
+
+    def __init__(self, path=None, max_messages=10000, overflow=DROP_OLDEST, fsync=False):
+        """
+        Bounded queue of messages sent in disconnected state. When path is given
+        messages are also appended to a segment file, so they survive process restart
+
+        :param path: Segment file path. Messages are kept in memory only by default
+        :type path: str
+        :param max_messages: Maximum number of queued messages
+        :type max_messages: int
+        :param overflow: What to drop when the queue is full, DROP_OLDEST or DROP_NEWEST
+        :type overflow: str
+        :param fsync: Call fsync() after every appended message
+        :type fsync: bool
+        """
+        if not isinstance(max_messages, int) or max_messages < 1:
+            raise ValueError('max_messages should be a positive integer')
+
+        if overflow not in (self.DROP_OLDEST, self.DROP_NEWEST):
+            raise ValueError('overflow should be one of: drop_oldest, drop_newest')
+
+        self._max_messages = max_messages
+        self._overflow = overflow
+        self._lock = threading.Lock()
+        self._messages = collections.deque()
+        self._segment = None
+        # The oldest message is being sent and mustn't be dropped
+        self._sending = False
+        # End offset of the last message dropped behind the one being sent
+        self._skipped = None
+
+        self._queued = 0
+        self._dropped = 0
+        self._sent = 0
+
+        if path is not None:
+            self._segment = SegmentFile(path, fsync=fsync)
+
+            for message in self._segment.read():
+                if len(self._messages) >= self._max_messages:
+                    self._drop_oldest()
+
+                self._messages.append(message + (None,))
+
+    def __len__(self):
+        return len(self._messages)
+
+    def put(self, topic, payload, qos, handle=None):
+        """
+        :param topic: Message topic
+        :type topic: str
+        :param payload: Encoded message payload
+        :type payload: bytes
+        :param qos: Message QoS
+        :type qos: int
+        :param handle: Delivery handle of the message, failed when the message is dropped
+        :type handle: DeliveryHandle
+        :return bool False when the message was dropped
+        """
+        with self._lock:
+            if len(self._messages) >= self._max_messages:
+                if self._overflow == self.DROP_NEWEST or (self._sending and len(self._messages) == 1):
+                    self._dropped += 1
+                    return False
+
+                self._drop_oldest()
+
+            offset = None
+
+            if self._segment is not None:
+                offset = self._segment.append(topic, payload, qos)
+
+            self._messages.append((topic, payload, qos, offset, handle))
+            self._queued += 1
+
+            return True
+
+    def peek(self):
+        """
+        Returns the oldest message as (topic, payload, qos) tuple or None when the queue is empty
+
+        :return tuple|None
+        """
+        with self._lock:
+            if not self._messages:
+                return None
+
+            return self._messages[0][:3]
+
+    def sending(self):
+        """
+        Returns the oldest message like peek() and keeps it from being dropped
+        until it's removed with pop() or released with release()
+
+        :return tuple|None
+        """
+        with self._lock:
+            if not self._messages:
+                return None
+
+            self._sending = True
+
+            return self._messages[0][:3]
+
+    def release(self):
+        """
+        Let the oldest message be dropped again after sending it failed
+
+        :return void
+        """
+        with self._lock:
+            self._sending = False
+
+    def pop(self):
+        """
+        Remove the oldest message after it was sent
+
+        :return DeliveryHandle|None Delivery handle of removed message
+        """
+        with self._lock:
+            if not self._messages:
+                return None
+
+            message = self._messages.popleft()
+            self._sent += 1
+            self._sending = False
+            skipped = self._skipped
+            self._skipped = None
+
+            if self._segment is not None:
+                if self._messages:
+                    self._segment.advance(message[3] if skipped is None else max(message[3], skipped))
+                else:
+                    self._segment.truncate()
+
+            return message[4]
+
+    def close(self):
+        with self._lock:
+            if self._segment is not None:
+                self._segment.close()
+
+    def stats(self):
+        """
+        :return dict
+        """
+        with self._lock:
+            return {
+                'queued': self._queued,
+                'sent': self._sent,
+                'dropped': self._dropped,
+                'pending': len(self._messages),
+            }
+
+    def _drop_oldest(self):
+        if self._sending:
+            # Drop the oldest message waiting behind the one being sent. The segment
+            # can't advance past the message being sent, so it's advanced by pop()
+            message = self._messages[1]
+            del self._messages[1]
+            self._skipped = message[3]
+        else:
+            message = self._messages.popleft()
+
+            if self._segment is not None:
+                self._segment.advance(message[3])
+
+        self._dropped += 1
+
+        if message[4] is not None:
+            message[4]._complete(False)
+
+
+class SegmentFile(object):
+    HEADER = struct.Struct('!BHI')
+
+    # Rewrite the file when this many consumed bytes precede the first pending message
+    COMPACT_THRESHOLD = 4 * 1024 * 1024
+
+    # Persist head position after this many consumed messages. After a crash
+    # at most this many already sent messages are sent again
+    HEAD_SYNC_INTERVAL = 64
+
+    def __init__(self, path, fsync=False):
+        """
+        Append-only file of messages. Position of the first pending message is stored in "<path>.head".
+        Offsets returned by this class are logical: they don't change when the file is compacted
+
+        :param path: File path
+        :type path: str
+        :param fsync: Call fsync() after every append
+        :type fsync: bool
+        """
+        self._path = path
+        self._fsync = fsync
+        self._file = open(path, 'ab')
+        self._head_file = open(path + '.head', 'a+b')
+        self._head = self._read_head()
+        self._base = 0
+        self._unsynced = 0
+
+    def read(self):
+        """
+        Returns pending messages as (topic, payload, qos, end_offset) tuples.
+        Trailing incomplete message (e.g. after a crash) is discarded
+
+        :return list
+        """
+        messages = []
+        size = self._file.tell()
+
+        if self._head > size:
+            self._head = 0
+
+        offset = self._head
+
+        with open(self._path, 'rb') as f:
+            f.seek(offset)
+
+            while True:
+                header = f.read(self.HEADER.size)
+
+                if len(header) < self.HEADER.size:
+                    break
+
+                qos, topic_length, payload_length = self.HEADER.unpack(header)
+                body = f.read(topic_length + payload_length)
+
+                if len(body) < topic_length + payload_length:
+                    break
+
+                offset += self.HEADER.size + len(body)
+                messages.append((body[:topic_length].decode('utf-8'), body[topic_length:], qos, offset))
+
+        if offset != size:
+            self._file.truncate(offset)
+            self._file.seek(offset)
+
+        return messages
+
+    def append(self, topic, payload, qos):
+        """
+        :param topic: Message topic
+        :type topic: str
+        :param payload: Encoded message payload
+        :type payload: bytes|str
+        :param qos: Message QoS
+        :type qos: int
+        :return int Offset of the end of appended message
+        """
+        if isinstance(payload, str):
+            payload = payload.encode('utf-8')
+
+        topic = topic.encode('utf-8')
+
+        self._file.write(self.HEADER.pack(qos, len(topic), len(payload)) + topic + payload)
+        self._file.flush()
+
+        if self._fsync:
+            os.fsync(self._file.fileno())
+
+        return self._base + self._file.tell()
+
+    def advance(self, offset):
+        """
+        Mark messages up to offset as consumed
+
+        :param offset: End offset of consumed message
+        :type offset: int
+        :return void
+        """
+        self._head = offset - self._base
+        self._unsynced += 1
+
+        if self._head >= self.COMPACT_THRESHOLD and self._head * 2 >= self._file.tell():
+            self._compact()
+        elif self._unsynced >= self.HEAD_SYNC_INTERVAL:
+            self._write_head()
+
+    def truncate(self):
+        """
+        Mark all messages as consumed
+
+        :return void
+        """
+        self._base += self._file.tell()
+        self._file.truncate(0)
+        self._file.seek(0)
+        self._head = 0
+        self._write_head()
+
+    def close(self):
+        self._write_head()
+        self._file.close()
+        self._head_file.close()
+
+    def _compact(self):
+        with open(self._path, 'rb') as f:
+            f.seek(self._head)
+            pending = f.read()
+
+        tmp_path = self._path + '.tmp'
+
+        with open(tmp_path, 'wb') as f:
+            f.write(pending)
+
+        self._file.close()
+        os.replace(tmp_path, self._path)
+        self._file = open(self._path, 'ab')
+
+        self._base += self._head
+        self._head = 0
+        self._write_head()
+
+    def _read_head(self):
+        self._head_file.seek(0)
+        data = self._head_file.read(8)
+
+        if len(data) < 8:
+            return 0
+
+        return struct.unpack('!Q', data)[0]
+
+    def _write_head(self):
+        self._head_file.seek(0)
+        self._head_file.truncate()
+        self._head_file.write(struct.pack('!Q', self._head))
+        self._head_file.flush()
+        self._unsynced = 0
@@ -60,15 +60,24 @@ class AgentProperties:
 
 
 class ConnectionProperties:
-    def __init__(self, host, capath="/etc/ssl/certs"):
+    def __init__(self, host, capath="/etc/ssl/certs", port=None, use_tls=True, mqtt_v5=False):
         """
         :param host: Hostname used to connect to Veides
         :type host: str
         :param capath: Path to certificates directory
         :type capath: str
+        :param port: Port used to connect to Veides. Defaults to 8883 (TLS) or 1883 (plain TCP)
+        :type port: int
+        :param use_tls: Whether to use encrypted connection
+        :type use_tls: bool
+        :param mqtt_v5: Whether to use MQTT v5 instead of MQTT 3.1.1
+        :type mqtt_v5: bool
         """
         self._host = host
         self._capath = capath
+        self._port = port
+        self._use_tls = use_tls
+        self._mqtt_v5 = mqtt_v5
 
     @property
     def host(self):
@@ -78,19 +87,40 @@ class ConnectionProperties:
     def capath(self):
         return self._capath
 
+    @property
+    def port(self):
+        return self._port
+
+    @property
+    def use_tls(self):
+        return self._use_tls
+
+    @property
+    def mqtt_v5(self):
+        return self._mqtt_v5
+
     @staticmethod
     def from_env():
         """
         Returns ConnectionProperties instance built from env variables. Required variables are:
             1. VEIDES_CLIENT_HOST: Hostname used to connect to Veides
 
+        Optional variables are VEIDES_CLIENT_CAPATH and VEIDES_CLIENT_PORT
+
         :raises ConfigurationException: If required variables are not provided
         :return ConnectionProperties
         """
         host = os.getenv('VEIDES_CLIENT_HOST', None)
         capath = os.getenv('VEIDES_CLIENT_CAPATH', "/etc/ssl/certs")
+        port = os.getenv('VEIDES_CLIENT_PORT', None)
 
         if host is None:
             raise ConfigurationException("Missing 'VEIDES_CLIENT_HOST' variable in env")
 
-        return ConnectionProperties(host, capath)
+        if port is not None:
+            try:
+                port = int(port)
+            except ValueError:
+                raise ConfigurationException("Invalid 'VEIDES_CLIENT_PORT' variable in env")
+
+        return ConnectionProperties(host, capath, port=port)
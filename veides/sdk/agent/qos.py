@@ -0,0 +1,44 @@
+class QosPolicy(object):
+    def __init__(self, method_response=1, action_completed=1, event=1, facts=1, trail=1, trails=None):
+        """
+        QoS of messages sent by AgentClient per message type. QoS 0 messages are sent
+        once without acknowledgement, so they don't wait for PUBACK and don't occupy
+        Paho's in-flight window. It suits high-frequency trails where losing a sample is harmless
+
+        :param method_response: QoS of method responses
+        :type method_response: int
+        :param action_completed: QoS of action completed messages
+        :type action_completed: int
+        :param event: QoS of events
+        :type event: int
+        :param facts: QoS of facts
+        :type facts: int
+        :param trail: QoS of trails
+        :type trail: int
+        :param trails: Per trail name QoS, overriding trail
+        :type trails: dict
+        """
+        self.method_response = _validate_qos(method_response, 'method_response')
+        self.action_completed = _validate_qos(action_completed, 'action_completed')
+        self.event = _validate_qos(event, 'event')
+        self.facts = _validate_qos(facts, 'facts')
+        self.trail = _validate_qos(trail, 'trail')
+        self._trails = {}
+
+        for name, qos in (trails or {}).items():
+            self._trails[name] = _validate_qos(qos, 'trail %s' % name)
+
+    def trail_qos(self, name):
+        """
+        :param name: Trail name
+        :type name: str
+        :return int
+        """
+        return self._trails.get(name, self.trail)
+
+
+def _validate_qos(qos, kind):
+    if isinstance(qos, bool) or not isinstance(qos, int) or qos not in (0, 1, 2):
+        raise ValueError('%s QoS should be one of: 0, 1, 2' % kind)
+
+    return qos
@@ -0,0 +1,366 @@
+import itertools
+import threading
+import time
+from collections import Counter, OrderedDict
+
+
+class TokenBucket(object):
+    __slots__ = ('rate', 'capacity', '_tokens', '_updated')
+
+    def __init__(self, rate, capacity):
+        """
+        :param rate: Number of tokens added per second
+        :type rate: int|float
+        :param capacity: Maximum number of tokens, i.e. allowed burst
+        :type capacity: int|float
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+
+    def take(self, now):
+        """
+        :param now: Current monotonic time
+        :type now: float
+        :return bool False when there's no token available
+        """
+        self._refill(now)
+
+        if self._tokens < 1:
+            return False
+
+        self._tokens -= 1
+
+        return True
+
+    def wait_time(self, now):
+        """
+        :param now: Current monotonic time
+        :type now: float
+        :return float Time (in seconds) until a token is available
+        """
+        self._refill(now)
+
+        if self._tokens >= 1:
+            return 0.0
+
+        return (1 - self._tokens) / self.rate
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+
+class RateLimiter(object):
+    BLOCK = 'block'
+    DROP = 'drop'
+    COALESCE = 'coalesce'
+
+    # acquire() results
+    SEND = 'send'
+    DROPPED = 'dropped'
+    COALESCED = 'coalesced'
+    QUEUED = 'queued'
+
+    # Message kinds which may be coalesced. Every trail has its own topic, so only the latest
+    # value is kept, while facts share one topic, so pending facts are merged
+    COALESCED_KINDS = ('trail', 'facts')
+    # Maximum number of messages queued instead of blocking a caller which mustn't be blocked
+    MAX_QUEUED = 1000
+
+    def __init__(
+            self,
+            publish,
+            rates,
+            burst=None,
+            overflow=BLOCK,
+            max_inflight=None,
+            inflight=None,
+            max_wait=10,
+            can_block=None
+    ):
+        """
+        Limits outbound messages per message kind (trail, facts, event, method_response,
+        action_completed) with token buckets. When max_inflight is given, messages are also
+        held back while the number of messages waiting for acknowledgement is too high
+
+        :param publish: Callable taking topic, data, QoS, kind and correlation_data (keyword arguments),
+            sending coalesced and queued messages
+        :type publish: callable
+        :param rates: Maximum number of messages per second per message kind. Other kinds are not limited
+        :type rates: dict
+        :param burst: Number of messages which may be sent at once (bucket capacity), per kind or for all kinds.
+            Defaults to one second worth of messages
+        :type burst: int|dict
+        :param overflow: What to do with a message above the limit: BLOCK the caller, DROP the message
+            or COALESCE it, i.e. send the latest trail of every name and merged facts when the limit
+            allows it. Other message kinds block the caller when coalescing
+        :type overflow: str
+        :param max_inflight: Number of messages waiting for acknowledgement above which sending is held back
+        :type max_inflight: int
+        :param inflight: Callable returning current number of messages waiting for acknowledgement
+        :type inflight: callable
+        :param max_wait: Maximum time (in seconds) a caller is blocked. The message is dropped afterwards
+        :type max_wait: float
+        :param can_block: Callable returning whether the caller may be blocked. Messages of callers which
+            mustn't be blocked, e.g. the network thread processing acknowledgements, are queued instead
+        :type can_block: callable
+        """
+        if overflow not in (self.BLOCK, self.DROP, self.COALESCE):
+            raise ValueError('overflow should be one of: block, drop, coalesce')
+
+        if max_inflight is not None:
+            if not isinstance(max_inflight, int) or max_inflight < 1:
+                raise ValueError('max_inflight should be a positive integer')
+
+            if not callable(inflight):
+                raise TypeError('inflight should be callable')
+
+        self._publish = publish
+        self._overflow = overflow
+        self._max_inflight = max_inflight
+        self._inflight = inflight
+        self._max_wait = max_wait
+        self._can_block = can_block
+        self._buckets = {}
+
+        for kind, rate in rates.items():
+            if not isinstance(rate, (int, float)) or rate <= 0:
+                raise ValueError('%s rate should be a positive number' % kind)
+
+            capacity = burst.get(kind) if isinstance(burst, dict) else burst
+
+            if capacity is None:
+                capacity = max(rate, 1)
+            elif not isinstance(capacity, (int, float)) or capacity < 1:
+                raise ValueError('%s burst should be at least 1' % kind)
+
+            self._buckets[kind] = TokenBucket(rate, capacity)
+
+        self._lock = threading.Lock()
+        self._condition = threading.Condition(self._lock)
+        # Topic (coalesced message) or topic and sequence number (queued message) ->
+        # (topic, kind, data, qos, correlation_data), in order of sending
+        self._pending = OrderedDict()
+        self._pending_topics = Counter()
+        self._queued = 0
+        self._sequence = itertools.count()
+        self._thread = None
+        self._closed = False
+
+        self._stats = {}
+
+    def acquire(self, kind, topic, data, qos, correlation_data=None):
+        """
+        Decide whether the message may be sent now
+
+        :param kind: Message kind, e.g. "trail"
+        :type kind: str
+        :param topic: Message topic
+        :type topic: str
+        :param data: Message data
+        :param qos: Message QoS
+        :type qos: int
+        :param correlation_data: Correlation data property (MQTT v5 only)
+        :type correlation_data: bytes
+        :return str SEND, DROPPED, COALESCED or QUEUED
+        """
+        bucket = self._buckets.get(kind)
+
+        if bucket is None and self._max_inflight is None:
+            return self.SEND
+
+        coalesce = self._overflow == self.COALESCE and kind in self.COALESCED_KINDS
+
+        with self._condition:
+            # Newer message must not overtake pending messages of the same topic
+            if self._pending_topics[topic] > 0:
+                return self._add_pending(coalesce, topic, kind, data, qos, correlation_data)
+
+            if self._wait_time(bucket, time.monotonic()) == 0:
+                self._take(bucket)
+                return self.SEND
+
+            self._count(kind, 'throttled')
+
+            if self._overflow == self.DROP:
+                self._count(kind, 'dropped')
+                return self.DROPPED
+
+            if coalesce or (self._can_block is not None and not self._can_block()):
+                return self._add_pending(coalesce, topic, kind, data, qos, correlation_data)
+
+        return self._block(kind, bucket)
+
+    def close(self):
+        """
+        Stop sending coalesced messages. Pending messages are dropped
+
+        :return void
+        """
+        with self._condition:
+            self._closed = True
+
+            for _, kind, _, _, _ in self._pending.values():
+                self._count(kind, 'dropped')
+
+            self._pending.clear()
+            self._pending_topics.clear()
+            self._queued = 0
+            self._condition.notify()
+
+    def stats(self):
+        """
+        Returns numbers of throttled, dropped, coalesced and queued messages, in total and per message kind
+
+        :return dict
+        """
+        with self._lock:
+            kinds = {kind: dict(stats) for kind, stats in self._stats.items()}
+
+            return {
+                'throttled': sum(stats['throttled'] for stats in kinds.values()),
+                'dropped': sum(stats['dropped'] for stats in kinds.values()),
+                'coalesced': sum(stats['coalesced'] for stats in kinds.values()),
+                'queued': sum(stats['queued'] for stats in kinds.values()),
+                'pending': len(self._pending),
+                'kinds': kinds,
+            }
+
+    def _add_pending(self, coalesce, topic, kind, data, qos, correlation_data):
+        """
+        Keeps the message to be sent by the rate limiter thread. Called holding the lock
+
+        :return str COALESCED, QUEUED or DROPPED
+        """
+        pending = self._pending.get(topic) if coalesce else None
+
+        if pending is not None:
+            if kind == 'facts':
+                # Facts of all pending messages are sent, the latest value of every fact wins
+                merged = dict(pending[2])
+                merged.update(data)
+                data = merged
+
+            # Replaced message keeps its place, so messages of other topics don't starve
+            self._pending[topic] = (topic, kind, data, qos, correlation_data)
+            self._count(kind, 'coalesced')
+            return self.COALESCED
+
+        if coalesce:
+            key = topic
+            self._count(kind, 'coalesced')
+        else:
+            if self._queued >= self.MAX_QUEUED:
+                self._count(kind, 'dropped')
+                return self.DROPPED
+
+            key = (topic, next(self._sequence))
+            self._queued += 1
+            self._count(kind, 'queued')
+
+        self._pending[key] = (topic, kind, data, qos, correlation_data)
+        self._pending_topics[topic] += 1
+        self._start()
+        self._condition.notify()
+
+        return self.COALESCED if coalesce else self.QUEUED
+
+    def _wait_time(self, bucket, now):
+        if self._max_inflight is not None and self._inflight() >= self._max_inflight:
+            # In-flight count drops on acknowledgements, which aren't signalled here
+            return 0.005
+
+        if bucket is None:
+            return 0.0
+
+        return bucket.wait_time(now)
+
+    def _take(self, bucket):
+        if bucket is not None:
+            bucket.take(time.monotonic())
+
+    def _block(self, kind, bucket):
+        deadline = time.monotonic() + self._max_wait
+
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                delay = self._wait_time(bucket, now)
+
+                if delay == 0:
+                    self._take(bucket)
+                    return self.SEND
+
+                if now + delay > deadline:
+                    self._count(kind, 'dropped')
+                    return self.DROPPED
+
+            time.sleep(delay)
+
+    def _start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='veides-rate-limiter', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while True:
+                    if self._closed:
+                        return
+
+                    if not self._pending:
+                        self._condition.wait()
+                        continue
+
+                    message, delay = self._next_pending(time.monotonic())
+
+                    if message is not None:
+                        break
+
+                    self._condition.wait(delay)
+
+            topic, kind, data, qos, correlation_data = message
+            self._publish(topic, data, qos, kind=kind, correlation_data=correlation_data)
+
+    def _next_pending(self, now):
+        """
+        Takes the oldest pending message which kind isn't limited at the moment
+
+        :return tuple (topic, kind, data, qos, correlation_data) tuple or None and time to wait
+        """
+        min_delay = None
+
+        for key, message in self._pending.items():
+            topic, kind = message[0], message[1]
+            bucket = self._buckets.get(kind)
+            delay = self._wait_time(bucket, now)
+
+            if delay == 0:
+                self._take(bucket)
+                del self._pending[key]
+
+                self._pending_topics[topic] -= 1
+
+                if self._pending_topics[topic] == 0:
+                    del self._pending_topics[topic]
+
+                if isinstance(key, tuple):
+                    self._queued -= 1
+
+                return message, 0.0
+
+            if min_delay is None or delay < min_delay:
+                min_delay = delay
+
+        return None, min_delay
+
+    def _count(self, kind, name):
+        stats = self._stats.get(kind)
+
+        if stats is None:
+            stats = self._stats[kind] = {'throttled': 0, 'dropped': 0, 'coalesced': 0, 'queued': 0}
+
+        stats[name] += 1
@@ -0,0 +1,170 @@
+import random
+import threading
+import time
+
+
+class ReconnectPolicy(object):
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(
+            self,
+            min_delay=1,
+            max_delay=120,
+            jitter=True,
+            max_attempts=None,
+            connect_attempts=1,
+            breaker_threshold=None,
+            breaker_timeout=60
+    ):
+        """
+        Decides when a client tries to (re)connect. Delays grow exponentially from min_delay
+        up to max_delay and with full jitter a random delay between 0 and the current
+        maximum is used, so agents disconnected at the same moment don't reconnect at once.
+
+        When breaker_threshold is given, the policy also works as a circuit breaker: after
+        that many consecutive failed attempts no client using the policy connects for
+        breaker_timeout seconds. Then a single attempt is let through, closing the breaker
+        on success. Share one policy between many agents (e.g. AgentHost agents) to protect
+        the broker from the whole fleet
+
+        :param min_delay: Maximum delay (in seconds) before the first reconnect attempt
+        :type min_delay: float
+        :param max_delay: Upper limit (in seconds) of delays
+        :type max_delay: float
+        :param jitter: Use a random delay between 0 and the exponential delay (full jitter)
+        :type jitter: bool
+        :param max_attempts: Number of consecutive reconnect attempts after which the client gives up.
+            Reconnects forever by default
+        :type max_attempts: int
+        :param connect_attempts: Number of attempts made by connect() before it raises ConnectionException
+        :type connect_attempts: int
+        :param breaker_threshold: Number of consecutive failed attempts opening the circuit breaker.
+            The breaker is disabled by default
+        :type breaker_threshold: int
+        :param breaker_timeout: Time (in seconds) the breaker stays open
+        :type breaker_timeout: float
+        """
+        if not isinstance(min_delay, (int, float)) or min_delay <= 0:
+            raise ValueError('min_delay should be a positive number')
+
+        if not isinstance(max_delay, (int, float)) or max_delay < min_delay:
+            raise ValueError('max_delay should be a number not lower than min_delay')
+
+        if max_attempts is not None and (not isinstance(max_attempts, int) or max_attempts < 1):
+            raise ValueError('max_attempts should be a positive integer')
+
+        if not isinstance(connect_attempts, int) or connect_attempts < 1:
+            raise ValueError('connect_attempts should be a positive integer')
+
+        if breaker_threshold is not None and (not isinstance(breaker_threshold, int) or breaker_threshold < 1):
+            raise ValueError('breaker_threshold should be a positive integer')
+
+        if not isinstance(breaker_timeout, (int, float)) or breaker_timeout <= 0:
+            raise ValueError('breaker_timeout should be a positive number')
+
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.max_attempts = max_attempts
+        self.connect_attempts = connect_attempts
+        self.breaker_threshold = breaker_threshold
+        self.breaker_timeout = breaker_timeout
+
+        self._random = random.Random()
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = None
+
+    @property
+    def state(self):
+        """
+        Circuit breaker state: CLOSED, OPEN or HALF_OPEN
+
+        :return str
+        """
+        return self._state
+
+    def backoff(self, attempt):
+        """
+        :param attempt: Number of the upcoming attempt, starting from 1
+        :type attempt: int
+        :return float Delay (in seconds) before the attempt
+        """
+        delay = min(self.max_delay, self.min_delay * 2 ** min(attempt - 1, 32))
+
+        if self.jitter:
+            return self._random.uniform(0, delay)
+
+        return delay
+
+    def reconnect_delay(self, attempt):
+        """
+        :param attempt: Number of the upcoming reconnect attempt, starting from 1
+        :type attempt: int
+        :return float|None Delay (in seconds) before the attempt, None when the client should give up
+        """
+        if self.max_attempts is not None and attempt > self.max_attempts:
+            return None
+
+        return self.backoff(attempt)
+
+    def connect_delay(self, attempt):
+        """
+        :param attempt: Number of the upcoming retry of connect(), starting from 1
+        :type attempt: int
+        :return float|None Delay (in seconds) before the retry, None when connect() should raise
+        """
+        if attempt >= self.connect_attempts:
+            return None
+
+        return self.backoff(attempt)
+
+    def acquire(self):
+        """
+        Ask the circuit breaker for a permission to connect
+
+        :return float 0 when the attempt may be made, time (in seconds) to wait otherwise
+        """
+        if self.breaker_threshold is None:
+            return 0.0
+
+        with self._lock:
+            if self._state == self.CLOSED:
+                return 0.0
+
+            now = time.monotonic()
+            remaining = self._opened_at + self.breaker_timeout - now
+
+            if remaining > 0:
+                return remaining
+
+            # A single probe attempt is let through per timeout
+            self._state = self.HALF_OPEN
+            self._opened_at = now
+
+            return 0.0
+
+    def record_success(self):
+        """
+        :return void
+        """
+        with self._lock:
+            self._failures = 0
+            self._state = self.CLOSED
+
+    def record_failure(self):
+        """
+        :return void
+        """
+        if self.breaker_threshold is None:
+            return
+
+        with self._lock:
+            self._failures += 1
+
+            if self._state == self.HALF_OPEN or self._failures >= self.breaker_threshold:
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
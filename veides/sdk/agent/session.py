@@ -0,0 +1,109 @@
+import collections
+import threading
+
+from veides.sdk.agent.outbox import SegmentFile
+
+
+class InflightStore(object):
+    # Number of remembered acknowledgements of messages not added yet. Paho's message ids
+    # wrap after 65535 messages, so an id is forgotten long before it's reused
+    MAX_EARLY = 1024
+
+    def __init__(self, path, fsync=False):
+        """
+        Keeps QoS 1 and 2 messages waiting for acknowledgement in a segment file, so they
+        are sent again after process restart. Messages found in the file on start are
+        returned by restored(). Only the oldest pending message moves the file head, so
+        messages acknowledged out of order may be sent again (QoS 1 is at least once anyway)
+
+        :param path: Segment file path
+        :type path: str
+        :param fsync: Call fsync() after every appended message
+        :type fsync: bool
+        """
+        self._segment = SegmentFile(path, fsync=fsync)
+        self._lock = threading.Lock()
+        # Message id (or restored message key) -> (start offset, end offset), in append order
+        self._pending = collections.OrderedDict()
+        # Paho may notify about a message before publish() returns its mid
+        self._early = collections.OrderedDict()
+        self._restored = collections.OrderedDict()
+
+        for index, (topic, payload, qos, end) in enumerate(self._segment.read()):
+            key = ('restored', index)
+            self._pending[key] = (end - _record_size(topic, payload), end)
+            self._restored[key] = (topic, payload, qos)
+
+    def __len__(self):
+        return len(self._pending)
+
+    def restored(self):
+        """
+        Returns messages left unacknowledged by previous process as (key, topic, payload, qos)
+        tuples. Remove them with remove(key) after they are sent again
+
+        :return list
+        """
+        with self._lock:
+            return [(key,) + message for key, message in self._restored.items()]
+
+    def add(self, mid, topic, payload, qos):
+        """
+        :param mid: Paho message id
+        :type mid: int
+        :param topic: Message topic
+        :type topic: str
+        :param payload: Encoded message payload
+        :type payload: bytes|str
+        :param qos: Message QoS
+        :type qos: int
+        :return void
+        """
+        with self._lock:
+            if self._early.pop(mid, None) is not None:
+                return
+
+            end = self._segment.append(topic, payload, qos)
+            self._pending[mid] = (end - _record_size(topic, payload), end)
+
+    def remove(self, key):
+        """
+        Forget acknowledged message
+
+        :param key: Paho message id or key of restored message
+        :return void
+        """
+        with self._lock:
+            entry = self._pending.pop(key, None)
+
+            if entry is None:
+                if not isinstance(key, tuple):
+                    self._early[key] = True
+
+                    if len(self._early) > self.MAX_EARLY:
+                        self._early.popitem(last=False)
+
+                return
+
+            self._restored.pop(key, None)
+
+            if not self._pending:
+                self._segment.truncate()
+                return
+
+            # Acknowledgements may come out of order. File head follows the oldest pending message
+            start = next(iter(self._pending.values()))[0]
+
+            if entry[0] < start:
+                self._segment.advance(start)
+
+    def close(self):
+        with self._lock:
+            self._segment.close()
+
+
+def _record_size(topic, payload):
+    if isinstance(payload, str):
+        payload = payload.encode('utf-8')
+
+    return SegmentFile.HEADER.size + len(topic.encode('utf-8')) + len(payload)
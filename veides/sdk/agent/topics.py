@@ -0,0 +1,303 @@
+import sys
+import threading
+
+
+class TopicCache(object):
+    def __init__(self, prefix, max_size=4096):
+        """
+        Builds and interns topics made of constant prefix and a name (e.g. trail name)
+
+        :param prefix: Topic prefix, e.g. "agent/<client_id>/trail/"
+        :type prefix: str
+        :param max_size: Maximum number of cached topics. Topics above the limit are built on every call
+        :type max_size: int
+        """
+        self._prefix = prefix
+        self._max_size = max_size
+        self._topics = {}
+
+    def get(self, name):
+        """
+        :param name: Last topic level
+        :type name: str
+        :return str
+        """
+        topic = self._topics.get(name)
+
+        if topic is None:
+            topic = sys.intern(self._prefix + name)
+
+            if len(self._topics) < self._max_size:
+                self._topics[name] = topic
+
+        return topic
+
+
+class TopicAliases(object):
+    def __init__(self, maximum=0):
+        """
+        MQTT v5 topic aliases of a single connection. The first message sent to a topic
+        carries the topic and a new alias, next messages carry the alias and an empty topic.
+        Paho keeps QoS 1 and 2 messages in order, but QoS 0 messages overtake QoS 1 and 2
+        messages held back when too many are in flight. So an alias assigned by a QoS 1
+        or 2 message is used by QoS 0 messages only once that message is acknowledged
+        (see published()). Topics above the broker's Topic Alias Maximum are sent in full
+
+        :param maximum: Number of aliases accepted by the broker, 0 disables aliases
+        :type maximum: int
+        """
+        self.maximum = maximum
+        # Topic -> alias
+        self._aliases = {}
+        # Alias -> topic
+        self._topics = {}
+        # Aliases known to the broker before any message sent from now on
+        self._established = set()
+        # Aliases known to the broker before QoS 1 and 2 messages sent from now on
+        self._ordered = set()
+        # Message id -> alias established by the message once it's acknowledged
+        self._pending = {}
+
+    def __len__(self):
+        return len(self._aliases)
+
+    def resolve(self, topic, qos):
+        """
+        :param topic: Message topic
+        :type topic: str
+        :param qos: Message QoS
+        :type qos: int
+        :return tuple Topic to send (empty when the alias is known to the broker) and alias or None
+        """
+        alias = self._aliases.get(topic)
+
+        if alias is None:
+            if len(self._aliases) >= self.maximum:
+                return topic, None
+
+            alias = len(self._aliases) + 1
+            self._aliases[topic] = alias
+            self._topics[alias] = topic
+
+            return topic, alias
+
+        if alias in self._established or (qos > 0 and alias in self._ordered):
+            return '', alias
+
+        return topic, alias
+
+    def sent(self, mid, qos, alias):
+        """
+        Called when a message carrying both topic and alias was handed over to Paho
+
+        :param mid: Paho message id
+        :type mid: int
+        :param qos: Message QoS
+        :type qos: int
+        :param alias: Topic alias
+        :type alias: int
+        :return void
+        """
+        if qos == 0:
+            self._established.add(alias)
+        else:
+            self._ordered.add(alias)
+            self._pending[mid] = alias
+
+    def published(self, mid):
+        """
+        :param mid: Id of acknowledged message
+        :type mid: int
+        :return void
+        """
+        alias = self._pending.pop(mid, None)
+
+        if alias is not None:
+            self._established.add(alias)
+
+    def topic(self, alias):
+        """
+        :param alias: Topic alias
+        :type alias: int
+        :return str|None
+        """
+        return self._topics.get(alias)
+
+
+class TopicTrie(object):
+    def __init__(self, cache_size=4096):
+        """
+        Matches topics against MQTT topic filters (with "+" and "#" wildcards).
+        Match results are cached per topic and the cache is dropped when routes change
+
+        :param cache_size: Maximum number of cached topics. The cache is cleared when it's full
+        :type cache_size: int
+        """
+        self._root = _TrieNode()
+        self._cache = {}
+        self._cache_size = cache_size
+        self._generation = 0
+        self._routes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._routes
+
+    def add(self, pattern, value):
+        """
+        :param pattern: Topic filter, e.g. "sensors/+/temperature" or "fleet/#"
+        :type pattern: str
+        :param value: Value returned for matching topics, e.g. a handler
+        :return void
+        """
+        levels = validate_topic_filter(pattern)
+
+        with self._lock:
+            node = self._root
+
+            for level in levels:
+                child = node.children.get(level)
+
+                if child is None:
+                    child = node.children[level] = _TrieNode()
+
+                node = child
+
+            node.values.append(value)
+            self._routes += 1
+            self._invalidate()
+
+    def remove(self, pattern, value=None):
+        """
+        :param pattern: Topic filter
+        :type pattern: str
+        :param value: Value to remove. All values of the pattern are removed by default
+        :return int Number of values left for the pattern
+        """
+        levels = pattern.split('/')
+
+        with self._lock:
+            path = [self._root]
+
+            for level in levels:
+                node = path[-1].children.get(level)
+
+                if node is None:
+                    return 0
+
+                path.append(node)
+
+            node = path[-1]
+            before = len(node.values)
+
+            if value is None:
+                node.values = []
+            else:
+                node.values = [v for v in node.values if v != value]
+
+            self._routes -= before - len(node.values)
+
+            # Drop nodes which don't lead to any route anymore
+            for level, parent, child in zip(reversed(levels), reversed(path[:-1]), reversed(path[1:])):
+                if child.values or child.children:
+                    break
+
+                del parent.children[level]
+
+            self._invalidate()
+
+            return len(node.values)
+
+    def match(self, topic):
+        """
+        :param topic: Topic of received message
+        :type topic: str
+        :return tuple Values of all matching topic filters
+        """
+        values = self._cache.get(topic)
+
+        if values is not None:
+            return values
+
+        generation = self._generation
+        values = self._match(topic)
+
+        with self._lock:
+            # Routes changed in the meantime, the result may be outdated
+            if generation == self._generation:
+                if len(self._cache) >= self._cache_size:
+                    self._cache.clear()
+
+                self._cache[topic] = values
+
+        return values
+
+    def _match(self, topic):
+        levels = topic.split('/')
+        count = len(levels)
+        # Wildcards at the first level don't match topics starting with "$" (e.g. "$SYS/...")
+        system = topic.startswith('$')
+        values = []
+        stack = [(self._root, 0)]
+
+        while stack:
+            node, index = stack.pop()
+            children = node.children
+            wildcards = index > 0 or not system
+
+            if wildcards and '#' in children:
+                values.extend(children['#'].values)
+
+            if index == count:
+                values.extend(node.values)
+                continue
+
+            child = children.get(levels[index])
+
+            if child is not None:
+                stack.append((child, index + 1))
+
+            if wildcards:
+                child = children.get('+')
+
+                if child is not None:
+                    stack.append((child, index + 1))
+
+        return tuple(values)
+
+    def _invalidate(self):
+        self._generation += 1
+        self._cache = {}
+
+
+class _TrieNode(object):
+    __slots__ = ('children', 'values')
+
+    def __init__(self):
+        self.children = {}
+        self.values = []
+
+
+def validate_topic_filter(pattern):
+    """
+    :param pattern: Topic filter
+    :raises TypeError: If pattern is not a string
+    :raises ValueError: If pattern is empty or wildcards are misplaced
+    :return list Topic filter levels
+    """
+    if not isinstance(pattern, str):
+        raise TypeError('topic filter should be a string')
+
+    if len(pattern) == 0:
+        raise ValueError('topic filter should be at least 1 length')
+
+    levels = pattern.split('/')
+
+    for index, level in enumerate(levels):
+        if level == '#':
+            if index != len(levels) - 1:
+                raise ValueError('"#" wildcard should be the last topic filter level')
+        elif level != '+' and ('#' in level or '+' in level):
+            raise ValueError('wildcards should occupy entire topic filter level')
+
+    return levels
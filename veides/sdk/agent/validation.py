@@ -0,0 +1,171 @@
+class ValidationMode(object):
+    # Validate every sent message
+    STRICT = 'strict'
+    # Validate the first message sent with particular name (trail, event, fact etc.) only
+    ONCE_PER_NAME = 'once'
+    # Don't validate sent messages. Meant for trusted producers guaranteeing types
+    OFF = 'off'
+
+
+class Validator(object):
+    def __init__(self, mode=ValidationMode.STRICT, max_names=4096):
+        """
+        Validates messages sent by AgentClient
+
+        :param mode: One of ValidationMode values
+        :type mode: str
+        :param max_names: Maximum number of remembered names in ONCE_PER_NAME mode.
+            Names above the limit are validated every time
+        :type max_names: int
+        """
+        if mode not in (ValidationMode.STRICT, ValidationMode.ONCE_PER_NAME, ValidationMode.OFF):
+            raise ValueError('validation mode should be one of: strict, once, off')
+
+        self.mode = mode
+        self._max_names = max_names
+        self._validated = {}
+
+    def method_response(self, name, payload, code):
+        if self._skip('method_response', name):
+            return
+
+        validate_name(name, 'method')
+
+        if payload is None:
+            raise TypeError('body is required')
+
+        if not isinstance(code, int):
+            raise TypeError('code should be an integer')
+
+        self._remember('method_response', name)
+
+    def action_completed(self, name):
+        if self._skip('action_completed', name):
+            return
+
+        validate_name(name, 'completed action')
+
+        self._remember('action_completed', name)
+
+    def event(self, name):
+        if self._skip('event', name):
+            return
+
+        validate_name(name, 'event')
+
+        self._remember('event', name)
+
+    def trail(self, name, value):
+        if self._skip('trail', name):
+            return
+
+        validate_name(name, 'trail')
+        validate_trail_value(value)
+
+        self._remember('trail', name)
+
+    def facts(self, facts):
+        if self.mode == ValidationMode.OFF:
+            return
+
+        if self.mode == ValidationMode.STRICT:
+            validate_facts(facts)
+            return
+
+        if not isinstance(facts, dict):
+            raise TypeError('facts should be a dictionary')
+
+        validated = self._validated.get('facts')
+
+        if validated is None:
+            new_facts = facts
+        elif validated.issuperset(facts):
+            return
+        else:
+            new_facts = {name: value for name, value in facts.items() if name not in validated}
+
+        if new_facts:
+            validate_facts(new_facts)
+
+            for name in new_facts:
+                self._remember('facts', name)
+
+    def _skip(self, kind, name):
+        if self.mode == ValidationMode.STRICT:
+            return False
+
+        if self.mode == ValidationMode.OFF:
+            return True
+
+        return name in self._validated.get(kind, ())
+
+    def _remember(self, kind, name):
+        if self.mode != ValidationMode.ONCE_PER_NAME:
+            return
+
+        names = self._validated.setdefault(kind, set())
+
+        if len(names) < self._max_names:
+            names.add(name)
+
+
+def validate_name(name, kind):
+    """
+    :param name: Validated name
+    :param kind: Name kind used in error message, e.g. "trail"
+    :type kind: str
+    :raises TypeError: If name is not a string
+    :raises ValueError: If name is empty
+    :return void
+    """
+    if not isinstance(name, str):
+        raise TypeError('%s name should be a string' % kind)
+
+    if len(name) == 0:
+        raise ValueError('%s name should be at least 1 length' % kind)
+
+
+def validate_trail_value(value):
+    """
+    :param value: Trail value
+    :raises TypeError: If value is not a string or number
+    :raises ValueError: If value is an empty string
+    :return void
+    """
+    if isinstance(value, str):
+        if len(value) == 0:
+            raise ValueError('value name should be at least 1 length')
+    elif not isinstance(value, (int, float)):
+        raise TypeError('value name should be a string or number')
+
+
+def validate_facts(facts):
+    """
+    Validates facts dictionary in a single pass
+
+    :param facts: Simple key-value dictionary containing fact name (key) and fact value (value)
+    :raises TypeError: If facts are not a dictionary of strings
+    :raises ValueError: If any fact name or value is empty
+    :return void
+    """
+    if not isinstance(facts, dict):
+        raise TypeError('facts should be a dictionary')
+
+    empty_name = False
+    empty_value = False
+
+    for name, value in facts.items():
+        if not isinstance(value, str) or not isinstance(name, str):
+            raise TypeError('facts should be key-value string pairs')
+
+        if not value:
+            empty_value = True
+
+        if not name:
+            empty_name = True
+
+    if empty_name:
+        raise ValueError('fact names should be at least 1 length')
+
+    if empty_value:
+        raise ValueError('fact values should be at least 1 length')